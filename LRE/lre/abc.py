@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+# activation和serving既可以是普通函数，也可以是协程函数（async def）
+# activation and serving may be either plain functions or coroutine functions (async def)
 class Server():
     def __init__(self):
         pass
@@ -10,3 +12,8 @@ class Server():
 
     def serving(self):
         pass
+
+    # 运行时关闭时调用，阻塞的serving需要在这里让自己返回
+    # Called when the runtime shuts down, a blocking serving must make itself return here
+    def shutdown(self):
+        pass
@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import collections
+from .base import LatteConfig, Logger
+from .abc import Server
+from .metrics import Metrics
+from .stream import Stream, END, isStream, closeAll
+
+# 计算Sec-WebSocket-Accept时使用的GUID
+# The GUID used to compute Sec-WebSocket-Accept
+_WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# WebSocket的操作码
+# WebSocket opcodes
+_CONTINUATION, _TEXT, _BINARY, _CLOSE, _PING, _PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+# 一个客户端连接
+# 收到的消息进入收件箱，由一个任务按顺序交给Server.received()处理；收件箱超过maxPending条时暂停读取。
+# 发送时使用writelines一次写出帧头和数据，对端读取过慢时可以等待drain()。
+# A client connection
+# Received messages go into an inbox that one task hands to Server.received() in order; reading pauses while the inbox holds more than maxPending messages.
+# Sending writes the frame header and the data at once with writelines, drain() can be awaited while the peer reads too slowly.
+class Connection(object):
+    def __init__(self, protocol, transport, server, maxPending):
+        self.protocol = protocol
+        self.transport = transport
+        self.server = server
+        self.peer = transport.get_extra_info('peername')
+        self.maxPending = maxPending
+        self.closed = False
+        self.__inbox = collections.deque()
+        self.__task = None
+        self.__paused = False
+        self.__writable = asyncio.Event()
+        self.__writable.set()
+
+    def __repr__(self):
+        return '<Connection %s>' % (self.peer,)
+
+    # 发送一条消息：字典和列表编码为JSON，str和bytes按协议发送
+    # Send one message: dicts and lists are encoded as JSON, str and bytes are sent as the protocol defines
+    def send(self, message):
+        if not self.closed:
+            self.transport.writelines(self.protocol.encode(message))
+
+    # 一次写出多条消息
+    # Write several messages at once
+    def sendMany(self, messages):
+        if not self.closed:
+            parts = []
+            for message in messages:
+                parts.extend(self.protocol.encode(message))
+            self.transport.writelines(parts)
+
+    # 等待写缓冲区降到低水位以下
+    # Wait until the write buffer drops below the low water mark
+    async def drain(self):
+        await self.__writable.wait()
+
+    # 逐块发送普通生成器或异步生成器产生的流式回复
+    # 每块写出后等待写缓冲区（drain），所以生成器不会比对端读取得更快；连接断开时生成器被关闭
+    # Send a streaming reply produced by a plain generator or an async generator chunk by chunk
+    # Every chunk waits for the write buffer (drain) after it is written, so the generator never runs ahead of the peer; the generator is closed when the connection is lost
+    async def stream(self, source):
+        stream = source if isinstance(source, Stream) else Stream(source)
+        state = self.protocol.openStream()
+        start = time.perf_counter()
+        try:
+            while not self.closed:
+                chunk = await stream.next()
+                if chunk is END:
+                    break
+                if self.closed:
+                    break
+                self.transport.writelines(self.protocol.encodeChunk(state, chunk))
+                if stream.chunks == 1:
+                    Metrics.observe('adapter', 'stream.firstChunk', time.perf_counter() - start)
+                await self.drain()
+            if self.closed:
+                Metrics.incr('adapter', 'stream.cancelled')
+            else:
+                self.transport.writelines(self.protocol.encodeEnd(state))
+        except asyncio.CancelledError:
+            Metrics.incr('adapter', 'stream.cancelled')
+            raise
+        finally:
+            Metrics.incr('adapter', 'stream.chunks', stream.chunks)
+            await stream.close()
+
+    def close(self):
+        if not self.closed:
+            self.protocol.closing()
+            self.transport.close()
+
+    def received(self, messages):
+        self.__inbox.extend(messages)
+        if len(self.__inbox) > self.maxPending and not self.__paused:
+            self.__paused = True
+            self.transport.pause_reading()
+        if self.__task is None:
+            self.__task = asyncio.get_running_loop().create_task(self.__deliver())
+
+    async def __deliver(self):
+        inbox = self.__inbox
+        try:
+            while inbox and not self.closed:
+                message = inbox.popleft()
+                if self.__paused and len(inbox) <= self.maxPending // 2:
+                    self.__paused = False
+                    self.transport.resume_reading()
+                try:
+                    await self.server.received(self, message)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    Metrics.incr('adapter', 'errors')
+                    self.server.logger.error('Handling a message from %r failed: %s', self, e, exc_info=e)
+        finally:
+            self.__task = None
+
+    def pauseWriting(self):
+        self.__writable.clear()
+
+    def resumeWriting(self):
+        self.__writable.set()
+
+    def lost(self):
+        self.closed = True
+        self.__inbox.clear()
+        self.__writable.set()
+        if self.__task is not None:
+            self.__task.cancel()
+
+
+# 分帧协议的基类
+# 使用预先分配的接收缓冲区：事件循环直接把数据读进缓冲区的空闲部分（get_buffer），
+# 子类在buffer_updated之后通过memoryview就地解析完整的帧，只有交给处理函数的数据才会被复制一次。
+# 缓冲区中剩余的不完整帧在需要时被移动到开头，帧大于缓冲区时缓冲区会增长，直到maxFrame。
+# Base class of framing protocols
+# Uses a preallocated receive buffer: the event loop reads straight into its free part (get_buffer),
+# after buffer_updated subclasses parse complete frames in place through a memoryview, only the data handed to handlers is copied once.
+# A remaining incomplete frame is moved to the beginning when needed, the buffer grows when a frame is larger than it, up to maxFrame.
+class FrameProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server, bufferSize=65536, maxFrame=1048576, maxPending=64):
+        self.server = server
+        self.maxFrame = maxFrame
+        self.maxPending = maxPending
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # 解析器需要的缓冲区大小，由parse()在帧不完整时设置
+        # Buffer size the parser needs, set by parse() when a frame is incomplete
+        self.need = 0
+        self.connection = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connection = Connection(self, transport, self.server, self.maxPending)
+        Metrics.incr('adapter', 'connections')
+
+    def connection_lost(self, exc):
+        self.connection.lost()
+        self.buffer = self.view = None
+
+    def pause_writing(self):
+        self.connection.pauseWriting()
+
+    def resume_writing(self):
+        self.connection.resumeWriting()
+
+    def get_buffer(self, sizehint):
+        if self.end == len(self.buffer) or self.need > len(self.buffer) - self.start:
+            self.__makeRoom()
+        return self.view[self.end:]
+
+    def __makeRoom(self):
+        pending = self.end - self.start
+        size = len(self.buffer)
+        if self.need > size or pending == size:
+            # 扩大缓冲区
+            # Grow the buffer
+            size = max(self.need, size * 2)
+            buffer = bytearray(size)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        else:
+            # memoryview的切片赋值可以处理重叠的区域
+            # Slice assignment of a memoryview handles overlapping regions
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        messages = []
+        try:
+            self.start = self.parse(self.start, self.end, messages)
+        except ValueError as e:
+            self.server.logger.warn('Protocol error from %r: %s', self.connection, e)
+            Metrics.incr('adapter', 'protocolErrors')
+            self.fail(e)
+            return
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.need > self.maxFrame:
+            self.fail(ValueError('a frame of %d bytes exceeds the limit of %d bytes' % (self.need, self.maxFrame)))
+            return
+        if messages:
+            Metrics.incr('adapter', 'messages.in', len(messages))
+            self.connection.received(messages)
+
+    # 解析buffer[start:end]中完整的帧，把消息加入messages，返回第一个未处理字节的位置
+    # 帧不完整时把它需要的总字节数写入need；协议错误时抛出ValueError
+    # Parse the complete frames in buffer[start:end], append the messages to messages and return the position of the first unhandled byte
+    # When a frame is incomplete the total number of bytes it needs is written to need; protocol errors raise ValueError
+    def parse(self, start, end, messages):
+        raise NotImplementedError
+
+    # 把一条消息编码为待写出的字节串列表
+    # Encode one message as a list of byte strings to write
+    def encode(self, message):
+        raise NotImplementedError
+
+    # 开始一个流式回复，返回之后传给encodeChunk和encodeEnd的状态
+    # Start a streaming reply, returns the state passed to encodeChunk and encodeEnd afterwards
+    def openStream(self):
+        return {}
+
+    # 把流式回复的一块编码为待写出的字节串列表
+    # Encode one chunk of a streaming reply as a list of byte strings to write
+    def encodeChunk(self, state, chunk):
+        return self.encode(chunk)
+
+    # 流式回复结束时需要写出的字节串列表
+    # The byte strings to write when a streaming reply ends
+    def encodeEnd(self, state):
+        return []
+
+    # 协议错误时关闭连接
+    # Close the connection on a protocol error
+    def fail(self, error):
+        self.transport.close()
+
+    # 连接被主动关闭前调用，子类可以在这里发送关闭帧
+    # Called before the connection is closed actively, subclasses can send a closing frame here
+    def closing(self):
+        pass
+
+
+# 以换行分隔的JSON（JSON Lines）
+# 通过bytearray.find在缓冲区中就地查找换行，每条消息只在交给json.loads时复制一次
+# Newline delimited JSON (JSON Lines)
+# Newlines are found in place in the buffer with bytearray.find, every message is copied only once when handed to json.loads
+class LineJsonProtocol(FrameProtocol):
+    def parse(self, start, end, messages):
+        buffer, view = self.buffer, self.view
+        while True:
+            newline = buffer.find(b'\n', start, end)
+            if newline < 0:
+                # 整行必须能放进缓冲区
+                # The whole line must fit into the buffer
+                self.need = end - start + 1
+                return start
+            if newline > start:
+                line = view[start:newline].tobytes()
+                if line.strip():
+                    try:
+                        messages.append(json.loads(line))
+                    except ValueError as e:
+                        raise ValueError('invalid JSON line: %s' % e)
+            start = newline + 1
+
+    def __init__(self, *args, **kwargs):
+        FrameProtocol.__init__(self, *args, **kwargs)
+        self.__streams = 0
+
+    # 字符串作为{"text": 文本}发送，字节串作为{"base64": Base64编码的数据}发送
+    # Strings are sent as {"text": text}, byte strings as {"base64": Base64 encoded data}
+    def encode(self, message):
+        if isinstance(message, str):
+            message = {'text': message}
+        elif isinstance(message, (bytes, bytearray, memoryview)):
+            message = {'base64': base64.b64encode(message).decode('ascii')}
+        return [json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), b'\n']
+
+    # 流式回复的每一块是一行{"stream": 编号, "text": 文本}，字节串的块为"base64"，其它的块为"data"，
+    # 最后一行是{"stream": 编号, "done": true}
+    # Every chunk of a streaming reply is a line {"stream": id, "text": text}, "base64" for chunks that are byte strings and "data" for other chunks,
+    # the last line is {"stream": id, "done": true}
+    def openStream(self):
+        self.__streams += 1
+        return {'stream': self.__streams}
+
+    def encodeChunk(self, state, chunk):
+        if isinstance(chunk, str):
+            return self.encode({'stream': state['stream'], 'text': chunk})
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            return self.encode({'stream': state['stream'], 'base64': base64.b64encode(chunk).decode('ascii')})
+        return self.encode({'stream': state['stream'], 'data': chunk})
+
+    def encodeEnd(self, state):
+        return self.encode({'stream': state['stream'], 'done': True})
+
+
+# 掩码处理：把数据和重复的掩码当作整数异或，一次完成整个帧，而不是逐字节循环
+# Unmasking: XOR the data and the repeated mask as integers, the whole frame at once instead of a byte by byte loop
+def _unmask(payload, mask):
+    length = len(payload)
+    if not length:
+        return b''
+    key = (mask * ((length >> 2) + 1))[:length]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(length, 'little')
+
+
+# WebSocket服务端（RFC 6455）
+# 先完成HTTP升级握手，之后就地解析帧头，文本消息交给处理函数时为str，二进制消息为bytes。
+# 自动回复ping，支持分片的消息；服务端发送的帧不加掩码，帧头和数据通过writelines一起写出。
+# WebSocket server side (RFC 6455)
+# Completes the HTTP upgrade handshake first, then parses frame headers in place, text messages reach handlers as str and binary messages as bytes.
+# Pings are answered automatically and fragmented messages are supported; frames sent by the server are not masked, the header and data are written together through writelines.
+class WebSocketProtocol(FrameProtocol):
+    def __init__(self, *args, **kwargs):
+        FrameProtocol.__init__(self, *args, **kwargs)
+        self.upgraded = False
+        self.__fragments = None
+        self.__fragmentOpcode = None
+
+    def parse(self, start, end, messages):
+        if not self.upgraded:
+            start = self.__handshake(start, end)
+            if not self.upgraded:
+                return start
+        buffer = self.buffer
+        self.need = 0
+        while end - start >= 2:
+            first, second = buffer[start], buffer[start + 1]
+            opcode = first & 0x0F
+            length = second & 0x7F
+            header = 2
+            if length == 126:
+                if end - start < 4:
+                    break
+                length = struct.unpack_from('!H', buffer, start + 2)[0]
+                header = 4
+            elif length == 127:
+                if end - start < 10:
+                    break
+                length = struct.unpack_from('!Q', buffer, start + 2)[0]
+                header = 10
+            if not second & 0x80:
+                raise ValueError('frames from clients must be masked')
+            if length > self.maxFrame:
+                raise ValueError('a frame of %d bytes exceeds the limit of %d bytes' % (length, self.maxFrame))
+            total = header + 4 + length
+            if end - start < total:
+                self.need = total
+                break
+            mask = self.view[start + header:start + header + 4].tobytes()
+            payload = _unmask(self.view[start + header + 4:start + total], mask)
+            start += total
+            self.__frame(first & 0x80, opcode, payload, messages)
+        return start
+
+    def __frame(self, fin, opcode, payload, messages):
+        if opcode == _PING:
+            self.transport.writelines(self.__header(_PONG, len(payload)) + [payload])
+            return
+        if opcode == _PONG:
+            return
+        if opcode == _CLOSE:
+            self.transport.writelines(self.__header(_CLOSE, len(payload[:2])) + [payload[:2]])
+            self.transport.close()
+            return
+        if opcode == _CONTINUATION:
+            if self.__fragments is None:
+                raise ValueError('unexpected continuation frame')
+            self.__fragments.extend(payload)
+            if len(self.__fragments) > self.maxFrame:
+                raise ValueError('a fragmented message exceeds the limit of %d bytes' % self.maxFrame)
+            if not fin:
+                return
+            opcode, payload = self.__fragmentOpcode, bytes(self.__fragments)
+            self.__fragments = self.__fragmentOpcode = None
+        elif not fin:
+            self.__fragments = bytearray(payload)
+            self.__fragmentOpcode = opcode
+            return
+        if opcode == _TEXT:
+            try:
+                messages.append(payload.decode('utf-8'))
+            except UnicodeDecodeError:
+                raise ValueError('a text frame is not valid UTF-8')
+        elif opcode == _BINARY:
+            messages.append(payload)
+        else:
+            raise ValueError('unknown opcode 0x%x' % opcode)
+
+    def __handshake(self, start, end):
+        terminator = self.buffer.find(b'\r\n\r\n', start, end)
+        if terminator < 0:
+            self.need = end - start + 4
+            if end - start > 16384:
+                raise ValueError('the handshake request is too large')
+            return start
+        lines = self.view[start:terminator].tobytes().decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not lines[0].startswith('GET ') or headers.get('upgrade', '').lower() != 'websocket' or not key:
+            self.transport.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Length: 0\r\n\r\n')
+            raise ValueError('not a WebSocket upgrade request')
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + _WEBSOCKET_GUID).digest())
+        self.transport.writelines([b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n',
+                                   b'Sec-WebSocket-Accept: ', accept, b'\r\n\r\n'])
+        self.upgraded = True
+        self.need = 0
+        return terminator + 4
+
+    @staticmethod
+    def __header(opcode, length, fin=True):
+        first = 0x80 | opcode if fin else opcode
+        if length < 126:
+            return [struct.pack('!BB', first, length)]
+        if length < 65536:
+            return [struct.pack('!BBH', first, 126, length)]
+        return [struct.pack('!BBQ', first, 127, length)]
+
+    @staticmethod
+    def __payload(message):
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            return _BINARY, message
+        if not isinstance(message, str):
+            message = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+        return _TEXT, message.encode('utf-8')
+
+    def encode(self, message):
+        opcode, payload = self.__payload(message)
+        return self.__header(opcode, len(payload)) + [payload]
+
+    # 流式回复作为一条分片的消息发送：第一块是文本或二进制帧，之后是延续帧，最后是一个空的结束帧
+    # A streaming reply is sent as one fragmented message: the first chunk is a text or binary frame, then continuation frames, and finally an empty final frame
+    def openStream(self):
+        return {'opcode': None}
+
+    def encodeChunk(self, state, chunk):
+        opcode, payload = self.__payload(chunk)
+        if state['opcode'] is None:
+            state['opcode'] = opcode
+        else:
+            opcode = _CONTINUATION
+        return self.__header(opcode, len(payload), False) + [payload]
+
+    def encodeEnd(self, state):
+        return self.__header(_TEXT if state['opcode'] is None else _CONTINUATION, 0)
+
+    def closing(self):
+        if self.upgraded:
+            self.transport.writelines(self.__header(_CLOSE, 2) + [struct.pack('!H', 1000)])
+
+
+# 聊天协议适配器的Server
+# 插件在servers()中返回它（或者它的子类），由运行时启动。监听listen指定的'host:port'，
+# 没有指定时在多进程模式下使用主进程分配的套接字。默认把收到的每条消息交给runtime.dispatch，
+# 并把处理函数的非None返回值作为回复发回；子类可以重写received()。
+# Server of chat protocol adapters
+# Plugins return it (or a subclass) from servers() and the runtime starts it. It listens on the 'host:port' given by listen,
+# and uses the socket handed out by the supervisor in worker mode when none is given. By default every received message is passed to runtime.dispatch,
+# and the non-None return values of the handlers are sent back as replies; subclasses may override received().
+class AdapterServer(Server):
+    def __init__(self, protocol=LineJsonProtocol, listen=None):
+        Server.__init__(self)
+        self.protocol = protocol
+        self.listen = listen
+        self.bufferSize = LatteConfig.getTypedConfig('adapter.bufferSize', int)
+        self.maxFrame = LatteConfig.getTypedConfig('adapter.maxFrame', int)
+        self.maxPending = LatteConfig.getTypedConfig('adapter.maxPending', int)
+        self.logger = Logger.bind('Latte.adapter')
+        self.runtime = None
+        self.server = None
+
+    def __factory(self):
+        return self.protocol(self, self.bufferSize, self.maxFrame, self.maxPending)
+
+    async def serving(self):
+        loop = asyncio.get_running_loop()
+        if self.listen:
+            host, _, port = self.listen.rpartition(':')
+            self.server = await loop.create_server(self.__factory, host.strip('[]') or None, int(port))
+        elif self.runtime is not None and self.runtime.socket is not None:
+            self.server = await loop.create_server(self.__factory, sock=self.runtime.socket)
+        else:
+            raise ValueError('%r has nothing to listen on' % self)
+        self.logger.info('%s listening on %s', self.protocol.__name__,
+                         ', '.join(str(sock.getsockname()) for sock in self.server.sockets))
+        async with self.server:
+            await self.server.serve_forever()
+
+    # 处理一条收到的消息，流式回复在前面的回复发出后逐块发送
+    # 准入控制按照消息中的user限流，没有user时按照对端的地址
+    # Handle one received message, streaming replies are sent chunk by chunk after the replies before them
+    # Admission control rate limits by the user in the message, or by the address of the peer when there is none
+    async def received(self, connection, message):
+        user = None
+        if isinstance(message, dict):
+            text = message.get('text')
+            user = message.get('user')
+        elif isinstance(message, str):
+            text = message
+        else:
+            return
+        if not isinstance(text, str):
+            return
+        if user is None and isinstance(connection.peer, tuple):
+            user = connection.peer[0]
+        elif user is not None:
+            user = str(user)
+        replies = []
+        results = await self.runtime.dispatch(text, message, user=user)
+        index = 0
+        try:
+            for index, (match, result) in enumerate(results):
+                if isStream(result):
+                    self.__reply(connection, replies)
+                    replies = []
+                    await connection.drain()
+                    await connection.stream(result)
+                    Metrics.incr('adapter', 'messages.out')
+                elif result is not None:
+                    replies.append(result)
+            index = len(results)
+        finally:
+            # 连接断开时还没有发送的流式回复也要关闭
+            # Streaming replies not sent yet are closed as well when the connection is lost
+            await closeAll(results[index:])
+        if replies:
+            self.__reply(connection, replies)
+            await connection.drain()
+
+    @staticmethod
+    def __reply(connection, replies):
+        if replies:
+            connection.sendMany(replies)
+            Metrics.incr('adapter', 'messages.out', len(replies))
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.close()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import asyncio
+import threading
+import itertools
+import collections
+from .base import LatteConfig, PluginConfig
+from .error import AdmissionException
+from .metrics import Metrics
+
+# 可以在latte.json的admission和plugin.json的"admission"中设置的限制
+# Limits that can be set in admission of latte.json and "admission" of plugin.json
+_LIMITS = (('queue', int), ('timeout', float), ('rate', float), ('burst', float),
+           ('userRate', float), ('userBurst', float), ('weight', float), ('reject', str))
+
+
+# 令牌桶，rate为每秒补充的令牌数，burst为桶的容量；rate为0时不限制
+# Token bucket, rate is the number of tokens refilled per second and burst the capacity; rate 0 means unlimited
+class TokenBucket(object):
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.tokens = self.burst
+        self.stamp = time.monotonic() if now is None else now
+
+    def take(self, now):
+        if self.rate <= 0:
+            return True
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.stamp) * self.rate)
+        self.stamp = max(self.stamp, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # 桶是否已满，满的桶与新建的桶相同，可以丢弃
+    # Whether the bucket is full, a full bucket is the same as a new one and can be dropped
+    def full(self, now):
+        return self.rate <= 0 or self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+# 一个插件的准入状态
+# The admission state of one plugin
+class _PluginState(object):
+    def __init__(self, name, limits):
+        self.name = name
+        self.configure(limits)
+        self.waiting = 0
+        # 该插件最后一个排队请求的虚拟完成时间
+        # Virtual finish time of the last request of this plugin that was queued
+        self.finish = 0.0
+        self.admitted = 0
+        self.rejected = collections.Counter()
+
+    # 设置限制，令牌桶从满的状态重新开始
+    # Set the limits, token buckets start over full
+    def configure(self, limits):
+        for key, _ in _LIMITS:
+            setattr(self, key, limits[key])
+        self.weight = max(self.weight, 1e-3)
+        self.bucket = TokenBucket(self.rate, self.burst)
+        # 用户 -> TokenBucket，按最近使用的顺序排列
+        # User -> TokenBucket, ordered by recent use
+        self.users = collections.OrderedDict()
+
+
+# 插件的准入控制和加权公平排队
+# 所有插件共享concurrency个执行槽位。每条消息先经过插件的令牌桶和用户的令牌桶，
+# 没有空闲槽位时进入插件的有界队列，排队的请求按照加权公平排队（WFQ）的虚拟完成时间获得槽位：
+# 每个请求的完成时间是max(当前虚拟时间, 插件上一个请求的完成时间) + 1 / weight，
+# 所以被大量消息淹没的插件只会拉长自己的队列，不会让其它插件饿死。
+# 令牌不足、队列已满或者排队超时的消息被拒绝，可以回复配置的reject文本。
+# Admission control and weighted fair queuing of plugins
+# All plugins share concurrency execution slots. Every message first passes the token bucket of the plugin and the one of the user,
+# when no slot is free it joins the bounded queue of the plugin, and queued requests get slots in order of their weighted fair queuing (WFQ) virtual finish time:
+# the finish time of every request is max(current virtual time, finish time of the plugin's previous request) + 1 / weight,
+# so a plugin flooded with messages only lengthens its own queue instead of starving the other plugins.
+# Messages are rejected when tokens run out, the queue is full or they waited too long, the configured reject text can be replied.
+class AdmissionController(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    _INSTANCE = None
+    # 每个插件最多记录的用户令牌桶数
+    # Maximum number of user token buckets kept per plugin
+    _MAX_USERS = 10000
+
+    # 获取按照latte.json中的admission配置创建的共享实例
+    # Get the shared instance created from the admission configuration in latte.json
+    @classmethod
+    def instance(cls):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                controller = cls._INSTANCE = AdmissionController(LatteConfig.getTypedConfig('admission.concurrency', int))
+                # 配置变化后重新读取限制，令牌桶从满的状态开始
+                # Limits are read again after the configuration changes, token buckets start full
+                LatteConfig.subscribe(lambda changes: controller.reset(), 'admission')
+                PluginConfig.subscribe(lambda changes: [controller.reset(name) for name in set(key.split('.', 1)[0] for key in changes)])
+        return cls._INSTANCE
+
+    def __init__(self, concurrency=16):
+        self.concurrency = max(1, concurrency)
+        self.inflight = 0
+        # 所有插件中排队的请求数
+        # Number of requests queued across all plugins
+        self.waiting = 0
+        self.virtual = 0.0
+        # (虚拟完成时间, 序号, 插件状态, future)
+        # (virtual finish time, sequence number, plugin state, future)
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__states = {}
+
+    # 插件是否受准入控制：latte.json中开启了admission.enable，或者插件在plugin.json中声明了"admission"
+    # Whether a plugin is under admission control: admission.enable is on in latte.json, or the plugin declares "admission" in plugin.json
+    def applies(self, plugin):
+        return plugin in self.__states or LatteConfig.getTypedConfig('admission.enable', bool) \
+            or PluginConfig.findConfig('%s.admission' % plugin) is not None
+
+    # 重新读取插件的限制，不指定插件时重新读取全部限制和concurrency；排队的请求保持不变
+    # Read the limits of a plugin again, all limits and concurrency when no plugin is specified; queued requests stay as they are
+    def reset(self, plugin=None):
+        if plugin is None:
+            self.concurrency = max(1, LatteConfig.getTypedConfig('admission.concurrency', int))
+        for name, state in list(self.__states.items()):
+            if plugin is None or name == plugin:
+                state.configure(self.__limits(name))
+
+    @staticmethod
+    def __limits(plugin):
+        overrides = PluginConfig.findConfig('%s.admission' % plugin)
+        if not isinstance(overrides, dict):
+            overrides = {}
+        limits = {}
+        for key, t in _LIMITS:
+            value = overrides.get(key)
+            limits[key] = LatteConfig.getTypedConfig('admission.%s' % key, t) if value is None else t(value)
+        return limits
+
+    def __state(self, plugin):
+        state = self.__states.get(plugin)
+        if state is None:
+            state = self.__states[plugin] = _PluginState(plugin, self.__limits(plugin))
+        return state
+
+    def __reject(self, state, reason):
+        state.rejected[reason] += 1
+        Metrics.incr(state.name, 'admission.rejected.%s' % reason)
+        raise AdmissionException(state.name, reason, state.reject or None)
+
+    # 为插件的一条消息获取执行槽位，被拒绝时抛出AdmissionException；成功后必须调用release()
+    # Acquire an execution slot for a message of a plugin, raises AdmissionException when rejected; release() must be called after success
+    async def acquire(self, plugin, user=None):
+        state = self.__state(plugin)
+        now = time.monotonic()
+        if not state.bucket.take(now):
+            self.__reject(state, 'rate')
+        if user is not None and state.userRate > 0:
+            bucket = state.users.get(user)
+            if bucket is None:
+                bucket = state.users[user] = TokenBucket(state.userRate, state.userBurst, now)
+                if len(state.users) > self._MAX_USERS:
+                    self.__pruneUsers(state, now)
+            else:
+                state.users.move_to_end(user)
+            if not bucket.take(now):
+                self.__reject(state, 'user')
+        if self.inflight < self.concurrency and not self.waiting:
+            self.inflight += 1
+            state.admitted += 1
+            return
+        if state.waiting >= state.queue:
+            self.__reject(state, 'queue')
+        state.finish = max(self.virtual, state.finish) + 1.0 / state.weight
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.__heap, (state.finish, next(self.__sequence), state, future))
+        state.waiting += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, state.timeout if state.timeout > 0 else None)
+        except asyncio.TimeoutError:
+            state.waiting -= 1
+            self.waiting -= 1
+            self.__reject(state, 'timeout')
+        except asyncio.CancelledError:
+            if future.cancelled():
+                state.waiting -= 1
+                self.waiting -= 1
+            else:
+                # 槽位已经交给了这个请求，把它转交给下一个
+                # The slot was already handed to this request, pass it on to the next one
+                self.release()
+            raise
+        state.admitted += 1
+        Metrics.observe(plugin, 'admission.wait', time.monotonic() - now)
+
+    # 释放一个执行槽位，有排队的请求时直接交给虚拟完成时间最早的那个
+    # Release an execution slot, it is handed directly to the queued request with the earliest virtual finish time if there is one
+    def release(self):
+        if self.__next():
+            return
+        self.inflight -= 1
+        if not self.inflight:
+            # 空闲时虚拟时间和插件的完成时间都可以重新开始
+            # Virtual time and the finish times of the plugins can start over while idle
+            self.virtual = 0.0
+            for state in self.__states.values():
+                state.finish = 0.0
+
+    # 把槽位交给虚拟完成时间最早的排队请求，没有排队的请求时返回False
+    # Hand a slot to the queued request with the earliest virtual finish time, returns False when no request is queued
+    def __next(self):
+        heap = self.__heap
+        while heap:
+            finish, _, state, future = heapq.heappop(heap)
+            # 已经超时或者被取消的请求
+            # Requests that already timed out or were cancelled
+            if future.done():
+                continue
+            self.virtual = finish
+            state.waiting -= 1
+            self.waiting -= 1
+            future.set_result(None)
+            return True
+        return False
+
+    # 移除已经满了的用户令牌桶，仍然不够时移除最久未使用的
+    # Remove the user token buckets that are full, the least recently used ones when that is not enough
+    def __pruneUsers(self, state, now):
+        for user in [user for user, bucket in state.users.items() if bucket.full(now)]:
+            del state.users[user]
+        while len(state.users) > self._MAX_USERS:
+            state.users.popitem(last=False)
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'queued': self.waiting,
+            'plugins': dict((name, {
+                'waiting': state.waiting,
+                'admitted': state.admitted,
+                'rejected': dict(state.rejected),
+                'users': len(state.users)
+            }) for name, state in list(self.__states.items()))
+        }
@@ -1,10 +1,233 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import io, os, sys, json
+import os, sys
 import traceback
+import functools
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import threading
+from stat import S_ISREG
 from .error import ConfigException, ReadConfigException
+from .manifest import ManifestCache
+
+# 表示索引中不存在的值，与配置中的None区分
+# Marks a value missing from the index, distinct from None in the configuration
+_MISSING = object()
+
+# 将用户配置覆盖到默认配置之上，字典会被递归合并
+# Overlay the user configuration on top of the default configuration, dictionaries are merged recursively
+def _overlay(default, user):
+    result = dict(default)
+    for key, value in user.items():
+        # 两边都是字典时递归合并，否则用户配置优先
+        # Merge recursively when both sides are dictionaries, otherwise the user configuration wins
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _overlay(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+# 将嵌套的配置字典展开为“the.multi.level.key”形式的扁平索引
+# 每一级的中间节点也会被写入索引，所以'logger'和'logger.file'同样可以直接查到
+# Flatten a nested configuration dictionary into an index keyed like "the.multi.level.key"
+# Intermediate nodes of every level are indexed too, so 'logger' and 'logger.file' are direct hits as well
+def _flatten(root, prefix=None, index=None):
+    if index is None:
+        index = {}
+    for key, value in root.items():
+        path = str(key) if prefix is None else '.'.join([prefix, str(key)])
+        index[path] = value
+        if isinstance(value, dict):
+            _flatten(value, path, index)
+    return index
+
+# 将配置值转换为指定的类型
+# Convert a configuration value to the specified type
+def _convert(value, t):
+    if isinstance(value, t):
+        return value
+    # 字符串形式的布尔值需要特殊处理，否则bool('false')会是True
+    # Boolean strings need special handling, otherwise bool('false') would be True
+    if t is bool and isinstance(value, str):
+        lower = value.strip().lower()
+        if lower in ('true', 'yes', 'on', '1'):
+            return True
+        if lower in ('false', 'no', 'off', '0', ''):
+            return False
+        raise ValueError('\'%s\' is not a boolean value' % value)
+    return t(value)
+
+# 校验用户配置：默认配置中是对象的键必须仍然是对象，标量必须能转换为默认值的类型
+# Validate a user configuration: keys that are objects in the default configuration must still be objects,
+# scalars must be convertible to the type of the default value
+def _validate(default, user, prefix=None):
+    for key, value in user.items():
+        path = str(key) if prefix is None else '.'.join([prefix, str(key)])
+        if key not in default or default[key] is None or value is None:
+            continue
+        if isinstance(default[key], dict):
+            if not isinstance(value, dict):
+                raise ConfigException('The key [%s] must be an object' % path)
+            _validate(default[key], value, path)
+        elif not isinstance(default[key], (list, dict)):
+            try:
+                _convert(value, type(default[key]))
+            except (TypeError, ValueError) as e:
+                raise ConfigException('The key [%s] cannot be converted to %s: %s' % (path, type(default[key]).__name__, e))
+
+# 比较两个扁平索引，返回值发生变化的叶子键：{键: (旧值, 新值)}，不存在的一侧为None
+# Compare two flattened indexes and return the leaf keys whose values changed: {key: (old value, new value)}, a missing side is None
+def _diff(old, new):
+    changes = {}
+    for key in set(old) | set(new):
+        before = old.get(key)
+        after = new.get(key)
+        if isinstance(before, dict) and isinstance(after, dict):
+            continue
+        if before != after:
+            changes[key] = (before, after)
+    return changes
+
+# 将变化通知给订阅者，订阅者只会收到它订阅的前缀下的键
+# Notify the subscribers of the changes, a subscriber only receives the keys under the prefix it subscribed to
+def _publish(subscribers, changes, logger):
+    for fn, prefix in list(subscribers):
+        if prefix is None:
+            selected = changes
+        else:
+            selected = dict((key, value) for key, value in changes.items() if key == prefix or key.startswith(prefix + '.'))
+        if selected:
+            try:
+                fn(selected)
+            except Exception as e:
+                # 一个订阅者出错不会影响其它订阅者
+                # A failing subscriber does not affect the other subscribers
+                logger.error('Configuration subscriber %r failed: %s', fn, e, exc_info=e)
+
+# 从快照中获取转换为类型t的配置值，转换结果缓存在快照中
+# Get a configuration value converted to type t from a snapshot, the converted result is cached in the snapshot
+def _typed(snapshot, k, t, default):
+    result = snapshot.typed.get((k, t), _MISSING)
+    if result is not _MISSING:
+        return result
+    value = snapshot.get(k, _MISSING) if isinstance(k, str) else _MISSING
+    if value is _MISSING:
+        return default
+    try:
+        result = _convert(value, t)
+    except (TypeError, ValueError) as e:
+        raise ReadConfigException('The key [%s] cannot be converted to %s: %s' % (k, t.__name__, e))
+    snapshot.typed[(k, t)] = result
+    return result
+
+# 什么都不做，用于替换被禁用的日志等级
+# Does nothing, it replaces the disabled log levels
+def _noop(*args, **kwargs):
+    pass
+
+# 延迟计算的日志参数，只有在该等级的日志真正被输出时才会调用fn
+# A lazily evaluated log argument, fn is only called when a record of that level is actually emitted
+class Lazy(object):
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __call__(self):
+        return self.fn(*self.args)
+
+    def __str__(self):
+        return str(self())
+
+
+# 绑定到某个名称（通常是插件名）的日志对象
+# 每个等级是否开启会被缓存下来，被禁用的等级直接是一个空函数，
+# 所以在消息处理循环中被禁用的DEBUG日志几乎没有开销。
+# 日志等级改变后需要调用rebuild（Logger.setLevel和Logger.refresh会自动完成）
+# A log object bound to a name (usually the plugin name)
+# Whether each level is enabled is cached, a disabled level is simply an empty function,
+# so disabled DEBUG logging in message handling loops costs close to nothing.
+# rebuild must be called after the log level changes (Logger.setLevel and Logger.refresh do it automatically)
+class BoundLogger(object):
+    __LEVELS = (
+        ('debug', logging.DEBUG),
+        ('info', logging.INFO),
+        ('warn', logging.WARNING),
+        ('warning', logging.WARNING),
+        ('error', logging.ERROR),
+        ('critical', logging.CRITICAL),
+        ('exception', logging.ERROR)
+    )
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.name = logger.name
+        self.rebuild()
+
+    # 重新计算每个等级是否开启，并替换对应的方法
+    # Recalculate whether each level is enabled and replace the corresponding methods
+    def rebuild(self):
+        self.__enabled = {}
+        for name, level in self.__LEVELS:
+            if self.isEnabledFor(level):
+                if name == 'exception':
+                    setattr(self, name, functools.partial(self.__emit, level, exc_info=True))
+                else:
+                    setattr(self, name, functools.partial(self.__emit, level))
+            else:
+                setattr(self, name, _noop)
+
+    # 指定的等级是否开启，结果会被缓存到下一次rebuild
+    # Whether the given level is enabled, the result is cached until the next rebuild
+    def isEnabledFor(self, level):
+        enabled = self.__enabled.get(level)
+        if enabled is None:
+            enabled = self.__enabled[level] = self.logger.isEnabledFor(level)
+        return enabled
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.isEnabledFor(level):
+            kwargs.setdefault('stacklevel', 3)
+            self.__emit(level, msg, *args, **kwargs)
+
+    # 只有开启的等级才会走到这里，此时才计算延迟的消息和参数
+    # stacklevel让记录中的模块和行号指向真正的调用者
+    # Only enabled levels get here, lazy messages and arguments are evaluated only now
+    # stacklevel makes the module and line number in the record point at the real caller
+    def __emit(self, level, msg, *args, **kwargs):
+        if isinstance(msg, Lazy):
+            msg = msg()
+        if args:
+            args = tuple(arg() if isinstance(arg, Lazy) else arg for arg in args)
+        kwargs.setdefault('stacklevel', 2)
+        self.logger.log(level, msg, *args, **kwargs)
+
+
+# 配置的不可变快照
+# 重新加载配置时会构建新的快照并整体替换，读取者只读取一次快照引用，所以不需要加锁，
+# 也不会看到新旧混合的配置。快照中的值不应该被修改。
+# An immutable snapshot of the configuration
+# Reloading builds a new snapshot and replaces it as a whole, readers only read the snapshot reference once,
+# so they need no lock and never see a mix of old and new configuration. Values in a snapshot must not be modified.
+class ConfigSnapshot(object):
+    __slots__ = ('config', 'index', 'typed', 'version')
+
+    def __init__(self, config, version):
+        self.config = config
+        # 索引是普通的字典（MappingProxyType会明显增加每次查找的开销），快照构建后不会再修改它
+        # The index is a plain dictionary (MappingProxyType adds a noticeable cost to every lookup), it is never modified after the snapshot is built
+        self.index = _flatten(config)
+        # 类型化的配置缓存属于快照，快照被替换时随之失效
+        # The typed configuration cache belongs to the snapshot and is invalidated together with it
+        self.typed = {}
+        self.version = version
+
+    # 从快照中获取配置值，不存在（或为None）时返回default
+    # Get a configuration value from the snapshot, returns default when it does not exist (or is None)
+    def get(self, k, default=None):
+        result = self.index.get(k)
+        return default if result is None else result
+
 
 # 日志基类
 # Logger base class
@@ -12,6 +235,9 @@ class Logger(object):
     # 日志配置信息
     # Log configuration information
     __Uninitialized = True
+    # 已经创建的BoundLogger，以名称为Key
+    # BoundLoggers that have been created, keyed by name
+    __Bound = {}
     # 初始化日志配置
     # Initialize log configuration
     @classmethod
@@ -31,10 +257,11 @@ class Logger(object):
                 # If configFile is not an absolute path,
                 # it is treated as a relative path relative to lattepath
                 if configFile[0] != '/':
-                    path = os.sep.join([LatteConfig['sys.path.latte'], configFile])
+                    path = os.sep.join([LatteConfig.getConfig('sys.path.latte'), configFile])
                 # 读取configFile以构建记录器
                 # Read configFile to construct the logger
-                logging.config.fileConfig(path, disable_existing_loggers=True)
+                from logging.config import fileConfig
+                fileConfig(path, disable_existing_loggers=True)
                 # 声明已初始化
                 # The declaration has been initialized
                 cls.__Uninitialized = False
@@ -102,11 +329,28 @@ class Logger(object):
                 # This will create the console output by default.
                 logging.basicConfig(level=level, format=format, datefmt=datefmt)
                 # 创建日志Formatter对象
+                # 开启logger.json时，文件中的每条日志都是一行JSON
                 # Create a log formatting object
-                formatter = logging.Formatter(format, datefmt)
+                # With logger.json enabled, every record in the file is one line of JSON
+                if LatteConfig.getTypedConfig('logger.json', bool, False):
+                    from .handlers import JsonFormatter
+                    formatter = JsonFormatter(datefmt=datefmt)
+                else:
+                    formatter = logging.Formatter(format, datefmt)
+                # 是否开启队列日志
+                # Whether queued logging is enabled
+                queued = LatteConfig.getTypedConfig('logger.queue.enable', bool, False)
                 # 创建日志输出Handler对象
+                # 只有在真正需要写文件时才导入logging.handlers
                 # Create a file output Handler
-                handler = TimedRotatingFileHandler(outpath, when, interval, backupCount)
+                # logging.handlers is only imported when a file is actually written
+                if queued:
+                    from .handlers import BatchRotatingFileHandler
+                    compress = LatteConfig.getTypedConfig('logger.file.compress', bool, False)
+                    handler = BatchRotatingFileHandler(outpath, when, interval, backupCount, compress=compress)
+                else:
+                    from logging.handlers import TimedRotatingFileHandler
+                    handler = TimedRotatingFileHandler(outpath, when, interval, backupCount)
                 handler.setFormatter(formatter)
                 # 设置记录日志等级
                 # Set the logging level
@@ -114,12 +358,30 @@ class Logger(object):
                 # 写入文件前缀风格
                 # Write file suffix style
                 handler.suffix = suffix
+                if queued:
+                    # 将文件Handler包装在队列Handler中，
+                    # 调用者只需要把日志放入队列，由后台线程批量写入文件
+                    # Wrap the file Handler in a queued Handler,
+                    # callers only put records into the queue and a background thread writes them in batches
+                    from .handlers import QueuedHandler
+                    handler = QueuedHandler(handler,
+                        size=LatteConfig.getTypedConfig('logger.queue.size', int),
+                        overflow=LatteConfig.getConfig('logger.queue.overflow'),
+                        flushInterval=LatteConfig.getTypedConfig('logger.queue.flushInterval', float),
+                        batchSize=LatteConfig.getTypedConfig('logger.queue.batchSize', int))
+                    handler.setLevel(level)
                 # 将文件输出Handler注册到全局Logger中
                 # Register the file output Handler into the global Logger
                 logging.getLogger().addHandler(handler)
+                # 重新加载latte.json时同步日志等级
+                # Follow the log level when latte.json is reloaded
+                LatteConfig.subscribe(cls.__levelChanged, 'logger.level')
                 # 声明已初始化
                 # The declaration has been initialized
                 cls.__Uninitialized = False
+            # 日志等级可能已经改变，重新构建已有的BoundLogger
+            # The log levels may have changed, rebuild the existing BoundLoggers
+            cls.refresh()
 
     # 退出程序
     # 如果指定了异常，
@@ -169,53 +431,99 @@ class Logger(object):
             cls.init()
         return logging.getLogger(app)
 
+    # 获取绑定到app的BoundLogger对象，同一个app总是返回同一个对象
+    # Get the BoundLogger bound to app, the same app always returns the same object
+    @classmethod
+    def bind(cls, app='root'):
+        bound = cls.__Bound.get(app)
+        if bound is None:
+            bound = cls.__Bound.setdefault(app, BoundLogger(cls.getLogger(app)))
+        return bound
+
+    # 设置app的日志等级，并重新构建BoundLogger的缓存
+    # level可以是logging中的等级，也可以是'debug'、'info'这样的名称
+    # Set the log level of app and rebuild the caches of the BoundLoggers
+    # level can be a level from logging or a name such as 'debug' and 'info'
+    @classmethod
+    def setLevel(cls, level, app='root'):
+        if not isinstance(level, int):
+            level = logging.getLevelName(str(level).upper())
+            if not isinstance(level, int):
+                raise ValueError('Unknown log level: \'%s\'' % level)
+        cls.getLogger(app).setLevel(level)
+        cls.refresh()
+
+    @classmethod
+    def __levelChanged(cls, changes):
+        cls.setLevel(changes['logger.level'][1])
+        root = logging.getLogger()
+        for handler in root.handlers:
+            handler.setLevel(root.level)
+
+    # 重新构建所有BoundLogger的缓存
+    # 直接通过logging修改日志等级后需要调用它
+    # Rebuild the caches of all BoundLoggers
+    # It must be called after changing log levels through logging directly
+    @classmethod
+    def refresh(cls):
+        for bound in list(cls.__Bound.values()):
+            bound.rebuild()
+
     # 记录日志
     # Record logs
     @classmethod
     def log(cls, *args, **kwargs):
-        cls.getLogger().log(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 4)
+        cls.bind().log(*args, **kwargs)
 
     # 记录 DEBUG 级别日志
     # Record DEBUG level logs
     @classmethod
     def debug(cls, *args, **kwargs):
-        cls.getLogger().debug(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().debug(*args, **kwargs)
 
     # 记录 INFO 级别日志
     # Record INFO level logs
     @classmethod
     def info(cls, *args, **kwargs):
-        cls.getLogger().info(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().info(*args, **kwargs)
 
     # 记录 WARNING 级别日志
     # Record WARNING level logs
     @classmethod
     def warn(cls, *args, **kwargs):
-        cls.getLogger().warning(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().warning(*args, **kwargs)
 
     # 记录 WARNING 级别日志
     # Record WARNING level logs
     @classmethod
     def warning(cls, *args, **kwargs):
-        cls.getLogger().warning(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().warning(*args, **kwargs)
 
     # 记录 ERROR 级别日志
     # Record ERROR level logs
     @classmethod
     def error(cls, *args, **kwargs):
-        cls.getLogger().error(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().error(*args, **kwargs)
 
     # 记录 CRITICAL 级别日志
     # Record CRITICAL level logs
     @classmethod
     def critical(cls, *args, **kwargs):
-        cls.getLogger().critical(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().critical(*args, **kwargs)
 
     # 记录异常日志
     # Record exception log
     @classmethod
     def exception(cls, *args, **kwargs):
-        cls.getLogger().exception(*args, **kwargs)
+        kwargs.setdefault('stacklevel', 3)
+        cls.bind().exception(*args, **kwargs)
 
 
 # Latte基本配置信息类
@@ -224,6 +532,15 @@ class LatteConfig(object):
     # 这是用户配置信息，在启动时加载
     # This is the user configuration information, which is loaded at startup.
     __UserConfig = None
+    # 这是当前的配置快照，包含扁平化的配置索引，重新加载时被整体替换
+    # This is the current configuration snapshot holding the flattened index, it is replaced as a whole on reload
+    __Snapshot = None
+    # 配置变化的订阅者：[(fn, 前缀)]
+    # Subscribers of configuration changes: [(fn, prefix)]
+    __Subscribers = []
+    # 重新加载是串行的，读取者不需要这个锁
+    # Reloads are serialized, readers do not need this lock
+    __Lock = threading.Lock()
     # 这是默认的配置信息，它是非常完善的
     # This is the default configuration information, it is comprehensive
     __DefaultConfig = {
@@ -232,16 +549,262 @@ class LatteConfig(object):
             'level': 'DEBUG',
             'format': '[%(levelname)-8s] %(asctime)s %(threadName)s %(name)s.%(module)s(%(lineno)d): \n\t%(message)s',
             'datefmt': '%Y-%m-%d %H:%M:%S',
+            # 是否以JSON Lines格式写入日志文件
+            # Whether the log file is written in JSON Lines format
+            'json': False,
             'file': {
                 'filename': 'latte.log',
                 'when': 'D',
                 'suffix': '%Y%m%d.log',
                 'interval': 1,
-                'backupCount': 7
+                'backupCount': 7,
+                # 是否在后台压缩滚动出去的日志文件，只在队列日志中生效
+                # Whether rotated log files are compressed in the background, only effective with queued logging
+                'compress': False
+            },
+            # 队列日志，开启后日志由后台线程批量写入文件
+            # Queued logging, when enabled records are written to the file by a background thread in batches
+            'queue': {
+                'enable': False,
+                'size': 10000,
+                # 'block'，'drop-debug'或'count'
+                # 'block', 'drop-debug' or 'count'
+                'overflow': 'block',
+                'flushInterval': 1.0,
+                'batchSize': 256
             }
         },
         'robot': {
             'name': 'Latte'
+        },
+        # 插件加载器
+        # Plugin loader
+        'loader': {
+            # 并行加载插件的线程数
+            # Number of threads that load plugins in parallel
+            'workers': 8,
+            # 为true时，在plugin.json中声明了"handlers"的插件在第一次收到消息时才加载，plugin.json中的"lazy"可以覆盖它
+            # When true, plugins declaring "handlers" in plugin.json are only loaded when they receive their first message,
+            # "lazy" in plugin.json overrides it
+            'lazy': False,
+            # 按需激活的插件空闲超过idleTimeout秒后被卸载，0表示不卸载，plugin.json中的"idleTimeout"可以覆盖它
+            # Plugins activated on demand are unloaded after idleTimeout idle seconds, 0 means never,
+            # "idleTimeout" in plugin.json overrides it
+            'idleTimeout': 0,
+            # 检查空闲插件的间隔（秒）
+            # Interval (seconds) of checking for idle plugins
+            'idleInterval': 30
+        },
+        # Server运行时
+        # Server runtime
+        'runtime': {
+            # 运行阻塞的（旧式的）Server的线程数
+            # Number of threads that run blocking (legacy) Servers
+            'workers': 32,
+            # 关闭时等待Server结束的秒数
+            # Seconds to wait for Servers to finish when shutting down
+            'shutdownTimeout': 10
+        },
+        # 消息路由器
+        # Message router
+        'router': {
+            # 命令的前缀，例如'/help'
+            # Prefixes of commands, e.g. '/help'
+            'commandPrefixes': ['/'],
+            # 匹配命令、前缀和关键字时是否忽略大小写
+            # Whether case is ignored when matching commands, prefixes and keywords
+            'ignoreCase': True,
+            # 批处理函数默认的批大小，以及一批中第一条消息最长的等待时间（秒）
+            # Default batch size of batch handlers, and the longest time (seconds) the first message of a batch waits
+            'batchSize': 64,
+            'batchWait': 0.005
+        },
+        # 多进程模式
+        # Worker mode
+        'worker': {
+            # 工作进程的数量，0表示单进程运行
+            # Number of worker processes, 0 means running in a single process
+            'count': 0,
+            # 工作进程退出后的重启策略：'always'，'on-failure'或'never'
+            # Restart policy when a worker exits: 'always', 'on-failure' or 'never'
+            'restart': 'on-failure',
+            # 在restartWindow秒内最多重启maxRestarts次，超过后主进程退出
+            # At most maxRestarts restarts within restartWindow seconds, the supervisor exits beyond that
+            'maxRestarts': 10,
+            'restartWindow': 60,
+            # 重启前等待的秒数
+            # Seconds to wait before restarting
+            'restartDelay': 1,
+            # 监听的地址，例如'0.0.0.0:8080'，为空时不监听
+            # Address to listen on, e.g. '0.0.0.0:8080', nothing is listened on when empty
+            'listen': '',
+            # 为true时每个工作进程使用SO_REUSEPORT各自监听，否则共享主进程的监听套接字
+            # When true every worker listens on its own with SO_REUSEPORT, otherwise they share the supervisor's listening socket
+            'reusePort': False,
+            'backlog': 1024
+        },
+        # 运行时指标
+        # Runtime metrics
+        'metrics': {
+            # 为false时不记录任何指标
+            # No metrics are recorded when false
+            'enable': True,
+            # 本地统计端点的地址，例如'127.0.0.1:9180'，为空时不启动
+            # Address of the local stats endpoint, e.g. '127.0.0.1:9180', it is not started when empty
+            'listen': '',
+            # 定期写入快照的文件，为空时不写入
+            # File that snapshots are periodically written to, nothing is written when empty
+            'dumpPath': '',
+            'dumpInterval': 60,
+            # 采样分析器的采样间隔（秒）
+            # Sampling interval (seconds) of the sampling profiler
+            'profileInterval': 0.005
+        },
+        # 插件处理函数的结果缓存，plugin.json中的"cache"可以覆盖这些限制
+        # Result cache of plugin handlers, "cache" in plugin.json overrides these limits
+        'cache': {
+            # 每个插件最多缓存的条目数
+            # Maximum number of entries cached per plugin
+            'maxEntries': 1024,
+            # 每个插件的缓存估算占用的内存上限（字节）
+            # Cap of the estimated memory used by the cache of each plugin (bytes)
+            'maxBytes': 8388608,
+            # 默认的过期时间（秒），0表示不过期
+            # Default expiry time (seconds), 0 means never expiring
+            'ttl': 0
+        },
+        # 会话存储
+        # Session store
+        'session': {
+            # 分片数，会被向上取整为2的幂
+            # Number of shards, rounded up to a power of two
+            'shards': 64,
+            # 会话在最后一次访问之后的过期时间（秒）
+            # Expiry time (seconds) of a session after its last access
+            'ttl': 1800,
+            # 过期时间轮的刻度（秒），也是后台清理的间隔
+            # Tick (seconds) of the expiry wheel, also the interval of the background sweep
+            'resolution': 1,
+            # 最多保存的会话数，0表示不限制
+            # Maximum number of sessions, 0 means no limit
+            'maxSessions': 0,
+            # 持久化文件的路径，相对路径基于lattepath，为空时只保存在内存中；多进程模式下会加上工作进程编号作为后缀
+            # Path of the persistence file, relative to lattepath, sessions are only kept in memory when empty; the worker index is appended as a suffix in worker mode
+            'path': ''
+        },
+        # 定时器调度器
+        # Timer scheduler
+        'scheduler': {
+            # 时间轮的刻度（秒），定时器的精度
+            # Tick (seconds) of the timing wheel, the precision of timers
+            'resolution': 0.01,
+            # 持久化定时器的保存路径，相对路径基于lattepath，为空时定时器只保存在内存中；多进程模式下会加上工作进程编号作为后缀
+            # Path the persistent timers are saved to, relative to lattepath, timers are only kept in memory when empty; the worker index is appended as a suffix in worker mode
+            'path': ''
+        },
+        # 插件之间的事件总线
+        # Event bus between plugins
+        'bus': {
+            # 每个排队的订阅最多缓存的消息数
+            # Maximum number of payloads held by each queued subscription
+            'maxQueue': 1024
+        },
+        # 聊天协议适配器
+        # Chat protocol adapters
+        'adapter': {
+            # 每个连接预先分配的接收缓冲区大小（字节）
+            # Size (bytes) of the receive buffer preallocated for every connection
+            'bufferSize': 65536,
+            # 一帧（或者一行）的最大长度（字节），超过时连接被关闭
+            # Maximum length (bytes) of a frame (or a line), the connection is closed beyond it
+            'maxFrame': 1048576,
+            # 每个连接最多等待处理的消息数，超过时暂停读取
+            # Maximum number of messages waiting to be handled per connection, reading pauses beyond it
+            'maxPending': 64
+        },
+        # 插件的准入控制，plugin.json中的"admission"可以覆盖除enable和concurrency以外的设置
+        # Admission control of plugins, "admission" in plugin.json overrides the settings other than enable and concurrency
+        'admission': {
+            # 为true时所有插件都受准入控制，否则只有在plugin.json中声明了"admission"的插件
+            # When true all plugins are under admission control, otherwise only the plugins declaring "admission" in plugin.json
+            'enable': False,
+            # 所有插件共享的执行槽位数
+            # Number of execution slots shared by all plugins
+            'concurrency': 16,
+            # 每个插件最多排队的消息数，以及排队的最长时间（秒），0表示不限制时间
+            # Maximum number of messages queued per plugin, and the longest time (seconds) they queue, 0 means no time limit
+            'queue': 64,
+            'timeout': 5,
+            # 插件的令牌桶：每秒的消息数和突发容量，0表示不限制
+            # Token bucket of the plugin: messages per second and burst capacity, 0 means unlimited
+            'rate': 0,
+            'burst': 0,
+            # 每个用户在每个插件上的令牌桶
+            # Token bucket of every user on every plugin
+            'userRate': 0,
+            'userBurst': 0,
+            # 加权公平排队的权重
+            # Weight in weighted fair queuing
+            'weight': 1,
+            # 消息被拒绝时的回复，为空时不回复
+            # Reply when a message is rejected, nothing is replied when empty
+            'reject': ''
+        },
+        # 隔离运行的插件，plugin.json中的"sandbox"为true时开启，为字典时可以覆盖这里的设置
+        # Sandboxed plugins, enabled by "sandbox": true in plugin.json, a dict there overrides the settings here
+        'sandbox': {
+            # 每个方向的共享内存环形缓冲区的字节数
+            # Bytes of the shared memory ring buffer in each direction
+            'ringSize': 1048576,
+            # 处理函数的超时时间（秒），超时后重启子进程，0表示不限制
+            # Timeout of handlers (seconds), the child process is restarted after it, 0 means no limit
+            'timeout': 10,
+            # 等待子进程导入插件并完成init()的最长时间（秒）
+            # Longest time (seconds) to wait for the child process to import the plugin and finish init()
+            'startTimeout': 30,
+            # 子进程常驻内存的上限（MB），超过后重启子进程，0表示不限制
+            # Limit of the resident memory of the child process (MB), the child is restarted beyond it, 0 means no limit
+            'memory': 0,
+            # 看门狗检查的间隔（秒）
+            # Interval of the watchdog checks (seconds)
+            'interval': 1,
+            # 在restartWindow秒内最多重启maxRestarts次，超过后不再重启
+            # At most maxRestarts restarts within restartWindow seconds, it is not restarted any more beyond that
+            'maxRestarts': 5,
+            'restartWindow': 60
+        },
+        # 插件共享的出站连接池（runtime.pool）
+        # The outbound connection pool shared by plugins (runtime.pool)
+        'pool': {
+            # 每个主机同时最多的连接数，以及最多保留的空闲连接数
+            # Maximum number of connections per host at a time, and maximum number of idle connections kept
+            'maxPerHost': 10,
+            'maxIdle': 10,
+            # 空闲连接保留的秒数
+            # Seconds idle connections are kept
+            'idleTimeout': 30,
+            # 建立连接、读取响应和等待空闲连接的超时时间（秒），0表示不限制
+            # Timeouts (seconds) of connecting, reading a response and waiting for a free connection, 0 means no limit
+            'connectTimeout': 5,
+            'readTimeout': 30,
+            'acquireTimeout': 10,
+            # DNS解析结果缓存的秒数，0表示不缓存
+            # Seconds DNS results are cached, 0 means no caching
+            'dnsTtl': 60
+        },
+        # 配置文件的热加载
+        # Hot reloading of configuration files
+        'watch': {
+            # 为true时运行时会监视latte.json和plugin.json，变化后自动重新加载
+            # When true the runtime watches latte.json and plugin.json and reloads them after they change
+            'enable': False,
+            # 是否使用inotify，不可用时退回到每隔interval秒轮询一次
+            # Whether inotify is used, it falls back to polling every interval seconds when it is not available
+            'inotify': True,
+            'interval': 1,
+            # 合并同一次保存产生的多个事件的等待时间（秒）
+            # Time (seconds) to wait to merge the several events of one save
+            'debounce': 0.1
         }
     }
     # 初始化latte的基本配置信息
@@ -278,6 +841,15 @@ class LatteConfig(object):
             configPath = os.environ.get('LATTE_CONFIG_PATH')
             if not configPath:
                 configPath = os.sep.join([lattePath, 'config'])
+            # 获取LRE缓存目录的路径
+            # 如果当前系统变量中没有'LATTE_CACHE_PATH'，
+            # 使用lattepath下.cache文件夹的路径
+            # Get the path to the LRE cache directory
+            # If there is no 'LATTE_CACHE_PATH' in the current system variable,
+            # use the path to the .cache folder under lattepath
+            cachePath = os.environ.get('LATTE_CACHE_PATH')
+            if not cachePath:
+                cachePath = os.sep.join([lattePath, '.cache'])
             # Latte系统配置信息，不是用户可定义的
             # Latte system configuration information, which is not user-definable
             sysConfig = {
@@ -285,7 +857,8 @@ class LatteConfig(object):
                     'path': {
                         'latte': lattePath,
                         'config': configPath,
-                        'plugin': pluginPath
+                        'plugin': pluginPath,
+                        'cache': cachePath
                     },
                 }
             }
@@ -299,80 +872,105 @@ class LatteConfig(object):
                 # 在configpath下查找latte.json配置文件
                 # Look for the latte.json configuration file under configpath
                 latteconfig = os.sep.join([configPath, 'latte.json'])
-                if not os.path.isfile(latteconfig):
-                    raise ConfigException('Could not find the latte.json configuration file, or it is not a readable file.' + configpath)
+                # 获取配置清单缓存，latte.json未变化时不会被重新解析
+                # Get the manifest cache, latte.json is not parsed again when it has not changed
+                manifest = ManifestCache.instance(os.sep.join([cachePath, 'manifest']))
+                try:
+                    stat = os.stat(latteconfig)
+                except OSError:
+                    stat = None
+                if stat is None or not S_ISREG(stat.st_mode):
+                    raise ConfigException('Could not find the latte.json configuration file, or it is not a readable file.' + configPath)
                 # 读取latte.json配置文件，如果发生异常则抛出
                 # Read the latte.json configuration file and throw if an exception occurs
-                with io.open(latteconfig, mode='r', encoding='utf-8') as config:
-                    cls.__UserConfig = json.load(config)
+                cls.__UserConfig = manifest.read(latteconfig, stat)
+                manifest.save()
+                # 构建扁平化的配置索引
+                # Build the flattened configuration index
+                cls.__build()
             except Exception as e:
                 # 拦截异常并退出程序
                 # Intercept the exception and exit the program
                 Logger.exit(e)
 
-    # 内部定义私有函数
-    # 遍历配置信息字典的功能
-    # Internally defines a private function
-    # that traverses the function of the configuration information dictionary
-    @classmethod
-    def __find(cls, keys, root):
-        # 获取keys数组的长度
-        # Get the length of the keys array
-        length = len(keys)
-        # 遍历配置信息
-        # Traverse configuration
-        for i in range(0, length):
-            key = keys[i]
-            # 如果root不是list或dict或tuple，
-            # 或者key不在root中，则退出循环
-            # If root is not a list or dict or tuple,
-            # Or the key is not in root, then the loop is exited
-            if (type(root) not in [list, dict, tuple]) or (key not in root):
-                break
-            # 如果这是最后一个key，则返回与该key对应的值。
-            # If this is the last key, the value corresponding to this key is returned.
-            if i == length - 1:
-                return root[key]
-            # 如果上述两者都不成立，
-            # 则将'root[key]'的值赋给'root'并继续遍历
-            # If neither of the above is true,
-            # assign the value of 'root[key]' to 'root' and continue traversing
-            root = root[key]
+    # 构建配置快照，用户配置覆盖默认配置
+    # 'sys'是系统配置，不允许用户覆盖
+    # Build the configuration snapshot, the user configuration overrides the default configuration
+    # 'sys' is system configuration and cannot be overridden by the user
+    @classmethod
+    def __build(cls):
+        user = cls.__UserConfig if isinstance(cls.__UserConfig, dict) else {}
+        user = dict((key, value) for key, value in user.items() if key != 'sys')
+        version = cls.__Snapshot.version + 1 if cls.__Snapshot is not None else 1
+        cls.__Snapshot = ConfigSnapshot(_overlay(cls.__DefaultConfig, user), version)
 
-    # 使用诸如“the.multi.level.key”之类的key获取配置信息的值
-    # Get the value of the configuration information using a key such as "the.multi.level.key"
+    # 获取当前的配置快照，需要读取多个相关的配置时，应该从同一个快照中读取
+    # Get the current configuration snapshot, related settings should be read from the same snapshot
     @classmethod
-    def getConfig(cls, k):
-        # 声明result
-        # Statement result
-        result = None
+    def snapshot(cls):
         # 验证初始化
         # Verify initialization
-        if cls.__UserConfig is None:
+        if cls.__Snapshot is None:
             cls.init()
+        return cls.__Snapshot
+
+    # 重新加载latte.json，只有文件发生变化时才会重新解析
+    # 新的配置校验通过后才会替换当前快照，否则抛出ConfigException并保留当前配置
+    # 返回发生变化的键：{键: (旧值, 新值)}，订阅者同时会收到这些变化
+    # Reload latte.json, it is only parsed again when the file has changed
+    # The current snapshot is only replaced after the new configuration is validated, otherwise a ConfigException is raised and the current configuration is kept
+    # Returns the changed keys: {key: (old value, new value)}, the subscribers receive these changes too
+    @classmethod
+    def reload(cls):
+        old = cls.snapshot()
+        with cls.__Lock:
+            latteconfig = os.sep.join([old.get('sys.path.config'), 'latte.json'])
+            manifest = ManifestCache.instance(os.sep.join([old.get('sys.path.cache'), 'manifest']))
+            try:
+                stat = os.stat(latteconfig)
+            except OSError:
+                stat = None
+            if stat is None or not S_ISREG(stat.st_mode):
+                raise ConfigException('Could not find the latte.json configuration file, or it is not a readable file.')
+            user = manifest.read(latteconfig, stat)
+            manifest.save()
+            if not isinstance(user, dict):
+                raise ConfigException('latte.json must contain a JSON object')
+            _validate(cls.__DefaultConfig, user)
+            cls.__UserConfig = user
+            cls.__build()
+            changes = _diff(old.index, cls.__Snapshot.index)
+        if changes:
+            Logger.bind('Latte.config').info('latte.json reloaded, %d keys changed', len(changes))
+            _publish(cls.__Subscribers, changes, Logger.bind('Latte.config'))
+        return changes
+
+    # 订阅配置的变化，prefix不为None时只接收该前缀下的键
+    # fn以fn({键: (旧值, 新值)})的形式在执行重新加载的线程中调用
+    # Subscribe to configuration changes, only keys under prefix are received when prefix is not None
+    # fn is called as fn({key: (old value, new value)}) on the thread that performs the reload
+    @classmethod
+    def subscribe(cls, fn, prefix=None):
+        cls.__Subscribers.append((fn, prefix))
+
+    @classmethod
+    def unsubscribe(cls, fn):
+        cls.__Subscribers[:] = [item for item in cls.__Subscribers if item[0] != fn]
+
+    # 使用诸如“the.multi.level.key”之类的key获取配置信息的值
+    # Get the value of the configuration information using a key such as "the.multi.level.key"
+    @classmethod
+    def getConfig(cls, k):
         # 如果k不是字符串，则抛出异常
         # Throws an exception if k is not a string
         if not isinstance(k, str):
             raise ReadConfigException('The key [' + str(k) + '] not is str type')
-        # 用'.'拆分k
-        # Split k with '.'
-        keys = k.split('.')
-
-        # 如果第一个是'sys'，则跳过用户配置信息
-        # Skip user configuration information if the first is 'sys'
-        if keys[0] != 'sys':
-            # 使用用户配置信息作为根，
-            # 遍历字典，找到k的值
-            # Use the user configuration information as the root,
-            # traverse the dictionary, and find the key value.
-            result = cls.__find(keys, cls.__UserConfig)
-
-        # 指定的密钥不在用户定义的配置中,
-        # 因此，开始遍历默认配置
-        # The specified key is not in the user-defined configuration
-        # So, start traversing the default configuration
-        result = cls.__find(keys, cls.__DefaultConfig)
-
+        # 直接从当前快照的扁平索引中查找
+        # Look it up directly in the flattened index of the current snapshot
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        result = snapshot.index.get(k)
         # 当result不是None时返回结果
         # Return the result when it is not None
         if result is not None:
@@ -389,144 +987,195 @@ class LatteConfig(object):
     # Returns the default value if the specified configuration does not exist
     @classmethod
     def getConfigOrDefault(cls, k, default):
-        # 捕获异常
-        # Capture exception
-        try:
-            return cls.getConfig(k)
-        # 它只会尝试捕获ReadConfigException,
-        # 不管其他异常
-        # It will only try to catch a ReadConfigException,
-        # regardless of other exceptions.
-        except ReadConfigException:
+        # 未命中时不再通过异常返回
+        # A miss no longer goes through an exception
+        if not isinstance(k, str):
             return default
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        result = snapshot.index.get(k)
+        return default if result is None else result
 
     # 尝试获取配置信息，如果没有，则返回None
     # Try to get the configuration information, if not, return None
     @classmethod
     def findConfig(cls, k):
-        try:
-            return cls.getConfig(k)
-        # 这将导致它拦截几乎所有异常并返回None
-        # This will cause it to intercept almost all exceptions and return None
-        except Exception:
-            return None
+        return cls.getConfigOrDefault(k, None)
+
+    # 获取配置信息并转换为类型t，转换结果会被缓存在当前快照中
+    # 如果指定的配置不存在，则返回default
+    # 如果无法转换，则抛出ReadConfigException异常
+    # Get the configuration information converted to type t, the converted result is cached in the current snapshot
+    # Returns the default value if the specified configuration does not exist
+    # Throws a ReadConfigException if the value cannot be converted
+    @classmethod
+    def getTypedConfig(cls, k, t, default=None):
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        return _typed(snapshot, k, t, default)
 
 
 class PluginConfig(object):
-    __Names = []
-    __Config = None
+    # 这是当前的插件配置快照，以插件名为第一级Key，重新加载时被整体替换
+    # This is the current plugin configuration snapshot keyed by plugin name first, it is replaced as a whole on reload
+    __Snapshot = None
+    # 配置变化的订阅者：[(fn, 前缀)]
+    # Subscribers of configuration changes: [(fn, prefix)]
+    __Subscribers = []
+    # 重新加载是串行的，读取者不需要这个锁
+    # Reloads are serialized, readers do not need this lock
+    __Lock = threading.Lock()
     # 初始化插件配置信息
     # Initialize plugin configuration information
     @classmethod
     def init(cls):
-        # 只有在当cls.__Config不为None时，才会执行
-        # Execute only when cls.__Config is not None
-        if cls.__Config is None:
-            cls.__Config = {}
-            # 获取Logger对象
-            # Get Logger object
-            logger = Logger.getLogger('Latte.plugin')
-            # 获取插件目录的路径
-            # Get the path to the plugin directory
-            pluginPath = LatteConfig.getConfig('sys.path.plugin')
-            # 如果插件目录不是一个文件夹，则抛出异常
-            # Throw an exception if the plugin directory is not a folder
-            if not os.path.isdir(pluginPath):
-                raise ConfigException('The specified plugin path does not exist or is not a folder')
-            # 遍历插件目录下的每一个文件
-            # Traverse every file in the plugin directory
-            for name in os.listdir(pluginPath):
-                # 拼接路径，得到当前遍历的插件的完整路径
-                # Splicing path, get the full path of the currently traversed plugin
-                currPluginPath = os.sep.join([pluginPath, name])
-                # 如果这个文件不是一个文件夹，则跳过该插件，并且发出警告
-                # If this file is not a folder, skip the plugin and issue a warning
-                if not os.path.isdir(currPluginPath):
-                    logger.warn('[Plugin \'%s\' is not loaded] File \'%s\' is not a folder.' % (name, name))
-                    continue
-                # 拼接路径，得到当前遍历的插件的配置文件的完整路径
-                # Splicing path, get the full path of the configuration file of the currently traversed plugin
-                pluginconfig = os.sep.join([currPluginPath, 'plugin.json'])
-                # 如果这个配置文件不存在，或者不是文件，则跳过该插件，并且发出警告
-                # If the configuration file does not exist or is not a file, skip the plugin and issue a warning
-                if not os.path.isfile(pluginconfig):
-                    logger.warn('[Plugin \'%s\' is not loaded] The plugin configuration file plugin.json is not found.' % name)
-                    continue
-                try:
-                    # 读取插件的配置信息，并以插件名为Key，将它存入cls.__Config中
-                    # Read the configuration information of the plugin and store it in cls.__Config with the plugin name Key.
-                    with io.open(pluginconfig, mode='r', encoding='utf-8') as plugin:
-                        cls.__Config[name] = json.load(plugin)
-                        # 读取成功时，才会将插件名添加到名称域中
-                        # The plugin name will be added to the name field when the read is successful
-                        cls.__Names.append(name)
-                except Exception as e:
-                    # 如果读取配置时，发生任何异常，则跳过该插件，并发出警告
-                    # If any exception occurs while reading the configuration, skip the plugin and issue a warning
-                    logger.warn('[Plugin \'%s\' is not loaded] %s' % (name, e))
-            # 如果cls.__Config内至少有一个元素，则执行下一步代码
-            # If there is at least one element in cls.__Config, execute the next code
-            # if cls.__Config:
-
-    # 内部定义私有函数
-    # 遍历配置信息字典的功能
-    # Internally defines a private function
-    # that traverses the function of the configuration information dictionary
-    @classmethod
-    def __find(cls, keys, root):
-        # 获取keys数组的长度
-        # Get the length of the keys array
-        length = len(keys)
-        # 遍历配置信息
-        # Traverse configuration
-        for i in range(0, length):
-            key = keys[i]
-            # 如果root不是list或dict或tuple，
-            # 或者key不在root中，则退出循环
-            # If root is not a list or dict or tuple,
-            # Or the key is not in root, then the loop is exited
-            if (type(root) not in [list, dict, tuple]) or (key not in root):
-                break
-            # 如果这是最后一个key，则返回与该key对应的值。
-            # If this is the last key, the value corresponding to this key is returned.
-            if i == length - 1:
-                return root[key]
-            # 如果上述两者都不成立，
-            # 则将'root[key]'的值赋给'root'并继续遍历
-            # If neither of the above is true,
-            # assign the value of 'root[key]' to 'root' and continue traversing
-            root = root[key]
+        # 只有在当cls.__Snapshot为None时，才会执行
+        # Execute only when cls.__Snapshot is None
+        if cls.__Snapshot is None:
+            with cls.__Lock:
+                if cls.__Snapshot is None:
+                    cls.__Snapshot = ConfigSnapshot(cls.__scan(None, {}), 1)
+
+    # 读取插件目录下的plugin.json，返回{插件名: 配置}
+    # names为None时读取全部插件，否则只读取指定的插件，其余插件沿用previous中的配置
+    # 无法读取的plugin.json会被跳过并发出警告，如果previous中有这个插件，继续使用之前的配置
+    # Read plugin.json files under the plugin directory and return {plugin name: configuration}
+    # All plugins are read when names is None, otherwise only the specified plugins are, the others keep their configuration from previous
+    # A plugin.json that cannot be read is skipped with a warning, the previous configuration is kept if previous has this plugin
+    @classmethod
+    def __scan(cls, names, previous):
+        # 获取Logger对象
+        # Get Logger object
+        logger = Logger.bind('Latte.plugin')
+        # 获取插件目录的路径
+        # Get the path to the plugin directory
+        pluginPath = LatteConfig.getConfig('sys.path.plugin')
+        # 如果插件目录不是一个文件夹，则抛出异常
+        # Throw an exception if the plugin directory is not a folder
+        if not os.path.isdir(pluginPath):
+            raise ConfigException('The specified plugin path does not exist or is not a folder')
+        # 获取配置清单缓存，未变化的plugin.json不会被重新解析
+        # Get the manifest cache, unchanged plugin.json files are not parsed again
+        manifest = ManifestCache.instance(os.sep.join([LatteConfig.getConfig('sys.path.cache'), 'manifest']))
+        # 遍历插件目录下的每一个文件
+        # os.scandir返回的条目自带文件类型，不需要额外的isdir调用
+        # Traverse every file in the plugin directory
+        # Entries returned by os.scandir carry the file type, no extra isdir call is needed
+        with os.scandir(pluginPath) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        if names is None:
+            config = {}
+        else:
+            entries = [entry for entry in entries if entry.name in names]
+            config = dict(previous)
+            # 已经被删除的插件目录
+            # Plugin directories that have been removed
+            for name in set(names) - set(entry.name for entry in entries):
+                config.pop(name, None)
+        for entry in entries:
+            name = entry.name
+            # 如果这个文件不是一个文件夹，则跳过该插件，并且发出警告
+            # If this file is not a folder, skip the plugin and issue a warning
+            if not entry.is_dir():
+                logger.warn('[Plugin \'%s\' is not loaded] File \'%s\' is not a folder.', name, name)
+                config.pop(name, None)
+                continue
+            # 拼接路径，得到当前遍历的插件的配置文件的完整路径
+            # Splicing path, get the full path of the configuration file of the currently traversed plugin
+            pluginconfig = os.sep.join([entry.path, 'plugin.json'])
+            # 如果这个配置文件不存在，或者不是文件，则跳过该插件，并且发出警告
+            # 只需要一次stat，结果同时用于校验缓存
+            # If the configuration file does not exist or is not a file, skip the plugin and issue a warning
+            # Only one stat is needed, its result is also used to validate the cache
+            try:
+                stat = os.stat(pluginconfig)
+            except OSError:
+                stat = None
+            if stat is None or not S_ISREG(stat.st_mode):
+                logger.warn('[Plugin \'%s\' is not loaded] The plugin configuration file plugin.json is not found.', name)
+                config.pop(name, None)
+                continue
+            try:
+                # 读取插件的配置信息，并以插件名为Key存入config中
+                # Read the configuration information of the plugin and store it in config with the plugin name Key.
+                data = manifest.read(pluginconfig, stat)
+                if not isinstance(data, dict):
+                    raise ConfigException('plugin.json must contain a JSON object')
+                config[name] = data
+            except Exception as e:
+                # 如果读取配置时，发生任何异常，则跳过该插件，并发出警告
+                # If any exception occurs while reading the configuration, skip the plugin and issue a warning
+                if name in previous:
+                    logger.warn('[Plugin \'%s\'] plugin.json is rejected, the previous configuration is kept: %s', name, e)
+                    config[name] = previous[name]
+                else:
+                    logger.warn('[Plugin \'%s\' is not loaded] %s', name, e)
+        # 将有变化的内容写回缓存
+        # Write the changes back to the cache
+        manifest.save()
+        # 插件名保持有序
+        # Plugin names are kept in order
+        return dict((name, config[name]) for name in sorted(config))
+
+    # 获取当前的插件配置快照
+    # Get the current plugin configuration snapshot
+    @classmethod
+    def snapshot(cls):
+        # 验证初始化
+        # Verify initialization
+        if cls.__Snapshot is None:
+            cls.init()
+        return cls.__Snapshot
+
+    # 重新加载plugin.json，names为None时重新读取所有插件，否则只读取指定的插件
+    # 只有发生变化的文件会被重新解析，返回发生变化的键：{键: (旧值, 新值)}，键以插件名开头
+    # Reload plugin.json files, all plugins are read again when names is None, otherwise only the specified plugins are
+    # Only files that have changed are parsed again, returns the changed keys: {key: (old value, new value)}, keys start with the plugin name
+    @classmethod
+    def reload(cls, names=None):
+        old = cls.snapshot()
+        with cls.__Lock:
+            cls.__Snapshot = ConfigSnapshot(cls.__scan(names, old.config), old.version + 1)
+            changes = _diff(old.index, cls.__Snapshot.index)
+        if changes:
+            Logger.bind('Latte.plugin').info('plugin.json reloaded, %d keys changed', len(changes))
+            _publish(cls.__Subscribers, changes, Logger.bind('Latte.plugin'))
+        return changes
+
+    # 订阅插件配置的变化，插件通常以自己的插件名作为prefix
+    # fn以fn({键: (旧值, 新值)})的形式在执行重新加载的线程中调用
+    # Subscribe to plugin configuration changes, a plugin usually uses its own plugin name as prefix
+    # fn is called as fn({key: (old value, new value)}) on the thread that performs the reload
+    @classmethod
+    def subscribe(cls, fn, prefix=None):
+        cls.__Subscribers.append((fn, prefix))
+
+    @classmethod
+    def unsubscribe(cls, fn):
+        cls.__Subscribers[:] = [item for item in cls.__Subscribers if item[0] != fn]
 
     # 获取全部的插件名称
     # Get all plugin names
     @classmethod
     def names(cls):
-        return cls.__Names[:]
+        return list(cls.snapshot().config)
 
     # 使用诸如“the.multi.level.key”之类的key获取配置信息的值
     # Get the value of the configuration information using a key such as "the.multi.level.key"
     @classmethod
     def getConfig(cls, k):
-        # 声明result
-        # Statement result
-        result = None
-        # 验证初始化
-        # Verify initialization
-        if cls.__Config is None:
-            cls.init()
         # 如果k不是字符串，则抛出异常
         # Throws an exception if k is not a string
         if not isinstance(k, str):
             raise ReadConfigException('The key [' + str(k) + '] not is str type')
-
-        # 用'.'拆分k
-        # Split k with '.'
-        keys = k.split('.')
-
-        # 遍历字典，找到k的值
-        # traverse the dictionary, and find the key value.
-        result = cls.__find(keys, cls.__Config)
-
+        # 直接从当前快照的扁平索引中查找
+        # Look it up directly in the flattened index of the current snapshot
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        result = snapshot.index.get(k)
         # 当result不是None时返回结果
         # Return the result when it is not None
         if result is not None:
@@ -543,30 +1192,51 @@ class PluginConfig(object):
     # Returns the default value if the specified configuration does not exist
     @classmethod
     def getConfigOrDefault(cls, k, default):
-        # 捕获异常
-        # Capture exception
-        try:
-            return cls.getConfig(k)
-        # 它只会尝试捕获ReadConfigException,
-        # 不管其他异常
-        # It will only try to catch a ReadConfigException,
-        # regardless of other exceptions.
-        except ReadConfigException:
+        # 未命中时不再通过异常返回
+        # A miss no longer goes through an exception
+        if not isinstance(k, str):
             return default
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        result = snapshot.index.get(k)
+        return default if result is None else result
 
     # 尝试获取配置信息，如果没有，则返回None
     # Try to get the configuration information, if not, return None
     @classmethod
     def findConfig(cls, k):
-        try:
-            return cls.getConfig(k)
-        # 这将导致它拦截几乎所有异常并返回None
-        # This will cause it to intercept almost all exceptions and return None
-        except Exception:
-            return None
-
-# 加载包时初始化Logger，LatteCofing和PluginConfig
-# Initialize Logger, LatteCofing, and PluginConfig when the package is loaded
-LatteConfig.init()
-Logger.init()
-PluginConfig.init()
+        return cls.getConfigOrDefault(k, None)
+
+    # 获取配置信息并转换为类型t，转换结果会被缓存在当前快照中
+    # 如果指定的配置不存在，则返回default
+    # 如果无法转换，则抛出ReadConfigException异常
+    # Get the configuration information converted to type t, the converted result is cached in the current snapshot
+    # Returns the default value if the specified configuration does not exist
+    # Throws a ReadConfigException if the value cannot be converted
+    @classmethod
+    def getTypedConfig(cls, k, t, default=None):
+        snapshot = cls.__Snapshot
+        if snapshot is None:
+            snapshot = cls.snapshot()
+        return _typed(snapshot, k, t, default)
+
+# 导入包时不再执行任何初始化，Logger，LatteCofing和PluginConfig都会在第一次使用时初始化
+# 需要提前完成初始化时（例如启动运行时），可以显式调用bootstrap
+# 'config'，'logger'和'plugin'分别对应这三个步骤，不指定时执行全部步骤
+# No initialization is performed when the package is imported,
+# Logger, LatteCofing and PluginConfig are initialized when first used.
+# Call bootstrap explicitly when initialization must be done up front (e.g. when the runtime starts).
+# 'config', 'logger' and 'plugin' correspond to these three steps, all of them are executed when none is specified.
+def bootstrap(*steps):
+    initializers = {
+        'config': LatteConfig.init,
+        'logger': Logger.init,
+        'plugin': PluginConfig.init
+    }
+    for step in steps or ('config', 'logger', 'plugin'):
+        if step not in initializers:
+            raise ValueError('Unknown bootstrap step: \'%s\'' % step)
+        # 每个步骤本身都是幂等的，重复调用不会重复初始化
+        # Each step is idempotent by itself, calling it again does not initialize twice
+        initializers[step]()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import inspect
+from .base import LatteConfig
+from .error import LatteException
+from .metrics import Metrics
+
+
+# 将处理函数标记为批处理函数，等价于在plugin.json的处理函数中声明"batch"
+# 批处理函数以handler(messages, matches)的形式调用，返回与messages一一对应的结果列表
+# 可以直接用作@batched，也可以指定批的大小和最长等待时间@batched(size=256, wait=0.01)
+# Mark a handler as a batch handler, equivalent to declaring "batch" for the handler in plugin.json
+# Batch handlers are called as handler(messages, matches) and return a list of results matching messages one to one
+# It can be used directly as @batched, or with the batch size and maximum wait as @batched(size=256, wait=0.01)
+def batched(size=None, wait=None):
+    def decorate(fn):
+        options = {}
+        if size is not None:
+            options['size'] = size
+        if wait is not None:
+            options['wait'] = wait
+        fn.latteBatch = options
+        return fn
+    if callable(size):
+        fn, size = size, None
+        return decorate(fn)
+    return decorate
+
+
+# 微批处理器
+# 收集同一个批处理函数的消息，批满size条，或者第一条消息等待了wait秒后，一次性调用处理函数。
+# 普通函数在executor（运行时的线程池）中运行，不会阻塞事件循环，协程函数被等待；前一批仍在处理时，后续的批可以同时进行。
+# Micro-batcher
+# Collects the messages of one batch handler and calls the handler once when the batch holds size messages,
+# or the first message has waited wait seconds. Plain functions run in executor (the thread pool of the runtime) so they do not block the event loop, coroutine functions are awaited;
+# later batches may proceed while an earlier one is still being handled.
+class Batcher(object):
+    def __init__(self, plugin, handler, fn, size=None, wait=None, executor=None):
+        if size is None:
+            size = LatteConfig.getTypedConfig('router.batchSize', int)
+        if wait is None:
+            wait = LatteConfig.getTypedConfig('router.batchWait', float)
+        self.plugin = plugin
+        self.handler = handler
+        self.fn = fn
+        self.size = max(1, size)
+        self.wait = max(0.0, wait)
+        self.executor = executor
+        self.__messages = []
+        self.__matches = []
+        self.__futures = []
+        self.__timer = None
+
+    def __len__(self):
+        return len(self.__futures)
+
+    # 提交一条消息，返回它的结果；必须在事件循环中调用
+    # Submit one message and return its result; it must be called on the event loop
+    async def submit(self, message, match):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__messages.append(message)
+        self.__matches.append(match)
+        self.__futures.append(future)
+        if len(self.__futures) >= self.size:
+            self.flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.wait, self.flush)
+        return await future
+
+    # 立即处理当前收集的批
+    # Handle the batch collected so far at once
+    def flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if not self.__futures:
+            return
+        messages, matches, futures = self.__messages, self.__matches, self.__futures
+        self.__messages, self.__matches, self.__futures = [], [], []
+        asyncio.get_running_loop().create_task(self.__run(messages, matches, futures))
+
+    async def __run(self, messages, matches, futures):
+        name = 'batch.%s' % self.handler
+        Metrics.incr(self.plugin, name + '.batches')
+        Metrics.incr(self.plugin, name + '.messages', len(messages))
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(self.fn):
+                results = self.fn(messages, matches)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, self.fn, messages, matches)
+            if inspect.isawaitable(results):
+                results = await results
+            results = list(results)
+            if len(results) != len(messages):
+                raise LatteException('[Plugin \'%s\'] Batch handler \'%s\' returned %d results for %d messages'
+                                     % (self.plugin, self.handler, len(results), len(messages)))
+        except BaseException as e:
+            Metrics.incr(self.plugin, name + '.errors')
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            for future, result in zip(futures, results):
+                # 等待结果的调用可能已经被取消
+                # The call waiting for the result may have been cancelled
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            Metrics.observe(self.plugin, name, time.perf_counter() - start)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os, sys, json
+import re
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import timeit
+import asyncio
+import tracemalloc
+from .base import LatteConfig, BoundLogger, Lazy, _flatten
+from .router import Router
+
+# 冷启动时导入lre.base并执行bootstrap的时间预算（秒），导入时不应做任何I/O
+# Startup-time budget for importing lre.base and running bootstrap on a cold start (seconds), importing should do no I/O
+IMPORT_BUDGET = 0.05
+
+# 在子进程中执行的计时脚本，保证每次都是冷启动
+# Timing script executed in a child process, so every run is a cold start
+_IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import lre.base
+imported = time.perf_counter()
+lre.base.bootstrap()
+print(imported - start, time.perf_counter() - imported)
+'''
+
+# 旧版本中getConfig使用的逐级遍历，仅用于对比
+# The level-by-level walk used by the old getConfig, kept only for comparison
+def _walk(k, root):
+    keys = k.split('.')
+    length = len(keys)
+    for i in range(0, length):
+        key = keys[i]
+        if (type(root) not in [list, dict, tuple]) or (key not in root):
+            break
+        if i == length - 1:
+            return root[key]
+        root = root[key]
+
+# 构建一个用于测试的嵌套配置
+# Build a nested configuration for the benchmark
+def _sampleConfig(width=8, depth=4):
+    def node(level):
+        if level == depth:
+            return 'value'
+        return dict(('k%d' % i, node(level + 1)) for i in range(width))
+    return node(0)
+
+# 对比逐级遍历和扁平索引的查找速度
+# Compare the lookup speed of the level-by-level walk and the flattened index
+def benchConfig(number=200000):
+    config = _sampleConfig()
+    index = _flatten(config)
+    hit = 'k7.k7.k7.k7'
+    miss = 'k7.k7.nope.k7'
+    results = {
+        'walk.hit': timeit.timeit(lambda: _walk(hit, config), number=number),
+        'walk.miss': timeit.timeit(lambda: _walk(miss, config), number=number),
+        'index.hit': timeit.timeit(lambda: index.get(hit), number=number),
+        'index.miss': timeit.timeit(lambda: index.get(miss), number=number),
+        'getConfig.hit': timeit.timeit(lambda: LatteConfig.getConfig('logger.file.when'), number=number),
+        'getConfigOrDefault.hit': timeit.timeit(lambda: LatteConfig.getConfigOrDefault('logger.file.when', None), number=number),
+        'getConfigOrDefault.miss': timeit.timeit(lambda: LatteConfig.getConfigOrDefault('logger.file.nope', None), number=number),
+        'getTypedConfig.hit': timeit.timeit(lambda: LatteConfig.getTypedConfig('logger.file.interval', int), number=number),
+    }
+    # 换算为每次调用的秒数
+    # Convert to seconds per call
+    return dict((name, seconds / number) for name, seconds in results.items())
+
+# 测量冷启动时导入lre.base和执行bootstrap的时间，取多次中的最小值
+# Measure the cold-start time of importing lre.base and running bootstrap, taking the minimum of several runs
+def benchImport(repeat=5):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports, bootstraps = [], []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT], cwd=root, stderr=subprocess.DEVNULL)
+        imported, bootstrapped = output.split()
+        imports.append(float(imported))
+        bootstraps.append(float(bootstrapped))
+    return {
+        'import': min(imports),
+        'bootstrap': min(bootstraps),
+        'budget': IMPORT_BUDGET,
+        'withinBudget': min(imports) + min(bootstraps) <= IMPORT_BUDGET
+    }
+
+# 构建n个插件的合成路由，每个插件一个命令、三个关键字和一个正则
+# Build synthetic routes for n plugins, each with one command, three keywords and one pattern
+def _sampleRoutes(n):
+    for i in range(n):
+        yield ('plugin%d' % i, 'handle', ['cmd%d' % i], ['kwa%d' % i, 'kwb%d' % i, 'kwc%d' % i], [r'order\s+%d\b' % i])
+
+# 逐个插件线性扫描的朴素分发，仅用于对比
+# Naive dispatch with a linear scan over every plugin, kept only for comparison
+def _naiveMatch(routes, text):
+    folded = text.lower()
+    matches = []
+    for plugin, commands, keywords, regexes in routes:
+        if any(folded == '/' + command or folded.startswith('/' + command + ' ') for command in commands) \
+                or any(keyword in folded for keyword in keywords) \
+                or any(regex.search(text) for regex in regexes):
+            matches.append(plugin)
+    return matches
+
+# 对比朴素扫描和路由器在n个插件下的分发速度
+# Compare the dispatch speed of the naive scan and the router with n plugins
+def benchRouter(n=1000, number=500):
+    router = Router(commandPrefixes=['/'], ignoreCase=True)
+    naive = []
+    for plugin, handler, commands, keywords, patterns in _sampleRoutes(n):
+        router.add(plugin, handler, commands=commands, keywords=keywords, patterns=patterns)
+        naive.append((plugin, commands, keywords, [re.compile(pattern) for pattern in patterns]))
+    router.build()
+    messages = ['/cmd%d with some arguments' % (n // 2), 'a message mentioning kwb%d somewhere' % (n - 1), 'nothing to see here at all']
+    results = {}
+    for index, message in enumerate(messages):
+        results['naive.%d' % index] = timeit.timeit(lambda: _naiveMatch(naive, message), number=number)
+        results['router.%d' % index] = timeit.timeit(lambda: router.match(message), number=number)
+    # 换算为每条消息的秒数
+    # Convert to seconds per message
+    return dict((name, seconds / number) for name, seconds in results.items())
+
+# 测量日志的开销：被禁用的等级和开启的等级，BoundLogger与直接使用logging对比
+# 日志写入os.devnull，所以结果包含格式化的开销，但不包含磁盘I/O
+# Measure the logging overhead: disabled and enabled levels, BoundLogger compared with logging directly
+# Records are written to os.devnull, so the results include formatting but no disk I/O
+def benchLogging(number=200000):
+    logger = logging.getLogger('Latte.bench')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    devnull = io.open(os.devnull, mode='w')
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(LatteConfig.getConfig('logger.format')))
+    logger.addHandler(handler)
+    bound = BoundLogger(logger)
+    try:
+        results = {
+            'logging.disabled': timeit.timeit(lambda: logger.debug('message %s', 1), number=number),
+            'bound.disabled': timeit.timeit(lambda: bound.debug('message %s', 1), number=number),
+            'bound.disabled.lazy': timeit.timeit(lambda: bound.debug('message %s', Lazy(str, 1)), number=number),
+            'logging.enabled': timeit.timeit(lambda: logger.info('message %s', 1), number=number // 10) * 10,
+            'bound.enabled': timeit.timeit(lambda: bound.info('message %s', 1), number=number // 10) * 10,
+        }
+    finally:
+        logger.removeHandler(handler)
+        devnull.close()
+    return dict((name, seconds / number) for name, seconds in results.items())
+
+# 在子进程中执行的插件发现计时脚本
+# Plugin discovery timing script executed in a child process
+_DISCOVERY_SCRIPT = '''
+import time
+from lre.base import bootstrap, PluginConfig
+bootstrap('config', 'logger')
+start = time.perf_counter()
+PluginConfig.init()
+print(time.perf_counter() - start, len(PluginConfig.names()))
+'''
+
+# 在root下创建n个插件的合成插件目录
+# Create a synthetic plugin tree with n plugins under root
+def _syntheticTree(root, n):
+    os.makedirs(os.path.join(root, 'config'))
+    with io.open(os.path.join(root, 'config', 'latte.json'), mode='w', encoding='utf-8') as config:
+        json.dump({'logger': {'level': 'error'}}, config)
+    for i in range(n):
+        path = os.path.join(root, 'plugins', 'plugin%d' % i)
+        os.makedirs(path)
+        with io.open(os.path.join(path, 'plugin.json'), mode='w', encoding='utf-8') as config:
+            json.dump({'name': 'plugin%d' % i, 'main': 'plugin', 'type': 'base',
+                'handlers': [{'handler': 'handle', 'commands': ['cmd%d' % i], 'keywords': ['kw%d' % i]}]}, config)
+
+# 测量在合成的插件目录下发现插件的时间
+# cold是没有清单缓存时的时间，warm是清单缓存有效时的时间
+# Measure the time to discover plugins in synthetic plugin trees
+# cold is the time without a manifest cache, warm is the time with a valid manifest cache
+def benchDiscovery(sizes=(10, 1000, 10000)):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for n in sizes:
+        tree = tempfile.mkdtemp(prefix='latte-bench-')
+        try:
+            _syntheticTree(tree, n)
+            env = dict(os.environ, LATTEPATH=tree, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+            env.pop('LATTE_PLUGIN_PATH', None)
+            env.pop('LATTE_CONFIG_PATH', None)
+            env.pop('LATTE_CACHE_PATH', None)
+            for phase in ('cold', 'warm'):
+                output = subprocess.check_output([sys.executable, '-c', _DISCOVERY_SCRIPT], cwd=tree, env=env, stderr=subprocess.DEVNULL)
+                seconds, found = output.split()
+                if int(found) != n:
+                    raise RuntimeError('Discovered %s of %d plugins' % (found, n))
+                results['%d.%s' % (n, phase)] = float(seconds)
+        finally:
+            shutil.rmtree(tree, ignore_errors=True)
+    return results
+
+# 回显每条消息的Server，用于测量适配器本身的开销
+# A Server echoing every message, used to measure the overhead of the adapter itself
+class _EchoServer(object):
+    logger = logging.getLogger('Latte.bench')
+
+    async def received(self, connection, message):
+        connection.send(message)
+
+# 用asyncio streams实现的同样的JSON Lines回显服务，作为对比的基线
+# The same JSON Lines echo service implemented with asyncio streams, the baseline to compare with
+async def _streamsEcho(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                message = json.loads(line)
+                writer.write(json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+                await writer.drain()
+    finally:
+        writer.close()
+
+# 启动服务，发送number条消息并读取全部回显，返回耗时（秒）
+# Start the service, send number messages and read all echoes, returns the elapsed seconds
+async def _echoRound(start, number):
+    server = await start()
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    batch = json.dumps({'text': '/echo hello', 'user': 'bench'}).encode('utf-8') + b'\n'
+    batch *= 100
+
+    async def send():
+        for _ in range(number // 100):
+            writer.write(batch)
+            await writer.drain()
+
+    async def receive():
+        for _ in range(number // 100 * 100):
+            await reader.readline()
+    began = time.perf_counter()
+    await asyncio.gather(send(), receive())
+    elapsed = time.perf_counter() - began
+    # 等待服务端看到连接结束并关闭它，这样服务端的任务在事件循环结束前完成
+    # Wait for the server to see the end of the connection and close it, so its task finishes before the event loop ends
+    writer.write_eof()
+    await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+# 对比适配器的分帧协议和asyncio streams回显number条JSON Lines消息的速度和内存分配
+# 时间是每条消息的秒数；peak是tracemalloc记录的内存峰值（字节），包含客户端，两种情况下客户端相同
+# Compare the speed and allocations of the adapter's framing protocol and asyncio streams echoing number JSON Lines messages
+# Times are seconds per message; peak is the memory peak traced by tracemalloc (bytes), it includes the client, which is the same in both cases
+def benchAdapter(number=20000):
+    from .adapter import LineJsonProtocol
+    cases = {
+        'frame': lambda: asyncio.get_running_loop().create_server(
+            lambda: LineJsonProtocol(_EchoServer(), 65536, 1048576, 64), '127.0.0.1', 0),
+        'streams': lambda: asyncio.start_server(_streamsEcho, '127.0.0.1', 0),
+    }
+    results = {}
+    for name, start in sorted(cases.items()):
+        results[name] = asyncio.run(_echoRound(start, number)) / number
+        tracemalloc.start()
+        try:
+            asyncio.run(_echoRound(start, number))
+            results[name + '.peak'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return results
+
+# 每个基准测试的名称和函数，--quick时使用较少的迭代次数
+# Name and function of every benchmark, fewer iterations are used with --quick
+SUITES = {
+    'import': lambda quick: benchImport(repeat=3 if quick else 5),
+    'config': lambda quick: benchConfig(number=20000 if quick else 200000),
+    'logging': lambda quick: benchLogging(number=20000 if quick else 200000),
+    'discovery': lambda quick: benchDiscovery(sizes=(10, 1000) if quick else (10, 1000, 10000)),
+    'dispatch': lambda quick: benchRouter(number=50 if quick else 500),
+    'adapter': lambda quick: benchAdapter(number=2000 if quick else 20000),
+}
+
+# 以合适的单位格式化每次操作的秒数
+# Format seconds per operation in a suitable unit
+def _formatSeconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%10.2f %s' % (seconds / scale, unit)
+    return '%10.1f ns' % (seconds * 1e9)
+
+# 运行指定的基准测试，返回可以写入JSON的结果
+# Run the specified benchmarks and return results that can be written as JSON
+def run(suites=None, quick=False):
+    results = {}
+    for name in (suites or sorted(SUITES)):
+        if name not in SUITES:
+            raise ValueError('Unknown benchmark suite: \'%s\'' % name)
+        results[name] = SUITES[name](quick)
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'quick': quick
+        },
+        'results': results
+    }
+
+# 打印结果，指定baseline时同时打印与它的比值（大于1表示变慢）
+# Print the results, the ratio to baseline is printed too when it is specified (greater than 1 means slower)
+def report(result, baseline=None, out=sys.stdout):
+    for suite, metrics in sorted(result['results'].items()):
+        out.write('[%s]\n' % suite)
+        previous = (baseline or {}).get('results', {}).get(suite, {})
+        for name, value in sorted(metrics.items()):
+            if isinstance(value, bool) or not isinstance(value, float):
+                out.write('  %-28s %13s\n' % (name, value))
+                continue
+            line = '  %-28s %s' % (name, _formatSeconds(value))
+            old = previous.get(name)
+            if isinstance(old, float) and old > 0:
+                line += '  x%.2f' % (value / old)
+            out.write(line + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m lre.bench', description='Latte runtime benchmarks')
+    parser.add_argument('suites', nargs='*', help='suites to run: %s (default: all)' % ', '.join(sorted(SUITES)))
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('-c', '--compare', help='compare with the results of a previous run')
+    parser.add_argument('-q', '--quick', action='store_true', help='use fewer iterations and smaller plugin trees')
+    args = parser.parse_args(argv)
+    result = run(args.suites, args.quick)
+    baseline = None
+    if args.compare:
+        with io.open(args.compare, mode='r', encoding='utf-8') as previous:
+            baseline = json.load(previous)
+    report(result, baseline)
+    if args.output:
+        with io.open(args.output, mode='w', encoding='utf-8') as output:
+            json.dump(result, output, indent=2, sort_keys=True)
+    # 超出启动时间预算时以非零状态退出，这样CI可以发现启动变慢
+    # Exit with a non-zero status when the startup budget is exceeded, so CI notices a slower startup
+    imported = result['results'].get('import')
+    if imported is not None and not imported['withinBudget']:
+        sys.stderr.write('Import and bootstrap took %.3f s, the budget is %.3f s\n' % (imported['import'] + imported['bootstrap'], IMPORT_BUDGET))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
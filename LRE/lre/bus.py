@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import threading
+import itertools
+import collections
+from .base import LatteConfig, Logger
+from .metrics import Metrics
+
+# 匹配一个层级的通配符，以及匹配零个或多个层级的通配符（只能出现在最后）
+# Wildcard matching one level, and wildcard matching zero or more levels (only allowed at the end)
+WILDCARD = '*'
+MULTI_WILDCARD = '#'
+
+
+# 主题树的节点
+# A node of the topic trie
+class _Node(object):
+    __slots__ = ('children', 'subscriptions')
+
+    def __init__(self):
+        self.children = {}
+        # id -> Subscription
+        self.subscriptions = {}
+
+
+# 一个订阅
+# 普通函数默认在发布者的线程中直接调用；协程函数，以及pool为true的普通函数，
+# 通过有界队列按顺序投递，它们在事件循环中（或者线程池中）运行。
+# A subscription
+# Plain functions are called directly on the publisher's thread by default; coroutine functions, and plain functions with pool set,
+# are delivered in order through a bounded queue, they run on the event loop (or in the thread pool).
+class Subscription(object):
+    __slots__ = ('id', 'pattern', 'fn', 'plugin', 'queued', 'pool', 'maxQueue', 'queue', 'bus', 'active',
+                 'delivered', 'dropped', 'errors', 'ready', 'space', 'task')
+
+    def __init__(self, bus, id, pattern, fn, plugin, pool, maxQueue):
+        self.bus = bus
+        self.id = id
+        self.pattern = pattern
+        self.fn = fn
+        self.plugin = plugin
+        self.pool = pool
+        self.queued = pool or asyncio.iscoroutinefunction(fn)
+        self.maxQueue = maxQueue
+        self.queue = collections.deque()
+        self.active = True
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        # 队列中有消息时设置ready，队列有空位时设置space，它们在事件循环开始后创建
+        # ready is set while the queue holds messages, space while the queue has room, they are created once the event loop starts
+        self.ready = None
+        self.space = None
+        self.task = None
+
+    def cancel(self):
+        self.bus.unsubscribe(self)
+
+    def __repr__(self):
+        return '<Subscription %s of \'%s\'>' % (self.pattern, self.plugin)
+
+
+# 插件之间的进程内发布/订阅事件总线
+# 订阅按照主题模式存放在一棵以'.'分层的树中，例如'weather.*.beijing'或'weather.#'，
+# 发布时只遍历与主题匹配的路径，所以开销取决于匹配的订阅数量而不是订阅的总数，匹配结果还会被缓存。
+# 消息按引用投递，不会被复制，订阅者不应该修改它们。
+# 每个排队的订阅有一个有界队列：publish()在队列满时丢弃消息并计数，publishAsync()会等待队列有空位（背压）。
+# Process local publish/subscribe event bus between plugins
+# Subscriptions are stored by topic pattern in a trie split on '.', e.g. 'weather.*.beijing' or 'weather.#',
+# publishing only walks the paths matching the topic, so its cost depends on the number of matching subscriptions rather than the total, and the matches are cached.
+# Payloads are delivered by reference without being copied, subscribers should not modify them.
+# Every queued subscription has a bounded queue: publish() drops the payload and counts it when the queue is full, publishAsync() waits for room in the queue (backpressure).
+class EventBus(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    _INSTANCE = None
+    # 缓存的主题数上限，超过后缓存被清空
+    # Cap of the topics whose matches are cached, the cache is cleared beyond it
+    _MATCH_CACHE_SIZE = 4096
+
+    # 获取按照latte.json中的bus配置创建的共享实例
+    # Get the shared instance created from the bus configuration in latte.json
+    @classmethod
+    def instance(cls):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                cls._INSTANCE = EventBus(LatteConfig.getTypedConfig('bus.maxQueue', int))
+        return cls._INSTANCE
+
+    def __init__(self, maxQueue=1024):
+        self.maxQueue = maxQueue
+        self.logger = Logger.bind('Latte.bus')
+        self.__lock = threading.RLock()
+        self.__ids = itertools.count(1)
+        self.__root = _Node()
+        self.__subscriptions = {}
+        # 主题 -> 匹配的订阅，订阅变化时清空
+        # Topic -> matching subscriptions, cleared when the subscriptions change
+        self.__matches = {}
+        self.loop = None
+        self.executor = None
+        self.__loopThread = None
+
+    def __len__(self):
+        return len(self.__subscriptions)
+
+    # 主题树中的节点数（不含根节点），取消订阅时变空的节点会被删除
+    # Number of nodes in the topic trie (without the root), nodes that become empty on unsubscribing are removed
+    def nodes(self):
+        with self.__lock:
+            pending = [self.__root]
+            count = 0
+            while pending:
+                children = pending.pop().children
+                count += len(children)
+                pending.extend(children.values())
+        return count
+
+    @staticmethod
+    def __split(pattern, wildcards):
+        segments = pattern.split('.')
+        if not pattern or '' in segments:
+            raise ValueError('Invalid topic \'%s\'' % pattern)
+        for index, segment in enumerate(segments):
+            if segment in (WILDCARD, MULTI_WILDCARD):
+                if not wildcards:
+                    raise ValueError('Wildcards are not allowed in a published topic: \'%s\'' % pattern)
+                if segment == MULTI_WILDCARD and index != len(segments) - 1:
+                    raise ValueError('\'%s\' is only allowed at the end of a pattern: \'%s\'' % (MULTI_WILDCARD, pattern))
+        return segments
+
+    # 订阅匹配pattern的主题，fn(topic, payload)在消息发布时被调用
+    # plugin用于指标和卸载插件时移除订阅，默认从fn所在的插件模块推断；maxQueue为None时使用总线的默认值
+    # Subscribe to the topics matching pattern, fn(topic, payload) is called when a payload is published
+    # plugin is used for metrics and to remove subscriptions when the plugin is unloaded, it is inferred from the plugin module of fn by default; the bus default is used when maxQueue is None
+    def subscribe(self, pattern, fn, plugin=None, pool=False, maxQueue=None):
+        segments = self.__split(pattern, True)
+        if plugin is None:
+            module = getattr(fn, '__module__', None) or ''
+            plugin = module.split('.')[2] if module.startswith('latte.plugin.') else None
+        subscription = Subscription(self, next(self.__ids), pattern, fn, plugin, pool,
+                                    self.maxQueue if maxQueue is None else maxQueue)
+        with self.__lock:
+            node = self.__root
+            for segment in segments:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _Node()
+                node = child
+            node.subscriptions[subscription.id] = subscription
+            self.__subscriptions[subscription.id] = subscription
+            self.__matches = {}
+        if subscription.queued and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.__startConsumer, subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            if self.__subscriptions.pop(subscription.id, None) is None:
+                return False
+            subscription.active = False
+            # 删除订阅，并删除因此变空的节点
+            # Remove the subscription, and the nodes that become empty because of it
+            segments = subscription.pattern.split('.')
+            path = [self.__root]
+            for segment in segments:
+                path.append(path[-1].children[segment])
+            del path[-1].subscriptions[subscription.id]
+            for index in range(len(segments), 0, -1):
+                if path[index].children or path[index].subscriptions:
+                    break
+                del path[index - 1].children[segments[index - 1]]
+            self.__matches = {}
+        if subscription.task is not None:
+            self.loop.call_soon_threadsafe(self.__stopConsumer, subscription)
+        return True
+
+    # 移除插件的所有订阅，插件被卸载或重新加载时调用
+    # Remove all subscriptions of a plugin, called when the plugin is unloaded or reloaded
+    def forget(self, plugin):
+        for subscription in [subscription for subscription in list(self.__subscriptions.values()) if subscription.plugin == plugin]:
+            self.unsubscribe(subscription)
+
+    # 匹配主题的所有订阅
+    # All subscriptions matching a topic
+    def match(self, topic):
+        matches = self.__matches.get(topic)
+        if matches is None:
+            segments = self.__split(topic, False)
+            found = []
+            with self.__lock:
+                self.__collect(self.__root, segments, 0, found)
+                if len(self.__matches) >= self._MATCH_CACHE_SIZE:
+                    self.__matches = {}
+                matches = self.__matches[topic] = tuple(found)
+        return matches
+
+    def __collect(self, node, segments, index, found):
+        multi = node.children.get(MULTI_WILDCARD)
+        if multi is not None:
+            found.extend(multi.subscriptions.values())
+        if index == len(segments):
+            found.extend(node.subscriptions.values())
+            return
+        child = node.children.get(segments[index])
+        if child is not None:
+            self.__collect(child, segments, index + 1, found)
+        child = node.children.get(WILDCARD)
+        if child is not None:
+            self.__collect(child, segments, index + 1, found)
+
+    # 发布消息，可以在任意线程中调用，返回接收到消息的订阅数
+    # 直接调用的订阅者在这里运行；排队的订阅在队列满时丢弃这条消息
+    # Publish a payload, it may be called from any thread, returns the number of subscriptions that received it
+    # Subscribers called directly run here; queued subscriptions drop this payload when their queue is full
+    def publish(self, topic, payload=None):
+        delivered = 0
+        for subscription in self.match(topic):
+            if not subscription.queued:
+                delivered += self.__call(subscription, topic, payload)
+            elif len(subscription.queue) < subscription.maxQueue:
+                self.__enqueue(subscription, topic, payload)
+                delivered += 1
+            else:
+                subscription.dropped += 1
+                Metrics.incr(subscription.plugin, 'bus.dropped')
+        return delivered
+
+    # 发布消息，订阅的队列满时等待它们有空位；必须在事件循环中调用
+    # Publish a payload, waiting for room when subscription queues are full; it must be called on the event loop
+    async def publishAsync(self, topic, payload=None):
+        delivered = 0
+        for subscription in self.match(topic):
+            if not subscription.queued:
+                delivered += self.__call(subscription, topic, payload)
+                continue
+            while subscription.active and len(subscription.queue) >= subscription.maxQueue:
+                if subscription.space is None:
+                    # 事件循环开始之前无法等待
+                    # Nothing can be waited for before the event loop starts
+                    break
+                subscription.space.clear()
+                await subscription.space.wait()
+            if subscription.active and len(subscription.queue) < subscription.maxQueue:
+                self.__enqueue(subscription, topic, payload)
+                delivered += 1
+            elif subscription.active:
+                subscription.dropped += 1
+                Metrics.incr(subscription.plugin, 'bus.dropped')
+        return delivered
+
+    def __call(self, subscription, topic, payload):
+        start = time.perf_counter()
+        try:
+            subscription.fn(topic, payload)
+        except Exception as e:
+            subscription.errors += 1
+            Metrics.incr(subscription.plugin, 'bus.errors')
+            self.logger.error('Subscriber %r failed on \'%s\': %s', subscription, topic, e, exc_info=e)
+            return 0
+        subscription.delivered += 1
+        Metrics.observe(subscription.plugin, 'bus.deliver', time.perf_counter() - start)
+        return 1
+
+    def __enqueue(self, subscription, topic, payload):
+        subscription.queue.append((topic, payload, time.perf_counter()))
+        if subscription.ready is None:
+            return
+        if threading.get_ident() == self.__loopThread:
+            subscription.ready.set()
+        else:
+            self.loop.call_soon_threadsafe(subscription.ready.set)
+
+    # 开始在事件循环中投递排队的消息，pool为true的订阅者在executor中运行
+    # Start delivering queued payloads on the event loop, subscribers with pool set run in the executor
+    def start(self, loop, executor=None):
+        self.loop = loop
+        self.executor = executor
+        self.__loopThread = threading.get_ident()
+        for subscription in list(self.__subscriptions.values()):
+            if subscription.queued:
+                self.__startConsumer(subscription)
+
+    def stop(self):
+        for subscription in list(self.__subscriptions.values()):
+            self.__stopConsumer(subscription)
+            subscription.ready = subscription.space = None
+        self.loop = None
+        self.__loopThread = None
+
+    def __startConsumer(self, subscription):
+        if not subscription.active or subscription.task is not None:
+            return
+        subscription.ready = asyncio.Event()
+        subscription.space = asyncio.Event()
+        if subscription.queue:
+            subscription.ready.set()
+        subscription.task = self.loop.create_task(self.__consume(subscription))
+
+    # 停止投递，并唤醒等待队列空位的发布者
+    # Stop delivering, and wake up publishers waiting for room in the queue
+    @staticmethod
+    def __stopConsumer(subscription):
+        if subscription.task is not None:
+            subscription.task.cancel()
+            subscription.task = None
+        if subscription.space is not None:
+            subscription.space.set()
+
+    async def __consume(self, subscription):
+        queue = subscription.queue
+        while subscription.active:
+            if not queue:
+                subscription.ready.clear()
+                await subscription.ready.wait()
+                continue
+            topic, payload, queued = queue.popleft()
+            subscription.space.set()
+            Metrics.observe(subscription.plugin, 'bus.queued', time.perf_counter() - queued)
+            start = time.perf_counter()
+            try:
+                if subscription.pool:
+                    await self.loop.run_in_executor(self.executor, subscription.fn, topic, payload)
+                else:
+                    await subscription.fn(topic, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                subscription.errors += 1
+                Metrics.incr(subscription.plugin, 'bus.errors')
+                self.logger.error('Subscriber %r failed on \'%s\': %s', subscription, topic, e, exc_info=e)
+            else:
+                subscription.delivered += 1
+                Metrics.observe(subscription.plugin, 'bus.deliver', time.perf_counter() - start)
+
+    # 每个订阅的统计信息
+    # Statistics of every subscription
+    def stats(self):
+        return [{
+            'pattern': subscription.pattern,
+            'plugin': subscription.plugin,
+            'queued': len(subscription.queue),
+            'delivered': subscription.delivered,
+            'dropped': subscription.dropped,
+            'errors': subscription.errors
+        } for subscription in list(self.__subscriptions.values())]
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import time
+import asyncio
+import threading
+import collections
+from .base import LatteConfig, PluginConfig
+from .metrics import Metrics
+
+# 表示缓存中不存在的值，与处理函数返回的None区分
+# Marks a value missing from the cache, distinct from None returned by a handler
+MISSING = object()
+
+
+# 规范化缓存的Key：合并空白并忽略大小写，这样'  Hello   World'和'hello world'命中同一条缓存
+# Normalize a cache key: collapse whitespace and ignore case, so '  Hello   World' and 'hello world' hit the same entry
+def normalize(text):
+    return ' '.join(text.split()).casefold()
+
+
+# 估算一个值占用的内存（字节），容器会被递归计算到有限的深度
+# Estimate the memory (bytes) a value takes, containers are counted recursively up to a limited depth
+def _sizeOf(value, depth=4):
+    size = sys.getsizeof(value)
+    if depth:
+        if isinstance(value, dict):
+            size += sum(_sizeOf(k, depth - 1) + _sizeOf(v, depth - 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(_sizeOf(item, depth - 1) for item in value)
+    return size
+
+
+# 取出已完成任务的异常，避免没有等待者时出现'Task exception was never retrieved'
+# Retrieve the exception of a finished task to avoid 'Task exception was never retrieved' when nobody is waiting
+def _retrieve(task):
+    if not task.cancelled():
+        task.exception()
+
+
+# 将处理函数标记为可缓存，等价于在plugin.json的处理函数中声明"cache"
+# 可以直接用作@memoize，也可以指定过期时间@memoize(ttl=60)
+# Mark a handler as cacheable, equivalent to declaring "cache" for the handler in plugin.json
+# It can be used directly as @memoize, or with an expiry time as @memoize(ttl=60)
+def memoize(ttl=None):
+    def decorate(fn):
+        fn.latteCache = {} if ttl is None else {'ttl': ttl}
+        return fn
+    if callable(ttl):
+        fn, ttl = ttl, None
+        return decorate(fn)
+    return decorate
+
+
+# 插件处理函数的结果缓存
+# 每个插件一个实例，按照LRU淘汰，并限制条目数和估算的内存占用，条目可以设置过期时间。
+# 协程形式的调用会合并并发的相同请求（single-flight），只有第一个请求真正执行处理函数。
+# 插件被重新加载或者它的配置变化时，它的缓存被清空。
+# Result cache of plugin handlers
+# One instance per plugin, evicted in LRU order and bounded by entry count and estimated memory, entries may expire.
+# Coroutine calls merge concurrent identical requests (single-flight), only the first request actually runs the handler.
+# The cache of a plugin is cleared when the plugin is reloaded or its configuration changes.
+class ResultCache(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    # 以插件名为Key的实例
+    # Instances keyed by plugin name
+    _INSTANCES = {}
+    _SUBSCRIBED = False
+
+    # 获取插件的缓存实例，限制来自latte.json中的cache，plugin.json中的"cache"可以覆盖它们
+    # Get the cache instance of a plugin, the limits come from cache in latte.json, "cache" in plugin.json overrides them
+    @classmethod
+    def instance(cls, plugin):
+        cache = cls._INSTANCES.get(plugin)
+        if cache is not None:
+            return cache
+        with cls._INSTANCE_LOCK:
+            if not cls._SUBSCRIBED:
+                # 配置变化时使对应的缓存失效
+                # Invalidate the matching caches when the configuration changes
+                LatteConfig.subscribe(lambda changes: cls.invalidate(), 'cache')
+                PluginConfig.subscribe(lambda changes: [cls.invalidate(name) for name in set(key.split('.', 1)[0] for key in changes)])
+                cls._SUBSCRIBED = True
+            if plugin not in cls._INSTANCES:
+                cls._INSTANCES[plugin] = ResultCache(plugin,
+                    maxEntries=PluginConfig.getTypedConfig('%s.cache.maxEntries' % plugin, int, LatteConfig.getTypedConfig('cache.maxEntries', int)),
+                    maxBytes=PluginConfig.getTypedConfig('%s.cache.maxBytes' % plugin, int, LatteConfig.getTypedConfig('cache.maxBytes', int)),
+                    ttl=PluginConfig.getTypedConfig('%s.cache.ttl' % plugin, float, LatteConfig.getTypedConfig('cache.ttl', float)))
+            return cls._INSTANCES[plugin]
+
+    # 清空插件的缓存，不指定插件时清空全部缓存；新的实例会重新读取配置中的限制
+    # Clear the cache of a plugin, all caches when no plugin is specified; new instances read the limits from the configuration again
+    @classmethod
+    def invalidate(cls, plugin=None):
+        with cls._INSTANCE_LOCK:
+            caches = list(cls._INSTANCES.values()) if plugin is None else [cls._INSTANCES.get(plugin)]
+            if plugin is None:
+                cls._INSTANCES.clear()
+            else:
+                cls._INSTANCES.pop(plugin, None)
+        for cache in caches:
+            if cache is not None:
+                cache.clear()
+
+    # 所有插件缓存的统计信息
+    # Statistics of all plugin caches
+    @classmethod
+    def statsAll(cls):
+        return dict((plugin, cache.stats()) for plugin, cache in list(cls._INSTANCES.items()))
+
+    def __init__(self, plugin, maxEntries=1024, maxBytes=8 * 1024 * 1024, ttl=0):
+        self.plugin = plugin
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        # 默认的过期时间（秒），0表示不过期
+        # Default expiry time (seconds), 0 means never expiring
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        # key -> (值, 过期时间, 估算的大小)，按最近使用的顺序排列
+        # key -> (value, expiry time, estimated size), ordered by recent use
+        self.__entries = collections.OrderedDict()
+        # 正在执行的请求：key -> asyncio.Future
+        # Requests in flight: key -> asyncio.Future
+        self.__flights = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # 合并到正在执行的相同请求中的次数
+        # Number of requests merged into an identical request in flight
+        self.merged = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    # 获取缓存的值，不存在或者已经过期时返回MISSING
+    # Get a cached value, returns MISSING when it does not exist or has expired
+    def get(self, key):
+        result = self.__lookup(key)
+        self.__count(result is not MISSING)
+        return result
+
+    def __lookup(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[1] and entry[1] < time.monotonic():
+                self.__remove(key)
+                self.expirations += 1
+                return MISSING
+            self.__entries.move_to_end(key)
+            return entry[0]
+
+    def __count(self, hit):
+        if hit:
+            self.hits += 1
+            Metrics.incr(self.plugin, 'cache.hits')
+        else:
+            self.misses += 1
+            Metrics.incr(self.plugin, 'cache.misses')
+
+    # 保存一个值，ttl为None时使用默认的过期时间；超过内存上限的值不会被缓存
+    # Store a value, the default expiry time is used when ttl is None; values over the memory cap are not cached
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        size = _sizeOf(value) + _sizeOf(key)
+        if size > self.maxBytes:
+            return False
+        expires = time.monotonic() + ttl if ttl else 0
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (value, expires, size)
+            self.bytes += size
+            # 按LRU淘汰，直到条目数和内存都在上限以内
+            # Evict in LRU order until both the entry count and the memory are within their caps
+            while len(self.__entries) > self.maxEntries or self.bytes > self.maxBytes:
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+        return True
+
+    def __remove(self, key):
+        self.bytes -= self.__entries.pop(key)[2]
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.bytes = 0
+
+    # 获取缓存的值，未命中时等待call()的结果并缓存它
+    # 相同key的并发请求只会执行一次call()，其余请求等待同一个结果（失败时它们会收到同样的异常）
+    # call()运行在属于这次请求的独立任务中，取消任何一个等待者（包括第一个）都不会影响其它等待者
+    # Get the cached value, on a miss await the result of call() and cache it
+    # Concurrent requests with the same key only run call() once, the others wait for the same result (they receive the same exception on failure)
+    # call() runs in a task of its own owned by the flight, cancelling any waiter (the first one included) does not affect the others
+    async def getOrCall(self, key, call, ttl=None):
+        result = self.__lookup(key)
+        if result is not MISSING:
+            self.__count(True)
+            return result
+        flight = self.__flights.get(key)
+        if flight is not None:
+            self.merged += 1
+            Metrics.incr(self.plugin, 'cache.merged')
+        else:
+            self.__count(False)
+            flight = self.__flights[key] = asyncio.ensure_future(self.__fly(key, call, ttl))
+            flight.add_done_callback(_retrieve)
+        return await asyncio.shield(flight)
+
+    async def __fly(self, key, call, ttl):
+        try:
+            result = await call()
+            self.put(key, result, ttl)
+            return result
+        finally:
+            del self.__flights[key]
+
+    def stats(self):
+        return {
+            'entries': len(self.__entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'merged': self.merged
+        }
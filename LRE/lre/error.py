@@ -17,3 +17,29 @@ class ReadConfigException(LatteRuntimeError, ConfigException, IOError):
     def __init__(self, msg):
         err = 'Cannot read configuration: %s' % msg
         RuntimeError.__init__(self, err)
+
+class PluginException(LatteException):
+    def __init__(self, name, msg):
+        err = 'Unable to load plugin \'%s\': %s' % (name, msg)
+        LatteException.__init__(self, err)
+        self.name = name
+
+class AdmissionException(LatteException):
+    def __init__(self, name, reason, reply=None):
+        err = 'Plugin \'%s\' rejected a message: %s' % (name, reason)
+        LatteException.__init__(self, err)
+        self.name = name
+        self.reason = reason
+        self.reply = reply
+
+class SandboxException(LatteException):
+    def __init__(self, name, msg):
+        err = 'Sandboxed plugin \'%s\' failed: %s' % (name, msg)
+        LatteException.__init__(self, err)
+        self.name = name
+
+class PoolException(LatteException):
+    def __init__(self, host, msg):
+        err = 'Connection to \'%s\' failed: %s' % (host, msg)
+        LatteException.__init__(self, err)
+        self.host = host
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, copy, json
+import gzip, shutil
+import time
+import queue
+import threading
+import weakref
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+# 通知写入线程退出的标记
+# Marker that tells the writer thread to exit
+_STOP = object()
+
+# 队列满时的溢出策略
+# 'block': 阻塞调用者直到队列有空位
+# 'drop-debug': 丢弃DEBUG及以下的日志，其它日志阻塞
+# 'count': 丢弃任何日志，只记录丢弃的数量
+# Overflow policies when the queue is full
+# 'block': block the caller until the queue has room
+# 'drop-debug': drop DEBUG and lower records, block for the others
+# 'count': drop any record and only count the drops
+OVERFLOW_POLICIES = ('block', 'drop-debug', 'count')
+
+# 所有存活的QueuedHandler，fork之后需要在子进程中重新启动它们的写入线程
+# All living QueuedHandlers, their writer threads must be restarted in the child process after a fork
+_QUEUED_HANDLERS = weakref.WeakSet()
+
+def _afterForkInChild():
+    for handler in list(_QUEUED_HANDLERS):
+        handler._restartAfterFork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_afterForkInChild)
+
+# 所有QueuedHandler中等待写入的日志记录数和丢弃的日志记录数
+# Number of records waiting to be written and number of dropped records over all QueuedHandlers
+def queueStats():
+    handlers = list(_QUEUED_HANDLERS)
+    return {'depth': sum(handler.queue.qsize() for handler in handlers), 'dropped': sum(handler.dropped for handler in handlers)}
+
+
+# 日志记录中的标准属性，其它属性都来自extra
+# Standard attributes of a log record, any other attribute comes from extra
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | frozenset(('message', 'asctime', 'taskName'))
+
+
+# JSON Lines格式的Formatter，每条日志输出为一行JSON
+# 通过extra传入的字段会作为结构化字段一起输出
+# JSON Lines Formatter, every record is output as one line of JSON
+# Fields passed through extra are output together as structured fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'name': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+# 批量写入的日志文件Handler
+# 每条日志不再单独刷新到磁盘，而是由写入线程在每一批结束后统一刷新
+# 可选地在后台将滚动出去的日志文件压缩为gzip
+# Batched log file Handler
+# Records are no longer flushed to disk one by one,
+# the writer thread flushes once at the end of every batch.
+# Optionally gzips rotated log files in the background
+class BatchRotatingFileHandler(TimedRotatingFileHandler):
+    def __init__(self, filename, when='h', interval=1, backupCount=0, compress=False, **kwargs):
+        TimedRotatingFileHandler.__init__(self, filename, when, interval, backupCount, **kwargs)
+        self.compress = compress
+
+    # 单条日志写入后不刷新，交由flushBatch处理
+    # Do not flush after a single record, flushBatch handles it
+    def flush(self):
+        pass
+
+    # 将这一批日志刷新到磁盘
+    # Flush this batch of records to disk
+    def flushBatch(self):
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, 'flush'):
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flushBatch()
+        TimedRotatingFileHandler.close(self)
+
+    # 滚动日志文件，开启压缩时在后台线程中压缩滚动出去的文件
+    # Rotate the log file, the rotated file is compressed in a background thread when compression is enabled
+    def rotate(self, source, dest):
+        TimedRotatingFileHandler.rotate(self, source, dest)
+        if self.compress and os.path.exists(dest):
+            threading.Thread(target=self.__compress, args=(dest,), name='LatteLogCompress', daemon=True).start()
+
+    def __compress(self, path):
+        try:
+            with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(path)
+            # 压缩后的文件不会被TimedRotatingFileHandler清理，这里只保留最新的backupCount个
+            # Compressed files are not cleaned up by TimedRotatingFileHandler, only the newest backupCount are kept here
+            if self.backupCount > 0:
+                dirname, basename = os.path.split(self.baseFilename)
+                prefix = basename + '.'
+                archives = sorted(name for name in os.listdir(dirname) if name.startswith(prefix) and name.endswith('.gz'))
+                for name in archives[:-self.backupCount]:
+                    os.remove(os.path.join(dirname, name))
+        except Exception:
+            # 压缩失败不能影响日志写入，保留未压缩的文件
+            # A failed compression must not affect logging, the uncompressed file is kept
+            pass
+
+
+# 队列日志Handler
+# 调用者只把日志放入有界的内存队列，由后台写入线程批量写入target
+# Queued log Handler
+# Callers only put records into a bounded in-memory queue,
+# a background writer thread writes them to the target in batches
+class QueuedHandler(logging.Handler):
+    def __init__(self, target, size=10000, overflow='block', flushInterval=1.0, batchSize=256):
+        logging.Handler.__init__(self)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: \'%s\'' % overflow)
+        self.target = target
+        self.queue = queue.Queue(size)
+        self.overflow = overflow
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        # 因队列已满而被丢弃的日志数量
+        # Number of records dropped because the queue was full
+        self.dropped = 0
+        self.__reported = 0
+        self.__dropLock = threading.Lock()
+        self.__writer = threading.Thread(target=self.__run, name='LatteLogWriter', daemon=True)
+        self.__writer.start()
+        _QUEUED_HANDLERS.add(self)
+
+    # 写入线程不会跟随fork进入子进程，队列的锁也可能处于被占用的状态，
+    # 所以子进程使用新的队列和写入线程，队列中尚未写入的日志由父进程负责
+    # The writer thread does not follow a fork into the child, and the locks of the queue may be held,
+    # so the child uses a new queue and writer thread, records still queued are written by the parent
+    def _restartAfterFork(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = 0
+        self.__reported = 0
+        self.__dropLock = threading.Lock()
+        self.__writer = threading.Thread(target=self.__run, name='LatteLogWriter', daemon=True)
+        self.__writer.start()
+
+    # 在放入队列之前合并消息和参数，格式化异常信息，
+    # 这样写入线程不再依赖调用者的对象状态
+    # Merge the message and arguments and format the exception before queueing,
+    # so the writer thread no longer depends on the caller's object state
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+            if self.overflow == 'block':
+                self.queue.put(record)
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                if self.overflow == 'drop-debug' and record.levelno > logging.DEBUG:
+                    self.queue.put(record)
+                else:
+                    with self.__dropLock:
+                        self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    # 写入线程：每次最多收集batchSize条日志，或者等待flushInterval秒，然后统一写入并刷新
+    # Writer thread: collect at most batchSize records or wait flushInterval seconds, then write and flush them together
+    def __run(self):
+        running = True
+        while running:
+            batch = []
+            deadline = time.monotonic() + self.flushInterval
+            while len(batch) < self.batchSize:
+                timeout = deadline - time.monotonic()
+                try:
+                    record = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    running = False
+                    break
+                batch.append(record)
+            self.__write(batch)
+
+    def __write(self, batch):
+        # 报告自上次以来被丢弃的日志数量
+        # Report the number of records dropped since last time
+        dropped = self.dropped - self.__reported
+        if dropped > 0:
+            self.__reported += dropped
+            batch.append(logging.makeLogRecord({
+                'name': 'Latte.logger',
+                'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': '%d log records were dropped because the log queue was full.' % dropped
+            }))
+        if not batch:
+            return
+        for record in batch:
+            self.target.handle(record)
+        if hasattr(self.target, 'flushBatch'):
+            self.target.flushBatch()
+        else:
+            self.target.flush()
+
+    # 关闭时通知写入线程写完队列中剩余的日志后退出
+    # On close, tell the writer thread to write the remaining records and exit
+    def close(self):
+        if self.__writer.is_alive():
+            self.queue.put(_STOP)
+            self.__writer.join()
+        self.target.close()
+        logging.Handler.close(self)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys
+import time
+import asyncio
+import collections
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .base import LatteConfig, PluginConfig, Logger
+from .error import PluginException
+from .metrics import Metrics
+from .matcher import Matcher
+from .sandbox import Sandbox
+
+
+# 一个插件的加载状态
+# The loading state of a plugin
+class Plugin(object):
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        # plugin.json中的"main"，插件的入口模块
+        # "main" in plugin.json, the entry module of the plugin
+        self.main = config.get('main', 'plugin')
+        # plugin.json中的"dependencies"，必须在该插件之前加载的插件
+        # "dependencies" in plugin.json, plugins that must be loaded before this plugin
+        self.dependencies = list(config.get('dependencies', []))
+        self.module = None
+        self.servers = []
+        # 'pending'，'loaded'或'failed'
+        # 'pending', 'loaded' or 'failed'
+        self.state = 'pending'
+        self.error = None
+        # 每个阶段的耗时（秒）
+        # Time spent in each phase (seconds)
+        self.timings = {}
+
+    def __repr__(self):
+        return '<Plugin %s %s>' % (self.name, self.state)
+
+
+# 将插件的servers()返回值转换为列表
+# servers()可以返回字典、列表或None
+# Convert the return value of a plugin's servers() to a list
+# servers() may return a dict, a list or None
+def _serverList(servers):
+    if servers is None:
+        return []
+    if isinstance(servers, dict):
+        return list(servers.values())
+    return list(servers)
+
+
+# 插件加载器
+# 根据plugin.json中声明的依赖关系构建DAG，
+# 相互独立的插件在线程池中并行地执行导入、init()和Server.activation()。
+# 一个插件失败时，只有依赖它的插件会被跳过。
+# Plugin loader
+# Builds a DAG from the dependencies declared in plugin.json,
+# independent plugins are imported, init() and Server.activation() are run in parallel in a thread pool.
+# When a plugin fails, only the plugins that depend on it are skipped.
+class PluginLoader(object):
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = LatteConfig.getTypedConfig('loader.workers', int)
+        self.workers = max(1, workers)
+        self.logger = Logger.bind('Latte.loader')
+        self.plugins = collections.OrderedDict()
+        self.reload = False
+
+    # 加载names中的插件，不指定时加载全部插件，返回加载成功的插件列表
+    # loaded中的插件已经在运行，依赖它们的插件不需要再等待
+    # reload为true时重新导入插件模块，而不是复用sys.modules中已有的模块
+    # Load the plugins in names, all plugins when not specified, and return the list of loaded plugins
+    # Plugins in loaded are already running, plugins depending on them do not wait for them
+    # When reload is true the plugin modules are imported again instead of reusing the modules in sys.modules
+    def load(self, names=None, loaded=(), reload=False):
+        if names is None:
+            names = PluginConfig.names()
+        self.reload = reload
+        plugins = self.plugins
+        for name in names:
+            plugins[name] = Plugin(name, PluginConfig.getConfig(name))
+        # 每个插件还在等待的依赖，以及依赖它的插件
+        # The dependencies each plugin is still waiting for, and the plugins that depend on it
+        waiting = dict((name, set(plugins[name].dependencies) - set(loaded)) for name in names)
+        dependents = dict((name, []) for name in names)
+        pending = set(names)
+        ready = collections.deque()
+        for name in names:
+            for dependency in plugins[name].dependencies:
+                if dependency in dependents:
+                    dependents[dependency].append(name)
+        for name in names:
+            missing = [dependency for dependency in waiting[name] if dependency not in plugins]
+            if missing:
+                self.__fail(name, PluginException(name, 'missing dependencies: %s' % ', '.join(missing)), pending, dependents)
+        for name in names:
+            if name in pending and not waiting[name]:
+                ready.append(name)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='LatteLoader') as executor:
+            running = {}
+            while True:
+                # 提交所有依赖已经满足的插件
+                # Submit every plugin whose dependencies are satisfied
+                while ready:
+                    name = ready.popleft()
+                    if name in pending:
+                        pending.remove(name)
+                        running[executor.submit(self.__activate, plugins[name])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        plugins[name].state = 'loaded'
+                        for dependent in dependents[name]:
+                            waiting[dependent].discard(name)
+                            if not waiting[dependent]:
+                                ready.append(dependent)
+                    else:
+                        self.__fail(name, error, pending, dependents)
+        # 仍然没有被提交的插件一定处在循环依赖中，或者依赖于循环依赖
+        # Plugins that have still not been submitted must be in a dependency cycle, or depend on one
+        for name in list(pending):
+            if name in pending:
+                self.__fail(name, PluginException(name, 'circular dependency'), pending, dependents)
+        for plugin in plugins.values():
+            if plugin.state == 'loaded':
+                self.logger.info('Plugin \'%s\' loaded in %.1f ms (%s)', plugin.name, plugin.timings['total'] * 1e3,
+                    ', '.join('%s %.1f ms' % (phase, seconds * 1e3) for phase, seconds in plugin.timings.items() if phase != 'total'))
+        return [plugin for plugin in plugins.values() if plugin.state == 'loaded']
+
+    # 将插件标记为失败，并递归地跳过依赖它的插件
+    # Mark a plugin as failed and recursively skip the plugins that depend on it
+    def __fail(self, name, error, pending, dependents):
+        plugin = self.plugins[name]
+        plugin.state = 'failed'
+        plugin.error = error
+        pending.discard(name)
+        self.logger.warn('[Plugin \'%s\' is not loaded] %s', name, error)
+        for dependent in dependents.get(name, []):
+            if dependent in pending:
+                self.__fail(dependent, PluginException(dependent, 'dependency \'%s\' failed' % name), pending, dependents)
+
+    # 在线程池中执行：导入插件模块，调用init()，servers()和每个Server的activation()
+    # Executed in the thread pool: import the plugin module, call init(), servers() and activation() of every Server
+    def __activate(self, plugin):
+        timings = plugin.timings
+        start = last = time.perf_counter()
+        # 隔离运行的插件在子进程中导入并调用init()，这里只得到转发调用的代理模块，它不提供Server
+        # Sandboxed plugins are imported and init() is called in a child process, only the proxy module forwarding calls is obtained here,
+        # it provides no Servers
+        if Sandbox.enabled(plugin.config):
+            plugin.module = Sandbox.load(plugin.name)
+            timings['sandbox'] = timings['total'] = time.perf_counter() - start
+            Metrics.observe(plugin.name, 'load.sandbox', timings['sandbox'])
+            return
+        plugin.module = self.importPlugin(plugin, self.reload)
+        now = time.perf_counter()
+        timings['import'], last = now - last, now
+        # 在init()之前构建plugin.json中声明的匹配器，索引未变化时直接从磁盘读取
+        # Build the matchers declared in plugin.json before init(), indexes are read from disk when they have not changed
+        matchers = plugin.config.get('matchers')
+        if matchers:
+            for name in matchers:
+                Matcher.forPlugin(plugin.name, name)
+            now = time.perf_counter()
+            timings['matchers'], last = now - last, now
+        if hasattr(plugin.module, 'init'):
+            plugin.module.init()
+        now = time.perf_counter()
+        timings['init'], last = now - last, now
+        if hasattr(plugin.module, 'servers'):
+            plugin.servers = _serverList(plugin.module.servers())
+        # 协程形式的activation由运行时在事件循环中执行
+        # Coroutine activations are run by the runtime on the event loop
+        for server in plugin.servers:
+            if not asyncio.iscoroutinefunction(server.activation):
+                server.activation()
+        now = time.perf_counter()
+        timings['activation'] = now - last
+        timings['total'] = now - start
+        for phase, seconds in timings.items():
+            Metrics.observe(plugin.name, 'load.%s' % phase, seconds)
+
+    # 以'latte.plugin.<name>'为模块名导入插件的入口模块
+    # reload为true时先从sys.modules中移除插件的模块（包括'latte.plugin.<name>.'下的子模块），再重新导入
+    # Import the entry module of a plugin with 'latte.plugin.<name>' as the module name
+    # When reload is true the modules of the plugin (including submodules under 'latte.plugin.<name>.') are removed from sys.modules first and imported again
+    def importPlugin(self, plugin, reload=False):
+        path = os.sep.join([LatteConfig.getConfig('sys.path.plugin'), plugin.name, plugin.main + '.py'])
+        if not os.path.isfile(path):
+            raise PluginException(plugin.name, 'the main module \'%s\' is not found' % path)
+        moduleName = 'latte.plugin.%s' % plugin.name
+        if reload:
+            self.unimport(plugin.name)
+            importlib.invalidate_caches()
+        # 已经预加载的模块直接复用（例如在多进程模式下，由主进程在fork之前导入）
+        # A preloaded module is reused directly (e.g. imported by the supervisor before forking in worker mode)
+        module = sys.modules.get(moduleName)
+        if module is not None:
+            return module
+        spec = importlib.util.spec_from_file_location(moduleName, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[moduleName] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(moduleName, None)
+            raise
+        return module
+
+    # 从sys.modules中移除插件的模块，包括'latte.plugin.<name>.'下的子模块
+    # Remove the modules of a plugin from sys.modules, including submodules under 'latte.plugin.<name>.'
+    @staticmethod
+    def unimport(name):
+        moduleName = 'latte.plugin.%s' % name
+        for name in [name for name in sys.modules if name == moduleName or name.startswith(moduleName + '.')]:
+            del sys.modules[name]
+
+    # 按照loader.lazy和plugin.json中的"lazy"把插件分为立即加载和按需激活两组，返回(立即加载, 按需激活)
+    # 只有在plugin.json中声明了"handlers"的插件才能按需激活，被立即加载的插件依赖的插件同样需要立即加载
+    # Split the plugins into loaded eagerly and activated on demand according to loader.lazy and "lazy" in plugin.json,
+    # returns (eager, lazy)
+    # Only plugins declaring "handlers" in plugin.json can be activated on demand,
+    # plugins that eagerly loaded plugins depend on have to be loaded eagerly as well
+    def partition(self, names=None):
+        if names is None:
+            names = PluginConfig.names()
+        default = LatteConfig.getTypedConfig('loader.lazy', bool)
+        lazy = set(name for name in names
+            if PluginConfig.getTypedConfig('%s.lazy' % name, bool, default) and PluginConfig.findConfig('%s.handlers' % name))
+        stack = [name for name in names if name not in lazy]
+        while stack:
+            for dependency in PluginConfig.getConfigOrDefault('%s.dependencies' % stack.pop(), []):
+                if dependency in lazy:
+                    lazy.discard(dependency)
+                    stack.append(dependency)
+        return [name for name in names if name not in lazy], [name for name in names if name in lazy]
+
+    # 只导入插件模块，不调用init()和servers()，返回导入成功的插件名称列表
+    # 导入失败的插件会在之后的load中再次报告
+    # Only import the plugin modules without calling init() and servers(), and return the names of the imported plugins
+    # Plugins that fail to import are reported again by the later load
+    def preload(self, names=None):
+        if names is None:
+            names = PluginConfig.names()
+        imported = []
+        for name in names:
+            # 隔离运行的插件不在这个进程中导入
+            # Sandboxed plugins are not imported in this process
+            if Sandbox.enabled(PluginConfig.getConfig(name)):
+                continue
+            try:
+                self.importPlugin(Plugin(name, PluginConfig.getConfig(name)))
+                imported.append(name)
+            except Exception as e:
+                self.logger.warn('[Plugin \'%s\' is not preloaded] %s', name, e)
+        return imported
+
+    # 每个插件的加载结果和耗时，按总耗时从大到小排列
+    # The loading result and timings of every plugin, ordered by total time descending
+    def report(self):
+        result = []
+        for plugin in self.plugins.values():
+            result.append({
+                'name': plugin.name,
+                'state': plugin.state,
+                'error': None if plugin.error is None else str(plugin.error),
+                'timings': dict(plugin.timings)
+            })
+        result.sort(key=lambda item: item['timings'].get('total', 0), reverse=True)
+        return result
@@ -1,11 +1,36 @@
-
-from .base import PluginConfig, Logger
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from .base import bootstrap, LatteConfig, PluginConfig, Logger
+from .loader import PluginLoader
+from .runtime import Runtime
 
 PLUGINS = []
+# 按需激活的插件名称
+# Names of the plugins activated on demand
+LAZY = []
 
+# 初始化运行时需要的全部配置，并按依赖顺序加载插件，按需激活的插件不会在这里加载
+# Initialize all the configuration the runtime needs and load the plugins in dependency order,
+# plugins activated on demand are not loaded here
 def init():
+    bootstrap()
+    loader = PluginLoader()
+    eager, LAZY[:] = loader.partition()
+    PLUGINS[:] = loader.load(eager)
 
 
 def run():
+    # worker.count大于0时以多进程模式运行
+    # Run in worker mode when worker.count is greater than 0
+    bootstrap('config')
+    if LatteConfig.getTypedConfig('worker.count', int) > 0:
+        from .worker import Supervisor
+        Logger.info('start latte in worker mode')
+        Supervisor().run()
+        return
+    init()
     Logger.info('start latte')
     print(PluginConfig.names())
+    # 运行所有插件的Server，直到它们全部结束或者收到停止信号
+    # Run the Servers of all plugins until they all finish or a stop signal is received
+    Runtime(PLUGINS, lazy=LAZY).run()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os, sys, json
+import marshal
+import threading
+
+# 快照文件的文件头，用于识别文件格式
+# Header of the snapshot file, used to recognize the file format
+_HEADER = b'LATTEMC1'
+
+
+# 配置清单缓存
+# 将解析后的latte.json和plugin.json以路径为Key保存在一个紧凑的二进制快照中，
+# 并记录文件的mtime和大小。启动时只有发生变化的文件才会被重新解析。
+# Manifest cache
+# Parsed latte.json and plugin.json content is kept in one compact binary snapshot keyed by path,
+# together with the mtime and size of the file. Only changed files are parsed again at startup.
+class ManifestCache(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    # 以快照路径为Key的实例
+    # Instances keyed by snapshot path
+    _INSTANCES = {}
+
+    # 获取指定快照路径的实例，同一个路径总是返回同一个实例
+    # path为None时，缓存只保存在内存中
+    # Get the instance of the specified snapshot path, the same path always returns the same instance
+    # When path is None, the cache is only kept in memory
+    @classmethod
+    def instance(cls, path=None):
+        with cls._INSTANCE_LOCK:
+            if path not in cls._INSTANCES:
+                cls._INSTANCES[path] = ManifestCache(path)
+        return cls._INSTANCES[path]
+
+    def __init__(self, path=None):
+        self.path = path
+        self.__lock = threading.Lock()
+        # path -> (mtime_ns, size, data)
+        self.__entries = {}
+        # 本次运行中读取过的路径
+        # Paths that have been read during this run
+        self.__seen = set()
+        self.__dirty = False
+        # 统计命中和重新解析的次数
+        # Count hits and re-parses
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    # 从磁盘加载快照，快照不存在、损坏或者来自其它Python版本时视为空缓存
+    # Load the snapshot from disk, a missing, broken or other-Python-version snapshot is treated as an empty cache
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with io.open(self.path, mode='rb') as snapshot:
+                if snapshot.read(len(_HEADER)) != _HEADER:
+                    return
+                tag, entries = marshal.loads(snapshot.read())
+            if tag == sys.implementation.cache_tag and isinstance(entries, dict):
+                self.__entries = entries
+        except Exception:
+            self.__entries = {}
+
+    # 读取并解析JSON文件，文件的mtime和大小未变化时直接返回缓存的内容
+    # stat可以传入已有的stat结果，避免重复的系统调用
+    # 文件不存在或无法解析时抛出的异常与直接读取时相同
+    # Read and parse a JSON file, the cached content is returned directly when its mtime and size are unchanged
+    # stat may be an existing stat result to avoid a duplicate system call
+    # The exceptions raised for a missing or unparsable file are the same as when reading directly
+    def read(self, path, stat=None):
+        if stat is None:
+            stat = os.stat(path)
+        self.__seen.add(path)
+        entry = self.__entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            self.hits += 1
+            return entry[2]
+        with io.open(path, mode='r', encoding='utf-8') as config:
+            data = json.load(config)
+        with self.__lock:
+            self.__entries[path] = (stat.st_mtime_ns, stat.st_size, data)
+            self.__dirty = True
+        self.misses += 1
+        return data
+
+    # 有变化时将快照写回磁盘
+    # 写入时会顺便移除已经被删除的文件。写入先到临时文件，再原子地替换快照
+    # Write the snapshot back to disk when something has changed
+    # Files that have been deleted are removed while writing. It is written to a temporary file first and then atomically replaces the snapshot
+    def save(self):
+        with self.__lock:
+            if not self.__dirty or self.path is None:
+                return
+            for path in [path for path in self.__entries if path not in self.__seen]:
+                if not os.path.exists(path):
+                    del self.__entries[path]
+            temp = '%s.%d.tmp' % (self.path, os.getpid())
+            try:
+                dirname = os.path.dirname(self.path)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                with io.open(temp, mode='wb') as snapshot:
+                    snapshot.write(_HEADER)
+                    snapshot.write(marshal.dumps((sys.implementation.cache_tag, self.__entries)))
+                os.replace(temp, self.path)
+                self.__dirty = False
+            except (OSError, ValueError):
+                # 缓存只是加速手段，无法写入时（例如只读目录）直接放弃
+                # The cache is only an acceleration, give up when it cannot be written (e.g. a read-only directory)
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
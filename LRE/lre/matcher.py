@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os, json
+import math
+import heapq
+import pickle
+import hashlib
+import threading
+import collections
+from array import array
+from .base import LatteConfig, PluginConfig, Logger
+from .cache import normalize
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 索引文件的文件头，格式变化时需要修改
+# Header of the index file, it must change when the format changes
+_HEADER = b'LATTEFM1'
+# 批量查询时一次计算的得分矩阵的元素上限
+# Cap of the elements of the score matrix computed at once by batch queries
+_BATCH_CELLS = 1 << 22
+
+
+# 将文本切分为词项：字符n-gram（默认，适合中文和拼写错误），或者单词n-gram
+# Split a text into terms: character n-grams (the default, suits Chinese and typos), or word n-grams
+def analyze(text, ngram=(2, 3), analyzer='char'):
+    text = normalize(text)
+    if analyzer == 'word':
+        units = text.split()
+        return collections.Counter(' '.join(units[i:i + n]) for n in ngram for i in range(len(units) - n + 1))
+    # 首尾加上空格，让短文本和词首、词尾也能产生n-gram
+    # Pad with spaces so short texts and the beginning and end of words produce n-grams too
+    text = ' %s ' % text
+    return collections.Counter(text[i:i + n] for n in ngram for i in range(len(text) - n + 1))
+
+
+# TF-IDF问答匹配引擎
+# 构建时为所有问题计算TF-IDF权重（次线性的词频），按行归一化后保存为倒排索引：
+# 每个词项对应一段连续的(文档, 权重)，三个数组termPtr、docIds和weights与CSC稀疏矩阵相同。
+# 查询只访问查询中出现的词项的倒排列表，因此开销与索引的大小基本无关。
+# 安装了NumPy时得分通过numpy.bincount累加，top-k通过argpartition选出；否则使用纯Python实现，结果相同。
+# 一个条目可以有多个问题，结果按条目去重并取最高分。索引按内容的哈希缓存在磁盘上。
+# TF-IDF question matching engine
+# On build TF-IDF weights (sublinear term frequency) are computed for all questions, normalized per row and stored as an inverted index:
+# every term owns a contiguous run of (document, weight), the three arrays termPtr, docIds and weights are the same as a CSC sparse matrix.
+# A query only visits the postings of the terms it contains, so its cost is roughly independent of the size of the index.
+# With NumPy installed the scores are accumulated through numpy.bincount and the top-k picked through argpartition;
+# otherwise a pure Python implementation gives the same results.
+# An entry may have several questions, results are deduplicated per entry keeping the best score. The index is cached on disk by a hash of its content.
+class Matcher(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    # 以(插件名, 匹配器名)为Key的实例
+    # Instances keyed by (plugin name, matcher name)
+    _INSTANCES = {}
+    _SUBSCRIBED = False
+
+    # 获取插件在plugin.json的"matchers"中声明的匹配器，例如
+    # "matchers": {"faq": {"entries": "faq.json", "key": "question", "ngram": [2, 3], "analyzer": "char"}}
+    # entries是插件目录下的JSON文件，内容为条目的列表，每个条目的key字段是一个问题或者问题的列表
+    # Get a matcher the plugin declares in "matchers" of plugin.json, e.g.
+    # "matchers": {"faq": {"entries": "faq.json", "key": "question", "ngram": [2, 3], "analyzer": "char"}}
+    # entries is a JSON file in the plugin directory holding a list of entries, the key field of every entry is one question or a list of questions
+    @classmethod
+    def forPlugin(cls, plugin, name):
+        matcher = cls._INSTANCES.get((plugin, name))
+        if matcher is not None:
+            return matcher
+        with cls._INSTANCE_LOCK:
+            if not cls._SUBSCRIBED:
+                # 插件配置变化时丢弃它的匹配器
+                # Drop the matchers of a plugin when its configuration changes
+                PluginConfig.subscribe(lambda changes: [cls.invalidate(plugin) for plugin in set(key.split('.', 1)[0] for key in changes)])
+                cls._SUBSCRIBED = True
+            matcher = cls._INSTANCES.get((plugin, name))
+            if matcher is None:
+                config = PluginConfig.findConfig('%s.matchers.%s' % (plugin, name))
+                if not isinstance(config, dict) or 'entries' not in config:
+                    raise KeyError('Matcher \'%s\' is not declared by plugin \'%s\'' % (name, plugin))
+                path = os.sep.join([LatteConfig.getConfig('sys.path.plugin'), plugin, config['entries']])
+                with io.open(path, mode='r', encoding='utf-8') as source:
+                    entries = json.load(source)
+                matcher = cls._INSTANCES[(plugin, name)] = Matcher.fromEntries(entries, config.get('key', 'question'),
+                    ngram=tuple(config.get('ngram', (2, 3))), analyzer=config.get('analyzer', 'char'),
+                    cachePath=os.sep.join([LatteConfig.getConfig('sys.path.cache'), 'matcher']))
+        return matcher
+
+    # 丢弃插件的匹配器，不指定插件时丢弃全部
+    # Drop the matchers of a plugin, all of them when no plugin is specified
+    @classmethod
+    def invalidate(cls, plugin=None):
+        with cls._INSTANCE_LOCK:
+            for key in [key for key in cls._INSTANCES if plugin is None or key[0] == plugin]:
+                del cls._INSTANCES[key]
+
+    # 从条目列表构建，每个条目的key字段是一个问题或者问题的列表
+    # Build from a list of entries, the key field of every entry is one question or a list of questions
+    @classmethod
+    def fromEntries(cls, entries, key='question', **kwargs):
+        questions, owners = [], []
+        for index, entry in enumerate(entries):
+            asked = entry[key]
+            for question in ([asked] if isinstance(asked, str) else asked):
+                questions.append(question)
+                owners.append(index)
+        return cls(questions, entries, owners, **kwargs)
+
+    # questions是问题的列表，entries是返回给调用者的条目（默认为问题本身），owners[i]是第i个问题所属条目的下标
+    # cachePath是索引缓存的目录，为None时不缓存
+    # questions is a list of questions, entries are what callers get back (the questions themselves by default), owners[i] is the index of the entry question i belongs to
+    # cachePath is the directory of the index cache, nothing is cached when it is None
+    def __init__(self, questions, entries=None, owners=None, ngram=(2, 3), analyzer='char', cachePath=None):
+        self.entries = list(questions) if entries is None else entries
+        self.ngram = tuple(ngram)
+        self.analyzer = analyzer
+        self.logger = Logger.bind('Latte.matcher')
+        owners = array('i', range(len(questions)) if owners is None else owners)
+        digest = hashlib.sha256(json.dumps([_HEADER.decode(), list(questions), list(owners), self.ngram, analyzer],
+                                           ensure_ascii=False).encode('utf-8')).hexdigest()
+        path = os.sep.join([cachePath, '%s.idx' % digest]) if cachePath else None
+        index = self.__read(path) if path else None
+        if index is None:
+            index = self.__build(questions, owners)
+            if path:
+                self.__write(path, index)
+        self.vocabulary, idf, termPtr, docIds, weights, owners = index
+        self.__idf, self.__termPtr, self.__docIds, self.__weights, self.__owners = idf, termPtr, docIds, weights, owners
+        self.size = len(owners)
+        if numpy is not None:
+            # 直接使用array的缓冲区，不复制
+            # Use the buffers of the arrays directly without copying
+            self.__npTermPtr = numpy.frombuffer(termPtr, dtype=numpy.int64)
+            self.__npDocIds = numpy.frombuffer(docIds, dtype=numpy.int32)
+            self.__npWeights = numpy.frombuffer(weights, dtype=numpy.float32)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __build(self, questions, owners):
+        documents = [analyze(question, self.ngram, self.analyzer) for question in questions]
+        frequencies = collections.Counter()
+        for terms in documents:
+            frequencies.update(terms.keys())
+        vocabulary = dict((term, column) for column, term in enumerate(frequencies))
+        # 平滑的IDF，与常见实现相同
+        # Smoothed IDF, the same as common implementations
+        total = len(documents)
+        idf = array('f', (math.log((1 + total) / (1 + frequencies[term])) + 1 for term in vocabulary))
+        # 每个词项的倒排列表长度就是它的文档频率，先算出每段的起点，再把(文档, 权重)直接填进对应的位置
+        # The postings of a term are as long as its document frequency, so the start of every run is computed first
+        # and (document, weight) is filled straight into its position
+        termPtr = array('q', [0])
+        for term in vocabulary:
+            termPtr.append(termPtr[-1] + frequencies[term])
+        cursor = termPtr[:-1]
+        docIds = array('i', bytes(4 * termPtr[-1]))
+        weights = array('f', bytes(4 * termPtr[-1]))
+        for doc, terms in enumerate(documents):
+            row = []
+            for term, count in terms.items():
+                column = vocabulary[term]
+                row.append((column, (1 + math.log(count)) * idf[column]))
+            norm = math.sqrt(sum(weight * weight for _, weight in row)) or 1.0
+            for column, weight in row:
+                position = cursor[column]
+                docIds[position] = doc
+                weights[position] = weight / norm
+                cursor[column] = position + 1
+        return vocabulary, idf, termPtr, docIds, weights, owners
+
+    def __read(self, path):
+        try:
+            with io.open(path, mode='rb') as source:
+                if source.read(len(_HEADER)) != _HEADER:
+                    return None
+                return pickle.load(source)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warn('Unable to read the matcher index \'%s\': %s', path, e)
+            return None
+
+    # 索引只是加速手段，无法写入时直接放弃
+    # The index is only an acceleration, give up when it cannot be written
+    def __write(self, path, index):
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with io.open(temp, mode='wb') as output:
+                output.write(_HEADER)
+                pickle.dump(index, output, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    # 查询的词项和归一化的权重
+    # Terms of a query and their normalized weights
+    def __query(self, text):
+        vocabulary, idf = self.vocabulary, self.__idf
+        row = [(column, (1 + math.log(count)) * idf[column])
+               for column, count in ((vocabulary.get(term), count) for term, count in analyze(text, self.ngram, self.analyzer).items())
+               if column is not None]
+        norm = math.sqrt(sum(weight * weight for _, weight in row)) or 1.0
+        return [(column, weight / norm) for column, weight in row]
+
+    # 返回与text最相似的最多k个条目[(余弦相似度, 条目)]，按相似度从高到低排列，低于threshold的条目被忽略
+    # Return at most k entries most similar to text as [(cosine similarity, entry)], ordered from high to low, entries below threshold are ignored
+    def search(self, text, k=5, threshold=0.0):
+        return self.searchBatch([text], k, threshold)[0]
+
+    # 与text最相似的条目，没有达到threshold的条目时返回None
+    # The entry most similar to text, None when no entry reaches threshold
+    def best(self, text, threshold=0.0):
+        found = self.search(text, 1, threshold)
+        return found[0] if found else None
+
+    # 批量查询，返回每个文本的search()结果
+    # Batch query, returns the search() result of every text
+    def searchBatch(self, texts, k=5, threshold=0.0):
+        queries = [self.__query(text) for text in texts]
+        if not self.size or k <= 0:
+            return [[] for _ in queries]
+        # 同一个条目的多个问题可能同时命中，多取一些候选再去重
+        # Several questions of one entry may hit together, take more candidates before deduplicating
+        candidates = min(self.size, k * 4 if len(self.entries) < self.size else k)
+        if numpy is None:
+            ranked = [self.__rankPython(query, candidates) for query in queries]
+        else:
+            ranked = []
+            step = max(1, _BATCH_CELLS // self.size)
+            for start in range(0, len(queries), step):
+                ranked.extend(self.__rankNumpy(queries[start:start + step], candidates))
+        results = []
+        for found in ranked:
+            seen, result = set(), []
+            for score, doc in found:
+                owner = self.__owners[doc]
+                if score <= threshold or owner in seen:
+                    continue
+                seen.add(owner)
+                result.append((score, self.entries[owner]))
+                if len(result) == k:
+                    break
+            results.append(result)
+        return results
+
+    def __rankPython(self, query, candidates):
+        termPtr, docIds, weights = self.__termPtr, self.__docIds, self.__weights
+        scores = collections.defaultdict(float)
+        for column, weight in query:
+            for position in range(termPtr[column], termPtr[column + 1]):
+                scores[docIds[position]] += weights[position] * weight
+        return [(score, doc) for doc, score in heapq.nlargest(candidates, scores.items(), key=lambda item: item[1])]
+
+    # 一次bincount累加一组查询的全部得分：第q个查询的文档下标偏移q * size，得分矩阵为(查询数, size)
+    # One bincount accumulates all scores of a group of queries: documents of query q are offset by q * size, the score matrix is (queries, size)
+    def __rankNumpy(self, queries, candidates):
+        termPtr, size = self.__npTermPtr, self.size
+        docs, values = [], []
+        for offset, query in enumerate(queries):
+            for column, weight in query:
+                start, end = termPtr[column], termPtr[column + 1]
+                docs.append(self.__npDocIds[start:end] + offset * size)
+                values.append(self.__npWeights[start:end] * weight)
+        if not docs:
+            return [[] for _ in queries]
+        scores = numpy.bincount(numpy.concatenate(docs), numpy.concatenate(values), minlength=len(queries) * size).reshape(len(queries), size)
+        if candidates < size:
+            top = numpy.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        else:
+            top = numpy.broadcast_to(numpy.arange(size), (len(queries), size))
+        ranked = []
+        for row, columns in zip(scores, top):
+            picked = row[columns]
+            order = numpy.argsort(-picked, kind='stable')
+            ranked.append([(float(picked[i]), int(columns[i])) for i in order if picked[i] > 0])
+        return ranked
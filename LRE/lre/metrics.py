@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os, sys, json
+import time
+import bisect
+import threading
+import contextlib
+import collections
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .base import LatteConfig, Logger
+
+# 延迟直方图的桶上界（秒），从1微秒到100秒的1-2-5序列
+# Upper bounds (seconds) of the latency histogram buckets, a 1-2-5 series from 1 microsecond to 100 seconds
+BUCKETS = tuple(base * 10 ** exponent for exponent in range(-6, 2) for base in (1, 2, 5)) + (100,)
+
+
+# 固定桶的延迟直方图
+# 为了让热路径足够便宜，observe不加锁，多线程同时写入时计数可能有极少的误差
+# Fixed-bucket latency histogram
+# observe takes no lock to keep the hot path cheap, counts may be slightly off under concurrent writes
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # 估算分位数p（0到1之间），在桶内线性插值
+    # Estimate the quantile p (between 0 and 1), interpolating linearly within the bucket
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99)
+        }
+
+
+# 采样分析器
+# 后台线程每隔interval秒采样一次所有线程的调用栈，只记录正在执行指定插件代码的调用栈
+# Sampling profiler
+# A background thread samples the stacks of all threads every interval seconds,
+# only stacks that are executing code of the specified plugin are recorded
+class Profiler(object):
+    def __init__(self, plugin, interval):
+        self.plugin = plugin
+        self.interval = interval
+        self.module = 'latte.plugin.%s' % plugin
+        self.samples = collections.Counter()
+        self.total = 0
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='LatteProfiler', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def __run(self):
+        current = threading.get_ident()
+        while not self.__stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == current:
+                    continue
+                stack = []
+                matched = False
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                    if not matched:
+                        name = frame.f_globals.get('__name__', '')
+                        matched = name == self.module or name.startswith(self.module + '.')
+                    frame = frame.f_back
+                if matched:
+                    stack.reverse()
+                    self.samples[';'.join(stack)] += 1
+            self.total += 1
+
+    # 折叠格式的调用栈（'外层;内层 次数'），可以直接生成火焰图
+    # Stacks in collapsed format ('outer;inner count'), flame graphs can be generated from it directly
+    def collapsed(self, limit=None):
+        return ['%s %d' % (stack, count) for stack, count in self.samples.most_common(limit)]
+
+
+# 运行时指标
+# 按插件记录计数器和延迟直方图，采样队列深度等瞬时值，可以按需开启单个插件的采样分析器。
+# 快照可以通过Python接口、本地统计端点或者定期写入的文件获取。
+# Runtime metrics
+# Keeps counters and latency histograms per plugin, samples instantaneous values such as queue depths,
+# and can switch on a sampling profiler for a single plugin on demand.
+# Snapshots are available through the Python API, a local stats endpoint or a periodically written file.
+class Metrics(object):
+    __Enabled = None
+    __Lock = threading.Lock()
+    # 插件名 -> {'counters': {名称: 值}, 'timers': {名称: Histogram}}
+    # plugin name -> {'counters': {name: value}, 'timers': {name: Histogram}}
+    __Plugins = {}
+    # 瞬时值的名称 -> 返回当前值的函数
+    # Name of an instantaneous value -> function returning the current value
+    __Gauges = {}
+    __Profilers = {}
+    __Server = None
+    __Dumper = None
+
+    # 是否记录指标，第一次调用时读取metrics.enable，之后随着latte.json的重新加载变化
+    # Whether metrics are recorded, metrics.enable is read on the first call and follows reloads of latte.json afterwards
+    @classmethod
+    def enabled(cls):
+        if cls.__Enabled is None:
+            with cls.__Lock:
+                if cls.__Enabled is None:
+                    LatteConfig.subscribe(cls.__enableChanged, 'metrics.enable')
+                    cls.__Enabled = LatteConfig.getTypedConfig('metrics.enable', bool, True)
+        return cls.__Enabled
+
+    @classmethod
+    def __enableChanged(cls, changes):
+        cls.__Enabled = LatteConfig.getTypedConfig('metrics.enable', bool, True)
+
+    @classmethod
+    def setEnabled(cls, enabled):
+        cls.__Enabled = bool(enabled)
+
+    @classmethod
+    def __plugin(cls, plugin):
+        stats = cls.__Plugins.get(plugin)
+        if stats is None:
+            with cls.__Lock:
+                stats = cls.__Plugins.setdefault(plugin, {'counters': collections.defaultdict(int), 'timers': {}})
+        return stats
+
+    # 增加插件的计数器
+    # Increase a counter of a plugin
+    @classmethod
+    def incr(cls, plugin, name, n=1):
+        if cls.enabled():
+            cls.__plugin(plugin)['counters'][name] += n
+
+    # 记录插件中一次操作的耗时（秒）
+    # Record the time (seconds) spent in one operation of a plugin
+    @classmethod
+    def observe(cls, plugin, name, seconds):
+        if cls.enabled():
+            timers = cls.__plugin(plugin)['timers']
+            histogram = timers.get(name)
+            if histogram is None:
+                histogram = timers.setdefault(name, Histogram())
+            histogram.observe(seconds)
+
+    # 计时的上下文管理器，with块中的异常会被计入'<name>.errors'
+    # Timing context manager, exceptions in the with block are counted as '<name>.errors'
+    @classmethod
+    @contextlib.contextmanager
+    def timed(cls, plugin, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            cls.incr(plugin, name + '.errors')
+            raise
+        finally:
+            cls.observe(plugin, name, time.perf_counter() - start)
+
+    # 注册一个瞬时值，例如队列深度，它在生成快照时被采样
+    # Register an instantaneous value, e.g. a queue depth, it is sampled when a snapshot is taken
+    @classmethod
+    def gauge(cls, name, fn):
+        cls.__Gauges[name] = fn
+
+    @classmethod
+    def removeGauge(cls, name):
+        cls.__Gauges.pop(name, None)
+
+    # 为单个插件开启采样分析器
+    # Switch on the sampling profiler for a single plugin
+    @classmethod
+    def startProfiler(cls, plugin, interval=None):
+        if interval is None:
+            interval = LatteConfig.getTypedConfig('metrics.profileInterval', float)
+        with cls.__Lock:
+            if plugin not in cls.__Profilers:
+                cls.__Profilers[plugin] = Profiler(plugin, interval)
+        return cls.__Profilers[plugin]
+
+    # 关闭插件的采样分析器，返回折叠格式的调用栈
+    # Switch off the sampling profiler of a plugin and return the stacks in collapsed format
+    @classmethod
+    def stopProfiler(cls, plugin):
+        with cls.__Lock:
+            profiler = cls.__Profilers.pop(plugin, None)
+        if profiler is None:
+            return []
+        profiler.stop()
+        return profiler.collapsed()
+
+    # 清除全部指标
+    # Clear all metrics
+    @classmethod
+    def reset(cls):
+        with cls.__Lock:
+            cls.__Plugins = {}
+
+    @classmethod
+    def snapshot(cls):
+        plugins = {}
+        for plugin, stats in list(cls.__Plugins.items()):
+            plugins[plugin] = {
+                'counters': dict(stats['counters']),
+                'timers': dict((name, histogram.snapshot()) for name, histogram in list(stats['timers'].items()))
+            }
+        gauges = {}
+        for name, fn in list(cls.__Gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                gauges[name] = None
+        profilers = {}
+        for plugin, profiler in list(cls.__Profilers.items()):
+            profilers[plugin] = {'samples': profiler.total, 'top': profiler.collapsed(20)}
+        return {'time': time.time(), 'pid': os.getpid(), 'plugins': plugins, 'gauges': gauges, 'profilers': profilers}
+
+    # 将快照写入文件，先写临时文件再原子地替换
+    # Write a snapshot to a file, a temporary file is written first and then atomically replaces it
+    @classmethod
+    def dump(cls, path):
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with io.open(temp, mode='w', encoding='utf-8') as output:
+            json.dump(cls.snapshot(), output, ensure_ascii=False, default=str)
+        os.replace(temp, path)
+
+    # 按照配置启动本地统计端点和定期写入快照文件的线程
+    # metrics.listen为'host:port'时，GET /stats返回快照，
+    # GET /profile/start?plugin=名称 和 GET /profile/stop?plugin=名称 开关采样分析器
+    # Start the local stats endpoint and the thread that periodically writes snapshot files, as configured
+    # When metrics.listen is 'host:port', GET /stats returns a snapshot,
+    # GET /profile/start?plugin=name and GET /profile/stop?plugin=name switch the sampling profiler
+    @classmethod
+    def start(cls):
+        if not cls.enabled():
+            return
+        logger = Logger.bind('Latte.metrics')
+        listen = LatteConfig.getConfigOrDefault('metrics.listen', '')
+        if listen and cls.__Server is None:
+            host, _, port = listen.rpartition(':')
+            cls.__Server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), _StatsHandler)
+            cls.__Server.daemon_threads = True
+            threading.Thread(target=cls.__Server.serve_forever, name='LatteMetricsServer', daemon=True).start()
+            logger.info('Metrics endpoint listening on %s', listen)
+        path = LatteConfig.getConfigOrDefault('metrics.dumpPath', '')
+        if path and cls.__Dumper is None:
+            interval = LatteConfig.getTypedConfig('metrics.dumpInterval', float)
+            cls.__Dumper = threading.Event()
+            threading.Thread(target=cls.__dumpLoop, args=(path, interval, cls.__Dumper, logger), name='LatteMetricsDumper', daemon=True).start()
+
+    @classmethod
+    def stop(cls):
+        if cls.__Server is not None:
+            cls.__Server.shutdown()
+            cls.__Server.server_close()
+            cls.__Server = None
+        if cls.__Dumper is not None:
+            cls.__Dumper.set()
+            cls.__Dumper = None
+
+    @classmethod
+    def __dumpLoop(cls, path, interval, stopped, logger):
+        # 多进程模式下每个工作进程写入自己的文件
+        # Every worker writes its own file in worker mode
+        worker = os.environ.get('LATTE_WORKER')
+        if worker is not None:
+            path = '%s.%s' % (path, worker)
+        while not stopped.wait(interval):
+            try:
+                cls.dump(path)
+            except Exception as e:
+                logger.warn('Unable to write metrics to \'%s\': %s', path, e)
+
+
+# 本地统计端点的请求处理
+# Request handling of the local stats endpoint
+class _StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        plugin = parse_qs(url.query).get('plugin', [None])[0]
+        if url.path == '/stats':
+            body = Metrics.snapshot()
+        elif url.path == '/profile/start' and plugin:
+            Metrics.startProfiler(plugin)
+            body = {'plugin': plugin, 'profiling': True}
+        elif url.path == '/profile/stop' and plugin:
+            body = {'plugin': plugin, 'profiling': False, 'stacks': Metrics.stopProfiler(plugin)}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        Logger.bind('Latte.metrics').debug(format, *args)
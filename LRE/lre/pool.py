@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import ssl
+import json
+import time
+import socket
+import asyncio
+import threading
+import ipaddress
+import collections
+from urllib.parse import urlsplit
+from .base import LatteConfig
+from .error import PoolException
+from .metrics import Metrics
+
+# 请求可以在复用的连接失效后安全地重试的HTTP方法
+# HTTP methods whose requests can be retried safely after a reused connection turned out to be stale
+_IDEMPOTENT = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'))
+
+
+# HTTP响应，headers的Key为小写，重复的头部以', '连接
+# An HTTP response, the keys of headers are lower case, repeated headers are joined with ', '
+class Response(object):
+    __slots__ = ('status', 'reason', 'headers', 'body')
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return '<Response %d %s>' % (self.status, self.reason)
+
+    def text(self, encoding='utf-8'):
+        return self.body.decode(encoding, 'replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+
+# 从连接池借出的一条连接
+# 用完后调用release()（或者使用async with）归还；连接处于未知状态时（例如没有读完响应）先调用discard()，它不会被复用
+# A connection borrowed from the pool
+# Return it with release() (or async with) after use; call discard() first when the connection is in an unknown state
+# (e.g. a response was not read completely), it is not reused then
+class PooledConnection(object):
+    __slots__ = ('pool', 'key', 'reader', 'writer', 'lastUsed', 'uses', 'reusable')
+
+    def __init__(self, pool, key, reader, writer):
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.lastUsed = time.monotonic()
+        # 被借出的次数，大于1表示这是一条复用的连接
+        # Times it was borrowed, greater than 1 means this is a reused connection
+        self.uses = 0
+        self.reusable = True
+
+    def __repr__(self):
+        return '<PooledConnection %s:%d uses=%d>' % (self.key[0], self.key[1], self.uses)
+
+    def discard(self):
+        self.reusable = False
+
+    # 连接是否还能使用：对端没有关闭，空闲时也没有收到数据
+    # Whether the connection can still be used: the peer has not closed it and no data was received while it was idle
+    def alive(self):
+        reader = self.reader
+        return not (self.writer.is_closing() or reader.at_eof() or reader.exception() is not None or reader.unsolicited)
+
+    def release(self):
+        self.pool.release(self)
+
+    def close(self):
+        self.writer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, excType, exc, traceback):
+        if excType is not None:
+            self.reusable = False
+        self.pool.release(self)
+
+
+# 连接池中的连接使用的StreamReader
+# 连接空闲时不应该收到任何数据，收到的数据（例如对端在关闭前发送的408响应）说明连接不能再复用
+# The StreamReader used by pooled connections
+# An idle connection should not receive any data, data received then (e.g. a 408 response the peer sends before closing)
+# means the connection cannot be reused
+class _Reader(asyncio.StreamReader):
+    def __init__(self):
+        asyncio.StreamReader.__init__(self)
+        self.idle = False
+        self.unsolicited = False
+
+    def feed_data(self, data):
+        if self.idle:
+            self.unsolicited = True
+        asyncio.StreamReader.feed_data(self, data)
+
+
+# 一个主机(host, port, 是否TLS)的连接
+# The connections of one host (host, port, whether TLS)
+class _Host(object):
+    __slots__ = ('idle', 'active', 'waiters')
+
+    def __init__(self):
+        # 空闲的连接，最近归还的在末尾
+        # Idle connections, the most recently returned one last
+        self.idle = collections.deque()
+        self.active = 0
+        # 等待连接的future，结果为归还的连接，或者None表示可以新建一条连接
+        # Futures waiting for a connection, the result is a returned connection, or None meaning a new connection may be opened
+        self.waiters = collections.deque()
+
+
+# 共享的出站连接池
+# 插件通过runtime.pool获取，同一个主机的连接保持长连接并复用，每个主机同时最多有maxPerHost条连接，
+# 超过时请求在acquireTimeout秒内排队等待归还的连接。DNS解析结果缓存dnsTtl秒，并发的相同解析只执行一次。
+# 连接、等待和读取超时时抛出asyncio.TimeoutError。连接池只能在事件循环中使用。
+# The shared outbound connection pool
+# Plugins get it through runtime.pool, connections to the same host are kept alive and reused, every host has at most
+# maxPerHost connections at a time, beyond that requests queue for up to acquireTimeout seconds for a returned connection.
+# DNS results are cached for dnsTtl seconds, concurrent identical lookups run only once.
+# asyncio.TimeoutError is raised when connecting, waiting or reading times out. The pool can only be used on the event loop.
+class ConnectionPool(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    _INSTANCE = None
+
+    # 获取按照latte.json中的pool配置创建的共享实例
+    # Get the shared instance created from the pool configuration in latte.json
+    @classmethod
+    def instance(cls):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                cls._INSTANCE = ConnectionPool(
+                    maxPerHost=LatteConfig.getTypedConfig('pool.maxPerHost', int),
+                    maxIdle=LatteConfig.getTypedConfig('pool.maxIdle', int),
+                    idleTimeout=LatteConfig.getTypedConfig('pool.idleTimeout', float),
+                    connectTimeout=LatteConfig.getTypedConfig('pool.connectTimeout', float),
+                    readTimeout=LatteConfig.getTypedConfig('pool.readTimeout', float),
+                    acquireTimeout=LatteConfig.getTypedConfig('pool.acquireTimeout', float),
+                    dnsTtl=LatteConfig.getTypedConfig('pool.dnsTtl', float))
+        return cls._INSTANCE
+
+    def __init__(self, maxPerHost=10, maxIdle=10, idleTimeout=30, connectTimeout=5, readTimeout=30, acquireTimeout=10, dnsTtl=60):
+        self.maxPerHost = max(1, maxPerHost)
+        self.maxIdle = max(0, maxIdle)
+        self.idleTimeout = idleTimeout
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.acquireTimeout = acquireTimeout
+        self.dnsTtl = dnsTtl
+        self.__hosts = {}
+        # 主机名 -> (过期时间, 地址列表)
+        # Host name -> (expiry time, list of addresses)
+        self.__dns = {}
+        self.__lookups = {}
+        self.__context = None
+        self.__sweeper = None
+        self.__closed = False
+
+    # 定期关闭空闲过久的连接和过期的DNS缓存
+    # Periodically close connections idle for too long and drop expired DNS entries
+    def start(self, loop):
+        self.__closed = False
+        if self.idleTimeout > 0 and self.__sweeper is None:
+            self.__sweeper = loop.create_task(self.__sweep())
+
+    # 关闭全部空闲的连接，借出的连接在归还时关闭
+    # Close all idle connections, borrowed connections are closed when they are returned
+    def stop(self):
+        self.__closed = True
+        if self.__sweeper is not None:
+            self.__sweeper.cancel()
+            self.__sweeper = None
+        for entry in self.__hosts.values():
+            while entry.idle:
+                self.__close(entry.idle.popleft())
+
+    # 解析主机名，返回地址列表；IP地址直接返回
+    # Resolve a host name and return the list of addresses; IP addresses are returned directly
+    async def resolve(self, host, port=0):
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        cached = self.__dns.get(host)
+        if cached is not None and cached[0] > time.monotonic():
+            Metrics.incr('pool', 'dns.hits')
+            return cached[1]
+        lookup = self.__lookups.get(host)
+        if lookup is None:
+            Metrics.incr('pool', 'dns.misses')
+            lookup = self.__lookups[host] = asyncio.ensure_future(self.__lookup(host, port))
+            lookup.add_done_callback(lambda future: self.__lookups.pop(host, None))
+        return await asyncio.shield(lookup)
+
+    async def __lookup(self, host, port):
+        loop = asyncio.get_running_loop()
+        with Metrics.timed('pool', 'dns'):
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), self.__timeout(self.connectTimeout))
+        addresses = []
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        if self.dnsTtl > 0:
+            self.__dns[host] = (time.monotonic() + self.dnsTtl, addresses)
+        return addresses
+
+    # 借出一条到host:port的连接，有空闲的连接时直接复用；tls可以是True或者ssl.SSLContext
+    # Borrow a connection to host:port, an idle connection is reused directly if there is one; tls may be True or an ssl.SSLContext
+    async def acquire(self, host, port, tls=None):
+        key = (host, port, bool(tls))
+        entry = self.__hosts.get(key)
+        if entry is None:
+            entry = self.__hosts[key] = _Host()
+        start = time.monotonic()
+        deadline = start + self.acquireTimeout if self.acquireTimeout > 0 else None
+        while True:
+            connection = self.__reuse(entry)
+            if connection is None and entry.active < self.maxPerHost:
+                entry.active += 1
+                try:
+                    connection = await self.__open(key, tls)
+                except BaseException:
+                    entry.active -= 1
+                    self.__wake(entry)
+                    raise
+            if connection is not None:
+                break
+            future = asyncio.get_running_loop().create_future()
+            entry.waiters.append(future)
+            try:
+                connection = await asyncio.wait_for(future, None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                Metrics.incr('pool', 'acquire.timeouts')
+                raise
+            except asyncio.CancelledError:
+                # 连接或者新建连接的名额已经交给了这个请求，转交给下一个等待的请求
+                # A connection or the right to open one was already handed to this request, pass it on to the next waiting request
+                if future.done() and not future.cancelled():
+                    if future.result() is not None:
+                        self.release(future.result())
+                    else:
+                        self.__wake(entry)
+                raise
+            if connection is not None:
+                break
+        connection.uses += 1
+        Metrics.observe('pool', 'acquire', time.monotonic() - start)
+        return connection
+
+    # 以async with的形式借出连接，异常退出时连接不会被复用
+    # Borrow a connection for async with, the connection is not reused when the block exits with an exception
+    def connection(self, host, port, tls=None):
+        return _Borrow(self, host, port, tls)
+
+    def __reuse(self, entry):
+        now = time.monotonic()
+        while entry.idle:
+            connection = entry.idle.pop()
+            connection.reader.idle = False
+            if connection.alive() and (self.idleTimeout <= 0 or now - connection.lastUsed < self.idleTimeout):
+                entry.active += 1
+                Metrics.incr('pool', 'connections.reused')
+                return connection
+            self.__close(connection)
+        return None
+
+    async def __open(self, key, tls):
+        host, port, _ = key
+        if tls is True:
+            if self.__context is None:
+                self.__context = ssl.create_default_context()
+            tls = self.__context
+        start = time.perf_counter()
+        error = None
+        loop = asyncio.get_running_loop()
+        for address in await self.resolve(host, port):
+            reader = _Reader()
+            protocol = asyncio.StreamReaderProtocol(reader)
+            try:
+                transport, _ = await asyncio.wait_for(
+                    loop.create_connection(lambda: protocol, address, port, ssl=tls or None, server_hostname=host if tls else None),
+                    self.__timeout(self.connectTimeout))
+            except (OSError, asyncio.TimeoutError) as e:
+                error = e
+                continue
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Metrics.incr('pool', 'connections.opened')
+            Metrics.observe('pool', 'connect', time.perf_counter() - start)
+            return PooledConnection(self, key, reader, writer)
+        # 所有地址都无法连接时，下次重新解析
+        # Resolve again next time when no address could be connected to
+        self.__dns.pop(host, None)
+        Metrics.incr('pool', 'connect.errors')
+        if error is None:
+            raise PoolException(host, 'no address was resolved')
+        raise error
+
+    # 归还一条连接：交给等待的请求，或者放回空闲列表
+    # Return a connection: hand it to a waiting request, or put it back into the idle list
+    def release(self, connection):
+        entry = self.__hosts.get(connection.key)
+        connection.lastUsed = time.monotonic()
+        if entry is None:
+            self.__close(connection)
+            return
+        if connection.reusable and not self.__closed and connection.alive():
+            while entry.waiters:
+                waiter = entry.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(connection)
+                    return
+            entry.active -= 1
+            if len(entry.idle) < self.maxIdle:
+                connection.reader.idle = True
+                entry.idle.append(connection)
+                return
+        else:
+            entry.active -= 1
+        self.__close(connection)
+        self.__wake(entry)
+
+    # 唤醒一个等待的请求，让它新建一条连接
+    # Wake up one waiting request so it opens a new connection
+    @staticmethod
+    def __wake(entry):
+        while entry.waiters:
+            waiter = entry.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @staticmethod
+    def __close(connection):
+        connection.close()
+        Metrics.incr('pool', 'connections.closed')
+
+    @staticmethod
+    def __timeout(seconds):
+        return seconds if seconds > 0 else None
+
+    async def __sweep(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idleTimeout / 2))
+            now = time.monotonic()
+            for key, entry in list(self.__hosts.items()):
+                for connection in [connection for connection in entry.idle if now - connection.lastUsed >= self.idleTimeout]:
+                    entry.idle.remove(connection)
+                    self.__close(connection)
+                if not entry.idle and not entry.active and not entry.waiters:
+                    del self.__hosts[key]
+            for host in [host for host, (expiry, _) in self.__dns.items() if expiry <= now]:
+                del self.__dns[host]
+
+    # 发送一个HTTP/1.1请求并读取完整的响应，连接在响应读完后归还给连接池
+    # 复用的连接在收到响应之前就被对端关闭时，幂等的请求会用新的连接重试一次
+    # Send an HTTP/1.1 request and read the whole response, the connection is returned to the pool after the response has been read
+    # Idempotent requests are retried once on a new connection when a reused connection was closed by the peer before any response
+    async def request(self, method, url, headers=None, body=None, timeout=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise PoolException(url, 'only absolute http and https URLs are supported')
+        tls = parts.scheme == 'https'
+        port = parts.port or (443 if tls else 80)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        method = method.upper()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % parts.netloc.rpartition('@')[2]]
+        names = set()
+        for name, value in (headers or {}).items():
+            names.add(name.lower())
+            lines.append('%s: %s' % (name, value))
+        if body is not None and 'content-length' not in names:
+            lines.append('Content-Length: %d' % len(body))
+        if 'connection' not in names:
+            lines.append('Connection: keep-alive')
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+        if timeout is None:
+            timeout = self.readTimeout
+        start = time.perf_counter()
+        retried = False
+        while True:
+            connection = await self.acquire(parts.hostname, port, tls)
+            try:
+                connection.writer.write(data)
+                await connection.writer.drain()
+                response = await asyncio.wait_for(self.__response(connection, method), self.__timeout(timeout))
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                connection.discard()
+                self.release(connection)
+                if not retried and connection.uses > 1 and method in _IDEMPOTENT and not getattr(e, 'partial', b''):
+                    retried = True
+                    Metrics.incr('pool', 'request.retries')
+                    continue
+                Metrics.incr('pool', 'request.errors')
+                raise
+            except BaseException:
+                connection.discard()
+                self.release(connection)
+                Metrics.incr('pool', 'request.errors')
+                raise
+            self.release(connection)
+            Metrics.observe('pool', 'request', time.perf_counter() - start)
+            return response
+
+    async def __response(self, connection, method):
+        reader = connection.reader
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            version, _, rest = line.decode('latin-1').strip().partition(' ')
+            status, _, reason = rest.partition(' ')
+            try:
+                status = int(status)
+            except ValueError:
+                raise PoolException(connection.key[0], 'malformed status line %r' % line)
+            headers = {}
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                name, value = name.strip().lower(), value.strip()
+                headers[name] = headers[name] + ', ' + value if name in headers else value
+            # 跳过100 Continue等临时响应
+            # Skip interim responses such as 100 Continue
+            if status >= 200 or status == 101:
+                break
+        tokens = headers.get('connection', '').lower()
+        if 'close' in tokens or (version == 'HTTP/1.0' and 'keep-alive' not in tokens):
+            connection.discard()
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            body = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+                if not size:
+                    # 跳过尾部的头部
+                    # Skip the trailer headers
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # 没有长度的响应以连接关闭结束
+            # A response without a length ends when the connection closes
+            body = await reader.read()
+            connection.discard()
+        return Response(status, reason, headers, body)
+
+    def stats(self):
+        return {
+            'hosts': dict(('%s:%d' % key[:2] + ('/tls' if key[2] else ''), {
+                'active': entry.active,
+                'idle': len(entry.idle),
+                'waiting': sum(1 for waiter in entry.waiters if not waiter.done()),
+                'utilization': entry.active / float(self.maxPerHost)
+            }) for key, entry in list(self.__hosts.items())),
+            'dns': len(self.__dns)
+        }
+
+
+class _Borrow(object):
+    __slots__ = ('pool', 'args', 'connection')
+
+    def __init__(self, pool, *args):
+        self.pool = pool
+        self.args = args
+        self.connection = None
+
+    async def __aenter__(self):
+        self.connection = await self.pool.acquire(*self.args)
+        return self.connection
+
+    async def __aexit__(self, excType, exc, traceback):
+        return await self.connection.__aexit__(excType, exc, traceback)
@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re, sys
+import time
+import inspect
+import collections
+try:
+    from re import _parser as _sre_parse, _constants as _sre_constants
+except ImportError:
+    import sre_parse as _sre_parse, sre_constants as _sre_constants
+from .base import LatteConfig, PluginConfig, Logger
+from .error import PluginException
+from .metrics import Metrics
+from .cache import ResultCache, MISSING, normalize
+from .batch import Batcher
+
+# 字典树中标记终点的Key
+# Key that marks a terminal in the tries
+_END = ''
+# 正则中的反向引用
+# Back references in a pattern
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+# 找出正则的任何匹配都必须包含的字面量片段
+# 只分析顶层的顺序结构，遇到分支、重复、断言等无法确定的部分时截断当前片段
+# Find the literal runs that every match of a pattern must contain
+# Only the top-level sequence is analysed, the current run is cut at branches, repeats, assertions and other undetermined parts
+def _requiredLiterals(regex):
+    if regex.flags & re.IGNORECASE:
+        return []
+    try:
+        parsed = _sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return []
+    runs, current = [], []
+
+    def flush():
+        if current:
+            runs.append(''.join(current))
+            del current[:]
+
+    def walk(items):
+        for op, av in items:
+            if op is _sre_constants.LITERAL:
+                current.append(chr(av))
+            elif op is _sre_constants.SUBPATTERN and not (av[1] & re.IGNORECASE) \
+                    and all(inner is not _sre_constants.BRANCH for inner, _ in av[-1]):
+                walk(av[-1])
+            else:
+                flush()
+    walk(parsed)
+    flush()
+    return runs
+
+
+# 一条路由：插件中的一个消息处理函数，以及触发它的命令、前缀、关键字和正则
+# A route: a message handler of a plugin, and the commands, prefixes, keywords and patterns that trigger it
+class Route(object):
+    __slots__ = ('plugin', 'handler', 'commands', 'prefixes', 'keywords', 'patterns', 'regexes', 'fn', 'cache', 'batch')
+
+    def __init__(self, plugin, handler, commands=(), prefixes=(), keywords=(), patterns=(), cache=None, batch=None):
+        self.plugin = plugin
+        self.handler = handler
+        self.commands = list(commands)
+        self.prefixes = list(prefixes)
+        self.keywords = list(keywords)
+        self.patterns = list(patterns)
+        self.regexes = [re.compile(pattern) for pattern in self.patterns]
+        # 解析后的处理函数，第一次分发时才会解析
+        # The resolved handler function, it is resolved on the first dispatch
+        self.fn = None
+        # plugin.json中的"cache"：True或者{"ttl": 秒}时缓存处理函数的结果，False时不缓存，
+        # None时由处理函数上的@memoize决定
+        # "cache" in plugin.json: results of the handler are cached when it is True or {"ttl": seconds}, not cached when False,
+        # decided by @memoize on the handler when None
+        self.cache = {} if cache is True else cache
+        # plugin.json中的"batch"：True或者{"size": 条数, "wait": 秒}时处理函数按批调用，
+        # None时由处理函数上的@batched决定
+        # "batch" in plugin.json: the handler is called in batches when it is True or {"size": count, "wait": seconds},
+        # decided by @batched on the handler when None
+        self.batch = {} if batch is True else batch
+
+    def __repr__(self):
+        return '<Route %s.%s>' % (self.plugin, self.handler)
+
+
+# 一次匹配的结果
+# kind是'command'，'prefix'，'keyword'或'pattern'，value是触发的命令、前缀、关键字或正则，
+# regex是正则匹配时的re.Match对象
+# The result of one match
+# kind is 'command', 'prefix', 'keyword' or 'pattern', value is the command, prefix, keyword or pattern that triggered it,
+# regex is the re.Match object of a pattern match
+class Match(object):
+    __slots__ = ('route', 'kind', 'value', 'start', 'end', 'regex')
+
+    def __init__(self, route, kind, value, start, end, regex=None):
+        self.route = route
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+        self.regex = regex
+
+    def __repr__(self):
+        return '<Match %r %s %r>' % (self.route, self.kind, self.value)
+
+
+# Aho-Corasick自动机，一次扫描文本即可找出所有关键字
+# Aho-Corasick automaton, finds all keywords in a single scan of the text
+class KeywordAutomaton(object):
+    def __init__(self):
+        # 每个状态的转移表，失败指针和输出
+        # Transition table, failure link and outputs of every state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            nextState = self.goto[state].get(char)
+            if nextState is None:
+                nextState = len(self.goto)
+                self.goto[state][char] = nextState
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nextState
+        self.output[state].append((keyword, value))
+
+    # 按广度优先的顺序计算失败指针，并合并输出
+    # Compute the failure links in breadth-first order and merge the outputs
+    def build(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nextState in self.goto[state].items():
+                queue.append(nextState)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[nextState] = target if target != nextState else 0
+                self.output[nextState] = self.output[nextState] + self.output[self.fail[nextState]]
+
+    # 返回(起始位置, 结束位置, 关键字, 值)
+    # Yields (start, end, keyword, value)
+    def search(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                for keyword, value in output[state]:
+                    yield index - len(keyword) + 1, index + 1, keyword, value
+
+
+# 消息路由器
+# 将所有插件声明的命令、前缀、关键字和正则编译为合并的索引：
+# 命令和前缀使用字典树，关键字使用Aho-Corasick自动机，正则按必需的字面量预过滤，
+# 没有必需字面量的正则合并为一个表达式，只有它匹配时才逐个执行这些正则。
+# 因此没有被触发的插件几乎不增加分发的开销。
+# Message router
+# Compiles the commands, prefixes, keywords and patterns declared by all plugins into combined indexes:
+# a trie for commands and prefixes, an Aho-Corasick automaton for keywords, and patterns are prefiltered by their required literals;
+# patterns without a required literal are merged into one expression and only run one by one when it matches.
+# Plugins that are not triggered therefore add almost nothing to the cost of dispatching.
+class Router(object):
+    def __init__(self, commandPrefixes=None, ignoreCase=None, resolver=None, executor=None):
+        if commandPrefixes is None:
+            commandPrefixes = LatteConfig.getConfig('router.commandPrefixes')
+        if ignoreCase is None:
+            ignoreCase = LatteConfig.getTypedConfig('router.ignoreCase', bool)
+        self.commandPrefixes = list(commandPrefixes)
+        self.ignoreCase = ignoreCase
+        self.resolver = resolver if resolver is not None else resolveHandler
+        # 普通的批处理函数运行的线程池，None时使用事件循环默认的线程池
+        # The thread pool plain batch handlers run in, the default executor of the event loop is used when None
+        self.executor = executor
+        self.logger = Logger.bind('Latte.router')
+        self.routes = []
+        # 批处理函数的路由 -> Batcher
+        # Route of a batch handler -> Batcher
+        self.__batchers = {}
+        self.__built = False
+
+    # 从PluginConfig构建路由器，names不指定时使用全部插件
+    # Build a router from PluginConfig, all plugins are used when names is not specified
+    @classmethod
+    def fromPlugins(cls, names=None, **kwargs):
+        router = cls(**kwargs)
+        for name in (PluginConfig.names() if names is None else names):
+            router.addPlugin(name, PluginConfig.getConfig(name))
+        router.build()
+        return router
+
+    # 添加plugin.json中"handlers"声明的全部路由
+    # Add all routes declared by "handlers" in plugin.json
+    def addPlugin(self, name, config):
+        for handler in config.get('handlers', []):
+            try:
+                self.add(name, handler['handler'],
+                    commands=handler.get('commands', ()),
+                    prefixes=handler.get('prefixes', ()),
+                    keywords=handler.get('keywords', ()),
+                    patterns=handler.get('patterns', ()),
+                    cache=handler.get('cache'),
+                    batch=handler.get('batch'))
+            except (KeyError, re.error) as e:
+                self.logger.warn('[Plugin \'%s\'] Invalid handler %r: %s', name, handler, e)
+
+    def add(self, plugin, handler, commands=(), prefixes=(), keywords=(), patterns=(), cache=None, batch=None):
+        route = Route(plugin, handler, commands, prefixes, keywords, patterns, cache, batch)
+        self.routes.append(route)
+        self.__built = False
+        return route
+
+    def __fold(self, text):
+        return text.lower() if self.ignoreCase else text
+
+    # 编译全部索引，添加路由后必须重新调用
+    # Compile all indexes, it must be called again after adding routes
+    def build(self):
+        # 命令和前缀的字典树，终点保存(是否需要单词边界, 触发值, 路由)
+        # Trie of commands and prefixes, a terminal holds (whether a word boundary is required, trigger, route)
+        trie = {}
+        automaton = KeywordAutomaton()
+        # 正则的字面量预过滤器：只有文本中出现了某个正则必需的字面量，才会执行该正则
+        # Literal prefilter of the patterns: a pattern only runs when a literal it requires appears in the text
+        literals = KeywordAutomaton()
+        guarded = []
+        alternatives = []
+        # 合并为预过滤器的正则的(顺序, 路由, 正则)，以及需要单独匹配的正则
+        # (order, route, regex) of the patterns merged into the prefilter, and the patterns that are matched alone
+        groups = []
+        loose = []
+        for order, route in enumerate(self.routes):
+            for command in route.commands:
+                for prefix in self.commandPrefixes:
+                    self.__insert(trie, self.__fold(prefix + command), (True, command, order, route))
+            for prefix in route.prefixes:
+                self.__insert(trie, self.__fold(prefix), (False, prefix, order, route))
+            for keyword in route.keywords:
+                if keyword:
+                    automaton.add(self.__fold(keyword), (keyword, order, route))
+            for regex in route.regexes:
+                required = _requiredLiterals(regex)
+                if required:
+                    guarded.append((required, order, route, regex))
+                # 带有标志或反向引用的正则放进合并的表达式后含义会改变，单独匹配
+                # Patterns with flags or back references change meaning inside the merged expression, they are matched alone
+                elif regex.flags & ~re.UNICODE or _BACKREFERENCE.search(regex.pattern):
+                    loose.append((order, route, regex))
+                else:
+                    groups.append((order, route, regex))
+                    alternatives.append('(?:%s)' % regex.pattern)
+        # 每个正则只用最有区分度的字面量建立索引：被最少的正则共享的那个，其次是最长的那个
+        # Every pattern is indexed by its most selective literal only: the one shared by the fewest patterns, then the longest one
+        usage = collections.Counter(self.__fold(literal) for required, _, _, _ in guarded for literal in set(required))
+        for required, order, route, regex in guarded:
+            literal = min((self.__fold(literal) for literal in required), key=lambda literal: (usage[literal], -len(literal)))
+            literals.add(literal, (order, route, regex))
+        automaton.build()
+        literals.build()
+        merged = None
+        if alternatives:
+            try:
+                merged = re.compile('|'.join(alternatives))
+            except re.error:
+                # 分组名在多个正则之间冲突，全部单独匹配
+                # Group names clash between patterns, match all of them alone
+                loose.extend(groups)
+                groups = []
+        self.__trie = trie
+        self.__automaton = automaton
+        self.__literals = literals
+        self.__merged = merged
+        self.__groups = groups
+        self.__loose = loose
+        self.__built = True
+
+    def __insert(self, trie, text, value):
+        node = trie
+        for char in text:
+            node = node.setdefault(char, {})
+        node.setdefault(_END, []).append(value)
+
+    # 找出文本匹配的全部路由，每条路由最多出现一次
+    # 顺序为：命令和前缀（较长的优先），关键字（按出现的位置），正则（有必需字面量的在前，各组内按声明顺序）
+    # Find all routes the text matches, every route appears at most once
+    # The order is: commands and prefixes (longer first), keywords (by position), patterns
+    # (those with a required literal first, declaration order within each group)
+    def match(self, text):
+        if not self.__built:
+            self.build()
+        folded = self.__fold(text)
+        matches = []
+        seen = set()
+        # 沿字典树匹配文本的开头
+        # Walk the trie along the beginning of the text
+        hits = []
+        node = self.__trie
+        for index, char in enumerate(folded):
+            node = node.get(char)
+            if node is None:
+                break
+            if _END in node:
+                hits.append((index + 1, node[_END]))
+        length = len(folded)
+        for end, values in reversed(hits):
+            for boundary, value, order, route in values:
+                if boundary and end < length and not folded[end].isspace():
+                    continue
+                if order not in seen:
+                    seen.add(order)
+                    matches.append(Match(route, 'command' if boundary else 'prefix', value, 0, end))
+        for start, end, _, (keyword, order, route) in self.__automaton.search(folded):
+            if order not in seen:
+                seen.add(order)
+                matches.append(Match(route, 'keyword', keyword, start, end))
+        # 只执行预过滤器选出的候选正则
+        # Only run the candidate patterns picked by the prefilter
+        candidates = {}
+        for _, _, _, (order, route, regex) in self.__literals.search(folded):
+            if order not in seen:
+                candidates[id(regex)] = (order, route, regex)
+        for order, route, regex in sorted(candidates.values(), key=lambda candidate: candidate[0]):
+            if order not in seen:
+                found = regex.search(text)
+                if found is not None:
+                    seen.add(order)
+                    matches.append(Match(route, 'pattern', regex.pattern, found.start(), found.end(), found))
+        # 合并的表达式只作为预过滤器：它不匹配时所有没有必需字面量的正则都不会匹配，否则逐个执行这些正则
+        # The merged expression is only a prefilter: when it does not match none of the patterns without a required literal can,
+        # otherwise each of those patterns is run
+        if self.__merged is not None and self.__merged.search(text) is not None:
+            for order, route, regex in self.__groups:
+                if order not in seen:
+                    found = regex.search(text)
+                    if found is not None:
+                        seen.add(order)
+                        matches.append(Match(route, 'pattern', regex.pattern, found.start(), found.end(), found))
+        for order, route, regex in self.__loose:
+            if order not in seen:
+                found = regex.search(text)
+                if found is not None:
+                    seen.add(order)
+                    matches.append(Match(route, 'pattern', regex.pattern, found.start(), found.end(), found))
+        return matches
+
+    # 解析路由的处理函数，结果保存在route.fn中
+    # Resolve the handler function of a route, the result is kept in route.fn
+    def handlerOf(self, route):
+        if route.fn is None:
+            route.fn = self.resolver(route)
+        return route.fn
+
+    # 将消息分发给所有匹配的处理函数，处理函数以handler(message, match)的形式调用
+    # 返回[(match, 返回值)]，协程形式的处理函数返回的是协程，需要调用者等待
+    # Dispatch the message to all matching handlers, handlers are called as handler(message, match)
+    # Returns [(match, return value)], coroutine handlers return a coroutine that the caller has to await
+    def dispatch(self, text, message=None):
+        results = []
+        for match in self.match(text):
+            route = match.route
+            name = 'handler.%s' % route.handler
+            Metrics.incr(route.plugin, 'inflight')
+            start = time.perf_counter()
+            try:
+                fn = self.handlerOf(route)
+                if self.batchOf(route, fn) is not None:
+                    # 同步分发时批处理函数以只有一条消息的批调用
+                    # Batch handlers are called with a batch of one message when dispatching synchronously
+                    fn = self.__single(fn)
+                options = self.cacheOf(route, fn)
+                if options is None:
+                    result = fn(message, match)
+                else:
+                    # 同步分发只查找和保存缓存，不合并并发的相同请求
+                    # Synchronous dispatching only looks up and stores cache entries, it does not merge concurrent identical requests
+                    cache = ResultCache.instance(route.plugin)
+                    key = self.__cacheKey(match, text)
+                    result = cache.get(key)
+                    if result is MISSING:
+                        result = fn(message, match)
+                        if not inspect.isawaitable(result):
+                            cache.put(key, result, options.get('ttl'))
+                results.append((match, result))
+            except Exception:
+                Metrics.incr(route.plugin, name + '.errors')
+                raise
+            finally:
+                Metrics.observe(route.plugin, name, time.perf_counter() - start)
+                Metrics.incr(route.plugin, 'inflight', -1)
+        return results
+
+    # dispatch的协程版本，会等待协程形式的处理函数，协程的耗时计入处理函数的延迟
+    # The coroutine version of dispatch, it awaits coroutine handlers, whose time counts towards the handler latency
+    async def dispatchAsync(self, text, message=None):
+        results = []
+        for match in self.match(text):
+            results.append((match, await self.callAsync(match, message, text)))
+        return results
+
+    # 调用一个匹配的处理函数，协程形式的处理函数会被等待，批处理函数的调用会被合并为微批
+    # 指定了text并且处理函数开启了缓存时，结果以规范化的text为Key缓存，并发的相同请求只执行一次
+    # Call the handler of one match, coroutine handlers are awaited, calls of batch handlers are merged into micro-batches
+    # When text is given and the handler has caching enabled, the result is cached keyed by the normalized text
+    # and concurrent identical requests run only once
+    async def callAsync(self, match, message=None, text=None):
+        route = match.route
+        name = 'handler.%s' % route.handler
+        Metrics.incr(route.plugin, 'inflight')
+        start = time.perf_counter()
+        try:
+            fn = self.handlerOf(route)
+            batch = self.batchOf(route, fn)
+            if batch is not None:
+                call = lambda: self.batcherOf(route, fn, batch).submit(message, match)
+            else:
+                call = lambda: self.__call(fn, message, match)
+            options = self.cacheOf(route, fn) if text is not None else None
+            if options is None:
+                return await call()
+            return await ResultCache.instance(route.plugin).getOrCall(self.__cacheKey(match, text), call, options.get('ttl'))
+        except Exception:
+            Metrics.incr(route.plugin, name + '.errors')
+            raise
+        finally:
+            Metrics.observe(route.plugin, name, time.perf_counter() - start)
+            Metrics.incr(route.plugin, 'inflight', -1)
+
+    @staticmethod
+    async def __call(fn, message, match):
+        result = fn(message, match)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    # 路由的缓存选项，plugin.json中的"cache"优先于处理函数上的@memoize，不缓存时返回None
+    # 返回流式回复的生成器函数从不缓存
+    # Cache options of a route, "cache" in plugin.json takes precedence over @memoize on the handler, returns None when not cached
+    # Generator functions returning streaming replies are never cached
+    @staticmethod
+    def cacheOf(route, fn):
+        if inspect.isgeneratorfunction(fn) or inspect.isasyncgenfunction(fn):
+            return None
+        options = route.cache
+        if options is None:
+            options = getattr(fn, 'latteCache', None)
+        return options if isinstance(options, dict) else None
+
+    # 路由的批处理选项，plugin.json中的"batch"优先于处理函数上的@batched，不是批处理函数时返回None
+    # Batch options of a route, "batch" in plugin.json takes precedence over @batched on the handler, returns None for handlers that are not batched
+    @staticmethod
+    def batchOf(route, fn):
+        options = route.batch
+        if options is None:
+            options = getattr(fn, 'latteBatch', None)
+        return options if isinstance(options, dict) else None
+
+    # 获取路由的微批处理器
+    # Get the micro-batcher of a route
+    def batcherOf(self, route, fn, options):
+        batcher = self.__batchers.get(route)
+        if batcher is None or batcher.fn is not fn:
+            batcher = self.__batchers[route] = Batcher(route.plugin, route.handler, fn, options.get('size'), options.get('wait'), self.executor)
+        return batcher
+
+    # 把批处理函数包装为处理单条消息的函数
+    # Wrap a batch handler into a function handling a single message
+    @staticmethod
+    def __single(fn):
+        def single(message, match):
+            results = fn([message], [match])
+            if inspect.isawaitable(results):
+                async def first():
+                    return list(await results)[0]
+                return first()
+            return list(results)[0]
+        return single
+
+    @staticmethod
+    def __cacheKey(match, text):
+        return (match.route.handler, match.kind, match.value, normalize(text))
+
+    # 丢弃插件已经解析的处理函数，插件重新导入后，仍然持有旧路由的调用会解析到新模块中的函数
+    # Drop the resolved handlers of a plugin, after the plugin is imported again, calls still holding old routes resolve the functions in the new module
+    def forget(self, plugin):
+        for route in self.routes:
+            if route.plugin == plugin:
+                route.fn = None
+                # 已经收集的批仍然由旧的处理函数处理
+                # Batches already collected are still handled by the old handler
+                self.__batchers.pop(route, None)
+
+
+# 默认的处理函数解析方式：从插件加载器导入的插件模块中按名称获取
+# The default way to resolve a handler: get it by name from the plugin module imported by the plugin loader
+def resolveHandler(route):
+    module = sys.modules.get('latte.plugin.%s' % route.plugin)
+    if module is None:
+        raise PluginException(route.plugin, 'the plugin is not loaded')
+    fn = getattr(module, route.handler, None)
+    if not callable(fn):
+        raise PluginException(route.plugin, 'handler \'%s\' is not found' % route.handler)
+    return fn
@@ -0,0 +1,607 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gc
+import time
+import signal
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .base import LatteConfig, PluginConfig, Logger
+from .loader import PluginLoader
+from .router import Router
+from .metrics import Metrics
+from .handlers import queueStats
+from .watcher import ConfigWatcher
+from .cache import ResultCache
+from .session import SessionStore
+from .scheduler import Scheduler
+from .bus import EventBus
+from .matcher import Matcher
+from .admission import AdmissionController
+from .sandbox import Sandbox
+from .pool import ConnectionPool
+from .error import AdmissionException
+from .stream import Stream, isStream, closeAll
+
+
+# 一个插件的消息闸门
+# 重新加载插件时关闭闸门，新的消息等待它重新打开；inflight为正在处理的消息数，idle在它为0时被设置
+# The message gate of a plugin
+# The gate is closed while the plugin is reloaded, new messages wait for it to open again;
+# inflight is the number of messages being handled, idle is set when it is 0
+class _Gate(object):
+    __slots__ = ('inflight', 'open', 'idle', 'lastUsed')
+
+    def __init__(self):
+        self.inflight = 0
+        self.open = asyncio.Event()
+        self.open.set()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        # 最近一次处理消息（或者被激活）的时间，用于卸载空闲的插件
+        # When the plugin last handled a message (or was activated), used to unload idle plugins
+        self.lastUsed = time.monotonic()
+
+    def enter(self):
+        self.inflight += 1
+        self.idle.clear()
+        self.lastUsed = time.monotonic()
+
+    def leave(self):
+        self.inflight -= 1
+        if not self.inflight:
+            self.idle.set()
+
+
+# 基于asyncio事件循环的Server运行时
+# 所有插件的Server在同一个事件循环中并发运行，协程形式的serving不需要独占线程，
+# 阻塞的（旧式的）serving运行在守护线程中，通过future桥接到事件循环。
+# Server runtime based on the asyncio event loop
+# The Servers of all plugins run concurrently on one event loop, coroutine servings do not need a thread of their own,
+# blocking (legacy) servings run on daemon threads and are bridged onto the event loop through futures.
+class Runtime(object):
+    def __init__(self, plugins, workers=None, shutdownTimeout=None, router=None, socket=None, lazy=()):
+        if workers is None:
+            workers = LatteConfig.getTypedConfig('runtime.workers', int)
+        if shutdownTimeout is None:
+            shutdownTimeout = LatteConfig.getTypedConfig('runtime.shutdownTimeout', float)
+        self.plugins = list(plugins)
+        # 插件名 -> 已加载的Plugin，与self.plugins同步维护，分发时不需要扫描列表
+        # Plugin name -> loaded Plugin, kept in step with self.plugins so dispatching does not scan the list
+        self.__loaded = dict((plugin.name, plugin) for plugin in self.plugins)
+        # 按需激活的插件：路由器第一次把消息路由给它们时才加载，空闲超过idleTimeout秒后卸载
+        # Plugins activated on demand: they are loaded when the router first routes a message to them and unloaded after idleTimeout idle seconds
+        self.lazy = set(lazy)
+        self.idleTimeout = LatteConfig.getTypedConfig('loader.idleTimeout', float)
+        self.idleInterval = LatteConfig.getTypedConfig('loader.idleInterval', float)
+        self.workers = max(1, workers)
+        self.shutdownTimeout = shutdownTimeout
+        self.logger = Logger.bind('Latte.runtime')
+        self.loop = None
+        self.executor = None
+        # 正在运行的serving任务，以任务为Key，值为(插件, Server)
+        # Running serving tasks, keyed by task, the value is (plugin, Server)
+        self.tasks = {}
+        self.__stopping = None
+        # 插件名 -> _Gate
+        # plugin name -> _Gate
+        self.__gates = {}
+        # 重新加载插件是串行的；serving任务增加时设置__changed，让main重新检查正在运行的任务
+        # Plugin reloads are serialized; __changed is set when serving tasks are added, so main checks the running tasks again
+        self.__reloading = None
+        self.__changed = None
+        # 多进程模式下由主进程分配的监听套接字，Server可以用它调用loop.create_server(..., sock=runtime.socket)
+        # The listening socket handed out by the supervisor in worker mode, Servers can use it with loop.create_server(..., sock=runtime.socket)
+        self.socket = socket
+        # 共享的会话存储，插件通过runtime.sessions.get(key)获取会话
+        # The shared session store, plugins get sessions through runtime.sessions.get(key)
+        self.sessions = SessionStore.instance()
+        # 共享的定时器调度器，插件通过runtime.scheduler.callLater()、every()或cron()注册定时器
+        # The shared timer scheduler, plugins register timers through runtime.scheduler.callLater(), every() or cron()
+        self.scheduler = Scheduler.instance()
+        # 插件之间的事件总线，插件通过runtime.bus.subscribe()和publish()通信
+        # The event bus between plugins, plugins communicate through runtime.bus.subscribe() and publish()
+        self.bus = EventBus.instance()
+        # 插件的准入控制和公平排队
+        # Admission control and fair queuing of plugins
+        self.admission = AdmissionController.instance()
+        # 共享的出站连接池，插件通过runtime.pool.request()或者runtime.pool.connection()访问后端
+        # The shared outbound connection pool, plugins reach backends through runtime.pool.request() or runtime.pool.connection()
+        self.pool = ConnectionPool.instance()
+        # 消息路由器，包含所有插件在plugin.json中声明的处理函数
+        # Message router holding the handlers all plugins declare in plugin.json
+        names = [plugin.name for plugin in self.plugins] + sorted(self.lazy)
+        self.router = router if router is not None else Router.fromPlugins(names)
+        # 构建路由器时每个插件在plugin.json中声明的"handlers"，只有它们变化时才需要重新构建路由器
+        # The "handlers" every plugin declared in plugin.json when the router was built, the router only needs rebuilding when they change
+        self.__routed = self.__handlers(names)
+        # Server通过runtime属性访问运行时，例如分发收到的消息
+        # Servers access the runtime through the runtime attribute, e.g. to dispatch received messages
+        for plugin in self.plugins:
+            for server in plugin.servers:
+                server.runtime = self
+
+    # 阻塞运行直到所有Server结束，或者收到停止信号
+    # Run blocking until all Servers have finished, or a stop signal is received
+    def run(self):
+        asyncio.run(self.main())
+
+    # 请求停止运行时，可以在任意线程中调用
+    # Ask the runtime to stop, it may be called from any thread
+    def stop(self):
+        if self.loop is not None and self.__stopping is not None:
+            self.loop.call_soon_threadsafe(self.__stopping.set)
+
+    # 在线程池中执行阻塞的函数
+    # Run a blocking function in the thread pool
+    def runBlocking(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+    # 将收到的消息分发给匹配的插件处理函数
+    # 正在重新加载的插件的消息会等待插件重新激活后再处理
+    # 受准入控制的插件先获取执行槽位，被拒绝时结果为配置的reject回复（没有配置时跳过该插件），user用于用户的限流
+    # 出错的处理函数被记录到日志并跳过，不产生结果
+    # 流式回复的结果是Stream，调用者必须把它读到结束或者调用close()，在这之前插件的闸门和执行槽位一直被占用
+    # Dispatch a received message to the matching plugin handlers
+    # Messages for a plugin being reloaded wait until the plugin is activated again
+    # Plugins under admission control acquire an execution slot first, when rejected the result is the configured reject reply
+    # (the plugin is skipped when there is none), user is used for per-user rate limits
+    # A failing handler is logged and skipped without a result
+    # The result of a streaming reply is a Stream, the caller must read it to the end or call close(),
+    # until then the gate and the execution slot of the plugin stay taken
+    async def dispatch(self, text, message=None, user=None):
+        router = self.router
+        results = []
+        try:
+            for match in router.match(text):
+                name = match.route.plugin
+                # 处理完成（流式回复读完）后需要调用的函数
+                # Functions to call once the message is handled (or the streaming reply is read)
+                releases = []
+                if self.admission.applies(name):
+                    try:
+                        await self.admission.acquire(name, user)
+                    except AdmissionException as e:
+                        if e.reply is not None:
+                            results.append((match, e.reply))
+                        continue
+                    releases.append(self.admission.release)
+                try:
+                    await self.__call(router, match, message, text, results, releases)
+                except Exception as e:
+                    # 一个处理函数出错不会影响同一条消息的其它匹配，错误已经由callAsync计入指标
+                    # A failing handler does not affect the other matches of the same message, the error was already counted by callAsync
+                    self.logger.error('[Plugin \'%s\'] Handler \'%s\' failed: %s', name, match.route.handler, e, exc_info=e)
+                finally:
+                    for release in releases:
+                        release()
+        except BaseException:
+            # 分发被取消时，已经得到的流式回复不会再被读取
+            # When dispatching is cancelled, the streaming replies already obtained will never be read
+            await closeAll(results)
+            raise
+        return results
+
+    # 等待插件的闸门后调用处理函数，插件不可用时不产生结果
+    # 返回流式回复时，releases中的函数转交给Stream，在流结束或者被关闭时才调用
+    # Call the handler after waiting at the gate of the plugin, no result is produced when the plugin is unavailable
+    # When a streaming reply is returned, the functions in releases are handed to the Stream and only called when it ends or is closed
+    async def __call(self, router, match, message, text, results, releases):
+        name = match.route.plugin
+        gate = self.__gate(name)
+        while True:
+            # 按需激活的插件可能还没有加载，或者在等待闸门期间因为空闲被卸载了
+            # A plugin activated on demand may not be loaded yet, or may have been unloaded as idle while waiting at the gate
+            if name in self.lazy and self.__find(name) is None:
+                if await self.activatePlugin(name) is None:
+                    return
+            if gate.open.is_set():
+                break
+            await gate.open.wait()
+        # 在闸门前等待期间插件可能已经被卸载
+        # The plugin may have been unloaded while waiting at the gate
+        if self.__find(name) is None:
+            return
+        gate.enter()
+        releases.append(gate.leave)
+        result = await router.callAsync(match, message, text)
+        if isStream(result):
+            if not isinstance(result, Stream):
+                result = Stream(result)
+            result.onClose.extend(releases)
+            del releases[:]
+        results.append((match, result))
+
+    def __gate(self, name):
+        gate = self.__gates.get(name)
+        if gate is None:
+            gate = self.__gates[name] = _Gate()
+        return gate
+
+    # 在任意线程中请求重新加载（或者新增）一个插件，返回concurrent.futures.Future
+    # Ask for a plugin to be reloaded (or added) from any thread, returns a concurrent.futures.Future
+    def reload(self, name):
+        return asyncio.run_coroutine_threadsafe(self.reloadPlugin(name), self.loop)
+
+    # 在不停止其它插件的情况下重新加载一个插件：
+    # 关闭它的消息闸门并等待正在处理的消息完成，停止它的Server并调用teardown()，
+    # 重新读取plugin.json，重新导入模块，调用init()，servers()和activation()后重新开始serving。
+    # 插件还没有加载时，相当于新增这个插件。返回新的Plugin，加载失败时返回None（插件保持卸载状态）。
+    # 依赖这个插件的其它插件不会被重新加载。
+    # Reload one plugin without stopping the other plugins:
+    # close its message gate and wait for the messages being handled, stop its Servers and call teardown(),
+    # read plugin.json again, import the module again, call init(), servers() and activation() and start serving again.
+    # A plugin that is not loaded yet is added. Returns the new Plugin, or None when loading fails (the plugin stays unloaded).
+    # Plugins depending on this plugin are not reloaded.
+    async def reloadPlugin(self, name):
+        async with self.__reloading:
+            return await self.__replace(name, True)
+
+    # 激活一个按需激活的插件（以及它依赖的按需激活的插件），已经加载的插件直接返回
+    # 激活失败的插件不再按需激活，它的路由被移除
+    # Activate a plugin activated on demand (and the on-demand plugins it depends on), a loaded plugin is returned directly
+    # A plugin that fails to activate is no longer activated on demand and its routes are removed
+    async def activatePlugin(self, name):
+        plugin = self.__find(name)
+        if plugin is not None:
+            return plugin
+        for dependency in PluginConfig.getConfigOrDefault('%s.dependencies' % name, []):
+            if dependency in self.lazy and await self.activatePlugin(dependency) is None:
+                break
+        async with self.__reloading:
+            plugin = self.__find(name)
+            if plugin is None:
+                plugin = await self.__replace(name, False)
+                if plugin is None:
+                    self.lazy.discard(name)
+                    self.__updateRouter(name)
+        return plugin
+
+    # 卸载插件的旧版本（如果有），然后加载新版本，reread为true时先重新读取plugin.json
+    # Unload the old version of a plugin (if any) and load the new version, plugin.json is read again first when reread is true
+    async def __replace(self, name, reread):
+        gate = self.__gate(name)
+        gate.open.clear()
+        try:
+            old = self.__find(name)
+            # 重新加载的插件保持原来的位置，关闭时teardown的顺序仍然与依赖关系一致
+            # A reloaded plugin keeps its position, so the teardown order on shutdown still follows the dependencies
+            position = len(self.plugins)
+            if old is not None:
+                position = self.plugins.index(old)
+                await self.__unload(old, gate)
+            # 新版本的插件不能使用旧版本缓存的结果
+            # The new version of the plugin must not use results cached by the old version
+            ResultCache.invalidate(name)
+            Matcher.invalidate(name)
+            if reread:
+                await self.runBlocking(PluginConfig.reload, [name])
+            if name not in PluginConfig.names():
+                self.logger.warn('[Plugin \'%s\' is not loaded] The plugin configuration file plugin.json is not found.', name)
+                self.__updateRouter(name)
+                return None
+            loader = PluginLoader(workers=1)
+            loaded = await self.runBlocking(loader.load, [name], [plugin.name for plugin in self.plugins], True)
+            if loaded:
+                plugin = loaded[0]
+                self.plugins.insert(position, plugin)
+                self.__loaded[name] = plugin
+            # 路由器要在新插件加入之后更新，这样新增的插件的路由也会被加入
+            # The router is updated after the new plugin joins, so the routes of an added plugin are included too
+            self.__updateRouter(name)
+            if not loaded:
+                return None
+            for server in plugin.servers:
+                server.runtime = self
+            await self.__activate([plugin])
+            for server in plugin.servers:
+                task = self.loop.create_task(self.__serve(plugin, server))
+                self.tasks[task] = (plugin, server)
+            gate.lastUsed = time.monotonic()
+            self.logger.info('Plugin \'%s\' %s', name, 'reloaded' if old is not None else ('activated' if name in self.lazy else 'added'))
+            return plugin
+        finally:
+            gate.open.set()
+            self.__changed.set()
+
+    # 卸载一个插件，其它插件继续运行
+    # Unload one plugin, the other plugins keep running
+    async def unloadPlugin(self, name):
+        async with self.__reloading:
+            plugin = self.__find(name)
+            if plugin is None:
+                return False
+            gate = self.__gate(name)
+            gate.open.clear()
+            try:
+                await self.__unload(plugin, gate)
+                self.__updateRouter(name)
+                # 释放插件模块占用的内存，按需激活的插件下次会重新导入
+                # Release the memory held by the plugin modules, plugins activated on demand are imported again next time
+                PluginLoader.unimport(name)
+                ResultCache.invalidate(name)
+                Matcher.invalidate(name)
+            finally:
+                gate.open.set()
+                self.__changed.set()
+            self.logger.info('Plugin \'%s\' unloaded', name)
+            return True
+
+    def __find(self, name):
+        return self.__loaded.get(name)
+
+    # 等待插件正在处理的消息（最多shutdownTimeout秒），然后停止它的Server并调用teardown()
+    # Wait for the messages the plugin is handling (at most shutdownTimeout seconds), then stop its Servers and call teardown()
+    async def __unload(self, plugin, gate):
+        try:
+            await asyncio.wait_for(gate.idle.wait(), self.shutdownTimeout)
+        except asyncio.TimeoutError:
+            self.logger.warn('[Plugin \'%s\'] %d messages were still being handled after %.1f seconds', plugin.name, gate.inflight, self.shutdownTimeout)
+        await self.__stopServers([task for task, (owner, server) in self.tasks.items() if owner is plugin])
+        for task in [task for task, (owner, server) in self.tasks.items() if owner is plugin]:
+            del self.tasks[task]
+        await self.__teardown(plugin)
+        # 旧模块中的订阅者不能再收到消息
+        # Subscribers in the old module must not receive payloads any more
+        self.bus.forget(plugin.name)
+        self.plugins.remove(plugin)
+        self.__loaded.pop(plugin.name, None)
+
+    # 插件的路由发生变化（新增、移除，或者重新读取的plugin.json中的"handlers"不同）时，用当前的插件重新构建路由器并整体替换；
+    # 否则路由保持不变，只丢弃插件已经解析的处理函数，之后的调用解析到新模块中的函数，例如按需激活和卸载插件时
+    # When the routes of a plugin change (it is added or removed, or "handlers" differs in the plugin.json read again),
+    # rebuild the router from the current plugins and replace it as a whole; otherwise the routes stay as they are and only the resolved
+    # handlers of the plugin are dropped, so later calls resolve the functions in the new module, e.g. when plugins are activated on demand or unloaded
+    def __updateRouter(self, name):
+        old = self.router
+        old.forget(name)
+        names = [plugin.name for plugin in self.plugins]
+        names = [name for name in names + sorted(self.lazy - set(names)) if PluginConfig.findConfig(name) is not None]
+        routed = self.__handlers(names)
+        if (name in routed, routed.get(name)) == (name in self.__routed, self.__routed.get(name)):
+            return
+        self.__routed = routed
+        self.router = Router.fromPlugins(names,
+            commandPrefixes=old.commandPrefixes, ignoreCase=old.ignoreCase, resolver=old.resolver, executor=old.executor)
+
+    @staticmethod
+    def __handlers(names):
+        return dict((name, PluginConfig.findConfig('%s.handlers' % name)) for name in names)
+
+    # 定期卸载空闲超过idleTimeout秒的按需激活的插件，plugin.json中的"idleTimeout"可以覆盖全局配置，0表示不卸载
+    # 还被其它已加载的插件依赖的插件不会被卸载
+    # Periodically unload on-demand plugins that have been idle for more than idleTimeout seconds,
+    # "idleTimeout" in plugin.json overrides the global setting, 0 means never unloading
+    # Plugins that loaded plugins still depend on are not unloaded
+    async def __unloadIdle(self):
+        while True:
+            await asyncio.sleep(self.idleInterval)
+            now = time.monotonic()
+            required = set()
+            for plugin in self.plugins:
+                required.update(plugin.dependencies)
+            unloaded = 0
+            for plugin in list(self.plugins):
+                name = plugin.name
+                if name not in self.lazy or name in required:
+                    continue
+                timeout = PluginConfig.getTypedConfig('%s.idleTimeout' % name, float, self.idleTimeout)
+                gate = self.__gate(name)
+                if timeout > 0 and not gate.inflight and now - gate.lastUsed > timeout:
+                    self.logger.info('Plugin \'%s\' has been idle for %.1f seconds', name, now - gate.lastUsed)
+                    if await self.unloadPlugin(name):
+                        unloaded += 1
+            if unloaded:
+                gc.collect()
+
+    # 调用插件模块的teardown()（如果有），它可以是普通函数或者协程函数
+    # Call teardown() of the plugin module (if any), it may be a plain function or a coroutine function
+    async def __teardown(self, plugin):
+        teardown = getattr(plugin.module, 'teardown', None)
+        if teardown is None:
+            return
+        try:
+            if asyncio.iscoroutinefunction(teardown):
+                await asyncio.wait_for(teardown(), self.shutdownTimeout)
+            else:
+                await asyncio.wait_for(self.runBlocking(teardown), self.shutdownTimeout)
+        except Exception as e:
+            self.logger.error('[Plugin \'%s\'] teardown failed: %s', plugin.name, e, exc_info=e)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='LatteServer')
+        self.__stopping = asyncio.Event()
+        self.__reloading = asyncio.Lock()
+        self.__changed = asyncio.Event()
+        self.__installSignalHandlers()
+        self.__registerGauges()
+        Metrics.start()
+        self.sessions.start()
+        self.router.executor = self.executor
+        self.scheduler.start(self.loop, self.executor)
+        self.bus.start(self.loop, self.executor)
+        self.pool.start(self.loop)
+        # 配置文件的热加载
+        # Hot reloading of configuration files
+        watcher = ConfigWatcher() if LatteConfig.getTypedConfig('watch.enable', bool) else None
+        sweeper = None
+        if watcher is not None:
+            watcher.start()
+        try:
+            await self.__activate(self.plugins)
+            for plugin in self.plugins:
+                for server in plugin.servers:
+                    task = self.loop.create_task(self.__serve(plugin, server))
+                    self.tasks[task] = (plugin, server)
+            if self.lazy:
+                sweeper = self.loop.create_task(self.__unloadIdle())
+            # 等待所有Server结束，或者收到停止信号
+            # 重新加载插件时serving任务会改变，所以每次唤醒后重新检查
+            # Wait until all Servers finish, or a stop signal is received
+            # Serving tasks change when plugins are reloaded, so they are checked again after every wakeup
+            stopping = self.loop.create_task(self.__stopping.wait())
+            while not stopping.done():
+                running = [task for task in self.tasks if not task.done()]
+                if not running and not self.__reloading.locked():
+                    break
+                self.__changed.clear()
+                changed = self.loop.create_task(self.__changed.wait())
+                await asyncio.wait(running + [stopping, changed], return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+            stopping.cancel()
+            if sweeper is not None:
+                sweeper.cancel()
+            await self.__shutdown()
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            Metrics.stop()
+            self.scheduler.stop()
+            self.bus.stop()
+            self.pool.stop()
+            self.sessions.stop()
+            self.__removeSignalHandlers()
+            # 阻塞的serving运行在守护线程中，无法及时退出时不会阻止进程退出；线程池中排队的任务被取消
+            # Blocking servings run on daemon threads, so the ones that cannot exit in time do not keep the process from exiting;
+            # tasks queued in the thread pool are cancelled
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # 执行协程形式的activation（普通函数的activation已经由插件加载器执行过了）
+    # Run coroutine activations (activations that are plain functions were already run by the plugin loader)
+    async def __activate(self, plugins):
+        activations = []
+        for plugin in plugins:
+            for server in plugin.servers:
+                if asyncio.iscoroutinefunction(server.activation):
+                    activations.append((plugin, server))
+        results = await asyncio.gather(*[self.__timed(plugin, 'activation', server.activation()) for plugin, server in activations], return_exceptions=True)
+        for (plugin, server), result in zip(activations, results):
+            if isinstance(result, BaseException):
+                # 激活失败的Server不会被运行
+                # A Server that failed to activate is not run
+                self.logger.error('[Plugin \'%s\'] Server %r failed to activate: %s', plugin.name, server, result, exc_info=result)
+                plugin.servers.remove(server)
+
+    async def __timed(self, plugin, name, coroutine):
+        with Metrics.timed(plugin.name, name):
+            return await coroutine
+
+    # 运行一个Server的serving，协程直接在事件循环中运行，普通函数在守护线程中运行
+    # serving的运行时间记录为serving，正常结束和出错分别计入serving.completed和serving.errors
+    # Run the serving of one Server, coroutines run directly on the event loop, plain functions run on a daemon thread
+    # The running time of serving is recorded as serving, normal completion and errors count towards serving.completed and serving.errors
+    async def __serve(self, plugin, server):
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(server.serving):
+                await server.serving()
+            else:
+                await self.__runDaemon(server.serving, 'LatteServing-%s' % plugin.name)
+            Metrics.incr(plugin.name, 'serving.completed')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 一个Server出错不会影响其它Server
+            # A failing Server does not affect the other Servers
+            Metrics.incr(plugin.name, 'serving.errors')
+            self.logger.error('[Plugin \'%s\'] Server %r stopped with an error: %s', plugin.name, server, e, exc_info=e)
+        finally:
+            Metrics.observe(plugin.name, 'serving', time.perf_counter() - start)
+
+    # 在守护线程中运行阻塞的函数，返回事件循环中的future；取消future不会停止线程
+    # Run a blocking function on a daemon thread and return a future on the event loop; cancelling the future does not stop the thread
+    def __runDaemon(self, fn, name):
+        loop = self.loop
+        future = loop.create_future()
+
+        def settle(result, error):
+            if not future.done():
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+        def run():
+            try:
+                result, error = fn(), None
+            except BaseException as e:
+                result, error = None, e
+            try:
+                loop.call_soon_threadsafe(settle, result, error)
+            except RuntimeError:
+                # 事件循环已经关闭
+                # The event loop is already closed
+                pass
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return future
+
+    # 优雅地关闭：停止所有Server，然后按加载顺序的逆序调用插件的teardown()
+    # Graceful shutdown: stop all Servers, then call teardown() of the plugins in reverse loading order
+    async def __shutdown(self):
+        running = [task for task in self.tasks if not task.done()]
+        if running:
+            self.logger.info('Shutting down %d servers', len(running))
+            await self.__stopServers(running)
+        for plugin in reversed(self.plugins):
+            await self.__teardown(plugin)
+
+    # 停止一组serving任务：先调用它们的Server的shutdown，然后取消协程形式的serving（它们可以在CancelledError中清理），
+    # 阻塞的serving最多等待shutdownTimeout秒
+    # Stop a group of serving tasks: call shutdown of their Servers first, then cancel the coroutine servings (they can clean up on CancelledError),
+    # blocking servings are waited for at most shutdownTimeout seconds
+    async def __stopServers(self, tasks):
+        running = [task for task in tasks if not task.done()]
+        if not running:
+            return
+        shutdowns = []
+        for task in running:
+            server = self.tasks[task][1]
+            try:
+                if asyncio.iscoroutinefunction(server.shutdown):
+                    shutdowns.append(server.shutdown())
+                else:
+                    # shutdown只应该通知serving返回，所以直接在事件循环中调用
+                    # shutdown should only tell serving to return, so it is called on the event loop directly
+                    server.shutdown()
+            except Exception as e:
+                self.logger.error('[Plugin \'%s\'] Server %r failed to shut down: %s', self.tasks[task][0].name, server, e)
+            if asyncio.iscoroutinefunction(server.serving):
+                task.cancel()
+        if shutdowns:
+            await asyncio.wait([self.loop.create_task(shutdown) for shutdown in shutdowns], timeout=self.shutdownTimeout)
+        done, running = await asyncio.wait(running, timeout=self.shutdownTimeout)
+        if running:
+            self.logger.warn('%d servers did not stop within %.1f seconds', len(running), self.shutdownTimeout)
+
+    # 注册运行时的瞬时指标：线程池中排队的任务数，运行中的Server数，日志队列的深度，结果缓存的统计，会话数，定时器数，事件总线的订阅和主题树的节点数，准入控制的槽位和队列，隔离运行的插件，连接池的使用率
+    # Register the instantaneous metrics of the runtime: tasks queued in the thread pool, running Servers, depth of the logging queue, result cache statistics, number of sessions, number of timers, event bus subscriptions and trie nodes, admission slots and queues, sandboxed plugins, connection pool utilization
+    def __registerGauges(self):
+        Metrics.gauge('runtime.executor.queue', lambda: self.executor._work_queue.qsize())
+        Metrics.gauge('runtime.servers', lambda: sum(1 for task in list(self.tasks) if not task.done()))
+        Metrics.gauge('runtime.loop.tasks', lambda: len(asyncio.all_tasks(self.loop)))
+        Metrics.gauge('logger.queue', queueStats)
+        Metrics.gauge('cache', ResultCache.statsAll)
+        Metrics.gauge('sessions', lambda: len(self.sessions))
+        Metrics.gauge('scheduler.timers', lambda: len(self.scheduler))
+        Metrics.gauge('bus', self.bus.stats)
+        Metrics.gauge('bus.nodes', self.bus.nodes)
+        Metrics.gauge('admission', self.admission.stats)
+        Metrics.gauge('sandbox', Sandbox.statsAll)
+        Metrics.gauge('pool', self.pool.stats)
+
+    def __installSignalHandlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.__stopping.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # 不在主线程中，或者平台不支持
+                # Not on the main thread, or not supported by the platform
+                pass
+
+    def __removeSignalHandlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.remove_signal_handler(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
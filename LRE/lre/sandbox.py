@@ -0,0 +1,652 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys
+import time
+import types
+import pickle
+import signal
+import socket
+import struct
+import asyncio
+import inspect
+import itertools
+import threading
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+from .base import bootstrap, LatteConfig, PluginConfig, Logger
+from .error import SandboxException
+from .metrics import Metrics
+from .router import Router, Match
+from .stream import isStream, collect
+
+# 帧头：负载长度，请求编号，类型
+# Frame header: payload length, request id, kind
+_HEADER = struct.Struct('<IIB')
+_COUNTER = struct.Struct('<Q')
+_MARKER = struct.Struct('<I')
+# 环形缓冲区末尾放不下一帧时写入的回绕标记
+# Wrap marker written when a frame does not fit at the end of the ring buffer
+_WRAP = 0xFFFFFFFF
+# 环形缓冲区的头部：写入位置和读取位置各占一个缓存行
+# Header of a ring buffer: the write and read positions take one cache line each
+_RING_HEADER = 128
+
+# 帧的类型，_MORE表示负载还有后续的分片
+# Kinds of frames, _MORE means more fragments of the payload follow
+_CALL = 1
+_RESULT = 2
+_ERROR = 3
+_READY = 4
+_STOP = 5
+_MORE = 0x80
+
+# 处理函数上需要传给核心进程的属性（@memoize和@batched）
+# Attributes of handlers that are passed to the core process (@memoize and @batched)
+_ATTRIBUTES = ('latteCache', 'latteBatch')
+
+
+# 共享内存中的单生产者单消费者环形缓冲区
+# 写入位置和读取位置都是单调递增的字节数，生产者只写写入位置，消费者只写读取位置，所以不需要锁。
+# 每一帧在缓冲区中是连续的，末尾放不下时写入回绕标记并从头开始。
+# A single-producer single-consumer ring buffer in shared memory
+# The write and read positions are monotonically increasing byte counts, the producer only writes the write position
+# and the consumer only writes the read position, so no lock is needed.
+# Every frame is contiguous in the buffer, a wrap marker is written and writing starts over when the end cannot hold it.
+class Ring(object):
+    __slots__ = ('buf', 'head', 'tail', 'data', 'capacity')
+
+    def __init__(self, buf, offset, capacity):
+        self.buf = buf
+        self.head = offset
+        self.tail = offset + _RING_HEADER // 2
+        self.data = offset + _RING_HEADER
+        self.capacity = capacity
+
+    # 容量为capacity的环形缓冲区占用的字节数
+    # Bytes taken by a ring buffer of the given capacity
+    @staticmethod
+    def size(capacity):
+        return _RING_HEADER + capacity
+
+    # 写入一帧，空间不足时返回False
+    # Write one frame, returns False when there is not enough room
+    def put(self, ident, kind, payload):
+        buf = self.buf
+        capacity = self.capacity
+        head = _COUNTER.unpack_from(buf, self.head)[0]
+        tail = _COUNTER.unpack_from(buf, self.tail)[0]
+        size = _HEADER.size + len(payload)
+        position = head % capacity
+        room = capacity - position
+        padding = room if room < size else 0
+        if head + padding + size - tail > capacity:
+            return False
+        if padding:
+            if room >= _MARKER.size:
+                _MARKER.pack_into(buf, self.data + position, _WRAP)
+            head += padding
+            position = 0
+        start = self.data + position
+        _HEADER.pack_into(buf, start, len(payload), ident, kind)
+        buf[start + _HEADER.size:start + size] = payload
+        _COUNTER.pack_into(buf, self.head, head + size)
+        return True
+
+    # 读取一帧(编号, 类型, 负载)，没有数据时返回None
+    # Read one frame (id, kind, payload), returns None when there is no data
+    def get(self):
+        buf = self.buf
+        capacity = self.capacity
+        head = _COUNTER.unpack_from(buf, self.head)[0]
+        tail = _COUNTER.unpack_from(buf, self.tail)[0]
+        while tail != head:
+            position = tail % capacity
+            room = capacity - position
+            if room < _HEADER.size or _MARKER.unpack_from(buf, self.data + position)[0] == _WRAP:
+                tail += room
+                continue
+            length, ident, kind = _HEADER.unpack_from(buf, self.data + position)
+            start = self.data + position + _HEADER.size
+            payload = bytes(buf[start:start + length])
+            _COUNTER.pack_into(buf, self.tail, tail + _HEADER.size + length)
+            return ident, kind, payload
+        _COUNTER.pack_into(buf, self.tail, tail)
+        return None
+
+
+# 把负载切分为不超过缓冲区四分之一的分片，除最后一片外都带有_MORE标记
+# Split a payload into fragments of at most a quarter of the buffer, all but the last one carry the _MORE flag
+def _fragments(kind, payload, capacity):
+    chunk = max(1, capacity // 4 - _HEADER.size)
+    if len(payload) <= chunk:
+        yield kind, payload
+        return
+    view = memoryview(payload)
+    for offset in range(0, len(view), chunk):
+        last = offset + chunk >= len(view)
+        yield kind if last else kind | _MORE, view[offset:offset + chunk]
+
+
+# 拼接分片，完整的帧返回(编号, 类型, 负载)，否则返回None
+# Join fragments, returns (id, kind, payload) for a complete frame, None otherwise
+def _assemble(parts, frame):
+    ident, kind, payload = frame
+    if kind & _MORE:
+        parts.setdefault(ident, []).append(payload)
+        return None
+    if ident in parts:
+        parts[ident].append(payload)
+        payload = b''.join(parts.pop(ident))
+    return ident, kind, payload
+
+
+# 通知对端有新的帧，对端还没有读取之前的通知时可以忽略
+# Tell the peer that there are new frames, it can be skipped while the peer has not read the previous notification yet
+def _ring(sock):
+    try:
+        sock.send(b'\0')
+    except (BlockingIOError, InterruptedError):
+        pass
+
+
+# 匹配结果中可以跨进程传递的部分，正则的匹配对象在子进程中重新生成
+# The part of a match that can cross processes, the regex match object is rebuilt in the child
+def _encodeMatch(match):
+    regex = match.regex
+    return (match.kind, match.value, match.start, match.end, None if regex is None else regex.string)
+
+
+def _decodeMatch(routes, handler, state):
+    kind, value, start, end, text = state
+    candidates = routes[handler]
+    route = candidates[0]
+    regex = None
+    if text is not None:
+        for candidate in candidates:
+            for compiled in candidate.regexes:
+                if compiled.pattern == value:
+                    route = candidate
+                    # 从匹配的起点重新匹配，不截断文本，这样前瞻等断言与核心进程中的结果一致
+                    # Match again from the start of the match without truncating the text, so lookaheads and other assertions agree with the core process
+                    found = compiled.match(text, start)
+                    if found is not None and found.end() == end:
+                        regex = found
+                    break
+            if regex is not None:
+                break
+    return Match(route, kind, value, start, end, regex)
+
+
+# 进程的常驻内存（字节），无法读取时返回None
+# Resident memory of a process (bytes), None when it cannot be read
+def _residentMemory(pid):
+    try:
+        with open('/proc/%d/statm' % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# 已经退出的子进程的退出码
+# 通知套接字关闭时子进程可能还没有被回收，exitcode在join之前为None，所以先短暂地等待它
+# Exit code of a child process that has exited
+# The child may not have been reaped yet when the notification socket closes, exitcode is None before a join, so wait for it briefly first
+def _exitCode(process):
+    process.join(0.1)
+    return process.exitcode
+
+
+# 隔离运行的插件的子进程入口
+# 导入插件并调用init()，然后在自己的事件循环中处理核心进程通过共享内存发来的调用。
+# 同步的处理函数在子进程的事件循环中直接执行，流式回复被完整读取后作为一个结果返回。
+# 核心进程退出后（通知套接字被关闭）子进程随之退出。
+# Entry of the child process of a sandboxed plugin
+# Imports the plugin and calls init(), then handles the calls the core process sends through shared memory on its own event loop.
+# Synchronous handlers run directly on the child's event loop, streaming replies are read completely and returned as one result.
+# The child exits when the core process has gone (the notification socket is closed).
+def _child(name, memoryName, capacity, sock):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    memory = shared_memory.SharedMemory(memoryName)
+    requests = Ring(memory.buf, 0, capacity)
+    replies = Ring(memory.buf, Ring.size(capacity), capacity)
+
+    def send(ident, kind, payload):
+        for kind, fragment in _fragments(kind, payload, capacity):
+            while not replies.put(ident, kind, fragment):
+                # 核心进程还没有读取之前的回复
+                # The core process has not read the previous replies yet
+                _ring(sock)
+                time.sleep(0.0005)
+        _ring(sock)
+
+    try:
+        from .loader import Plugin, PluginLoader
+        from .matcher import Matcher
+        bootstrap()
+        plugin = Plugin(name, PluginConfig.getConfig(name))
+        module = PluginLoader(workers=1).importPlugin(plugin)
+        for matcher in plugin.config.get('matchers') or ():
+            Matcher.forPlugin(name, matcher)
+        if hasattr(module, 'init'):
+            module.init()
+        router = Router.fromPlugins([name])
+        routes = collections.defaultdict(list)
+        attributes = {}
+        for route in router.routes:
+            routes[route.handler].append(route)
+            fn = router.handlerOf(route)
+            attributes[route.handler] = dict((key, getattr(fn, key)) for key in _ATTRIBUTES if hasattr(fn, key))
+    except BaseException as e:
+        send(0, _ERROR, pickle.dumps('%s: %s' % (type(e).__name__, e), pickle.HIGHEST_PROTOCOL))
+        return
+    send(0, _READY, pickle.dumps(attributes, pickle.HIGHEST_PROTOCOL))
+    try:
+        asyncio.run(_childLoop(router, routes, module, requests, send, sock))
+    finally:
+        del requests, replies
+        try:
+            memory.close()
+        except BufferError:
+            pass
+
+
+async def _childLoop(router, routes, module, requests, send, sock):
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    sock.setblocking(False)
+    loop.add_reader(sock.fileno(), wake.set)
+    parts = {}
+    tasks = set()
+
+    async def handle(ident, payload):
+        try:
+            handler, message, match, batch = pickle.loads(payload)
+            fn = router.handlerOf(routes[handler][0])
+            if batch:
+                result = fn(message, [_decodeMatch(routes, handler, state) for state in match])
+            else:
+                result = fn(message, _decodeMatch(routes, handler, match))
+            if inspect.isawaitable(result):
+                result = await result
+            if isStream(result):
+                result = await collect(result)
+            kind, payload = _RESULT, pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            # 完整的调用栈记录在子进程的日志中，核心进程只得到异常的类型和内容
+            # The full traceback is logged by the child, the core process only gets the type and text of the exception
+            Logger.bind('Latte.sandbox').error('[Plugin \'%s\'] Handler failed in the sandbox: %s', router.routes[0].plugin, e, exc_info=e)
+            kind, payload = _ERROR, pickle.dumps('%s: %s' % (type(e).__name__, e), pickle.HIGHEST_PROTOCOL)
+        send(ident, kind, payload)
+
+    while True:
+        await wake.wait()
+        wake.clear()
+        try:
+            if not sock.recv(4096):
+                return
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            return
+        while True:
+            frame = requests.get()
+            if frame is None:
+                break
+            frame = _assemble(parts, frame)
+            if frame is None:
+                continue
+            ident, kind, payload = frame
+            if kind == _CALL:
+                task = loop.create_task(handle(ident, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif kind == _STOP:
+                if tasks:
+                    await asyncio.wait(list(tasks))
+                teardown = getattr(module, 'teardown', None)
+                try:
+                    if teardown is not None:
+                        result = teardown()
+                        if inspect.isawaitable(result):
+                            await result
+                finally:
+                    send(ident, _STOP, b'')
+                return
+
+
+# 一个正在运行的子进程，以及它的共享内存和通知套接字
+# A running child process, with its shared memory and notification socket
+class _Child(object):
+    def __init__(self, process, memory, sock, capacity):
+        self.process = process
+        self.memory = memory
+        self.sock = sock
+        self.requests = Ring(memory.buf, 0, capacity)
+        self.replies = Ring(memory.buf, Ring.size(capacity), capacity)
+        self.parts = {}
+
+    def close(self):
+        if self.process.pid is not None:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join(1)
+        self.sock.close()
+        self.requests = self.replies = None
+        try:
+            self.memory.close()
+            self.memory.unlink()
+        except (OSError, BufferError):
+            pass
+
+
+# 隔离运行的插件
+# plugin.json中声明了"sandbox"的插件在子进程中运行，核心进程与它通过共享内存中的两个环形缓冲区交换消息：
+# 帧由紧凑的二进制帧头（长度，编号，类型）和pickle编码的负载组成，每批帧之后通过socketpair发送一个字节唤醒对端。
+# 看门狗在子进程退出、处理函数超时或者常驻内存超过限制时重启子进程，
+# 在restartWindow秒内重启超过maxRestarts次后不再重启，之后的调用直接失败。
+# 隔离运行的插件不提供Server；处理函数的返回值必须能被pickle，并且不能依赖插件模块中定义的类。
+# A sandboxed plugin
+# Plugins declaring "sandbox" in plugin.json run in a child process, the core process exchanges messages with it
+# through two ring buffers in shared memory: frames consist of a compact binary header (length, id, kind) and a pickled payload,
+# and one byte is sent over a socketpair after every batch of frames to wake up the peer.
+# A watchdog restarts the child when it exits, a handler times out or its resident memory exceeds the limit,
+# after more than maxRestarts restarts within restartWindow seconds it is not restarted any more and later calls fail directly.
+# Sandboxed plugins provide no Servers; return values of handlers must be picklable and must not depend on classes defined in the plugin module.
+class Sandbox(object):
+    _INSTANCES = {}
+    # 这是一个线程锁，修改实例列表时会使用它
+    # This is a thread lock, it is used when modifying the list of instances
+    _INSTANCE_LOCK = threading.Lock()
+
+    # 插件是否声明了隔离运行
+    # Whether a plugin declares to run sandboxed
+    @staticmethod
+    def enabled(config):
+        return bool(config.get('sandbox'))
+
+    # 启动插件的子进程，并返回代替插件模块放入sys.modules的代理模块
+    # Start the child process of a plugin and return the proxy module put into sys.modules in place of the plugin module
+    @classmethod
+    def load(cls, name):
+        sandbox = Sandbox(name)
+        sandbox.start()
+        module = SandboxModule(sandbox)
+        sys.modules[module.__name__] = module
+        return module
+
+    # 所有隔离运行的插件的统计信息
+    # Statistics of all sandboxed plugins
+    @classmethod
+    def statsAll(cls):
+        return dict((name, sandbox.stats()) for name, sandbox in list(cls._INSTANCES.items()))
+
+    def __init__(self, name):
+        self.name = name
+        # plugin.json中的"sandbox"为字典时覆盖latte.json中的sandbox
+        # "sandbox" in plugin.json overrides sandbox in latte.json when it is a dict
+        overrides = PluginConfig.findConfig('%s.sandbox' % name)
+        if not isinstance(overrides, dict):
+            overrides = {}
+
+        def option(key, t):
+            value = overrides.get(key)
+            return LatteConfig.getTypedConfig('sandbox.%s' % key, t) if value is None else t(value)
+        self.ringSize = max(4096, option('ringSize', int))
+        self.timeout = option('timeout', float)
+        self.startTimeout = option('startTimeout', float)
+        self.memory = option('memory', float) * 1024 * 1024
+        self.interval = max(0.01, option('interval', float))
+        self.maxRestarts = option('maxRestarts', int)
+        self.restartWindow = option('restartWindow', float)
+        self.logger = Logger.bind('Latte.sandbox')
+        self.loop = None
+        self.attributes = {}
+        self.restarts = 0
+        self.__child = None
+        self.__pending = {}
+        # 调用的编号从1开始，0留给启动和停止
+        # Call ids start at 1, 0 is kept for starting and stopping
+        self.__ids = itertools.count()
+        self.__restarting = None
+        self.__restartTimes = collections.deque()
+        self.__watchdog = None
+        self.__stopped = False
+
+    # 启动子进程并等待插件的init()完成，失败时抛出SandboxException；会阻塞
+    # Start the child process and wait for init() of the plugin to finish, raises SandboxException on failure; it blocks
+    def start(self):
+        child, self.attributes = self.__spawn()
+        self.__child = child
+        with self._INSTANCE_LOCK:
+            self._INSTANCES[self.name] = self
+
+    def __spawn(self):
+        capacity = self.ringSize
+        memory = shared_memory.SharedMemory(create=True, size=2 * Ring.size(capacity))
+        ours, theirs = socket.socketpair()
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(target=_child, args=(self.name, memory.name, capacity, theirs),
+                                  name='LatteSandbox-%s' % self.name, daemon=True)
+        child = _Child(process, memory, ours, capacity)
+        try:
+            process.start()
+            theirs.close()
+            deadline = time.monotonic() + self.startTimeout
+            while True:
+                frame = child.replies.get()
+                if frame is not None:
+                    frame = _assemble(child.parts, frame)
+                    if frame is None:
+                        continue
+                    _, kind, payload = frame
+                    if kind == _READY:
+                        break
+                    raise SandboxException(self.name, 'init() failed in the sandbox: %s' % pickle.loads(payload))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SandboxException(self.name, 'the sandbox did not start within %.1f seconds' % self.startTimeout)
+                ours.settimeout(remaining)
+                try:
+                    if not ours.recv(4096):
+                        raise SandboxException(self.name, 'the sandbox process exited with code %s' % _exitCode(process))
+                except socket.timeout:
+                    pass
+        except BaseException:
+            child.close()
+            raise
+        ours.setblocking(False)
+        self.logger.info('[Plugin \'%s\'] Sandbox started (pid %d)', self.name, process.pid)
+        return child, pickle.loads(payload)
+
+    # 在事件循环中开始读取回复并运行看门狗，第一次调用时执行
+    # Start reading replies and running the watchdog on the event loop, done on the first call
+    def __attach(self):
+        self.loop = asyncio.get_running_loop()
+        if self.__child is not None:
+            self.loop.add_reader(self.__child.sock.fileno(), self.__readable, self.__child)
+        self.__watchdog = self.loop.create_task(self.__watch())
+
+    # 调用子进程中的处理函数，match为列表时以批处理函数的形式调用
+    # Call a handler in the child process, it is called as a batch handler when match is a list
+    async def call(self, handler, message, match):
+        if self.loop is None:
+            self.__attach()
+        if self.__restarting is not None:
+            await asyncio.shield(self.__restarting)
+        child = self.__child
+        if child is None:
+            raise SandboxException(self.name, 'the sandbox is not running')
+        batch = isinstance(match, list)
+        state = [_encodeMatch(item) for item in match] if batch else _encodeMatch(match)
+        payload = pickle.dumps((handler, message, state, batch), pickle.HIGHEST_PROTOCOL)
+        ident = next(self.__ids) % 0xFFFFFFFF + 1
+        future = self.loop.create_future()
+        self.__pending[ident] = future
+        Metrics.incr(self.name, 'sandbox.calls')
+        start = time.perf_counter()
+        try:
+            for kind, fragment in _fragments(_CALL, payload, child.requests.capacity):
+                while not child.requests.put(ident, kind, fragment):
+                    # 子进程还没有读取之前的调用
+                    # The child has not read the previous calls yet
+                    _ring(child.sock)
+                    await asyncio.sleep(0.0005)
+                    if child is not self.__child:
+                        raise SandboxException(self.name, 'the sandbox was restarted')
+            _ring(child.sock)
+            try:
+                kind, payload = await asyncio.wait_for(future, self.timeout if self.timeout > 0 else None)
+            except asyncio.TimeoutError:
+                # 阻塞的处理函数会让子进程无法处理其它消息，只能重启
+                # A blocking handler keeps the child from handling other messages, it can only be restarted
+                self.__restart('handler \'%s\' did not reply within %.1f seconds' % (handler, self.timeout))
+                raise SandboxException(self.name, 'handler \'%s\' timed out' % handler)
+            if kind == _ERROR:
+                raise SandboxException(self.name, 'handler \'%s\' raised %s' % (handler, pickle.loads(payload)))
+            try:
+                return pickle.loads(payload)
+            except Exception as e:
+                raise SandboxException(self.name, 'the result of handler \'%s\' cannot be read: %s' % (handler, e))
+        except Exception:
+            Metrics.incr(self.name, 'sandbox.errors')
+            raise
+        finally:
+            self.__pending.pop(ident, None)
+            Metrics.observe(self.name, 'sandbox.call', time.perf_counter() - start)
+
+    # 通知套接字可读：读取子进程的全部回复，套接字关闭表示子进程已经退出
+    # The notification socket is readable: read all replies of the child, a closed socket means the child has exited
+    def __readable(self, child):
+        try:
+            alive = bool(child.sock.recv(4096))
+        except (BlockingIOError, InterruptedError):
+            alive = True
+        except OSError:
+            alive = False
+        while child.replies is not None:
+            frame = child.replies.get()
+            if frame is None:
+                break
+            frame = _assemble(child.parts, frame)
+            if frame is None:
+                continue
+            ident, kind, payload = frame
+            future = self.__pending.get(ident)
+            if future is not None and not future.done():
+                future.set_result((kind, payload))
+        if not alive:
+            self.loop.remove_reader(child.sock.fileno())
+            if child is self.__child and not self.__stopped:
+                self.__restart('the sandbox process exited with code %s' % _exitCode(child.process))
+
+    # 看门狗：检查子进程是否还在运行，以及常驻内存是否超过限制
+    # Watchdog: check whether the child is still running, and whether its resident memory exceeds the limit
+    async def __watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            child = self.__child
+            if child is None or self.__restarting is not None:
+                continue
+            if not child.process.is_alive():
+                self.__restart('the sandbox process exited with code %s' % _exitCode(child.process))
+            elif self.memory > 0:
+                resident = _residentMemory(child.process.pid)
+                if resident is not None and resident > self.memory:
+                    self.__restart('resident memory %.1f MB exceeds the limit of %.1f MB' % (resident / 1048576.0, self.memory / 1048576.0))
+
+    def __restart(self, reason):
+        if self.__restarting is None and not self.__stopped:
+            self.__restarting = self.loop.create_task(self.__restartChild(reason))
+
+    async def __restartChild(self, reason):
+        try:
+            self.logger.warn('[Plugin \'%s\'] Restarting the sandbox: %s', self.name, reason)
+            self.__discard(reason)
+            now = time.monotonic()
+            while self.__restartTimes and now - self.__restartTimes[0] > self.restartWindow:
+                self.__restartTimes.popleft()
+            if len(self.__restartTimes) >= self.maxRestarts:
+                self.logger.error('[Plugin \'%s\'] The sandbox restarted %d times within %.0f seconds, giving up',
+                                  self.name, len(self.__restartTimes), self.restartWindow)
+                return
+            self.__restartTimes.append(now)
+            self.restarts += 1
+            Metrics.incr(self.name, 'sandbox.restarts')
+            try:
+                child, self.attributes = await self.loop.run_in_executor(None, self.__spawn)
+            except Exception as e:
+                self.logger.error('[Plugin \'%s\'] The sandbox failed to restart: %s', self.name, e)
+                return
+            if self.__stopped:
+                child.close()
+                return
+            self.__child = child
+            self.loop.add_reader(child.sock.fileno(), self.__readable, child)
+        finally:
+            self.__restarting = None
+
+    # 结束当前的子进程，等待中的调用全部以reason失败
+    # End the current child, all waiting calls fail with reason
+    def __discard(self, reason):
+        child, self.__child = self.__child, None
+        if child is None:
+            return
+        if self.loop is not None:
+            self.loop.remove_reader(child.sock.fileno())
+        child.close()
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(SandboxException(self.name, reason))
+
+    # 停止子进程：请求它调用插件的teardown()并退出，超过timeout秒后强制结束
+    # Stop the child: ask it to call teardown() of the plugin and exit, it is killed after timeout seconds
+    async def stop(self):
+        self.__stopped = True
+        with self._INSTANCE_LOCK:
+            if self._INSTANCES.get(self.name) is self:
+                del self._INSTANCES[self.name]
+        if self.__watchdog is not None:
+            self.__watchdog.cancel()
+        if self.__restarting is not None:
+            await asyncio.gather(self.__restarting, return_exceptions=True)
+        child = self.__child
+        if child is not None and child.process.is_alive() and child.requests.put(0, _STOP, b''):
+            _ring(child.sock)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, child.process.join, self.timeout if self.timeout > 0 else None)
+        self.__discard('the sandbox was stopped')
+
+    def stats(self):
+        child = self.__child
+        return {
+            'pid': None if child is None else child.process.pid,
+            'pending': len(self.__pending),
+            'restarts': self.restarts,
+            'memory': None if child is None else _residentMemory(child.process.pid)
+        }
+
+
+# 代替隔离运行的插件放入sys.modules的模块
+# plugin.json中声明的每个处理函数都是同名的协程函数，调用会被转发到子进程；teardown()停止子进程
+# The module put into sys.modules in place of a sandboxed plugin
+# Every handler declared in plugin.json is a coroutine function of the same name whose calls are forwarded to the child;
+# teardown() stops the child
+class SandboxModule(types.ModuleType):
+    def __init__(self, sandbox):
+        types.ModuleType.__init__(self, 'latte.plugin.%s' % sandbox.name)
+        self.sandbox = sandbox
+        self.teardown = sandbox.stop
+        for handler in sandbox.attributes:
+            setattr(self, handler, self.__proxy(sandbox, handler))
+
+    @staticmethod
+    def __proxy(sandbox, handler):
+        async def call(message, match):
+            return await sandbox.call(handler, message, match)
+        call.__name__ = call.__qualname__ = handler
+        # 子进程中处理函数的@memoize和@batched在核心进程中同样生效
+        # @memoize and @batched on the handlers in the child take effect in the core process as well
+        for key, value in sandbox.attributes[handler].items():
+            setattr(call, key, value)
+        return call
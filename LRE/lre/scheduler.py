@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os, sys
+import time
+import pickle
+import asyncio
+import datetime
+import importlib
+import threading
+import itertools
+from .base import LatteConfig, Logger
+
+# 时间轮的层数和每层的槽位数（2的_BITS次方）
+# Number of wheel levels and the slots per level (2 to the power of _BITS)
+_LEVELS = 4
+_BITS = 8
+_SLOTS = 1 << _BITS
+_MASK = _SLOTS - 1
+
+# cron表达式中的别名
+# Aliases in cron expressions
+_CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *'
+}
+
+
+# cron表达式：分 时 日 月 周
+# 每个字段支持*，数字，范围a-b，步长*/n或a-b/n，以及逗号分隔的列表；周日为0或7
+# 日和周都被限制时，满足其中之一即可（与Vixie cron相同）
+# Cron expression: minute hour day-of-month month day-of-week
+# Every field supports *, numbers, ranges a-b, steps */n or a-b/n and comma separated lists; Sunday is 0 or 7
+# When both day-of-month and day-of-week are restricted, matching either of them is enough (the same as Vixie cron)
+class CronExpression(object):
+    __RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = _CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError('A cron expression needs 5 fields: \'%s\'' % expression)
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self.__parse(field, low, high) for field, (low, high) in zip(fields, self.__RANGES)]
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.anyDay = fields[2] == '*'
+        self.anyWeekday = fields[4] == '*'
+
+    @staticmethod
+    def __parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/', 1)
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = end = int(part)
+                if step != 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError('Invalid cron field \'%s\'' % field)
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def __matchesDay(self, date):
+        # isoweekday()中周日是7
+        # Sunday is 7 in isoweekday()
+        day = date.day in self.days
+        weekday = date.isoweekday() % 7 in self.weekdays
+        if self.anyDay or self.anyWeekday:
+            return day and weekday
+        return day or weekday
+
+    # 返回after（时间戳）之后第一个匹配的时间戳，按本地时间计算
+    # Returns the first matching timestamp after after (a timestamp), computed in local time
+    def next(self, after):
+        moment = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # 最多向后查找5年，不存在的日期（例如2月30日）永远不会匹配
+        # Look ahead at most 5 years, impossible dates (e.g. February 30th) never match
+        limit = moment + datetime.timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self.__matchesDay(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError('The cron expression \'%s\' never matches' % self.expression)
+
+    def __repr__(self):
+        return '<CronExpression %s>' % self.expression
+
+
+# 一个定时器
+# A timer
+class Timer(object):
+    __slots__ = ('id', 'name', 'when', 'fn', 'args', 'interval', 'cron', 'pool', 'persist', 'cancelled',
+                 'level', 'slot', 'scheduler')
+
+    def __init__(self, scheduler, id, when, fn, args, interval=None, cron=None, pool=False, persist=False, name=None):
+        self.scheduler = scheduler
+        self.id = id
+        self.name = name
+        # 触发的时间戳
+        # Timestamp it fires at
+        self.when = when
+        # 回调函数，持久化的定时器使用'模块:名称'形式的字符串
+        # The callback, persistent timers use a string of the form 'module:name'
+        self.fn = fn
+        self.args = args
+        # 周期定时器的间隔（秒），或者cron表达式
+        # Interval (seconds) of a periodic timer, or a cron expression
+        self.interval = interval
+        self.cron = cron
+        self.pool = pool
+        self.persist = persist
+        self.cancelled = False
+        # 所在的时间轮层和槽位，不在时间轮中时level为None
+        # Wheel level and slot it is in, level is None when it is not in the wheel
+        self.level = None
+        self.slot = None
+
+    def cancel(self):
+        return self.scheduler.cancel(self)
+
+    def __repr__(self):
+        return '<Timer %s at %.3f>' % (self.name or self.id, self.when)
+
+
+# 分层时间轮调度器
+# 4层，每层256个槽位，插入和取消都是O(1)。最底层的每个槽位是一个刻度（resolution秒），
+# 更高层的定时器在低层转完一圈时下降到低层。调度器只在下一个非空槽位或者下降边界唤醒，
+# 没有到期的定时器时不会占用CPU。
+# 定时器在事件循环中触发：协程函数作为任务运行，普通函数直接调用，pool为true时在线程池中运行。
+# Hierarchical timing wheel scheduler
+# 4 levels of 256 slots, insert and cancel are O(1). Each slot of the lowest level is one tick (resolution seconds),
+# timers of higher levels cascade down when the level below completes a round. The scheduler only wakes up at the next
+# non-empty slot or cascade boundary, so it uses no CPU while no timer is due.
+# Timers fire on the event loop: coroutine functions run as tasks, plain functions are called directly, or in the thread pool when pool is true.
+class Scheduler(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    _INSTANCE = None
+
+    # 获取按照latte.json中的scheduler配置创建的共享实例
+    # Get the shared instance created from the scheduler configuration in latte.json
+    @classmethod
+    def instance(cls):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                path = LatteConfig.getConfigOrDefault('scheduler.path', '')
+                if path and not os.path.isabs(path):
+                    path = os.sep.join([LatteConfig.getConfig('sys.path.latte'), path])
+                # 多进程模式下每个工作进程保存和恢复自己的定时器，持久化的定时器不会在每个工作进程中各触发一次
+                # Every worker saves and restores its own timers in worker mode, so a persistent timer does not fire once in every worker
+                worker = os.environ.get('LATTE_WORKER')
+                if path and worker is not None:
+                    path = '%s.%s' % (path, worker)
+                cls._INSTANCE = Scheduler(LatteConfig.getTypedConfig('scheduler.resolution', float), path or None)
+        return cls._INSTANCE
+
+    # clock返回当前的时间戳，默认为time.time
+    # clock returns the current timestamp, time.time by default
+    def __init__(self, resolution=0.01, path=None, clock=time.time):
+        self.resolution = resolution
+        self.path = path
+        self.clock = clock
+        self.logger = Logger.bind('Latte.scheduler')
+        self.__lock = threading.RLock()
+        self.__ids = itertools.count(1)
+        # 每层的槽位，槽位在第一次使用时才创建为{id: Timer}
+        # The slots of every level, a slot is created as {id: Timer} on first use
+        self.__wheel = [[None] * _SLOTS for _ in range(_LEVELS)]
+        self.__counts = [0] * _LEVELS
+        # 超出最高层范围的定时器
+        # Timers beyond the range of the highest level
+        self.__overflow = {}
+        self.__current = self.__tick(self.clock())
+        self.__names = {}
+        self.__persistent = {}
+        self.__dirty = False
+        self.loop = None
+        self.executor = None
+        self.__handle = None
+        self.__wakeAt = None
+        self.fired = 0
+        if path is not None:
+            self.__restore()
+
+    def __tick(self, when):
+        return int(when / self.resolution)
+
+    # 定时器到期的刻度，向上取整，这样定时器不会提前触发
+    # The tick a timer expires at, rounded up so timers never fire early
+    def __expiry(self, when):
+        return -int(-when // self.resolution)
+
+    def __len__(self):
+        return sum(self.__counts) + len(self.__overflow)
+
+    # 在delay秒后调用fn(*args)
+    # Call fn(*args) after delay seconds
+    def callLater(self, delay, fn, *args, pool=False, persist=False, name=None):
+        return self.callAt(self.clock() + delay, fn, *args, pool=pool, persist=persist, name=name)
+
+    # 在时间戳when调用fn(*args)
+    # Call fn(*args) at the timestamp when
+    def callAt(self, when, fn, *args, pool=False, persist=False, name=None):
+        return self.__add(when, fn, args, pool=pool, persist=persist, name=name)
+
+    # 每隔interval秒调用fn(*args)，第一次在interval秒后
+    # Call fn(*args) every interval seconds, the first time after interval seconds
+    def every(self, interval, fn, *args, pool=False, persist=False, name=None):
+        if interval <= 0:
+            raise ValueError('The interval must be positive')
+        return self.__add(self.clock() + interval, fn, args, interval=interval, pool=pool, persist=persist, name=name)
+
+    # 按照cron表达式调用fn(*args)
+    # Call fn(*args) following a cron expression
+    def cron(self, expression, fn, *args, pool=False, persist=False, name=None):
+        cron = CronExpression(expression)
+        return self.__add(cron.next(self.clock()), fn, args, cron=cron, pool=pool, persist=persist, name=name)
+
+    # 取消定时器，O(1)
+    # Cancel a timer, O(1)
+    def cancel(self, timer):
+        with self.__lock:
+            if timer.cancelled:
+                return False
+            timer.cancelled = True
+            self.__unlink(timer)
+            if self.__names.get(timer.name) is timer:
+                del self.__names[timer.name]
+            if self.__persistent.pop(timer.id, None) is not None:
+                self.__dirty = True
+        return True
+
+    # 按名称获取定时器
+    # Get a timer by name
+    def find(self, name):
+        return self.__names.get(name)
+
+    def __add(self, when, fn, args, interval=None, cron=None, pool=False, persist=False, name=None, id=None):
+        if persist:
+            # 持久化的定时器在重启后需要重新找到回调函数，所以它必须是模块级的函数
+            # A persistent timer must find its callback again after a restart, so it must be a module level function
+            if not isinstance(fn, str):
+                fn = '%s:%s' % (fn.__module__, fn.__qualname__)
+            if '<' in fn:
+                raise ValueError('Only module level functions can be persisted: \'%s\'' % fn)
+            id = id or 'p%x-%d' % (int(time.time() * 1e6), next(self.__ids))
+        timer = Timer(self, id or next(self.__ids), when, fn, args, interval, cron, pool, persist, name)
+        with self.__lock:
+            # 同名的定时器被替换，这样插件每次启动时注册周期任务不会产生重复的定时器
+            # A timer with the same name is replaced, so plugins registering periodic tasks on every start do not create duplicates
+            if name is not None:
+                previous = self.__names.get(name)
+                if previous is not None:
+                    self.cancel(previous)
+                self.__names[name] = timer
+            if persist:
+                self.__persistent[timer.id] = timer
+                self.__dirty = True
+            self.__link(timer)
+        self.__reschedule(when)
+        return timer
+
+    # 把定时器放进对应的层和槽位
+    # Put a timer into its level and slot
+    def __link(self, timer):
+        expiry = max(self.__expiry(timer.when), self.__current + 1)
+        delta = expiry - self.__current
+        for level in range(_LEVELS):
+            if delta < 1 << (_BITS * (level + 1)):
+                slot = (expiry >> (_BITS * level)) & _MASK
+                timers = self.__wheel[level][slot]
+                if timers is None:
+                    timers = self.__wheel[level][slot] = {}
+                timers[timer.id] = timer
+                self.__counts[level] += 1
+                timer.level, timer.slot = level, slot
+                return
+        self.__overflow[timer.id] = timer
+        timer.level, timer.slot = _LEVELS, None
+
+    def __unlink(self, timer):
+        if timer.level is None:
+            return
+        if timer.level == _LEVELS:
+            self.__overflow.pop(timer.id, None)
+        else:
+            timers = self.__wheel[timer.level][timer.slot]
+            if timers is not None and timers.pop(timer.id, None) is not None:
+                self.__counts[timer.level] -= 1
+        timer.level = timer.slot = None
+
+    # 推进到时间戳now，返回到期的定时器
+    # 没有定时器的层会被整段跳过，所以长时间空闲后推进的开销也很小
+    # Advance to the timestamp now and return the timers that are due
+    # Levels without timers are skipped in whole rounds, so advancing after a long idle period is cheap too
+    def __advance(self, now):
+        target = self.__tick(now)
+        due = []
+        while self.__current < target:
+            lowest = next((level for level in range(_LEVELS) if self.__counts[level]), None)
+            if lowest is None and not self.__overflow:
+                self.__current = target
+                break
+            if lowest is None:
+                lowest = _LEVELS
+            if lowest > 0:
+                # 跳到第lowest层之下的所有层都转完一圈之前的刻度
+                # Jump to the tick just before all levels below level lowest complete a round
+                skip = min(target, self.__current | ((1 << (_BITS * lowest)) - 1))
+                if skip > self.__current:
+                    self.__current = skip
+                    continue
+            self.__current += 1
+            current = self.__current
+            # 低层转完一圈时，上一层对应槽位中的定时器下降
+            # When a lower level completes a round, the timers in the matching slot of the level above cascade down
+            for level in range(1, _LEVELS + 1):
+                if (current >> (_BITS * (level - 1))) & _MASK:
+                    break
+                if level == _LEVELS:
+                    timers, self.__overflow = self.__overflow, {}
+                else:
+                    slot = (current >> (_BITS * level)) & _MASK
+                    timers = self.__wheel[level][slot]
+                    self.__wheel[level][slot] = None
+                    if not timers:
+                        continue
+                    self.__counts[level] -= len(timers)
+                for timer in timers.values():
+                    timer.level = None
+                    self.__link(timer)
+            slot = current & _MASK
+            timers = self.__wheel[0][slot]
+            if timers:
+                self.__wheel[0][slot] = None
+                self.__counts[0] -= len(timers)
+                for timer in timers.values():
+                    timer.level = None
+                    due.append(timer)
+        return due
+
+    # 下一次需要唤醒的时间戳，没有定时器时返回None
+    # 最底层的下一个非空槽位和更高层的下一个下降边界中较早的那个
+    # The timestamp of the next wakeup, None when there are no timers
+    # The earlier of the next non-empty slot of the lowest level and the next cascade boundary of a higher level
+    def __nextWakeup(self):
+        current = self.__current
+        wakeup = None
+        if self.__counts[0]:
+            for offset in range(1, _SLOTS + 1):
+                if self.__wheel[0][(current + offset) & _MASK]:
+                    wakeup = current + offset
+                    break
+        level = next((level for level in range(1, _LEVELS) if self.__counts[level]), None)
+        if level is None and self.__overflow:
+            level = _LEVELS
+        if level is not None:
+            boundary = (current | ((1 << (_BITS * level)) - 1)) + 1
+            wakeup = boundary if wakeup is None else min(wakeup, boundary)
+        return None if wakeup is None else wakeup * self.resolution
+
+    # 开始在事件循环中运行，pool为true的定时器在executor中运行
+    # Start running on the event loop, timers with pool set run in the executor
+    def start(self, loop, executor=None):
+        self.loop = loop
+        self.executor = executor
+        self.__reschedule()
+
+    def stop(self):
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+        with self.__lock:
+            self.__wakeAt = None
+        self.loop = None
+        self.save()
+
+    # 重新安排下一次唤醒，可以在任意线程中调用
+    # hint是新加入的定时器的触发时间，它不早于已经安排的唤醒时不需要重新计算
+    # Arrange the next wakeup again, it may be called from any thread
+    # hint is the time a newly added timer fires at, nothing needs to be computed again when it is not earlier than the arranged wakeup
+    def __reschedule(self, hint=None):
+        loop = self.loop
+        if loop is None or (hint is not None and self.__wakeAt is not None and self.__wakeAt <= hint):
+            return
+        with self.__lock:
+            when = self.__nextWakeup()
+            if when is None or (self.__wakeAt is not None and self.__wakeAt <= when):
+                return
+            self.__wakeAt = when
+        try:
+            loop.call_soon_threadsafe(self.__arm, when)
+        except RuntimeError:
+            # 事件循环已经关闭
+            # The event loop is already closed
+            pass
+
+    def __arm(self, when):
+        if self.loop is None:
+            return
+        if self.__handle is not None:
+            self.__handle.cancel()
+        self.__handle = self.loop.call_at(self.loop.time() + max(0.0, when - self.clock()), self.__wake)
+
+    def __wake(self):
+        self.__handle = None
+        now = self.clock()
+        with self.__lock:
+            self.__wakeAt = None
+            due = self.__advance(now)
+        for timer in due:
+            if not timer.cancelled:
+                self.__fire(timer, now)
+        if self.__dirty:
+            self.save()
+        self.__reschedule()
+
+    def __fire(self, timer, now):
+        self.fired += 1
+        with self.__lock:
+            if timer.interval is not None:
+                timer.when = max(timer.when + timer.interval, now)
+            elif timer.cron is not None:
+                timer.when = timer.cron.next(now)
+            else:
+                timer.cancelled = True
+                if self.__names.get(timer.name) is timer:
+                    del self.__names[timer.name]
+            if timer.cancelled:
+                if self.__persistent.pop(timer.id, None) is not None:
+                    self.__dirty = True
+            else:
+                self.__link(timer)
+                self.__dirty = self.__dirty or timer.persist
+        try:
+            fn = self.__resolve(timer.fn) if isinstance(timer.fn, str) else timer.fn
+            if asyncio.iscoroutinefunction(fn):
+                self.loop.create_task(self.__guard(timer, fn(*timer.args)))
+            elif timer.pool:
+                self.loop.run_in_executor(self.executor, self.__call, timer, fn)
+            else:
+                fn(*timer.args)
+        except Exception as e:
+            self.logger.error('Timer %r failed: %s', timer, e, exc_info=e)
+
+    async def __guard(self, timer, coroutine):
+        try:
+            await coroutine
+        except Exception as e:
+            self.logger.error('Timer %r failed: %s', timer, e, exc_info=e)
+
+    def __call(self, timer, fn):
+        try:
+            fn(*timer.args)
+        except Exception as e:
+            self.logger.error('Timer %r failed: %s', timer, e, exc_info=e)
+
+    # 将'模块:名称'解析为函数，插件模块必须已经被加载
+    # Resolve 'module:name' to a function, plugin modules must already be loaded
+    @staticmethod
+    def __resolve(target):
+        moduleName, _, name = target.partition(':')
+        module = sys.modules.get(moduleName) or importlib.import_module(moduleName)
+        fn = module
+        for part in name.split('.'):
+            fn = getattr(fn, part)
+        return fn
+
+    # 保存持久化的定时器，先写临时文件再原子地替换
+    # Save the persistent timers, a temporary file is written first and then atomically replaces it
+    def save(self):
+        if self.path is None or not self.__dirty:
+            return
+        with self.__lock:
+            records = [(timer.id, timer.name, timer.when, timer.fn, timer.args, timer.interval,
+                        timer.cron.expression if timer.cron is not None else None, timer.pool)
+                       for timer in self.__persistent.values()]
+            self.__dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp = '%s.%d.tmp' % (self.path, os.getpid())
+            with io.open(temp, mode='wb') as output:
+                pickle.dump(records, output, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, self.path)
+        except Exception as e:
+            self.__dirty = True
+            self.logger.error('Unable to save timers to \'%s\': %s', self.path, e)
+
+    # 恢复持久化的定时器，停机期间到期的一次性定时器会尽快触发
+    # Restore the persistent timers, one-shot timers that became due during the downtime fire as soon as possible
+    def __restore(self):
+        try:
+            with io.open(self.path, mode='rb') as source:
+                records = pickle.load(source)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warn('Unable to restore timers from \'%s\': %s', self.path, e)
+            return
+        now = self.clock()
+        for id, name, when, fn, args, interval, cron, pool in records:
+            cron = CronExpression(cron) if cron is not None else None
+            if cron is not None and when < now:
+                when = cron.next(now)
+            self.__add(when, fn, args, interval=interval, cron=cron, pool=pool, persist=True, name=name, id=id)
+        self.logger.info('Restored %d timers from \'%s\'', len(records), self.path)
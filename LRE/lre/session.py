@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io, os
+import mmap
+import time
+import zlib
+import pickle
+import struct
+import threading
+from .base import LatteConfig, Logger
+
+# 持久化文件的文件头：格式标识和写入位置
+# Header of the persistence file: format marker and write position
+_MAGIC = b'LATTESS1'
+_HEADER = struct.Struct('<8sQ')
+# 每条记录的头：数据长度和CRC32
+# Header of every record: payload length and CRC32
+_RECORD = struct.Struct('<II')
+# 记录类型：保存会话数据，删除会话
+# Record types: store session data, delete a session
+_SET = 0
+_DELETE = 1
+
+
+# 一个会话
+# 使用__slots__让每个会话只占用固定的少量内存，data只有在第一次写入时才会创建
+# A session
+# __slots__ keeps every session to a small fixed amount of memory, data is only created on the first write
+class Session(object):
+    __slots__ = ('key', 'data', 'created', 'expires', 'tick', 'store')
+
+    def __init__(self, key, store, expires):
+        self.key = key
+        self.data = None
+        self.created = time.time()
+        self.expires = expires
+        # 会话所在的时间轮刻度
+        # The tick of the expiry wheel the session is in
+        self.tick = None
+        self.store = store
+
+    def get(self, name, default=None):
+        return default if self.data is None else self.data.get(name, default)
+
+    # 写入会话数据，开启持久化时会追加到持久化文件中
+    # 修改在分片的锁内进行，持久化和压缩文件时复制的数据不会被其它线程同时修改
+    # Write session data, it is appended to the persistence file when persistence is enabled
+    # Changes are made under the shard lock, so the data copied for persistence and compaction is not modified by other threads at the same time
+    def set(self, name, value):
+        with self.store.lock(self.key):
+            if self.data is None:
+                self.data = {}
+            self.data[name] = value
+        self.store.persist(self)
+
+    def update(self, values):
+        with self.store.lock(self.key):
+            if self.data is None:
+                self.data = {}
+            self.data.update(values)
+        self.store.persist(self)
+
+    def delete(self, name):
+        with self.store.lock(self.key):
+            deleted = self.data is not None and self.data.pop(name, None) is not None
+        if deleted:
+            self.store.persist(self)
+
+    def __repr__(self):
+        return '<Session %r>' % (self.key,)
+
+
+# 一个分片：独立的锁，会话表和过期时间轮
+# 时间轮以刻度号为Key，只保存非空的刻度，所以不需要预先分配槽位，清理的开销只与到期的会话数成正比
+# A shard: its own lock, session map and expiry wheel
+# The wheel is keyed by tick number and only keeps non-empty ticks, so no slots are allocated up front
+# and sweeping costs only in proportion to the sessions that expire
+class _Shard(object):
+    __slots__ = ('lock', 'sessions', 'wheel')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.wheel = {}
+
+
+# 会话存储
+# 会话按Key的哈希分散到多个分片中，每个分片有自己的锁，多线程访问时很少互相阻塞。
+# 每次访问会话都会延长它的过期时间，过期的会话由时间轮淘汰，不需要扫描全部会话。
+# 指定path时，会话数据以追加的方式写入内存映射的文件，重启后可以恢复；
+# 只有写入数据才会记录，仅被访问过的会话在恢复后以最后一次写入的时间计算过期。
+# Session store
+# Sessions are spread over several shards by the hash of their key, each shard has its own lock,
+# so threads rarely block each other.
+# Every access to a session extends its expiry, expired sessions are evicted by the expiry wheel without scanning all sessions.
+# When path is given, session data is appended to a memory-mapped file and can be recovered after a restart;
+# only writes are recorded, a session that was only accessed expires after recovery counting from its last write.
+class SessionStore(object):
+    # 这是一个线程锁，获取实例时会使用它
+    # This is a thread lock, it is used when getting an instance
+    _INSTANCE_LOCK = threading.Lock()
+    _INSTANCE = None
+
+    # 获取按照latte.json中的session配置创建的共享实例
+    # Get the shared instance created from the session configuration in latte.json
+    @classmethod
+    def instance(cls):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                path = LatteConfig.getConfigOrDefault('session.path', '')
+                if path and not os.path.isabs(path):
+                    path = os.sep.join([LatteConfig.getConfig('sys.path.latte'), path])
+                # 多进程模式下每个工作进程写入自己的日志文件，工作进程之间不会互相覆盖
+                # Every worker writes its own journal file in worker mode, so workers do not overwrite each other
+                worker = os.environ.get('LATTE_WORKER')
+                if path and worker is not None:
+                    path = '%s.%s' % (path, worker)
+                cls._INSTANCE = SessionStore(
+                    shards=LatteConfig.getTypedConfig('session.shards', int),
+                    ttl=LatteConfig.getTypedConfig('session.ttl', float),
+                    resolution=LatteConfig.getTypedConfig('session.resolution', float),
+                    maxSessions=LatteConfig.getTypedConfig('session.maxSessions', int),
+                    path=path or None)
+        return cls._INSTANCE
+
+    # 是否已经创建了共享实例
+    # Whether the shared instance has been created
+    @classmethod
+    def created(cls):
+        return cls._INSTANCE is not None
+
+    def __init__(self, shards=64, ttl=1800, resolution=1.0, maxSessions=0, path=None):
+        # 分片数取2的幂，用位运算选择分片
+        # The number of shards is a power of two, shards are selected with a bit mask
+        count = 1
+        while count < shards:
+            count <<= 1
+        self.__shards = [_Shard() for _ in range(count)]
+        self.__mask = count - 1
+        self.ttl = ttl
+        self.resolution = resolution
+        # 每个分片最多保存的会话数，超过时淘汰该分片中最早创建的会话，0表示不限制
+        # Maximum number of sessions per shard, the oldest session of the shard is evicted beyond it, 0 means no limit
+        self.shardLimit = (maxSessions + count - 1) // count if maxSessions > 0 else 0
+        self.logger = Logger.bind('Latte.session')
+        self.__swept = self.__tick(time.time())
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.evictions = 0
+        self.journal = None
+        if path is not None:
+            self.journal = _Journal(path)
+            self.__restore()
+
+    def __tick(self, when):
+        return int(when // self.resolution)
+
+    def __shard(self, key):
+        return self.__shards[hash(key) & self.__mask]
+
+    # 会话所在分片的锁
+    # The lock of the shard a session is in
+    def lock(self, key):
+        return self.__shards[hash(key) & self.__mask].lock
+
+    # 获取会话并延长它的过期时间，会话不存在时create为true则创建，否则返回None
+    # ttl为None时使用默认的过期时间
+    # Get a session and extend its expiry, when it does not exist it is created if create is true, otherwise None is returned
+    # The default expiry time is used when ttl is None
+    def get(self, key, create=True, ttl=None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        shard = self.__shards[hash(key) & self.__mask]
+        evicted = None
+        with shard.lock:
+            session = shard.sessions.get(key)
+            if session is not None and session.expires <= now:
+                self.__remove(shard, session)
+                session = None
+            if session is None:
+                if not create:
+                    return None
+                session = shard.sessions[key] = Session(key, self, expires)
+                if self.shardLimit and len(shard.sessions) > self.shardLimit:
+                    evicted = shard.sessions[next(iter(shard.sessions))]
+                    self.__remove(shard, evicted)
+                    self.evictions += 1
+            else:
+                session.expires = expires
+            self.__schedule(shard, session)
+        # 持久化文件在分片的锁之外写入，压缩文件时会反过来获取分片的锁
+        # The persistence file is written outside the shard lock, compaction takes the shard locks the other way round
+        if evicted is not None and self.journal is not None:
+            self.journal.append((_DELETE, evicted.key, 0, None))
+        return session
+
+    # 获取会话但不延长它的过期时间
+    # Get a session without extending its expiry
+    def peek(self, key):
+        shard = self.__shard(key)
+        with shard.lock:
+            session = shard.sessions.get(key)
+        if session is None or session.expires <= time.time():
+            return None
+        return session
+
+    def delete(self, key):
+        shard = self.__shard(key)
+        with shard.lock:
+            session = shard.sessions.get(key)
+            if session is None:
+                return False
+            self.__remove(shard, session)
+        if self.journal is not None:
+            self.journal.append((_DELETE, key, 0, None))
+        return True
+
+    def __len__(self):
+        return sum(len(shard.sessions) for shard in self.__shards)
+
+    # 将会话放到它过期的刻度上，同一个刻度内的多次访问不需要移动
+    # Put the session on the tick it expires at, accesses within the same tick do not move it
+    def __schedule(self, shard, session):
+        tick = int(session.expires // self.resolution) + 1
+        if tick == session.tick:
+            return
+        if session.tick is not None:
+            keys = shard.wheel.get(session.tick)
+            if keys is not None:
+                keys.discard(session.key)
+        session.tick = tick
+        keys = shard.wheel.get(tick)
+        if keys is None:
+            keys = shard.wheel[tick] = set()
+        keys.add(session.key)
+
+    def __remove(self, shard, session):
+        shard.sessions.pop(session.key, None)
+        if session.tick is not None:
+            keys = shard.wheel.get(session.tick)
+            if keys is not None:
+                keys.discard(session.key)
+                if not keys:
+                    del shard.wheel[session.tick]
+
+    # 淘汰到期的会话，只处理上次清理之后经过的刻度，返回淘汰的会话数
+    # Evict expired sessions, only the ticks passed since the last sweep are processed, returns the number of evicted sessions
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+        current = self.__tick(now)
+        first, self.__swept = self.__swept + 1, current
+        evicted = []
+        for shard in self.__shards:
+            with shard.lock:
+                # 跨过的刻度很多时（例如长时间没有清理），直接遍历非空的刻度
+                # When many ticks were skipped (e.g. no sweep for a long time), walk the non-empty ticks directly
+                if current - first > len(shard.wheel):
+                    ticks = [tick for tick in shard.wheel if tick <= current]
+                else:
+                    ticks = range(first, current + 1)
+                for tick in ticks:
+                    keys = shard.wheel.pop(tick, None)
+                    if not keys:
+                        continue
+                    for key in keys:
+                        session = shard.sessions.get(key)
+                        if session is not None and session.expires <= now:
+                            del shard.sessions[key]
+                            evicted.append(key)
+        if self.journal is not None:
+            for key in evicted:
+                self.journal.append((_DELETE, key, 0, None))
+        return len(evicted)
+
+    # 记录会话的当前数据，由Session.set等方法调用
+    # 数据在分片的锁内复制，在锁外序列化和写入
+    # Record the current data of a session, called by Session.set and similar methods
+    # The data is copied under the shard lock, and serialized and written outside it
+    def persist(self, session):
+        if self.journal is not None:
+            with self.lock(session.key):
+                record = (_SET, session.key, session.expires,
+                          None if session.data is None else dict(session.data))
+            self.journal.append(record)
+
+    # 从持久化文件中恢复没有过期的会话，然后压缩文件
+    # Recover the sessions that have not expired from the persistence file, then compact the file
+    def __restore(self):
+        now = time.time()
+        restored = {}
+        for op, key, expires, data in self.journal.replay():
+            if op == _SET and expires > now:
+                restored[key] = (expires, data)
+            else:
+                restored.pop(key, None)
+        for key, (expires, data) in restored.items():
+            shard = self.__shard(key)
+            session = shard.sessions[key] = Session(key, self, expires)
+            session.data = data
+            self.__schedule(shard, session)
+        self.compact()
+        if restored:
+            self.logger.info('Restored %d sessions from \'%s\'', len(restored), self.journal.path)
+
+    # 用当前的会话重写持久化文件，去掉已经被覆盖和删除的记录
+    # Rewrite the persistence file from the current sessions, dropping records that were overwritten or deleted
+    def compact(self):
+        if self.journal is None:
+            return
+        def records():
+            for shard in self.__shards:
+                with shard.lock:
+                    sessions = [(_SET, session.key, session.expires, dict(session.data))
+                                for session in shard.sessions.values() if session.data is not None]
+                for record in sessions:
+                    yield record
+        self.journal.rewrite(records())
+
+    # 启动后台线程，定期淘汰过期的会话并刷新持久化文件
+    # Start the background thread that periodically evicts expired sessions and flushes the persistence file
+    def start(self):
+        if self.__thread is None:
+            self.__stopped.clear()
+            self.__thread = threading.Thread(target=self.__run, name='LatteSession', daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__thread = None
+        if self.journal is not None:
+            self.journal.flush()
+
+    def close(self):
+        self.stop()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def __run(self):
+        while not self.__stopped.wait(self.resolution):
+            try:
+                self.sweep()
+                if self.journal is not None:
+                    self.journal.flush()
+                    if self.journal.wasteful():
+                        self.compact()
+            except Exception as e:
+                self.logger.error('Session sweep failed: %s', e, exc_info=e)
+
+
+# 追加写入的持久化文件
+# 文件通过mmap映射到内存中，写入只是内存复制，由flush定期写回磁盘。
+# 每条记录带有长度和CRC32，恢复时遇到不完整的记录（例如进程在写入时崩溃）就停止。
+# Append-only persistence file
+# The file is memory-mapped, a write is just a memory copy, flush periodically writes it back to disk.
+# Every record carries its length and CRC32, recovery stops at an incomplete record (e.g. the process crashed while writing).
+class _Journal(object):
+    # 文件的初始大小和压缩的阈值
+    # Initial size of the file and the compaction threshold
+    INITIAL_SIZE = 1 << 20
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__map = None
+        # 上次压缩后的数据量，数据量增长到它的数倍时再次压缩
+        # The amount of data after the last compaction, the file is compacted again when it grows to a multiple of it
+        self.__compacted = 0
+        self.__open(path)
+
+    def __open(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__file = io.open(path, mode='a+b')
+        self.__file.seek(0, os.SEEK_END)
+        size = self.__file.tell()
+        if size < _HEADER.size:
+            self.__file.truncate(self.INITIAL_SIZE)
+            size = self.INITIAL_SIZE
+        self.__map = mmap.mmap(self.__file.fileno(), size)
+        magic, end = _HEADER.unpack_from(self.__map, 0)
+        if magic != _MAGIC or end < _HEADER.size or end > size:
+            # 新文件或者无法识别的文件
+            # A new or unrecognized file
+            end = _HEADER.size
+            _HEADER.pack_into(self.__map, 0, _MAGIC, end)
+        self.__end = end
+
+    def replay(self):
+        position = _HEADER.size
+        while position + _RECORD.size <= self.__end:
+            length, checksum = _RECORD.unpack_from(self.__map, position)
+            start = position + _RECORD.size
+            # 超出写入位置的记录没有写完
+            # A record beyond the write position was not completely written
+            if start + length > self.__end:
+                break
+            payload = self.__map[start:start + length]
+            if zlib.crc32(payload) != checksum:
+                break
+            try:
+                yield pickle.loads(payload)
+            except Exception:
+                break
+            position = start + length
+
+    def append(self, record):
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            if self.__map is None:
+                return
+            end = self.__end + _RECORD.size + len(payload)
+            if end > len(self.__map):
+                self.__grow(end)
+            _RECORD.pack_into(self.__map, self.__end, len(payload), zlib.crc32(payload))
+            self.__map[self.__end + _RECORD.size:end] = payload
+            self.__end = end
+            # 先写记录再更新写入位置，崩溃时最多丢失最后一条记录
+            # The record is written before the write position is updated, at most the last record is lost on a crash
+            _HEADER.pack_into(self.__map, 0, _MAGIC, end)
+
+    def __grow(self, end):
+        size = len(self.__map)
+        while size < end:
+            size <<= 1
+        self.__map.flush()
+        self.__map.resize(size)
+
+    # 写入的数据超过上次压缩后的4倍时需要压缩
+    # Compaction is needed when the written data exceeds 4 times the amount after the last compaction
+    def wasteful(self):
+        return self.__end > max(4 * self.__compacted, self.INITIAL_SIZE)
+
+    # 用records重写文件：先写入临时文件，再原子地替换
+    # Rewrite the file with records: a temporary file is written first and then atomically replaces it
+    def rewrite(self, records):
+        temp = '%s.%d.tmp' % (self.path, os.getpid())
+        with self.__lock:
+            with io.open(temp, mode='wb') as output:
+                output.write(_HEADER.pack(_MAGIC, 0))
+                end = _HEADER.size
+                for record in records:
+                    payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                    output.write(_RECORD.pack(len(payload), zlib.crc32(payload)))
+                    output.write(payload)
+                    end += _RECORD.size + len(payload)
+                output.seek(0)
+                output.write(_HEADER.pack(_MAGIC, end))
+                output.truncate(max(self.INITIAL_SIZE, end * 2))
+            self.__closeMap()
+            os.replace(temp, self.path)
+            self.__open(self.path)
+            self.__compacted = end
+
+    def flush(self):
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__closeMap()
+
+    def __closeMap(self):
+        if self.__map is not None:
+            self.__map.flush()
+            self.__map.close()
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
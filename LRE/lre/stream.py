@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import inspect
+
+# 表示流已经结束
+# Marks the end of a stream
+END = object()
+
+
+# 处理函数的返回值是否为流式回复（普通生成器、异步生成器或者Stream）
+# Whether the return value of a handler is a streaming reply (a plain generator, an async generator or a Stream)
+def isStream(value):
+    return isinstance(value, Stream) or inspect.isgenerator(value) or inspect.isasyncgen(value)
+
+
+# 流式回复
+# 统一地逐块读取普通生成器和异步生成器，普通生成器在事件循环中直接推进。
+# close()会关闭生成器，生成器中的finally和with会在这时执行，例如用户断开连接后。
+# onClose中的函数在流结束、出错或者被关闭时调用一次，运行时用它们在流读完之前保持插件的闸门和执行槽位，
+# 所以读取Stream的一方必须把它读到结束或者调用close()。
+# A streaming reply
+# Reads plain generators and async generators chunk by chunk in the same way, plain generators are advanced directly on the event loop.
+# close() closes the generator, so the finally and with blocks in it run, e.g. after the user disconnects.
+# The functions in onClose are called once when the stream ends, fails or is closed, the runtime uses them to hold the gate and
+# the execution slot of the plugin until the stream is read, so whoever reads a Stream must read it to the end or call close().
+class Stream(object):
+    def __init__(self, source, onClose=()):
+        self.source = source
+        self.asynchronous = inspect.isasyncgen(source)
+        self.chunks = 0
+        self.closed = False
+        self.onClose = list(onClose)
+
+    # 下一块数据，流结束时返回END
+    # The next chunk, END when the stream has finished
+    async def next(self):
+        if self.closed:
+            return END
+        try:
+            if self.asynchronous:
+                chunk = await self.source.__anext__()
+            else:
+                chunk = next(self.source)
+        except (StopIteration, StopAsyncIteration):
+            self.closed = True
+            self.__finish()
+            return END
+        except BaseException:
+            # 抛出异常的生成器已经结束
+            # A generator that raised has finished
+            self.__finish()
+            raise
+        self.chunks += 1
+        return chunk
+
+    async def close(self):
+        try:
+            if self.asynchronous:
+                await self.source.aclose()
+            else:
+                self.source.close()
+        finally:
+            self.closed = True
+            self.__finish()
+
+    def __finish(self):
+        callbacks, self.onClose = self.onClose, []
+        for callback in callbacks:
+            callback()
+
+
+# 读取整个流并拼接，字符串和字节串直接连接，其它类型返回列表
+# Read a whole stream and join it, strings and byte strings are concatenated, other types are returned as a list
+async def collect(source):
+    stream = source if isinstance(source, Stream) else Stream(source)
+    chunks = []
+    try:
+        while True:
+            chunk = await stream.next()
+            if chunk is END:
+                break
+            chunks.append(chunk)
+    finally:
+        await stream.close()
+    if chunks and all(isinstance(chunk, str) for chunk in chunks):
+        return ''.join(chunks)
+    if chunks and all(isinstance(chunk, bytes) for chunk in chunks):
+        return b''.join(chunks)
+    return chunks
+
+
+# 关闭[(match, 结果)]中还没有读取的流式回复，释放它们占用的闸门和执行槽位
+# Close the streaming replies in [(match, result)] that have not been read, releasing the gates and execution slots they hold
+async def closeAll(results):
+    for _, result in results:
+        if isinstance(result, Stream):
+            await result.close()
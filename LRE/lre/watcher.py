@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys
+import select
+import threading
+from .base import LatteConfig, PluginConfig, Logger
+
+# inotify事件：文件被写入、创建、删除或移动
+# inotify events: a file was written, created, deleted or moved
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+# 通过ctypes使用Linux的inotify，不可用时返回None
+# Use Linux inotify through ctypes, returns None when it is not available
+def _inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        init, addWatch = libc.inotify_init1, libc.inotify_add_watch
+    except (ImportError, OSError, AttributeError):
+        return None
+    addWatch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    return fd, lambda path: addWatch(fd, os.fsencode(path), _IN_MASK)
+
+
+# 文件监视器
+# 监视一组文件，以及一个目录下每个子目录中的同名文件（例如plugins/*/plugin.json）。
+# 有inotify时只在目录发生变化后检查文件，否则每隔interval秒轮询一次。
+# 哪些文件发生了变化总是通过比较(mtime, size)确定，所以两种方式的结果相同，
+# 编辑器保存文件时产生的多个事件会在debounce秒内合并为一次回调。
+# File watcher
+# Watches a set of files, and the file with the same name in every subdirectory of a directory (e.g. plugins/*/plugin.json).
+# With inotify the files are only checked after a directory changed, otherwise they are polled every interval seconds.
+# Which files changed is always decided by comparing (mtime, size), so both ways give the same result,
+# the several events an editor produces when saving a file are merged into one callback within debounce seconds.
+class FileWatcher(object):
+    def __init__(self, callback, interval=1.0, debounce=0.1, inotify=True):
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.inotify = inotify
+        self.logger = Logger.bind('Latte.watcher')
+        self.files = set()
+        # 目录 -> 每个子目录中需要监视的文件名
+        # Directory -> name of the file to watch in each of its subdirectories
+        self.trees = {}
+        self.__states = {}
+        self.__thread = None
+        self.__stopped = threading.Event()
+        # 用于在stop时唤醒等待inotify事件的线程
+        # Used to wake up the thread waiting for inotify events on stop
+        self.__pipe = None
+
+    # 监视一个文件
+    # Watch a file
+    def watch(self, path):
+        self.files.add(os.path.abspath(path))
+
+    # 监视root下每个子目录中名为filename的文件，之后新建的子目录同样会被监视
+    # Watch the file named filename in every subdirectory of root, subdirectories created later are watched too
+    def watchTree(self, root, filename):
+        self.trees[os.path.abspath(root)] = filename
+
+    def start(self):
+        self.__states = self.__scan()
+        self.__stopped.clear()
+        self.__pipe = os.pipe()
+        self.__thread = threading.Thread(target=self.__run, name='LatteWatcher', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            os.write(self.__pipe[1], b'\0')
+            self.__thread.join()
+            self.__thread = None
+            for fd in self.__pipe:
+                os.close(fd)
+            self.__pipe = None
+
+    # 当前所有被监视的文件
+    # All files currently watched
+    def paths(self):
+        paths = set(self.files)
+        for root, filename in self.trees.items():
+            try:
+                with os.scandir(root) as entries:
+                    paths.update(os.path.join(entry.path, filename) for entry in entries if entry.is_dir())
+            except OSError:
+                pass
+        return paths
+
+    # 每个文件的(mtime, size)，不存在的文件为None
+    # (mtime, size) of every file, None for files that do not exist
+    def __scan(self):
+        states = {}
+        for path in self.paths():
+            try:
+                stat = os.stat(path)
+                states[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                states[path] = None
+        return states
+
+    # 比较前后两次的状态，通知发生变化的文件
+    # Compare the states with the previous ones and report the files that changed
+    def check(self):
+        states = self.__scan()
+        previous = self.__states
+        self.__states = states
+        changed = set(path for path in set(states) | set(previous) if states.get(path) != previous.get(path))
+        if changed:
+            try:
+                self.callback(changed)
+            except Exception as e:
+                self.logger.error('Watcher callback failed: %s', e, exc_info=e)
+        return changed
+
+    def __run(self):
+        inotify = _inotify() if self.inotify else None
+        if inotify is None:
+            self.logger.debug('inotify is not available, polling every %.1f seconds', self.interval)
+            while not self.__stopped.wait(self.interval):
+                self.check()
+            return
+        fd, addWatch = inotify
+        try:
+            self.__addWatches(addWatch)
+            while not self.__stopped.is_set():
+                select.select([fd, self.__pipe[0]], [], [])
+                if self.__stopped.is_set():
+                    break
+                # 等待debounce秒，让一次保存产生的事件都到达，然后一并丢弃
+                # Wait debounce seconds so all events of one save arrive, then discard them together
+                self.__stopped.wait(self.debounce)
+                self.__drain(fd)
+                # 新建的子目录需要加入监视，对已经监视的目录重复添加没有影响
+                # New subdirectories must be watched, adding an already watched directory again has no effect
+                self.__addWatches(addWatch)
+                self.check()
+        finally:
+            os.close(fd)
+
+    def __addWatches(self, addWatch):
+        directories = set(self.trees)
+        directories.update(os.path.dirname(path) for path in self.paths())
+        for directory in directories:
+            if os.path.isdir(directory):
+                addWatch(directory)
+
+    @staticmethod
+    def __drain(fd):
+        try:
+            while os.read(fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+
+# 配置文件的热加载
+# latte.json发生变化时调用LatteConfig.reload()，plugin.json发生变化时只重新加载对应的插件配置。
+# 无效的配置会被拒绝，当前配置保持不变。
+# Hot reloading of configuration files
+# LatteConfig.reload() is called when latte.json changes, only the matching plugin configurations are reloaded when plugin.json files change.
+# Invalid configurations are rejected and the current configuration stays in effect.
+class ConfigWatcher(object):
+    def __init__(self, interval=None, debounce=None, inotify=None):
+        if interval is None:
+            interval = LatteConfig.getTypedConfig('watch.interval', float)
+        if debounce is None:
+            debounce = LatteConfig.getTypedConfig('watch.debounce', float)
+        if inotify is None:
+            inotify = LatteConfig.getTypedConfig('watch.inotify', bool)
+        self.logger = Logger.bind('Latte.watcher')
+        self.latteConfig = os.path.abspath(os.sep.join([LatteConfig.getConfig('sys.path.config'), 'latte.json']))
+        self.watcher = FileWatcher(self.changed, interval, debounce, inotify)
+        self.watcher.watch(self.latteConfig)
+        self.watcher.watchTree(LatteConfig.getConfig('sys.path.plugin'), 'plugin.json')
+
+    def start(self):
+        # 确保在开始监视之前配置已经加载
+        # Make sure the configuration is loaded before watching starts
+        PluginConfig.snapshot()
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def changed(self, paths):
+        if self.latteConfig in paths:
+            try:
+                LatteConfig.reload()
+            except Exception as e:
+                self.logger.error('latte.json is rejected, the previous configuration is kept: %s', e)
+        names = sorted(set(os.path.basename(os.path.dirname(path)) for path in paths if path != self.latteConfig))
+        if names:
+            PluginConfig.reload(names)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import gc
+import time
+import signal
+import socket
+import logging
+import collections
+from .base import bootstrap, LatteConfig, Logger
+from .loader import PluginLoader
+from .runtime import Runtime
+
+
+# 解析'host:port'形式的地址
+# Parse an address of the form 'host:port'
+def _parseAddress(address):
+    host, _, port = address.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+# 工作进程的重启策略
+# policy为'always'、'on-failure'或者'never'，restartWindow秒内最多重启maxRestarts次，超过后exhausted被设置
+# The restart policy of the workers
+# policy is 'always', 'on-failure' or 'never', at most maxRestarts restarts are allowed within restartWindow seconds, exhausted is set after that
+class _RestartPolicy(object):
+    def __init__(self, policy, maxRestarts, restartWindow, clock=time.monotonic):
+        if policy not in ('always', 'on-failure', 'never'):
+            raise ValueError('Unknown restart policy: \'%s\'' % policy)
+        self.policy = policy
+        self.maxRestarts = maxRestarts
+        self.restartWindow = restartWindow
+        self.clock = clock
+        self.exhausted = False
+        self.__restarts = collections.deque()
+
+    # 以code退出的工作进程是否应该被重启
+    # Whether a worker that exited with code should be restarted
+    def allows(self, code):
+        if self.exhausted or self.policy == 'never' or (self.policy == 'on-failure' and code == 0):
+            return False
+        now = self.clock()
+        while self.__restarts and now - self.__restarts[0] > self.restartWindow:
+            self.__restarts.popleft()
+        if len(self.__restarts) >= self.maxRestarts:
+            self.exhausted = True
+            return False
+        self.__restarts.append(now)
+        return True
+
+
+# 多进程模式的主进程
+# 主进程只加载一次配置并导入全部插件，调用gc.freeze()后fork出N个工作进程，
+# 工作进程以写时复制的方式共享这些内存。主进程负责重启崩溃的工作进程，
+# 并通过共享的监听套接字（或者SO_REUSEPORT）把连接分散到各个工作进程。
+# The supervisor of worker mode
+# The supervisor loads the configuration and imports all plugins once, calls gc.freeze() and then forks N workers,
+# which share that memory copy-on-write. The supervisor restarts crashed workers
+# and spreads connections across the workers through a shared listening socket (or SO_REUSEPORT).
+class Supervisor(object):
+    def __init__(self, count=None, restart=None):
+        bootstrap()
+        self.count = count if count is not None else LatteConfig.getTypedConfig('worker.count', int)
+        self.restart = _RestartPolicy(restart if restart is not None else LatteConfig.getConfig('worker.restart'),
+            LatteConfig.getTypedConfig('worker.maxRestarts', int), LatteConfig.getTypedConfig('worker.restartWindow', float))
+        self.restartDelay = LatteConfig.getTypedConfig('worker.restartDelay', float)
+        self.listen = LatteConfig.getConfigOrDefault('worker.listen', '')
+        self.reusePort = LatteConfig.getTypedConfig('worker.reusePort', bool)
+        self.backlog = LatteConfig.getTypedConfig('worker.backlog', int)
+        self.logger = Logger.bind('Latte.worker')
+        self.socket = None
+        # 工作进程的pid -> 编号
+        # pid of a worker -> its index
+        self.workers = {}
+        self.__stopping = False
+
+    # 运行主进程，直到所有工作进程退出
+    # Run the supervisor until all workers have exited
+    def run(self):
+        # 导入期间关闭gc，避免产生大量的内存碎片，导入完成后冻结，
+        # 这样工作进程中的gc不会触碰（从而复制）这些对象所在的内存页
+        # gc is disabled while importing to avoid fragmenting memory, and frozen after importing,
+        # so gc in the workers does not touch (and therefore copy) the pages holding these objects
+        gc.disable()
+        loader = PluginLoader()
+        self.eager, self.lazy = loader.partition()
+        imported = loader.preload(self.eager)
+        self.logger.info('Preloaded %d plugins', len(imported))
+        if self.listen and not self.reusePort:
+            self.socket = self.__createSocket(False)
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self.__stop)
+        signal.signal(signal.SIGINT, self.__stop)
+        for index in range(self.count):
+            self.__spawn(index)
+        gc.enable()
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            index = self.workers.pop(pid, None)
+            if index is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0:
+                self.logger.warn('Worker %d (pid %d) exited with code %d', index, pid, code)
+            else:
+                self.logger.info('Worker %d (pid %d) exited', index, pid)
+            if self.__shouldRestart(code):
+                time.sleep(self.restartDelay)
+                if not self.__stopping:
+                    self.__spawn(index)
+        if self.socket is not None:
+            self.socket.close()
+
+    def __shouldRestart(self, code):
+        if self.__stopping:
+            return False
+        if self.restart.allows(code):
+            return True
+        # 在restartWindow秒内重启次数过多时，认为故障无法通过重启恢复，停止全部工作进程
+        # Too many restarts within restartWindow seconds mean restarting cannot fix the failure, stop all workers
+        if self.restart.exhausted:
+            self.logger.error('Workers restarted %d times within %.0f seconds, giving up', self.restart.maxRestarts, self.restart.restartWindow)
+            self.__stop()
+        return False
+
+    # 停止：通知所有工作进程退出，主进程在它们退出后结束
+    # Stop: tell all workers to exit, the supervisor finishes after they have exited
+    def __stop(self, signum=None, frame=None):
+        self.__stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def __createSocket(self, reusePort):
+        host, port = _parseAddress(self.listen)
+        sock = socket.create_server((host, port), backlog=self.backlog, reuse_port=reusePort)
+        sock.setblocking(False)
+        return sock
+
+    def __spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            self.logger.info('Worker %d started (pid %d)', index, pid)
+            return
+        # 以下代码只在工作进程中执行，工作进程无论如何都不会返回到主进程的代码中
+        # The code below only runs in the worker, the worker never returns into the supervisor's code
+        code = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.environ['LATTE_WORKER'] = str(index)
+            # 主进程在fork前关闭了gc，工作进程需要自己重新打开
+            # The supervisor disabled gc before forking, the worker has to enable it again itself
+            gc.enable()
+            sock = self.socket
+            if self.listen and self.reusePort:
+                sock = self.__createSocket(True)
+            plugins = PluginLoader().load(self.eager)
+            Runtime(plugins, socket=sock, lazy=self.lazy).run()
+            code = 0
+        except BaseException as e:
+            self.logger.exception('Worker %d failed: %s', index, e)
+        finally:
+            logging.shutdown()
+            os._exit(code)
@@ -3,7 +3,9 @@
 
 import json, os, sys
 import threading
-from .error import ConfigException, ReadConfigException
+from lre.error import ConfigException, ReadConfigException
+from lre.base import Logger, Lazy, LatteConfig
+from lre.manifest import ManifestCache
 
 
 
@@ -61,35 +63,45 @@ class AppConfig(object):
             'warn': []
         }
         # Get logger instance
-        self.logger = Logger.getlogger(self.__class__.__name__)
-        logTempStore['debug'].append('The current latte system environment variables are as follows:\n\tLATTEPATH: \'%s\',\n\tLATTE_CONFIG_PATH: \'%s\',\n\tLATTE_PLUGIN_PATH: \'%s\' ', lattepath, configpath, pluginpath)
+        self.logger = Logger.bind(self.__class__.__name__)
+        # The message and its arguments are stored separately, they are only formatted if the level is enabled
+        logTempStore['debug'].append(('The current latte system environment variables are as follows:\n\tLATTEPATH: \'%s\',\n\tLATTE_CONFIG_PATH: \'%s\',\n\tLATTE_PLUGIN_PATH: \'%s\' ', lattepath, configpath, pluginpath))
         try:
             # Read the latte.json configuration file and throw if an exception occurs
             latteconfig = os.sep.join([configpath, 'latte.json'])
             if not os.path.isfile(latteconfig):
                 raise ConfigException('Could not find the latte.json configuration file, or it is not a readable file.' + configpath)
-            with open(latteconfig, 'r', encoding='utf-8') as config:
-                self.userconfig = json.load(config)
+            # The manifest cache is shared with LatteConfig and PluginConfig,
+            # so files they have already parsed are not parsed again
+            manifest = ManifestCache.instance(os.sep.join([LatteConfig.getConfig('sys.path.cache'), 'manifest']))
+            self.userconfig = manifest.read(latteconfig)
             # Traverse all folders under the pluginpath and read the plugin.json configuration file
             self.plugins = {}
-            for pluginname in os.listdir(pluginpath):
-                latteplugin = os.sep.join([pluginpath, pluginname, 'plugin.json'])
-                if not os.path.isfile(latteplugin):
-                    # If there is no plugin.json file in the plugin directory,
-                    # skip the plugin and output a warning log.
-                    logTempStore['warn'].append('There is no plugin.json file under this plugin \'%s\'. ' % pluginname)
-                    continue
-                # Read the configuration file and save it to the 'plugins'
-                with open(latteplugin, 'r', encoding='utf-8') as plugin:
-                    self.plugins[pluginname] = json.load(plugin)
-            logTempStore['debug'].append('The plugin that was successfully read into the configuration is as follows: [%s]', ', '.join(self.plugins.keys()))
+            with os.scandir(pluginpath) as entries:
+                for entry in entries:
+                    latteplugin = os.sep.join([entry.path, 'plugin.json'])
+                    try:
+                        stat = os.stat(latteplugin)
+                    except OSError:
+                        # If there is no plugin.json file in the plugin directory,
+                        # skip the plugin and output a warning log.
+                        logTempStore['warn'].append(('There is no plugin.json file under this plugin \'%s\'. ', entry.name))
+                        continue
+                    # Read the configuration file and save it to the 'plugins'
+                    self.plugins[entry.name] = manifest.read(latteplugin, stat)
+            manifest.save()
+            logTempStore['debug'].append(('The plugin that was successfully read into the configuration is as follows: [%s]', Lazy(', '.join, self.plugins.keys())))
         except UnicodeError as e:
-            self.logger.exit(ConfigException('%s(%s)' % (e, 'make sure the configuration file is UTF-8 encoded.')))
+            Logger.exit(ConfigException('%s(%s)' % (e, 'make sure the configuration file is UTF-8 encoded.')))
         except ConfigException as e:
-            self.logger.exit(e)
+            Logger.exit(e)
         except Exception as e:
-            self.logger.exit(ConfigException(e))
-        #
+            Logger.exit(ConfigException(e))
+        # Output the temporarily stored logs
+        for args in logTempStore['debug']:
+            self.logger.debug(*args)
+        for args in logTempStore['warn']:
+            self.logger.warn(*args)
 
     # This is a way to get plugin configuration information using a key such as "multi.level.key".
     def get_plugin_config(self, k):
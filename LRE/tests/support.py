@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import atexit
+import shutil
+import tempfile
+import itertools
+
+# 测试使用的临时lattepath，导入这个模块时设置，必须在第一次读取配置之前导入
+# The temporary lattepath used by the tests, it is set when this module is imported, so it must be imported before the configuration is first read
+ROOT = tempfile.mkdtemp(prefix='latte-test-')
+atexit.register(shutil.rmtree, ROOT, True)
+os.environ['LATTEPATH'] = ROOT
+for variable in ('LATTE_PLUGIN_PATH', 'LATTE_CONFIG_PATH', 'LATTE_CACHE_PATH'):
+    os.environ.pop(variable, None)
+for folder in ('config', 'plugins'):
+    os.makedirs(os.sep.join([ROOT, folder]), exist_ok=True)
+# 写入的文件使用递增的mtime，这样配置清单缓存总能发现变化
+# Written files get increasing mtimes, so the manifest cache always notices the change
+_STAMPS = itertools.count(int(1e18))
+
+
+def _write(path, content):
+    with open(path, 'w') as output:
+        output.write(content)
+    stamp = next(_STAMPS)
+    os.utime(path, ns=(stamp, stamp))
+
+
+# 写入latte.json
+# Write latte.json
+def writeConfig(config):
+    _write(os.sep.join([ROOT, 'config', 'latte.json']), json.dumps(config))
+
+
+# 写入一个插件的plugin.json和入口模块
+# Write the plugin.json and the entry module of a plugin
+def writePlugin(name, config, source):
+    folder = os.sep.join([ROOT, 'plugins', name])
+    os.makedirs(folder, exist_ok=True)
+    _write(os.sep.join([folder, 'plugin.json']), json.dumps(dict(config, name=name, main='plugin')))
+    if source is not None:
+        _write(os.sep.join([folder, 'plugin.py']), source)
+
+
+writeConfig({'robot': {'name': 'LatteTest'}, 'logger': {'level': 'ERROR'}})
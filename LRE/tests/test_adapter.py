@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import base64
+import struct
+import asyncio
+import hashlib
+import unittest
+import support
+from lre.base import Logger
+from lre.adapter import LineJsonProtocol, WebSocketProtocol
+
+
+# 记录写出数据的传输层替身
+# A stand-in transport recording the data written to it
+class _Transport(object):
+    def __init__(self):
+        self.written = []
+        self.closed = False
+        self.paused = False
+
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 1) if name == 'peername' else default
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writelines(self, parts):
+        self.written.append(b''.join(bytes(part) for part in parts))
+
+    def close(self):
+        self.closed = True
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def output(self):
+        return b''.join(self.written)
+
+
+class LineJsonStreamTest(unittest.TestCase):
+    # 字节串的块以Base64发送，不会让流中途失败
+    # Byte string chunks are sent as Base64 and do not break the stream halfway
+    def testBytesChunks(self):
+        def chunks():
+            yield 'text'
+            yield b'\x00\xff'
+            yield {'key': 1}
+
+        async def run():
+            protocol = LineJsonProtocol(None)
+            transport = _Transport()
+            protocol.connection_made(transport)
+            await protocol.connection.stream(chunks())
+            return transport.output()
+
+        lines = [json.loads(line) for line in asyncio.run(run()).splitlines()]
+        self.assertEqual(lines, [{'stream': 1, 'text': 'text'}, {'stream': 1, 'base64': 'AP8='},
+                                 {'stream': 1, 'data': {'key': 1}}, {'stream': 1, 'done': True}])
+
+    def testBytesMessage(self):
+        protocol = LineJsonProtocol(None)
+        self.assertEqual(json.loads(b''.join(protocol.encode(b'ok'))), {'base64': 'b2s='})
+
+
+# 记录收到的消息的Server替身，gate被设置之前处理函数不会返回
+# A stand-in Server recording the received messages, handlers do not return before gate is set
+class _Server(object):
+    def __init__(self):
+        self.logger = Logger.bind('Latte.adapter')
+        self.messages = []
+        self.gate = None
+
+    async def received(self, connection, message):
+        self.messages.append(message)
+        if self.gate is not None:
+            await self.gate.wait()
+
+
+# 建立一个连接，收到的消息直接记录在返回的列表中，不经过收件箱
+# Make a connection whose received messages are recorded straight into the returned list, bypassing the inbox
+def _connect(protocol):
+    transport = _Transport()
+    protocol.connection_made(transport)
+    received = []
+    protocol.connection.received = received.extend
+    return transport, received
+
+
+# 按照事件循环的方式把data分成每次step字节写入协议的接收缓冲区
+# Write data into the receive buffer of the protocol step bytes at a time, the way the event loop does
+def _feed(protocol, data, step=None):
+    data = memoryview(data)
+    step = step or len(data)
+    while data and protocol.buffer is not None and not protocol.transport.closed:
+        buffer = protocol.get_buffer(step)
+        count = min(step, len(buffer), len(data))
+        buffer[:count] = data[:count]
+        data = data[count:]
+        protocol.buffer_updated(count)
+
+
+class FrameBufferTest(unittest.TestCase):
+    # 逐字节到达的消息与一次到达的结果相同
+    # Messages arriving byte by byte give the same result as arriving at once
+    def testSplitFrames(self):
+        lines = b'{"text":"a"}\n\n  \n{"text":"b"}\n"c"\n'
+        for step in (1, 3, 7, len(lines)):
+            protocol = LineJsonProtocol(_Server(), bufferSize=16)
+            transport, received = _connect(protocol)
+            _feed(protocol, lines, step)
+            self.assertEqual(received, [{'text': 'a'}, {'text': 'b'}, 'c'], step)
+            self.assertFalse(transport.closed)
+
+    # 缓冲区写满时剩余的不完整帧被移动到开头，缓冲区不增长
+    # When the buffer is full the remaining incomplete frame is moved to the beginning, the buffer does not grow
+    def testCompaction(self):
+        protocol = LineJsonProtocol(_Server(), bufferSize=16)
+        transport, received = _connect(protocol)
+        _feed(protocol, b'"0123456789"\n"ab')
+        self.assertEqual((protocol.start, protocol.end), (13, 16))
+        self.assertEqual(len(protocol.get_buffer(-1)), 13)
+        self.assertEqual((protocol.start, protocol.end), (0, 3))
+        _feed(protocol, b'c"\n')
+        self.assertEqual(received, ['0123456789', 'abc'])
+        self.assertEqual(len(protocol.buffer), 16)
+
+    # 一帧大于缓冲区时缓冲区增长，已经收到的部分被保留
+    # The buffer grows when a frame is larger than it, the part already received is kept
+    def testGrowth(self):
+        protocol = LineJsonProtocol(_Server(), bufferSize=16)
+        transport, received = _connect(protocol)
+        line = json.dumps('x' * 100).encode('utf-8') + b'\n'
+        _feed(protocol, line, 5)
+        self.assertEqual(received, ['x' * 100])
+        self.assertGreaterEqual(len(protocol.buffer), len(line))
+
+    # 超过maxFrame的帧关闭连接
+    # A frame beyond maxFrame closes the connection
+    def testMaxFrame(self):
+        protocol = LineJsonProtocol(_Server(), bufferSize=16, maxFrame=64)
+        transport, received = _connect(protocol)
+        _feed(protocol, b'"' + b'x' * 100, 8)
+        self.assertTrue(transport.closed)
+        self.assertEqual(received, [])
+
+    # 无效的JSON关闭连接
+    # Invalid JSON closes the connection
+    def testInvalidJson(self):
+        protocol = LineJsonProtocol(_Server())
+        transport, received = _connect(protocol)
+        _feed(protocol, b'{"text": 1}\n')
+        _feed(protocol, b'{nope\n')
+        self.assertTrue(transport.closed)
+        self.assertEqual(received, [{'text': 1}])
+
+
+# 客户端发送的带掩码的帧
+# A masked frame as sent by a client
+def _frame(opcode, payload, fin=True, mask=b'\x11\x22\x33\x44'):
+    first = (0x80 if fin else 0) | opcode
+    flag = 0 if mask is None else 0x80
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first, flag | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', first, flag | 126, length)
+    else:
+        header = struct.pack('!BBQ', first, flag | 127, length)
+    if mask is None:
+        return header + payload
+    return header + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+# 解析服务端写出的不带掩码的帧，返回(fin, 操作码, 负载)的列表
+# Parse the unmasked frames written by the server, returns a list of (fin, opcode, payload)
+def _serverFrames(data):
+    frames = []
+    while data:
+        first, length = data[0], data[1] & 0x7F
+        header = 2
+        if length == 126:
+            length, header = struct.unpack_from('!H', data, 2)[0], 4
+        elif length == 127:
+            length, header = struct.unpack_from('!Q', data, 2)[0], 10
+        frames.append((bool(first & 0x80), first & 0x0F, data[header:header + length]))
+        data = data[header + length:]
+    return frames
+
+
+_KEY = 'dGhlIHNhbXBsZSBub25jZQ=='
+_HANDSHAKE = ('GET /chat HTTP/1.1\r\nHost: example.com\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+              'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % _KEY).encode('latin-1')
+
+
+class WebSocketTest(unittest.TestCase):
+    # 完成握手的连接，握手的回复已经从输出中移除
+    # A connection that completed the handshake, the handshake reply is already removed from the output
+    def connect(self, **kwargs):
+        protocol = WebSocketProtocol(_Server(), **kwargs)
+        transport, received = _connect(protocol)
+        _feed(protocol, _HANDSHAKE)
+        self.assertTrue(protocol.upgraded)
+        del transport.written[:]
+        return protocol, transport, received
+
+    # 分多次到达的握手请求，Sec-WebSocket-Accept按RFC 6455计算
+    # A handshake request arriving in pieces, Sec-WebSocket-Accept is computed as RFC 6455 defines
+    def testHandshake(self):
+        protocol = WebSocketProtocol(_Server(), bufferSize=32)
+        transport, received = _connect(protocol)
+        _feed(protocol, _HANDSHAKE + _frame(0x1, b'hi'), 5)
+        reply = transport.output().decode('latin-1')
+        self.assertTrue(reply.startswith('HTTP/1.1 101 Switching Protocols\r\n'))
+        accept = base64.b64encode(hashlib.sha1(_KEY.encode('latin-1') + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+        self.assertIn('Sec-WebSocket-Accept: %s\r\n' % accept.decode('ascii'), reply)
+        self.assertEqual(accept, b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+        self.assertEqual(received, ['hi'])
+
+    # 不是升级请求时回复400并关闭连接
+    # A request that is not an upgrade gets 400 and the connection is closed
+    def testRejectedHandshake(self):
+        protocol = WebSocketProtocol(_Server())
+        transport, received = _connect(protocol)
+        _feed(protocol, b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.assertTrue(transport.output().startswith(b'HTTP/1.1 400 '))
+        self.assertTrue(transport.closed)
+
+    # 逐字节到达的带掩码的帧，包括16位和64位长度
+    # Masked frames arriving byte by byte, including 16-bit and 64-bit lengths
+    def testMaskedFrames(self):
+        protocol, transport, received = self.connect(bufferSize=64)
+        text = 'héllo'
+        data = bytes(range(256)) * 300
+        _feed(protocol, _frame(0x1, text.encode('utf-8')) + _frame(0x2, data[:200]) + _frame(0x2, data), 3)
+        self.assertEqual(received, [text, data[:200], data])
+
+    # 客户端的帧必须带掩码
+    # Frames from clients must be masked
+    def testUnmaskedFrame(self):
+        protocol, transport, received = self.connect()
+        _feed(protocol, _frame(0x1, b'hi', mask=None))
+        self.assertTrue(transport.closed)
+        self.assertEqual(received, [])
+
+    # 分片的消息被拼接，分片之间的ping立即得到带有相同负载的pong
+    # A fragmented message is joined, a ping between the fragments immediately gets a pong with the same payload
+    def testFragmentsAndPing(self):
+        protocol, transport, received = self.connect()
+        _feed(protocol, _frame(0x1, b'hel', fin=False) + _frame(0x9, b'are you there') + _frame(0x0, b'lo, ', fin=False), 2)
+        self.assertEqual(received, [])
+        self.assertEqual(_serverFrames(transport.output()), [(True, 0xA, b'are you there')])
+        _feed(protocol, _frame(0x0, b'world'))
+        self.assertEqual(received, ['hello, world'])
+
+    # 没有开始分片时的延续帧是协议错误
+    # A continuation frame without a started fragmented message is a protocol error
+    def testUnexpectedContinuation(self):
+        protocol, transport, received = self.connect()
+        _feed(protocol, _frame(0x0, b'orphan'))
+        self.assertTrue(transport.closed)
+
+    # 收到close帧时回复close帧并关闭连接
+    # A close frame is answered with a close frame and the connection is closed
+    def testClose(self):
+        protocol, transport, received = self.connect()
+        _feed(protocol, _frame(0x8, struct.pack('!H', 1001) + b'going away'))
+        self.assertEqual(_serverFrames(transport.output()), [(True, 0x8, struct.pack('!H', 1001))])
+        self.assertTrue(transport.closed)
+
+    # 帧头声明的长度超过maxFrame时不等待负载就关闭连接
+    # The connection is closed without waiting for the payload when the length in the header exceeds maxFrame
+    def testMaxFrame(self):
+        protocol, transport, received = self.connect(maxFrame=1024)
+        _feed(protocol, _frame(0x2, b'x' * 2048)[:16])
+        self.assertTrue(transport.closed)
+
+    # 流式回复是一条分片的消息，以空的结束帧结束
+    # A streaming reply is one fragmented message ending with an empty final frame
+    def testStreamFrames(self):
+        protocol, transport, received = self.connect()
+        state = protocol.openStream()
+        transport.writelines(protocol.encodeChunk(state, 'a'))
+        transport.writelines(protocol.encodeChunk(state, 'b'))
+        transport.writelines(protocol.encodeEnd(state))
+        self.assertEqual(_serverFrames(transport.output()), [(False, 0x1, b'a'), (False, 0x0, b'b'), (True, 0x0, b'')])
+
+
+class BackpressureTest(unittest.TestCase):
+    # 收件箱超过maxPending条时暂停读取，处理到一半以下时恢复
+    # Reading pauses while the inbox holds more than maxPending messages and resumes when it is handled down to half of it
+    def testPauseAndResume(self):
+        async def run():
+            server = _Server()
+            server.gate = asyncio.Event()
+            protocol = LineJsonProtocol(server, maxPending=4)
+            transport = _Transport()
+            protocol.connection_made(transport)
+            _feed(protocol, b''.join(b'%d\n' % index for index in range(8)))
+            self.assertTrue(transport.paused)
+            await asyncio.sleep(0)
+            self.assertEqual(server.messages, [0])
+            server.gate.set()
+            while len(server.messages) < 5:
+                await asyncio.sleep(0)
+            self.assertFalse(transport.paused)
+            while len(server.messages) < 8:
+                await asyncio.sleep(0)
+            protocol.connection_lost(None)
+            return server.messages
+
+        self.assertEqual(asyncio.run(run()), list(range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import support
+from lre.base import LatteConfig, PluginConfig
+from lre.admission import AdmissionController, TokenBucket
+from lre.error import AdmissionException
+
+
+# 写入插件的"admission"限制并重新读取这些插件的配置
+# Write the "admission" limits of plugins and read the configuration of those plugins again
+def _limits(**plugins):
+    for name, limits in plugins.items():
+        support.writePlugin(name, {'admission': limits}, None)
+    PluginConfig.reload(list(plugins))
+
+
+class TokenBucketTest(unittest.TestCase):
+    # 桶从满的状态开始，按rate补充令牌，最多burst个
+    # A bucket starts full and is refilled at rate tokens per second, up to burst
+    def testRefill(self):
+        bucket = TokenBucket(2, 3, now=0.0)
+        self.assertEqual([bucket.take(0.0) for _ in range(4)], [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+        self.assertFalse(bucket.full(1.0))
+        self.assertTrue(bucket.full(10.0))
+        self.assertEqual([bucket.take(10.0) for _ in range(4)], [True, True, True, False])
+
+    # 时钟回退不会产生令牌
+    # A clock going backwards does not create tokens
+    def testClockGoingBackwards(self):
+        bucket = TokenBucket(1, 1, now=10.0)
+        self.assertTrue(bucket.take(10.0))
+        self.assertFalse(bucket.take(5.0))
+        self.assertFalse(bucket.take(10.5))
+        self.assertTrue(bucket.take(11.0))
+
+    # rate为0时不限制
+    # No limit when rate is 0
+    def testUnlimited(self):
+        bucket = TokenBucket(0, 0, now=0.0)
+        self.assertTrue(all(bucket.take(0.0) for _ in range(100)))
+
+
+class AdmissionTest(unittest.TestCase):
+    # 令牌不足时以'rate'拒绝，回复配置的reject文本；用户的令牌桶彼此独立
+    # Rejected with 'rate' when tokens run out, with the configured reject text as reply; token buckets of users are independent
+    def testTokenBuckets(self):
+        _limits(limited={'rate': 1, 'burst': 2, 'reject': 'slow down'}, peruser={'userRate': 1, 'userBurst': 1})
+
+        async def run():
+            controller = AdmissionController(concurrency=4)
+            for _ in range(2):
+                await controller.acquire('limited')
+                controller.release()
+            with self.assertRaises(AdmissionException) as context:
+                await controller.acquire('limited')
+            self.assertEqual((context.exception.reason, context.exception.reply), ('rate', 'slow down'))
+            await controller.acquire('peruser', user='first')
+            controller.release()
+            with self.assertRaises(AdmissionException) as context:
+                await controller.acquire('peruser', user='first')
+            self.assertEqual((context.exception.reason, context.exception.reply), ('user', None))
+            await controller.acquire('peruser', user='second')
+            controller.release()
+            return controller.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats['plugins']['limited']['rejected'], {'rate': 1})
+        self.assertEqual(stats['plugins']['peruser'], {'waiting': 0, 'admitted': 2, 'rejected': {'user': 1}, 'users': 2})
+        self.assertEqual(stats['inflight'], 0)
+
+    # 排队的请求按照加权公平排队的虚拟完成时间获得槽位，权重大的插件更早得到槽位
+    # Queued requests get slots in order of their WFQ virtual finish time, plugins with a larger weight get slots earlier
+    def testWeightedFairQueuing(self):
+        _limits(heavy={'weight': 1}, light={'weight': 2}, holder={})
+
+        async def run():
+            controller = AdmissionController(concurrency=1)
+            order = []
+
+            async def request(plugin, tag):
+                await controller.acquire(plugin)
+                order.append(tag)
+                controller.release()
+            await controller.acquire('holder')
+            tasks = [asyncio.ensure_future(request('heavy', 'H%d' % index)) for index in range(1, 4)]
+            tasks += [asyncio.ensure_future(request('light', 'L%d' % index)) for index in range(1, 4)]
+            await asyncio.sleep(0)
+            self.assertEqual(controller.waiting, 6)
+            controller.release()
+            await asyncio.gather(*tasks)
+            return order, controller.inflight, controller.virtual
+
+        # heavy的完成时间为1, 2, 3，light的为0.5, 1, 1.5，完成时间相同时先排队的优先
+        # Finish times are 1, 2, 3 for heavy and 0.5, 1, 1.5 for light, the one queued first wins a tie
+        self.assertEqual(asyncio.run(run()), (['L1', 'H1', 'L2', 'L3', 'H2', 'H3'], 0, 0.0))
+
+    # 队列满时以'queue'拒绝，排队超时以'timeout'拒绝，超时的请求不会再得到槽位
+    # Rejected with 'queue' when the queue is full and with 'timeout' after waiting too long, a timed out request gets no slot later
+    def testQueueAndTimeout(self):
+        _limits(bounded={'queue': 1, 'timeout': 0.05})
+
+        async def run():
+            controller = AdmissionController(concurrency=1)
+            await controller.acquire('bounded')
+            waiting = asyncio.ensure_future(controller.acquire('bounded'))
+            await asyncio.sleep(0)
+            with self.assertRaises(AdmissionException) as context:
+                await controller.acquire('bounded')
+            self.assertEqual(context.exception.reason, 'queue')
+            with self.assertRaises(AdmissionException) as context:
+                await waiting
+            self.assertEqual(context.exception.reason, 'timeout')
+            self.assertEqual(controller.waiting, 0)
+            controller.release()
+            return controller.inflight
+
+        self.assertEqual(asyncio.run(run()), 0)
+
+    # 排队中被取消的请求离开队列；已经得到槽位后才被取消的请求通过release()把槽位转交给下一个
+    # A request cancelled while queued leaves the queue; one cancelled after it got its slot passes the slot on through release()
+    def testCancellation(self):
+        _limits(cancelled={})
+
+        async def run():
+            controller = AdmissionController(concurrency=1)
+            await controller.acquire('cancelled')
+            queued = asyncio.ensure_future(controller.acquire('cancelled'))
+            await asyncio.sleep(0)
+            queued.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await queued
+            self.assertEqual(controller.waiting, 0)
+
+            granted = asyncio.ensure_future(controller.acquire('cancelled'))
+            following = asyncio.ensure_future(controller.acquire('cancelled'))
+            await asyncio.sleep(0)
+            controller.release()
+            granted.cancel()
+            try:
+                # Python 3.11及更早版本的wait_for在结果已经设置时仍然返回它
+                # wait_for of Python 3.11 and earlier still returns the result when it was already set
+                await granted
+                controller.release()
+            except asyncio.CancelledError:
+                pass
+            await asyncio.wait_for(following, 1)
+            self.assertEqual((controller.inflight, controller.waiting), (1, 0))
+            controller.release()
+            return controller.inflight
+
+        self.assertEqual(asyncio.run(run()), 0)
+
+    # 配置变化后共享实例重新读取限制，令牌桶从满的状态开始
+    # The shared instance reads the limits again after the configuration changes, token buckets start full
+    def testResetOnConfigChange(self):
+        _limits(changing={'rate': 1, 'burst': 1})
+        controller = AdmissionController.instance()
+
+        async def take():
+            await controller.acquire('changing')
+            controller.release()
+
+        asyncio.run(take())
+        self.assertRaises(AdmissionException, asyncio.run, take())
+        _limits(changing={'rate': 1, 'burst': 3})
+        for _ in range(3):
+            asyncio.run(take())
+        self.assertRaises(AdmissionException, asyncio.run, take())
+
+        concurrency = controller.concurrency
+        support.writeConfig({'robot': {'name': 'LatteTest'}, 'logger': {'level': 'ERROR'}, 'admission': {'concurrency': concurrency + 1}})
+        try:
+            LatteConfig.reload()
+            self.assertEqual(controller.concurrency, concurrency + 1)
+        finally:
+            support.writeConfig({'robot': {'name': 'LatteTest'}, 'logger': {'level': 'ERROR'}})
+            LatteConfig.reload()
+        self.assertEqual(controller.concurrency, concurrency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import support
+from lre.batch import Batcher
+from lre.error import LatteException
+from lre.router import Router
+
+
+class BatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def handler(self, messages, matches):
+        self.batches.append(list(messages))
+        return [message * 2 for message in messages]
+
+    # 批满size条时立即调用处理函数，不等待wait
+    # The handler is called as soon as the batch holds size messages, without waiting for wait
+    def testFlushOnSize(self):
+        async def run():
+            batcher = Batcher('test', 'double', self.handler, size=3, wait=60)
+            futures = [asyncio.ensure_future(batcher.submit(index, None)) for index in range(4)]
+            results = await asyncio.wait_for(asyncio.gather(*futures[:3]), 1)
+            self.assertFalse(futures[3].done())
+            self.assertEqual(len(batcher), 1)
+            batcher.flush()
+            return results + [await futures[3]]
+
+        self.assertEqual(asyncio.run(run()), [0, 2, 4, 6])
+        self.assertEqual(self.batches, [[0, 1, 2], [3]])
+
+    # 批不满时第一条消息等待wait秒后调用处理函数
+    # When the batch is not full the handler is called wait seconds after the first message
+    def testFlushOnWait(self):
+        async def run():
+            loop = asyncio.get_running_loop()
+            batcher = Batcher('test', 'double', self.handler, size=100, wait=0.05)
+            start = loop.time()
+            results = await asyncio.gather(batcher.submit(1, None), batcher.submit(2, None))
+            return results, loop.time() - start, len(batcher)
+
+        results, elapsed, left = asyncio.run(run())
+        self.assertEqual(results, [2, 4])
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertEqual(self.batches, [[1, 2]])
+        self.assertEqual(left, 0)
+
+    # 处理函数的异常传给批中的每一条消息
+    # An exception of the handler is passed to every message of the batch
+    def testExceptionFansOut(self):
+        def failing(messages, matches):
+            raise ValueError('broken')
+
+        async def run():
+            batcher = Batcher('test', 'failing', failing, size=3, wait=60)
+            return await asyncio.gather(*[batcher.submit(index, None) for index in range(3)], return_exceptions=True)
+
+        errors = asyncio.run(run())
+        self.assertEqual([type(error) for error in errors], [ValueError] * 3)
+        self.assertIs(errors[0], errors[2])
+
+    # 结果的数量与消息不一致时每一条消息都得到LatteException
+    # Every message gets a LatteException when the number of results does not match the messages
+    def testWrongResultCount(self):
+        async def run():
+            batcher = Batcher('test', 'short', lambda messages, matches: messages[:1], size=2, wait=60)
+            return await asyncio.gather(batcher.submit(1, None), batcher.submit(2, None), return_exceptions=True)
+
+        self.assertEqual([type(error) for error in asyncio.run(run())], [LatteException] * 2)
+
+    # 协程形式的批处理函数被等待
+    # Coroutine batch handlers are awaited
+    def testCoroutineHandler(self):
+        async def handler(messages, matches):
+            await asyncio.sleep(0)
+            return [message + 1 for message in messages]
+
+        async def run():
+            batcher = Batcher('test', 'increment', handler, size=2, wait=60)
+            return await asyncio.gather(batcher.submit(1, None), batcher.submit(2, None))
+
+        self.assertEqual(asyncio.run(run()), [2, 3])
+
+    # 普通的批处理函数运行在路由器的executor中，而不是事件循环默认的线程池
+    # Plain batch handlers run in the executor of the router instead of the default executor of the event loop
+    def testRouterExecutor(self):
+        threads = []
+
+        def handler(messages, matches):
+            threads.append(threading.current_thread().name)
+            return messages
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LatteBatchTest')
+        router = Router(commandPrefixes=['/'], ignoreCase=False, resolver=lambda route: handler, executor=executor)
+        router.add('test', 'echo', commands=['echo'], batch={'size': 1})
+        router.build()
+
+        async def run():
+            match, = router.match('/echo')
+            return await router.callAsync(match, 'message')
+
+        try:
+            self.assertEqual(asyncio.run(run()), 'message')
+        finally:
+            executor.shutdown()
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('LatteBatchTest'))
+
+
+if __name__ == '__main__':
+    unittest.main()
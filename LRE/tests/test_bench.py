@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import contextlib
+import unittest
+import support
+from lre import bench
+
+
+class ImportBudgetTest(unittest.TestCase):
+    # 冷启动时导入lre.base并执行bootstrap不超过启动时间预算
+    # Importing lre.base and running bootstrap on a cold start stays within the startup budget
+    def testWithinBudget(self):
+        result = bench.benchImport(repeat=3)
+        self.assertTrue(result['withinBudget'], 'import %.3f s + bootstrap %.3f s > budget %.3f s' % (
+            result['import'], result['bootstrap'], bench.IMPORT_BUDGET))
+
+    # 超出预算时python -m lre.bench以非零状态退出
+    # python -m lre.bench exits with a non-zero status when the budget is exceeded
+    def testMainExitsOverBudget(self):
+        budget = bench.IMPORT_BUDGET
+        bench.IMPORT_BUDGET = 0.0
+        self.addCleanup(setattr, bench, 'IMPORT_BUDGET', budget)
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors), self.assertRaises(SystemExit) as raised:
+            bench.main(['import', '--quick'])
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn('the budget is 0.000 s', errors.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
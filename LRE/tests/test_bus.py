@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import support
+from lre.bus import EventBus
+
+
+# 记录收到的消息的订阅者
+# A subscriber recording the payloads it receives
+class _Recorder(object):
+    def __init__(self):
+        self.received = []
+
+    def __call__(self, topic, payload):
+        self.received.append((topic, payload))
+
+
+class TopicTrieTest(unittest.TestCase):
+    def patterns(self, bus, topic):
+        return sorted(subscription.pattern for subscription in bus.match(topic))
+
+    # '*'匹配一个层级，'#'匹配零个或多个层级
+    # '*' matches one level, '#' matches zero or more levels
+    def testWildcards(self):
+        bus = EventBus()
+        for pattern in ('weather.*.beijing', 'weather.#', 'weather.today.beijing', '*', '#', '*.today.#'):
+            bus.subscribe(pattern, _Recorder())
+        self.assertEqual(self.patterns(bus, 'weather.today.beijing'),
+                         ['#', '*.today.#', 'weather.#', 'weather.*.beijing', 'weather.today.beijing'])
+        self.assertEqual(self.patterns(bus, 'weather'), ['#', '*', 'weather.#'])
+        self.assertEqual(self.patterns(bus, 'weather.tomorrow.shanghai'), ['#', 'weather.#'])
+        self.assertEqual(self.patterns(bus, 'news.today'), ['#', '*.today.#'])
+        self.assertEqual(self.patterns(bus, 'news'), ['#', '*'])
+
+    # 发布的主题不能包含通配符，'#'只能出现在模式的最后，空的层级无效
+    # Published topics may not contain wildcards, '#' may only end a pattern, empty levels are invalid
+    def testInvalidTopics(self):
+        bus = EventBus()
+        for topic in ('weather.*', 'weather.#', '', 'weather..today'):
+            self.assertRaises(ValueError, bus.publish, topic)
+        for pattern in ('weather.#.today', '', 'weather.'):
+            self.assertRaises(ValueError, bus.subscribe, pattern, _Recorder())
+
+    # 匹配结果被缓存，订阅变化时缓存被清空
+    # Matches are cached, the cache is cleared when the subscriptions change
+    def testMatchCache(self):
+        bus = EventBus()
+        bus.subscribe('a.*', _Recorder())
+        matches = bus.match('a.b')
+        self.assertIs(bus.match('a.b'), matches)
+        subscription = bus.subscribe('a.b', _Recorder())
+        self.assertEqual(len(bus.match('a.b')), 2)
+        subscription.cancel()
+        self.assertEqual(len(bus.match('a.b')), 1)
+
+    # 缓存的主题数达到上限时缓存被清空
+    # The cache is cleared when it reaches the cap of cached topics
+    def testMatchCacheCap(self):
+        bus = EventBus()
+        bus._MATCH_CACHE_SIZE = 2
+        bus.subscribe('#', _Recorder())
+        first = bus.match('a')
+        bus.match('b')
+        self.assertIs(bus.match('a'), first)
+        bus.match('c')
+        self.assertIsNot(bus.match('a'), first)
+
+    # 取消订阅时删除因此变空的节点，forget()移除一个插件的全部订阅
+    # Nodes that become empty are removed on unsubscribing, forget() removes all subscriptions of a plugin
+    def testForgetRemovesEmptyNodes(self):
+        bus = EventBus()
+        bus.subscribe('x.y.z', _Recorder(), plugin='first')
+        bus.subscribe('x.y', _Recorder(), plugin='first')
+        bus.subscribe('x.w', _Recorder(), plugin='second')
+        self.assertEqual(bus.nodes(), 4)
+        bus.forget('first')
+        self.assertEqual((len(bus), bus.nodes()), (1, 2))
+        self.assertEqual(bus.match('x.y.z'), ())
+        bus.forget('second')
+        self.assertEqual((len(bus), bus.nodes()), (0, 0))
+
+
+class PublishTest(unittest.TestCase):
+    # 普通函数在发布者的线程中直接调用，异常被计数，不影响其它订阅者
+    # Plain functions are called directly on the publisher's thread, exceptions are counted and do not affect other subscribers
+    def testDirectSubscribers(self):
+        bus = EventBus()
+        recorder = _Recorder()
+
+        def failing(topic, payload):
+            raise ValueError('broken')
+        bus.subscribe('a.#', recorder)
+        broken = bus.subscribe('a.b', failing)
+        self.assertEqual(bus.publish('a.b', 1), 1)
+        self.assertEqual(recorder.received, [('a.b', 1)])
+        self.assertEqual(broken.errors, 1)
+
+    # 队列满时publish()丢弃消息并计数
+    # publish() drops the payload and counts it when the queue is full
+    def testQueueFullDrops(self):
+        bus = EventBus()
+
+        async def subscriber(topic, payload):
+            pass
+        subscription = bus.subscribe('a', subscriber, maxQueue=2)
+        self.assertEqual([bus.publish('a', index) for index in range(3)], [1, 1, 0])
+        self.assertEqual((len(subscription.queue), subscription.dropped), (2, 1))
+        self.assertEqual(bus.stats()[0]['dropped'], 1)
+
+    # 队列满时publishAsync()等待队列有空位，消息按顺序投递，不会丢弃
+    # publishAsync() waits for room when the queue is full, payloads are delivered in order and none is dropped
+    def testPublishAsyncBackpressure(self):
+        async def run():
+            bus = EventBus()
+            bus.start(asyncio.get_running_loop())
+            gate = asyncio.Event()
+            received = []
+
+            async def subscriber(topic, payload):
+                received.append(payload)
+                await gate.wait()
+            subscription = bus.subscribe('a', subscriber, maxQueue=1)
+            await asyncio.sleep(0)
+            self.assertEqual(await bus.publishAsync('a', 0), 1)
+            self.assertEqual(await bus.publishAsync('a', 1), 1)
+            blocked = asyncio.ensure_future(bus.publishAsync('a', 2))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked.done())
+            self.assertEqual(received, [0])
+            gate.set()
+            self.assertEqual(await blocked, 1)
+            while len(received) < 3:
+                await asyncio.sleep(0)
+            bus.stop()
+            return received, subscription.dropped
+
+        self.assertEqual(asyncio.run(run()), ([0, 1, 2], 0))
+
+    # 取消订阅会唤醒等待队列空位的发布者
+    # Unsubscribing wakes up publishers waiting for room in the queue
+    def testUnsubscribeWakesPublisher(self):
+        async def run():
+            bus = EventBus()
+            bus.start(asyncio.get_running_loop())
+            gate = asyncio.Event()
+
+            async def subscriber(topic, payload):
+                await gate.wait()
+            subscription = bus.subscribe('a', subscriber, maxQueue=1)
+            await asyncio.sleep(0)
+            await bus.publishAsync('a', 0)
+            await bus.publishAsync('a', 1)
+            blocked = asyncio.ensure_future(bus.publishAsync('a', 2))
+            await asyncio.sleep(0.01)
+            subscription.cancel()
+            result = await asyncio.wait_for(blocked, 1)
+            bus.stop()
+            return result
+
+        self.assertEqual(asyncio.run(run()), 0)
+
+    # pool为true的订阅者在executor中运行
+    # Subscribers with pool set run in the executor
+    def testPoolSubscriber(self):
+        threads = []
+
+        def subscriber(topic, payload):
+            threads.append(threading.current_thread().name)
+
+        async def run(executor):
+            bus = EventBus()
+            bus.start(asyncio.get_running_loop(), executor)
+            subscription = bus.subscribe('a', subscriber, pool=True)
+            await asyncio.sleep(0)
+            bus.publish('a')
+            while not subscription.delivered:
+                await asyncio.sleep(0.001)
+            bus.stop()
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='LatteBusTest') as executor:
+            asyncio.run(run(executor))
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('LatteBusTest'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import unittest
+import support
+from lre.base import PluginConfig
+from lre.cache import ResultCache, MISSING, memoize, normalize
+from lre.router import Router
+
+
+class SingleFlightTest(unittest.TestCase):
+    # 取消第一个请求不会取消合并到它上面的其它请求
+    # Cancelling the first request does not cancel the requests merged into it
+    def testCancelledOriginatorKeepsWaiters(self):
+        cache = ResultCache('test', ttl=60)
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return 42
+
+        async def run():
+            first = asyncio.ensure_future(cache.getOrCall('key', call))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(cache.getOrCall('key', call))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()), 42)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['merged'], 1)
+        self.assertEqual(cache.get('key'), 42)
+
+    # 失败时所有等待者收到同样的异常，并且之后可以重新执行
+    # On failure every waiter receives the same exception, and the call can run again afterwards
+    def testFailureIsShared(self):
+        cache = ResultCache('test', ttl=60)
+
+        async def call():
+            await asyncio.sleep(0.01)
+            raise ValueError('broken')
+
+        async def run():
+            return await asyncio.gather(cache.getOrCall('key', call), cache.getOrCall('key', call), return_exceptions=True)
+
+        first, second = asyncio.run(run())
+        self.assertIsInstance(first, ValueError)
+        self.assertIs(first, second)
+        self.assertIsInstance(asyncio.run(run())[0], ValueError)
+
+
+class ResultCacheTest(unittest.TestCase):
+    # 按照LRU淘汰，读取会刷新条目的位置
+    # Entries are evicted in LRU order, reading refreshes the position of an entry
+    def testLruEviction(self):
+        cache = ResultCache('test', maxEntries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (3, 1))
+
+    # 超过内存上限的值不会被缓存，内存超限时淘汰最久未使用的条目
+    # Values over the memory cap are not cached, the least recently used entries are evicted when memory is over the cap
+    def testMemoryCap(self):
+        cache = ResultCache('test', maxBytes=2000)
+        self.assertFalse(cache.put('big', 'x' * 4000))
+        self.assertIs(cache.get('big'), MISSING)
+        self.assertTrue(cache.put('first', 'x' * 800))
+        self.assertTrue(cache.put('second', 'x' * 800))
+        self.assertTrue(cache.put('third', 'x' * 800))
+        self.assertIs(cache.get('first'), MISSING)
+        self.assertLessEqual(cache.bytes, 2000)
+        cache.clear()
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+
+    # 条目在过期时间之后不再返回，ttl为0时不过期
+    # An entry is no longer returned after it expires, a ttl of 0 never expires
+    def testExpiry(self):
+        cache = ResultCache('test', ttl=0)
+        cache.put('short', 1, ttl=0.01)
+        cache.put('forever', 2)
+        time.sleep(0.02)
+        self.assertIs(cache.get('short'), MISSING)
+        self.assertEqual(cache.get('forever'), 2)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    # 插件的缓存使用plugin.json中的限制，配置变化时被清空并重新读取限制
+    # The cache of a plugin uses the limits in plugin.json, it is cleared and reads the limits again when the configuration changes
+    def testInstanceFollowsPluginConfig(self):
+        support.writePlugin('cached', {'cache': {'maxEntries': 3}}, None)
+        PluginConfig.reload(['cached'])
+        cache = ResultCache.instance('cached')
+        self.assertIs(ResultCache.instance('cached'), cache)
+        self.assertEqual(cache.maxEntries, 3)
+        cache.put('key', 'value')
+        support.writePlugin('cached', {'cache': {'maxEntries': 5}}, None)
+        PluginConfig.reload(['cached'])
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(ResultCache.instance('cached').maxEntries, 5)
+
+
+class CachedHandlerTest(unittest.TestCase):
+    # 空白和大小写不同的消息命中同一条缓存，处理函数只执行一次
+    # Messages differing in whitespace and case hit the same entry, the handler runs only once
+    def testNormalizedHits(self):
+        self.assertEqual(normalize('  Hello\t  WORLD '), 'hello world')
+        calls = []
+
+        @memoize(ttl=60)
+        def handler(message, match):
+            calls.append(message)
+            return len(calls)
+        ResultCache.invalidate('memo')
+        router = Router(commandPrefixes=['/'], ignoreCase=True, resolver=lambda route: handler)
+        router.add('memo', 'handler', keywords=['hello'])
+        router.build()
+
+        async def run():
+            first = await router.dispatchAsync('hello world')
+            second = await router.dispatchAsync('  HELLO   world ')
+            return [result for match, result in first + second]
+        self.assertEqual(asyncio.run(run()), [1, 1])
+        self.assertEqual(len(calls), 1)
+        ResultCache.invalidate('memo')
+
+    # plugin.json中的"cache"优先于@memoize，生成器函数从不缓存
+    # "cache" in plugin.json takes precedence over @memoize, generator functions are never cached
+    def testCacheOptions(self):
+        @memoize
+        def plain(message, match):
+            pass
+
+        def generator(message, match):
+            yield 1
+        router = Router(commandPrefixes=['/'], ignoreCase=False, resolver=lambda route: None)
+        declared = router.add('test', 'plain', cache={'ttl': 5})
+        undeclared = router.add('test', 'plain')
+        self.assertEqual(Router.cacheOf(declared, plain), {'ttl': 5})
+        self.assertEqual(Router.cacheOf(undeclared, plain), {})
+        self.assertEqual(memoize(ttl=30)(lambda message, match: None).latteCache, {'ttl': 30})
+        self.assertIsNone(Router.cacheOf(undeclared, lambda message, match: None))
+        self.assertIsNone(Router.cacheOf(declared, memoize(generator)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import threading
+import unittest
+import support
+from lre.base import LatteConfig, PluginConfig
+from lre.error import ConfigException
+from lre.manifest import ManifestCache
+from lre.watcher import FileWatcher, ConfigWatcher
+
+_DEFAULT = {'robot': {'name': 'LatteTest'}, 'logger': {'level': 'ERROR'}}
+
+
+def _manifest():
+    return ManifestCache.instance(os.sep.join([LatteConfig.getConfig('sys.path.cache'), 'manifest']))
+
+
+def _touch(path, content='{}'):
+    with open(path, 'w') as output:
+        output.write(content)
+    stamp = int(os.stat(path).st_mtime_ns) + 1000000
+    os.utime(path, ns=(stamp, stamp))
+
+
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        LatteConfig.snapshot()
+        self.addCleanup(self.restore)
+
+    @staticmethod
+    def restore():
+        support.writeConfig(_DEFAULT)
+        LatteConfig.reload()
+
+    # 有效的latte.json替换快照，订阅者只收到它订阅的前缀下的变化
+    # A valid latte.json replaces the snapshot, a subscriber only receives the changes under its prefix
+    def testReloadPublishesChanges(self):
+        received = []
+        LatteConfig.subscribe(received.append, 'watch')
+        self.addCleanup(LatteConfig.unsubscribe, received.append)
+        old = LatteConfig.snapshot()
+        support.writeConfig(dict(_DEFAULT, watch={'interval': 5}, robot={'name': 'Renamed'}))
+        changes = LatteConfig.reload()
+        self.assertEqual(changes['watch.interval'], (1, 5))
+        self.assertEqual(changes['robot.name'], ('LatteTest', 'Renamed'))
+        self.assertEqual(received, [{'watch.interval': (1, 5)}])
+        self.assertEqual(LatteConfig.snapshot().version, old.version + 1)
+        self.assertEqual(LatteConfig.reload(), {})
+
+    # 无效的latte.json被拒绝，之前的快照保持不变，订阅者不会收到通知
+    # An invalid latte.json is rejected, the previous snapshot is kept and the subscribers are not notified
+    def testInvalidConfigKeepsSnapshot(self):
+        received = []
+        LatteConfig.subscribe(received.append)
+        self.addCleanup(LatteConfig.unsubscribe, received.append)
+        support.writeConfig(dict(_DEFAULT, watch={'interval': 2}))
+        LatteConfig.reload()
+        received.clear()
+        old = LatteConfig.snapshot()
+        for config in (dict(_DEFAULT, watch=5), dict(_DEFAULT, watch={'interval': 'often'}), [1, 2]):
+            support.writeConfig(config)
+            self.assertRaises(ConfigException, LatteConfig.reload)
+            self.assertIs(LatteConfig.snapshot(), old)
+        _touch(os.sep.join([support.ROOT, 'config', 'latte.json']), '{"watch": ')
+        self.assertRaises(ValueError, LatteConfig.reload)
+        self.assertIs(LatteConfig.snapshot(), old)
+        self.assertEqual(LatteConfig.getTypedConfig('watch.interval', float), 2.0)
+        self.assertEqual(received, [])
+
+    # 只有发生变化的plugin.json被重新解析，其它插件沿用之前的配置
+    # Only the plugin.json files that changed are parsed again, the other plugins keep their previous configuration
+    def testOnlyChangedPluginsAreRead(self):
+        support.writePlugin('first', {'value': 1}, None)
+        support.writePlugin('second', {'value': 2}, None)
+        PluginConfig.reload()
+        manifest = _manifest()
+        misses = manifest.misses
+        self.assertEqual(PluginConfig.reload(), {})
+        self.assertEqual(manifest.misses, misses)
+        support.writePlugin('second', {'value': 3}, None)
+        self.assertEqual(PluginConfig.reload(), {'second.value': (2, 3)})
+        self.assertEqual(manifest.misses, misses + 1)
+        # 只重新加载指定的插件时，其它插件的变化不会被读取
+        # When only the named plugins are reloaded, changes to the other plugins are not read
+        support.writePlugin('first', {'value': 4}, None)
+        support.writePlugin('second', {'value': 5}, None)
+        self.assertEqual(PluginConfig.reload(['first']), {'first.value': (1, 4)})
+        self.assertEqual(PluginConfig.getConfig('second.value'), 3)
+
+    # 无效的plugin.json被拒绝，这个插件继续使用之前的配置
+    # An invalid plugin.json is rejected and the plugin keeps its previous configuration
+    def testInvalidPluginKeepsConfig(self):
+        support.writePlugin('broken', {'value': 1}, None)
+        PluginConfig.reload(['broken'])
+        _touch(os.sep.join([support.ROOT, 'plugins', 'broken', 'plugin.json']), '[1, ')
+        self.assertEqual(PluginConfig.reload(['broken']), {})
+        self.assertEqual(PluginConfig.getConfig('broken.value'), 1)
+
+
+class FileWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.root = os.sep.join([support.ROOT, 'watched'])
+        os.makedirs(os.sep.join([self.root, 'one']), exist_ok=True)
+        self.file = os.sep.join([support.ROOT, 'watched.json'])
+        _touch(self.file)
+        _touch(os.sep.join([self.root, 'one', 'plugin.json']))
+        self.changes = []
+        self.watcher = FileWatcher(self.changes.append, interval=0.01, inotify=False)
+        self.watcher.watch(self.file)
+        self.watcher.watchTree(self.root, 'plugin.json')
+
+    # check()比较(mtime, size)，报告修改、新建和删除的文件，没有变化时不调用回调
+    # check() compares (mtime, size) and reports modified, created and removed files, the callback is not called without changes
+    def testCheck(self):
+        tree = os.sep.join([self.root, 'one', 'plugin.json'])
+        self.assertEqual(self.watcher.check(), {self.file, tree})
+        self.assertEqual(self.watcher.check(), set())
+        _touch(self.file, '{"changed": true}')
+        self.assertEqual(self.watcher.check(), {self.file})
+        os.makedirs(os.sep.join([self.root, 'two']))
+        added = os.sep.join([self.root, 'two', 'plugin.json'])
+        self.assertEqual(self.watcher.check(), set())
+        _touch(added)
+        self.assertEqual(self.watcher.check(), {added})
+        os.remove(tree)
+        self.assertEqual(self.watcher.check(), {tree})
+        self.assertEqual(self.changes, [{self.file, tree}, {self.file}, {added}, {tree}])
+
+    # 回调出错不会影响之后的检查
+    # A failing callback does not affect later checks
+    def testFailingCallback(self):
+        watcher = FileWatcher(lambda paths: 1 / 0, inotify=False)
+        watcher.watch(self.file)
+        self.assertEqual(watcher.check(), {self.file})
+        _touch(self.file, '{"again": true}')
+        self.assertEqual(watcher.check(), {self.file})
+
+    # 没有inotify时按照interval轮询
+    # It polls every interval without inotify
+    def testPolling(self):
+        changed = threading.Event()
+        watcher = FileWatcher(lambda paths: changed.set(), interval=0.01, inotify=False)
+        watcher.watch(self.file)
+        watcher.start()
+        try:
+            _touch(self.file, '{"polled": true}')
+            self.assertTrue(changed.wait(5))
+        finally:
+            watcher.stop()
+
+    # ConfigWatcher只重新加载发生变化的插件，无效的latte.json只会被记录
+    # ConfigWatcher only reloads the plugins that changed, an invalid latte.json is only logged
+    def testConfigWatcher(self):
+        support.writePlugin('watchedone', {'value': 1}, None)
+        support.writePlugin('watchedtwo', {'value': 1}, None)
+        PluginConfig.reload()
+        watcher = ConfigWatcher(inotify=False)
+        support.writePlugin('watchedone', {'value': 2}, None)
+        support.writePlugin('watchedtwo', {'value': 2}, None)
+        old = LatteConfig.snapshot()
+        support.writeConfig(dict(_DEFAULT, watch=5))
+        try:
+            watcher.changed({watcher.latteConfig, os.sep.join([support.ROOT, 'plugins', 'watchedone', 'plugin.json'])})
+            self.assertIs(LatteConfig.snapshot(), old)
+            self.assertEqual(PluginConfig.getConfig('watchedone.value'), 2)
+            self.assertEqual(PluginConfig.getConfig('watchedtwo.value'), 1)
+        finally:
+            support.writeConfig(_DEFAULT)
+            LatteConfig.reload()
+
+
+if __name__ == '__main__':
+    unittest.main()
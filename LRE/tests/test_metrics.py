@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import support
+from lre.base import LatteConfig
+from lre.metrics import Metrics, Histogram
+
+_DEFAULT = {'robot': {'name': 'LatteTest'}, 'logger': {'level': 'ERROR'}}
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        Metrics.reset()
+        self.addCleanup(Metrics.reset)
+
+    # 重新加载latte.json后metrics.enable的变化立即生效
+    # A change of metrics.enable takes effect as soon as latte.json is reloaded
+    def testEnabledFollowsReload(self):
+        self.assertTrue(Metrics.enabled())
+        support.writeConfig(dict(_DEFAULT, metrics={'enable': False}))
+        try:
+            LatteConfig.reload()
+            self.assertFalse(Metrics.enabled())
+            Metrics.incr('metered', 'calls')
+            self.assertNotIn('metered', Metrics.snapshot()['plugins'])
+        finally:
+            support.writeConfig(_DEFAULT)
+            LatteConfig.reload()
+        self.assertTrue(Metrics.enabled())
+        Metrics.incr('metered', 'calls')
+        self.assertEqual(Metrics.snapshot()['plugins']['metered']['counters'], {'calls': 1})
+
+    # timed()记录耗时，异常被计入'<名称>.errors'
+    # timed() records the time spent, exceptions count towards '<name>.errors'
+    def testTimed(self):
+        with Metrics.timed('metered', 'work'):
+            pass
+        with self.assertRaises(KeyError), Metrics.timed('metered', 'work'):
+            raise KeyError()
+        stats = Metrics.snapshot()['plugins']['metered']
+        self.assertEqual(stats['counters'], {'work.errors': 1})
+        self.assertEqual(stats['timers']['work']['count'], 2)
+
+    # 分位数在桶内插值，并且不超过最大值
+    # Quantiles are interpolated within a bucket and never exceed the maximum
+    def testPercentile(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(0.5), 0.0)
+        for _ in range(99):
+            histogram.observe(0.0015)
+        histogram.observe(0.3)
+        self.assertTrue(0.001 < histogram.percentile(0.5) <= 0.002)
+        self.assertEqual(histogram.percentile(1.0), 0.3)
+        self.assertEqual(histogram.snapshot()['max'], 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
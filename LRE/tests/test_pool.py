@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import support
+from lre.error import PoolException
+from lre.pool import ConnectionPool
+
+
+# 本地的替身HTTP服务器，每条连接只回答limit个请求，之后收到请求时直接关闭连接
+# A local stand-in HTTP server, every connection answers only limit requests and is closed on the next request after that
+# 指定idle时，每个响应之后过idle秒再主动发送一个408响应，就像关闭空闲连接的服务器
+# With idle, an unsolicited 408 response is sent idle seconds after every response, like a server closing idle connections
+class _StandIn(object):
+    def __init__(self, limit=None, idle=None):
+        self.limit = limit
+        self.idle = idle
+        self.accepted = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __handle(self, reader, writer):
+        self.accepted += 1
+        answered = 0
+        try:
+            while True:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                if self.limit is not None and answered >= self.limit:
+                    break
+                answered += 1
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+                await writer.drain()
+                if self.idle is not None:
+                    await asyncio.sleep(self.idle)
+                    writer.write(b'HTTP/1.1 408 Request Timeout\r\nContent-Length: 0\r\n\r\n')
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _run(test, limit=None, idle=None, **options):
+    async def run():
+        server = _StandIn(limit, idle)
+        port = await server.start()
+        pool = ConnectionPool(**options)
+        try:
+            return await test(server, pool, 'http://127.0.0.1:%d/' % port)
+        finally:
+            pool.stop()
+            await server.stop()
+    return asyncio.run(run())
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    # 连续的请求复用同一条连接
+    # Consecutive requests reuse the same connection
+    def testKeepAlive(self):
+        async def test(server, pool, url):
+            for _ in range(3):
+                response = await pool.request('GET', url)
+                self.assertEqual((response.status, response.body), (200, b'ok'))
+            self.assertEqual(server.accepted, 1)
+        _run(test)
+
+    # 复用的连接失效时，幂等的请求用新的连接重试
+    # An idempotent request is retried on a new connection when the reused connection is stale
+    def testRetryStaleConnection(self):
+        async def test(server, pool, url):
+            await pool.request('GET', url)
+            response = await pool.request('GET', url)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(server.accepted, 2)
+        _run(test, limit=1)
+
+    # 重试最多一次，即使还有其它失效的空闲连接
+    # There is at most one retry, even when more stale idle connections are left
+    def testRetryOnlyOnce(self):
+        async def test(server, pool, url):
+            await asyncio.gather(pool.request('GET', url), pool.request('GET', url))
+            self.assertEqual(server.accepted, 2)
+            with self.assertRaises((ConnectionError, asyncio.IncompleteReadError)):
+                await pool.request('GET', url)
+            self.assertEqual(server.accepted, 2)
+        _run(test, limit=1)
+
+    # 没有解析出任何地址时抛出PoolException
+    # PoolException is raised when no address was resolved
+    def testNoAddress(self):
+        async def resolve(host, port=0):
+            return []
+
+        async def test(server, pool, url):
+            pool.resolve = resolve
+            with self.assertRaises(PoolException):
+                await pool.request('GET', url)
+        _run(test)
+
+
+    # 空闲时收到数据的连接不会被复用
+    # A connection that received data while idle is not reused
+    def testUnsolicitedData(self):
+        async def test(server, pool, url):
+            await pool.request('GET', url)
+            await asyncio.sleep(0.05)
+            response = await pool.request('GET', url)
+            self.assertEqual((response.status, response.body), (200, b'ok'))
+            self.assertEqual(server.accepted, 2)
+        _run(test, idle=0.01)
+
+    # 被唤醒去新建连接的请求在取消时，把这个名额转交给下一个等待的请求
+    # A request woken up to open a new connection passes that right on to the next waiting request when it is cancelled
+    def testCancelledWaiterPassesOn(self):
+        async def test(server, pool, url):
+            port = int(url.rsplit(':', 1)[1].strip('/'))
+            first = await pool.acquire('127.0.0.1', port)
+            cancelled = asyncio.ensure_future(pool.acquire('127.0.0.1', port))
+            waiting = asyncio.ensure_future(pool.acquire('127.0.0.1', port))
+            await asyncio.sleep(0.01)
+            first.discard()
+            pool.release(first)
+            cancelled.cancel()
+            try:
+                # Python 3.11及更早版本的wait_for可能仍然返回已经交出的结果
+                # wait_for of Python 3.11 and earlier may still return the result already handed over
+                pool.release(await cancelled)
+            except asyncio.CancelledError:
+                pass
+            connection = await waiting
+            self.assertIsNotNone(connection)
+            pool.release(connection)
+        _run(test, maxPerHost=1, acquireTimeout=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import support
+from lre.base import PluginConfig
+from lre.router import Router, KeywordAutomaton
+
+
+def _router(*patterns):
+    router = Router(commandPrefixes=['/'], ignoreCase=False, resolver=lambda route: None)
+    for index, pattern in enumerate(patterns):
+        router.add('test', 'h%d' % index, patterns=[pattern])
+    router.build()
+    return router
+
+
+class RouterPatternTest(unittest.TestCase):
+    # 没有必需字面量的正则全部都要报告，而不只是最靠左的那个
+    # Every pattern without a required literal is reported, not only the leftmost one
+    def testAllLiteralFreePatternsMatch(self):
+        router = _router(r'\d+', r'[a-z]+', r'(\d+)(?=\s*kg)')
+        self.assertEqual([match.value for match in router.match('hello 42')], [r'\d+', r'[a-z]+'])
+        self.assertEqual([match.value for match in router.match('5 kg')], [r'\d+', r'[a-z]+', r'(\d+)(?=\s*kg)'])
+        self.assertEqual(router.match('!!!'), [])
+
+    # 处理函数得到的分组与声明的正则一致，前瞻也不例外
+    # The groups the handler gets agree with the declared pattern, lookaheads included
+    def testGroupsOfLookaheadPattern(self):
+        router = _router(r'(\d+)(?=\s*kg)')
+        match, = router.match('take 5 kg')
+        self.assertEqual(match.regex.groups(), ('5',))
+        self.assertEqual((match.start, match.end), (5, 6))
+
+    # 有必需字面量的正则与没有的正则同时匹配
+    # Patterns with and without a required literal match together
+    def testGuardedAndMergedPatterns(self):
+        router = _router(r'order (\d+)', r'\d+')
+        matches = router.match('order 7')
+        self.assertEqual([match.value for match in matches], [r'order (\d+)', r'\d+'])
+        self.assertEqual(matches[0].regex.group(1), '7')
+
+    # 命令需要单词边界，不区分大小写时命令和关键字都按小写匹配
+    # Commands need a word boundary, with ignoreCase both commands and keywords match in lower case
+    def testCommandsAndKeywords(self):
+        router = Router(commandPrefixes=['/'], ignoreCase=True, resolver=lambda route: None)
+        router.add('test', 'help', commands=['help'])
+        router.add('test', 'weather', keywords=['weather'])
+        router.build()
+        self.assertEqual([match.kind for match in router.match('/HELP weather')], ['command', 'keyword'])
+        self.assertEqual([match.kind for match in router.match('/helpme')], [])
+
+
+class RouterIndexTest(unittest.TestCase):
+    # 关键字自动机一次扫描找出全部关键字，包括重叠和互为后缀的关键字
+    # The keyword automaton finds every keyword in one scan, overlapping keywords and keywords that are suffixes of others included
+    def testKeywordAutomaton(self):
+        automaton = KeywordAutomaton()
+        for keyword in ('he', 'she', 'his', 'hers'):
+            automaton.add(keyword, keyword.upper())
+        automaton.build()
+        self.assertEqual([(start, end, keyword) for start, end, keyword, value in automaton.search('ushers')],
+                         [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')])
+
+    # 每条路由最多出现一次，顺序为命令和前缀（较长的优先）、关键字、正则
+    # Every route appears at most once, in the order commands and prefixes (longer first), keywords, patterns
+    def testOrderAndDeduplication(self):
+        router = Router(commandPrefixes=['/', '!'], ignoreCase=False, resolver=lambda route: None)
+        router.add('test', 'short', prefixes=['wea'])
+        router.add('test', 'command', commands=['weather'])
+        router.add('test', 'keyword', keywords=['rain', 'sun'])
+        router.add('test', 'pattern', patterns=[r'(\d+) days'])
+        router.add('test', 'all', commands=['weather'], keywords=['rain'], patterns=['rain'])
+        router.build()
+        self.assertEqual([(match.route.handler, match.kind) for match in router.match('!weather sun rain 3 days')],
+                         [('command', 'command'), ('all', 'command'), ('keyword', 'keyword'), ('pattern', 'pattern')])
+        self.assertEqual([(match.route.handler, match.kind) for match in router.match('weather rain')],
+                         [('short', 'prefix'), ('keyword', 'keyword'), ('all', 'keyword')])
+        self.assertEqual([match.route.handler for match in router.match('/weather')], ['command', 'all'])
+
+    # 带有标志或反向引用的正则单独匹配，含义不变
+    # Patterns with flags or back references are matched alone and keep their meaning
+    def testFlagsAndBackReferences(self):
+        router = _router(r'(?i)^yes$', r'(\w)\1', r'\bno\b')
+        self.assertEqual([match.value for match in router.match('YES')], [r'(?i)^yes$'])
+        self.assertEqual([match.value for match in router.match('look no')], [r'\bno\b', r'(\w)\1'])
+        self.assertEqual(router.match('yes sir'), [])
+
+    # 从plugin.json构建路由器时跳过无效的处理函数声明，有效的声明不受影响
+    # Invalid handler declarations are skipped when building from plugin.json, the valid ones are not affected
+    def testFromPlugins(self):
+        support.writePlugin('routed', {'handlers': [
+            {'commands': ['nohandler']},
+            {'handler': 'broken', 'patterns': ['(']},
+            {'handler': 'hello', 'commands': ['hello'], 'keywords': ['hi']}]}, None)
+        PluginConfig.reload(['routed'])
+        router = Router.fromPlugins(['routed'], commandPrefixes=['/'], ignoreCase=False, resolver=lambda route: None)
+        self.assertEqual([route.handler for route in router.routes], ['hello'])
+        self.assertEqual([match.kind for match in router.match('/hello hi')], ['command'])
+        self.assertEqual([match.kind for match in router.match('oh hi')], ['keyword'])
+
+    # 处理函数只解析一次，forget()之后重新解析；dispatchAsync等待协程形式的处理函数
+    # A handler is resolved only once and again after forget(); dispatchAsync awaits coroutine handlers
+    def testResolveAndDispatch(self):
+        resolved = []
+
+        async def echo(message, match):
+            return '%s:%s' % (message, match.value)
+
+        def resolver(route):
+            resolved.append(route.handler)
+            return echo if route.handler == 'echo' else (lambda message, match: message)
+        router = Router(commandPrefixes=['/'], ignoreCase=False, resolver=resolver)
+        router.add('test', 'echo', commands=['echo'])
+        router.add('other', 'plain', keywords=['echo'])
+        router.build()
+        self.assertEqual([result for match, result in asyncio.run(router.dispatchAsync('/echo', 'm'))], ['m:echo', 'm'])
+        self.assertEqual([result for match, result in router.dispatch('echo', 'n')], ['n'])
+        self.assertEqual(resolved, ['echo', 'plain'])
+        router.forget('other')
+        router.dispatch('echo', 'n')
+        self.assertEqual(resolved, ['echo', 'plain', 'plain'])
+
+
+if __name__ == '__main__':
+    unittest.main()
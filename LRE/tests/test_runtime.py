@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import support
+from lre.base import bootstrap, PluginConfig
+from lre.loader import PluginLoader
+from lre.metrics import Metrics
+from lre.runtime import Runtime
+from lre.stream import END
+
+# 插件的公共部分：一个一直运行的Server让运行时保持运行，events记录处理函数和teardown()的顺序
+# The common part of the plugins: a Server that keeps running keeps the runtime alive, events records the order of handlers and teardown()
+_COMMON = '''
+import asyncio
+from lre.abc import Server
+
+events = []
+
+
+class Idle(Server):
+    async def serving(self):
+        await asyncio.Event().wait()
+
+
+def servers():
+    return [Idle()]
+
+
+def teardown():
+    events.append('teardown')
+'''
+
+_STREAMER = _COMMON + '''
+
+def chunks(message, match):
+    for index in range(3):
+        events.append('chunk')
+        yield str(index)
+'''
+
+
+# 加载插件并在运行中的运行时里执行test(runtime)，lazy中的插件按需激活
+# Load the plugins and run test(runtime) inside a running runtime, the plugins in lazy are activated on demand
+def _run(test, *names, lazy=()):
+    bootstrap()
+    PluginConfig.reload(list(names) + list(lazy))
+    runtime = Runtime(PluginLoader(workers=1).load(list(names), reload=True), shutdownTimeout=5, lazy=lazy)
+
+    async def run():
+        main = asyncio.ensure_future(runtime.main())
+        while not runtime.tasks:
+            await asyncio.sleep(0.001)
+        try:
+            return await test(runtime)
+        finally:
+            runtime.stop()
+            await main
+    return asyncio.run(run())
+
+
+class StreamingTest(unittest.TestCase):
+    # 重新加载插件会等待仍在发送的流式回复，teardown()在最后一块之后才被调用
+    # Reloading a plugin waits for a streaming reply still being sent, teardown() is only called after the last chunk
+    def testReloadWaitsForOpenStream(self):
+        support.writePlugin('streamer', {'handlers': [{'handler': 'chunks', 'commands': ['stream']}]}, _STREAMER)
+
+        async def test(runtime):
+            module = runtime.plugins[0].module
+            (match, stream), = await runtime.dispatch('/stream')
+            self.assertEqual(await stream.next(), '0')
+            reload = asyncio.ensure_future(runtime.reloadPlugin('streamer'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(reload.done())
+            self.assertEqual([await stream.next(), await stream.next()], ['1', '2'])
+            self.assertIs(await stream.next(), END)
+            self.assertIsNotNone(await reload)
+            self.assertEqual(module.events, ['chunk', 'chunk', 'chunk', 'teardown'])
+        _run(test, 'streamer')
+
+    # 流式回复在读完或者被关闭之前一直占用准入控制的执行槽位
+    # A streaming reply holds its admission slot until it is read or closed
+    def testStreamHoldsAdmissionSlot(self):
+        support.writePlugin('admitted', {'admission': {}, 'handlers': [{'handler': 'chunks', 'commands': ['stream']}]}, _STREAMER)
+
+        async def test(runtime):
+            (match, stream), = await runtime.dispatch('/stream')
+            self.assertEqual(runtime.admission.inflight, 1)
+            self.assertEqual(await stream.next(), '0')
+            await stream.close()
+            self.assertEqual(runtime.admission.inflight, 0)
+        _run(test, 'admitted')
+
+
+_ECHO = _COMMON + '''
+
+def echo(message, match):
+    return 'echo'
+
+
+def other(message, match):
+    return 'other'
+'''
+
+
+_FAILING = _ECHO + '''
+
+def fail(message, match):
+    raise RuntimeError('failed')
+'''
+
+
+class DispatchTest(unittest.TestCase):
+    # 一个处理函数出错时同一条消息的其它匹配仍然被处理，错误被计入指标
+    # When one handler fails the other matches of the same message are still handled, and the error is counted in the metrics
+    def testFailingHandlerIsSkipped(self):
+        support.writePlugin('failing', {'handlers': [
+            {'handler': 'fail', 'commands': ['go']}, {'handler': 'echo', 'keywords': ['go']}]}, _FAILING)
+
+        async def test(runtime):
+            self.assertEqual([result for match, result in await runtime.dispatch('/go')], ['echo'])
+            self.assertEqual(Metrics.snapshot()['plugins']['failing']['counters']['handler.fail.errors'], 1)
+        _run(test, 'failing')
+
+
+class RouterUpdateTest(unittest.TestCase):
+    # 按需激活和卸载插件不会重新构建路由器，只会换成新模块中的处理函数
+    # Activating and unloading a plugin on demand does not rebuild the router, only the handlers are swapped for the ones in the new module
+    def testLazyPluginKeepsRouter(self):
+        support.writePlugin('keeper', {}, _ECHO)
+        support.writePlugin('lazyecho', {'lazy': True, 'handlers': [{'handler': 'echo', 'commands': ['echo']}]}, _ECHO)
+
+        async def test(runtime):
+            router = runtime.router
+            self.assertEqual([result for match, result in await runtime.dispatch('/echo')], ['echo'])
+            self.assertIsNotNone(await runtime.activatePlugin('lazyecho'))
+            self.assertTrue(await runtime.unloadPlugin('lazyecho'))
+            self.assertEqual([result for match, result in await runtime.dispatch('/echo')], ['echo'])
+            self.assertIs(runtime.router, router)
+        _run(test, 'keeper', lazy=['lazyecho'])
+
+    # 重新读取的plugin.json中的路由变化时路由器被重新构建，新增的插件的路由也会被加入
+    # The router is rebuilt when the routes in the plugin.json read again change, and the routes of an added plugin are included
+    def testChangedRoutesRebuildRouter(self):
+        support.writePlugin('routes', {'handlers': [{'handler': 'echo', 'commands': ['first']}]}, _ECHO)
+
+        async def test(runtime):
+            router = runtime.router
+            self.assertIsNotNone(await runtime.reloadPlugin('routes'))
+            self.assertIs(runtime.router, router)
+            support.writePlugin('routes', {'handlers': [{'handler': 'other', 'commands': ['second']}]}, None)
+            self.assertIsNotNone(await runtime.reloadPlugin('routes'))
+            self.assertIsNot(runtime.router, router)
+            self.assertEqual(await runtime.dispatch('/first'), [])
+            self.assertEqual([result for match, result in await runtime.dispatch('/second')], ['other'])
+            support.writePlugin('added', {'handlers': [{'handler': 'echo', 'commands': ['added']}]}, _ECHO)
+            self.assertIsNotNone(await runtime.reloadPlugin('added'))
+            self.assertEqual([result for match, result in await runtime.dispatch('/added')], ['echo'])
+        _run(test, 'routes')
+
+
+_SLOW = _COMMON + """
+
+async def slow(message, match):
+    events.append('start')
+    await asyncio.sleep(0.1)
+    events.append('done')
+    return 'slow'
+
+
+def echo(message, match):
+    events.append('echo')
+    return 'echo'
+"""
+
+
+class ReloadTest(unittest.TestCase):
+    # 重新加载插件时正在处理的消息先处理完再调用teardown()，期间到达的消息等待闸门并由新模块处理
+    # When a plugin is reloaded the messages being handled finish before teardown(),
+    # messages arriving meanwhile wait at the gate and are handled by the new module
+    def testInflightDrainsBeforeTeardown(self):
+        support.writePlugin('draining', {'handlers': [
+            {'handler': 'slow', 'commands': ['slow']}, {'handler': 'echo', 'commands': ['echo']}]}, _SLOW)
+
+        async def test(runtime):
+            old = runtime.plugins[0].module
+            slow = asyncio.ensure_future(runtime.dispatch('/slow'))
+            while not old.events:
+                await asyncio.sleep(0.001)
+            reload = asyncio.ensure_future(runtime.reloadPlugin('draining'))
+            await asyncio.sleep(0.01)
+            late = asyncio.ensure_future(runtime.dispatch('/echo'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(late.done())
+            self.assertEqual([result for match, result in await slow], ['slow'])
+            plugin = await reload
+            self.assertEqual([result for match, result in await late], ['echo'])
+            self.assertEqual(old.events, ['start', 'done', 'teardown'])
+            self.assertIsNot(plugin.module, old)
+            self.assertEqual(plugin.module.events, ['echo'])
+        _run(test, 'draining')
+
+    # 重新加载失败的插件保持卸载状态，它的路由被移除，其它插件和之后成功的重新加载不受影响
+    # A plugin that fails to reload stays unloaded and its routes are removed,
+    # the other plugins and a later successful reload are not affected
+    def testFailedReloadLeavesPluginUnloaded(self):
+        support.writePlugin('keeper', {'handlers': [{'handler': 'echo', 'commands': ['keep']}]}, _ECHO)
+        support.writePlugin('fragile', {'handlers': [{'handler': 'other', 'commands': ['fragile']}]}, _ECHO)
+
+        async def test(runtime):
+            old = runtime.plugins[1].module
+            support.writePlugin('fragile', {'handlers': [{'handler': 'other', 'commands': ['fragile']}]}, _ECHO + '\nraise RuntimeError()\n')
+            self.assertIsNone(await runtime.reloadPlugin('fragile'))
+            self.assertEqual(old.events, ['teardown'])
+            self.assertEqual([plugin.name for plugin in runtime.plugins], ['keeper'])
+            self.assertEqual([plugin.name for plugin, server in runtime.tasks.values()], ['keeper'])
+            self.assertEqual(list(runtime.router.match('/fragile')), [])
+            self.assertEqual(await runtime.dispatch('/fragile'), [])
+            self.assertEqual([result for match, result in await runtime.dispatch('/keep')], ['echo'])
+            support.writePlugin('fragile', {'handlers': [{'handler': 'other', 'commands': ['fragile']}]}, _ECHO)
+            self.assertIsNotNone(await runtime.reloadPlugin('fragile'))
+            self.assertEqual([result for match, result in await runtime.dispatch('/fragile')], ['other'])
+            self.assertEqual(sorted(plugin.name for plugin, server in runtime.tasks.values()), ['fragile', 'keeper'])
+        _run(test, 'keeper', 'fragile')
+
+
+_SERVING = _COMMON + """
+
+class Done(Server):
+    async def serving(self):
+        pass
+
+
+class Broken(Server):
+    async def serving(self):
+        raise RuntimeError('broken')
+
+
+def servers():
+    return [Idle(), Done(), Broken()]
+"""
+
+
+class ServingMetricsTest(unittest.TestCase):
+    # Server的运行时间被记录为serving，正常结束和出错分别计入serving.completed和serving.errors
+    # The running time of a Server is recorded as serving, completion and errors count towards serving.completed and serving.errors
+    def testServingMetrics(self):
+        support.writePlugin('serving', {}, _SERVING)
+
+        async def test(runtime):
+            while Metrics.snapshot()['plugins'].get('serving', {}).get('timers', {}).get('serving', {}).get('count', 0) < 2:
+                await asyncio.sleep(0.001)
+            stats = Metrics.snapshot()['plugins']['serving']
+            self.assertEqual(stats['counters']['serving.completed'], 1)
+            self.assertEqual(stats['counters']['serving.errors'], 1)
+        _run(test, 'serving')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import signal
+import asyncio
+import unittest
+import support
+from lre.base import bootstrap, PluginConfig
+from lre.error import SandboxException
+from lre.router import Match
+from lre.sandbox import Ring, Sandbox, _fragments, _assemble, _HEADER, _CALL, _RESULT, _MORE
+
+
+class RingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = Ring(bytearray(Ring.size(64)), 0, 64)
+
+    # 缓冲区满时put()返回False，读取之后才有空间
+    # put() returns False when the buffer is full, there is room again after reading
+    def testFull(self):
+        ring = self.ring
+        self.assertTrue(ring.put(1, _CALL, b'a' * 20))
+        self.assertTrue(ring.put(2, _CALL, b'b' * 20))
+        self.assertFalse(ring.put(3, _CALL, b'c' * 20))
+        self.assertEqual(ring.get(), (1, _CALL, b'a' * 20))
+        self.assertTrue(ring.put(3, _CALL, b'c' * 20))
+        self.assertEqual(ring.get(), (2, _CALL, b'b' * 20))
+        self.assertEqual(ring.get(), (3, _CALL, b'c' * 20))
+        self.assertIsNone(ring.get())
+
+    # 末尾放不下一帧时写入回绕标记，帧从缓冲区的开头写入
+    # A wrap marker is written when the end cannot hold a frame, the frame is written at the start of the buffer
+    def testWrapMarker(self):
+        ring = self.ring
+        for ident in range(1, 20):
+            self.assertTrue(ring.put(ident, _RESULT, bytes([ident]) * 20))
+            self.assertEqual(ring.get(), (ident, _RESULT, bytes([ident]) * 20))
+        self.assertIsNone(ring.get())
+
+    # 末尾剩余的空间连回绕标记都放不下时，读取方同样跳过它
+    # When the space left at the end cannot even hold the wrap marker, the reader skips it as well
+    def testPaddingWithoutMarker(self):
+        ring = self.ring
+        payload = b'x' * (31 - _HEADER.size)
+        self.assertTrue(ring.put(1, _CALL, payload))
+        self.assertTrue(ring.put(2, _CALL, payload))
+        self.assertEqual(ring.get(), (1, _CALL, payload))
+        self.assertEqual(ring.get(), (2, _CALL, payload))
+        self.assertTrue(ring.put(3, _CALL, payload))
+        self.assertEqual(ring.get(), (3, _CALL, payload))
+        self.assertIsNone(ring.get())
+
+    # 空的负载也是一帧
+    # An empty payload is a frame as well
+    def testEmptyPayload(self):
+        self.assertTrue(self.ring.put(0, _RESULT, b''))
+        self.assertEqual(self.ring.get(), (0, _RESULT, b''))
+
+
+class FragmentTest(unittest.TestCase):
+    # 小的负载不切分
+    # Small payloads are not split
+    def testSmallPayload(self):
+        self.assertEqual(list(_fragments(_CALL, b'small', 4096)), [(_CALL, b'small')])
+
+    # 大的负载按缓冲区的四分之一切分，除最后一片外都带有_MORE标记，交错的分片按编号拼接
+    # Large payloads are split by a quarter of the buffer, all but the last fragment carry _MORE, interleaved fragments are joined by id
+    def testSplitAndAssemble(self):
+        first, second = os.urandom(3000), os.urandom(1500)
+        fragments = [list(_fragments(_CALL, payload, 4096)) for payload in (first, second)]
+        self.assertEqual([kind for kind, _ in fragments[0]], [_CALL | _MORE, _CALL | _MORE, _CALL])
+        self.assertTrue(all(len(fragment) <= 4096 // 4 - _HEADER.size for _, fragment in fragments[0]))
+        parts = {}
+        frames = []
+        for index in range(3):
+            for ident in (1, 2):
+                if index < len(fragments[ident - 1]):
+                    kind, fragment = fragments[ident - 1][index]
+                    frame = _assemble(parts, (ident, kind, bytes(fragment)))
+                    if frame is not None:
+                        frames.append(frame)
+        self.assertEqual(frames, [(2, _CALL, second), (1, _CALL, first)])
+        self.assertEqual(parts, {})
+
+
+_BOXED = '''
+import os
+import asyncio
+
+
+def pid(message, match):
+    return os.getpid()
+
+
+async def wait(message, match):
+    await asyncio.sleep(60)
+'''
+
+
+class SandboxTest(unittest.TestCase):
+    # 子进程被杀死后，等待中的调用以它的退出码失败，看门狗重启子进程，之后的调用由新的子进程处理
+    # After the child is killed, waiting calls fail with its exit code, the watchdog restarts the child and later calls are handled by the new child
+    def testRestartAfterKill(self):
+        support.writePlugin('boxed', {'sandbox': {'interval': 0.05, 'ringSize': 4096}, 'handlers': [
+            {'handler': 'pid', 'commands': ['pid']}, {'handler': 'wait', 'commands': ['wait']}]}, _BOXED)
+        bootstrap()
+        PluginConfig.reload(['boxed'])
+        match = Match(None, 'command', 'pid', 0, 4)
+
+        async def run():
+            sandbox = Sandbox('boxed')
+            await asyncio.get_running_loop().run_in_executor(None, sandbox.start)
+            try:
+                first = await sandbox.call('pid', '/pid', match)
+                waiting = asyncio.ensure_future(sandbox.call('wait', '/wait', match))
+                await asyncio.sleep(0.05)
+                os.kill(first, signal.SIGKILL)
+                with self.assertRaises(SandboxException) as context:
+                    await waiting
+                self.assertIn('exited with code %d' % -signal.SIGKILL, str(context.exception))
+                second = await sandbox.call('pid', '/pid', match)
+                self.assertNotEqual(first, second)
+                self.assertEqual(sandbox.restarts, 1)
+            finally:
+                await sandbox.stop()
+            self.assertIsNone(sandbox.stats()['pid'])
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
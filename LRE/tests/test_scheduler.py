@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+import support
+from lre.scheduler import Scheduler, CronExpression
+
+
+# 手动推进的时钟
+# A clock advanced by hand
+class _Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class _Handle(object):
+    def __init__(self, when, fn):
+        self.when = when
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# 只记录唤醒的事件循环，它的时间就是时钟的时间
+# An event loop that only records wakeups, its time is the time of the clock
+class _Loop(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.handles = []
+
+    def time(self):
+        return self.clock.now
+
+    def call_soon_threadsafe(self, fn, *args):
+        fn(*args)
+
+    def call_at(self, when, fn):
+        handle = _Handle(when, fn)
+        self.handles.append(handle)
+        return handle
+
+    # 下一次安排的唤醒，没有时返回None
+    # The next arranged wakeup, None when there is none
+    def wakeup(self):
+        handles = [handle for handle in self.handles if not handle.cancelled]
+        return handles[-1].when if handles else None
+
+    # 把时钟推进到下一次唤醒并执行它
+    # Advance the clock to the next wakeup and run it
+    def advance(self):
+        handle = next(handle for handle in reversed(self.handles) if not handle.cancelled)
+        handle.cancelled = True
+        self.clock.now = handle.when
+        handle.fn()
+
+
+# 创建运行在手动时钟上的调度器
+# Create a scheduler running on a clock advanced by hand
+def _scheduler(now=250):
+    clock = _Clock(now)
+    loop = _Loop(clock)
+    scheduler = Scheduler(1, clock=clock)
+    scheduler.start(loop)
+    return scheduler, loop
+
+
+def _timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+class TimingWheelTest(unittest.TestCase):
+    # 定时器按照时间顺序触发，不会提前触发
+    # Timers fire in order of time and never early
+    def testCallAtAndCallLater(self):
+        scheduler, loop = _scheduler()
+        fired = []
+        scheduler.callAt(260, fired.append, 'at')
+        scheduler.callLater(5, fired.append, 'later')
+        self.assertEqual(loop.wakeup(), 255)
+        loop.advance()
+        self.assertEqual(fired, ['later'])
+        self.assertEqual(loop.wakeup(), 260)
+        loop.advance()
+        self.assertEqual(fired, ['later', 'at'])
+        self.assertIsNone(loop.wakeup())
+        self.assertEqual(len(scheduler), 0)
+
+    # 被取消的定时器不会触发，第二次取消返回False
+    # A cancelled timer does not fire and cancelling it again returns False
+    def testCancel(self):
+        scheduler, loop = _scheduler()
+        fired = []
+        timer = scheduler.callLater(5, fired.append, 'cancelled')
+        scheduler.callLater(10, fired.append, 'kept')
+        self.assertTrue(timer.cancel())
+        self.assertFalse(scheduler.cancel(timer))
+        while loop.wakeup() is not None:
+            loop.advance()
+        self.assertEqual(fired, ['kept'])
+
+    # 最底层有定时器时，更早的下降边界仍然决定下一次唤醒
+    # An earlier cascade boundary still decides the next wakeup while the lowest level has timers
+    def testEarlierCascadeBoundaryWins(self):
+        scheduler, loop = _scheduler()
+        fired = []
+        scheduler.callAt(550, fired.append, 550)
+        scheduler.callAt(350, fired.append, 350)
+        self.assertEqual(loop.wakeup(), 256)
+        loop.advance()
+        self.assertEqual(fired, [])
+        self.assertEqual(loop.wakeup(), 350)
+        loop.advance()
+        self.assertEqual(fired, [350])
+        while loop.wakeup() is not None:
+            loop.advance()
+        self.assertEqual(fired, [350, 550])
+        self.assertEqual(loop.clock.now, 550)
+
+    # 超出最高层范围的定时器在长时间之后仍然准时触发
+    # A timer beyond the range of the highest level still fires on time after a long time
+    def testOverflow(self):
+        scheduler, loop = _scheduler()
+        fired = []
+        when = 250 + (1 << 33)
+        scheduler.callAt(when, fired.append, 'far')
+        while loop.wakeup() is not None:
+            loop.advance()
+        self.assertEqual(fired, ['far'])
+        self.assertEqual(loop.clock.now, when)
+
+    # 周期定时器在触发后重新加入，同名的定时器被替换
+    # A periodic timer is added again after firing, a timer with the same name is replaced
+    def testEveryAndNames(self):
+        scheduler, loop = _scheduler()
+        fired = []
+        scheduler.every(10, fired.append, 'old', name='tick')
+        timer = scheduler.every(10, fired.append, 'new', name='tick')
+        self.assertIs(scheduler.find('tick'), timer)
+        for _ in range(3):
+            loop.advance()
+        self.assertEqual(fired, ['new'] * 3)
+        self.assertEqual(loop.clock.now, 280)
+        timer.cancel()
+        self.assertIsNone(scheduler.find('tick'))
+        loop.advance()
+        self.assertEqual(fired, ['new'] * 3)
+        self.assertIsNone(loop.wakeup())
+
+
+class CronExpressionTest(unittest.TestCase):
+    # 日和周都被限制时满足其中之一即可，只限制其中一个时必须满足它
+    # When both day-of-month and day-of-week are restricted matching either is enough, when only one is restricted it must match
+    def testDayOrWeekday(self):
+        # 2026年10月1日是周四
+        # October 1st 2026 is a Thursday
+        after = _timestamp(2026, 10, 1, 12, 0)
+        self.assertEqual(CronExpression('0 0 13 * 5').next(after), _timestamp(2026, 10, 2))
+        self.assertEqual(CronExpression('0 0 13 * *').next(after), _timestamp(2026, 10, 13))
+        self.assertEqual(CronExpression('0 0 * * 5').next(after), _timestamp(2026, 10, 2))
+        self.assertEqual(CronExpression('0 0 13 * 1').next(_timestamp(2026, 10, 6)), _timestamp(2026, 10, 12))
+
+    # 别名展开为对应的表达式，周日可以写成0或7
+    # Aliases expand to their expressions, Sunday can be written as 0 or 7
+    def testAliases(self):
+        after = _timestamp(2026, 10, 1, 12, 30)
+        self.assertEqual(CronExpression('@hourly').next(after), _timestamp(2026, 10, 1, 13, 0))
+        self.assertEqual(CronExpression('@daily').next(after), _timestamp(2026, 10, 2))
+        self.assertEqual(CronExpression('@midnight').next(after), _timestamp(2026, 10, 2))
+        self.assertEqual(CronExpression('@weekly').next(after), _timestamp(2026, 10, 4))
+        self.assertEqual(CronExpression('0 0 * * 7').next(after), _timestamp(2026, 10, 4))
+        self.assertEqual(CronExpression('@monthly').next(after), _timestamp(2026, 11, 1))
+        self.assertEqual(CronExpression('@yearly').next(after), _timestamp(2027, 1, 1))
+        self.assertEqual(CronExpression('@annually').next(after), _timestamp(2027, 1, 1))
+
+    # 范围、步长和列表，结果总是在after之后
+    # Ranges, steps and lists, the result is always after after
+    def testFields(self):
+        cron = CronExpression('*/15 9-17/4 * * 1-5')
+        self.assertEqual(cron.next(_timestamp(2026, 10, 1, 9, 15)), _timestamp(2026, 10, 1, 9, 30))
+        self.assertEqual(cron.next(_timestamp(2026, 10, 1, 17, 45)), _timestamp(2026, 10, 2, 9, 0))
+        self.assertEqual(cron.next(_timestamp(2026, 10, 2, 17, 45)), _timestamp(2026, 10, 5, 9, 0))
+        self.assertEqual(CronExpression('5,10 0 1 3 *').next(_timestamp(2026, 3, 1, 0, 5)), _timestamp(2026, 3, 1, 0, 10))
+
+    # 无效和永远不会匹配的表达式
+    # Invalid expressions and expressions that never match
+    def testInvalid(self):
+        for expression in ('* * * *', '60 * * * *', '* * 0 * *', '5-1 * * * *', '*/0 * * * *', '@often'):
+            self.assertRaises(ValueError, CronExpression, expression)
+        self.assertRaises(ValueError, CronExpression('0 0 30 2 *').next, _timestamp(2026, 1, 1))
+
+    # cron定时器按照表达式在调度器中重新安排
+    # A cron timer is arranged again in the scheduler following its expression
+    def testCronTimer(self):
+        scheduler, loop = _scheduler(_timestamp(2026, 10, 1, 12, 0))
+        fired = []
+        scheduler.cron('0 * * * *', fired.append, 'hour')
+        for hour in (13, 14):
+            while len(fired) < hour - 12:
+                loop.advance()
+            self.assertEqual(loop.clock.now, _timestamp(2026, 10, 1, hour, 0))
+        self.assertEqual(fired, ['hour', 'hour'])
+
+
+if __name__ == '__main__':
+    unittest.main()
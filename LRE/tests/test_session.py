@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import time
+import struct
+import unittest
+import support
+from lre.session import SessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+    # 过期的会话被时间轮淘汰，之后get()会创建新的会话
+    # An expired session is evicted by the expiry wheel, get() creates a new session afterwards
+    def testExpiry(self):
+        store = SessionStore(shards=4, ttl=10, resolution=1.0)
+        session = store.get('user')
+        session.set('name', 'latte')
+        self.assertIs(store.peek('user'), session)
+        self.assertEqual(store.sweep(time.time() + 5), 0)
+        self.assertEqual(store.sweep(time.time() + 12), 1)
+        self.assertIsNone(store.peek('user'))
+        self.assertIsNone(store.get('user', create=False))
+        self.assertIsNone(store.get('user').get('name'))
+
+    # 访问会话会延长它的过期时间
+    # Accessing a session extends its expiry
+    def testAccessExtendsExpiry(self):
+        store = SessionStore(shards=1, ttl=10, resolution=1.0)
+        session = store.get('user', ttl=1)
+        self.assertIs(store.get('user'), session)
+        self.assertEqual(store.sweep(time.time() + 5), 0)
+        self.assertIs(store.peek('user'), session)
+
+    # 分片中的会话数超过maxSessions时淘汰最早创建的会话
+    # The oldest session of a shard is evicted when it holds more than maxSessions
+    def testEvictionAtMaxSessions(self):
+        store = SessionStore(shards=1, maxSessions=2)
+        for key in ('first', 'second', 'third'):
+            store.get(key)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.evictions, 1)
+        self.assertIsNone(store.peek('first'))
+        self.assertIsNotNone(store.peek('second'))
+        self.assertIsNotNone(store.peek('third'))
+
+
+class SessionJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.sep.join([support.ROOT, 'sessions-%s' % self.id()])
+
+    # 重启后恢复写入过数据的会话，删除的会话不会恢复
+    # Sessions with written data are recovered after a restart, deleted sessions are not
+    def testRestore(self):
+        store = SessionStore(shards=2, path=self.path)
+        store.get('kept').update({'a': 1, 'b': 2})
+        store.get('kept').delete('a')
+        store.get('deleted').set('a', 1)
+        store.delete('deleted')
+        store.close()
+        store = SessionStore(shards=2, path=self.path)
+        self.assertEqual(store.peek('kept').data, {'b': 2})
+        self.assertIsNone(store.peek('deleted'))
+        store.close()
+
+    # 最后一条记录不完整时（例如进程在写入时崩溃），之前的记录仍然被恢复
+    # When the last record is incomplete (e.g. the process crashed while writing), the records before it are still recovered
+    def testTruncatedRecord(self):
+        store = SessionStore(shards=2, path=self.path)
+        store.get('first').set('value', 1)
+        store.get('second').set('value', 2)
+        store.close()
+        header = struct.Struct('<8sQ')
+        with open(self.path, 'r+b') as journal:
+            magic, end = header.unpack(journal.read(header.size))
+            journal.seek(0)
+            journal.write(header.pack(magic, end - 3))
+        store = SessionStore(shards=2, path=self.path)
+        self.assertEqual(store.peek('first').data, {'value': 1})
+        self.assertIsNone(store.peek('second'))
+        store.get('third').set('value', 3)
+        store.close()
+        store = SessionStore(shards=2, path=self.path)
+        self.assertEqual(store.peek('third').data, {'value': 3})
+        store.close()
+
+    # 校验和不匹配的记录和它之后的记录都被丢弃
+    # A record with a mismatched checksum and the records after it are dropped
+    def testCorruptRecord(self):
+        store = SessionStore(shards=2, path=self.path)
+        store.get('first').set('value', 1)
+        store.get('second').set('value', 2)
+        store.get('third').set('value', 3)
+        store.close()
+        with open(self.path, 'r+b') as journal:
+            content = journal.read()
+            journal.seek(content.index(b'second'))
+            journal.write(b'SECOND')
+        store = SessionStore(shards=2, path=self.path)
+        self.assertEqual(store.peek('first').data, {'value': 1})
+        self.assertIsNone(store.peek('second'))
+        self.assertIsNone(store.peek('third'))
+        store.close()
+
+    # 持久化和压缩文件时序列化的是会话数据的副本，序列化期间数据被修改也不会失败
+    # Persistence and compaction serialize a copy of the session data, so changing the data while it is serialized does not fail
+    def testSerializeCopy(self):
+        store = SessionStore(shards=2, path=self.path)
+        session = store.get('user')
+        session.set('other', 1)
+        session.set('value', _Changing(session))
+        store.compact()
+        store.close()
+        store = SessionStore(shards=2, path=self.path)
+        self.assertEqual(sorted(store.peek('user').data), ['changed', 'other', 'value'])
+        store.close()
+
+
+# 序列化时修改所在会话数据的值，模拟另一个线程同时写入会话
+# A value that changes the data of its session while it is serialized, simulating another thread writing the session at the same time
+class _Changing(object):
+    def __init__(self, session):
+        self.session = session
+
+    def __reduce__(self):
+        self.session.data['changed'] = True
+        return (dict, ())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import gc
+import signal
+import unittest
+import support
+from lre import worker
+from lre.worker import Supervisor, _RestartPolicy
+
+# 工作进程把启动时的gc状态追加到这个文件中，每行一个工作进程
+# Workers append their gc state at startup to this file, one line per worker
+_STARTS = os.sep.join([support.ROOT, 'worker-starts'])
+
+
+# 代替PluginLoader，不导入任何插件
+# Stands in for PluginLoader and imports no plugins
+class _Loader(object):
+    def partition(self):
+        return [], []
+
+    def preload(self, names):
+        return []
+
+    def load(self, names):
+        return []
+
+
+# 代替Runtime，记录工作进程中的gc状态后立即返回，code不为0时抛出异常让工作进程以1退出
+# Stands in for Runtime, records the gc state in the worker and returns at once, raises when code is not 0 so the worker exits with 1
+class _Runtime(object):
+    code = 0
+
+    def __init__(self, plugins, socket=None, lazy=()):
+        pass
+
+    def run(self):
+        with open(_STARTS, 'a') as output:
+            output.write('%d %d %s\n' % (gc.isenabled(), gc.get_freeze_count() > 0, os.environ.get('LATTE_WORKER')))
+        if self.code:
+            raise RuntimeError('worker failed')
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RestartPolicyTest(unittest.TestCase):
+    # 'never'从不重启，'on-failure'只在非零退出时重启，'always'总是重启
+    # 'never' never restarts, 'on-failure' only restarts after a non-zero exit, 'always' always restarts
+    def testPolicies(self):
+        self.assertEqual([_RestartPolicy('never', 10, 60).allows(code) for code in (0, 1)], [False, False])
+        self.assertEqual([_RestartPolicy('on-failure', 10, 60).allows(code) for code in (0, 1, -9)], [False, True, True])
+        self.assertEqual([_RestartPolicy('always', 10, 60).allows(code) for code in (0, 1)], [True, True])
+        self.assertRaises(ValueError, _RestartPolicy, 'sometimes', 10, 60)
+        self.assertRaises(ValueError, Supervisor, 1, 'sometimes')
+
+    # restartWindow秒内超过maxRestarts次后放弃，之后不再重启；窗口之外的重启不计入
+    # It gives up after more than maxRestarts restarts within restartWindow seconds and never restarts again;
+    # restarts outside the window do not count
+    def testRestartWindow(self):
+        clock = _Clock()
+        policy = _RestartPolicy('always', 2, 60, clock)
+        self.assertTrue(policy.allows(1))
+        clock.now = 30
+        self.assertTrue(policy.allows(1))
+        clock.now = 61
+        self.assertTrue(policy.allows(1))
+        self.assertFalse(policy.exhausted)
+        clock.now = 62
+        self.assertFalse(policy.allows(1))
+        self.assertTrue(policy.exhausted)
+        clock.now = 1000
+        self.assertFalse(policy.allows(1))
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(_STARTS):
+            os.remove(_STARTS)
+        for name, value in (('PluginLoader', _Loader), ('Runtime', _Runtime)):
+            self.addCleanup(setattr, worker, name, getattr(worker, name))
+            setattr(worker, name, value)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        self.addCleanup(setattr, _Runtime, 'code', 0)
+        self.addCleanup(gc.unfreeze)
+
+    # 运行主进程并返回每个工作进程启动时的(gc是否开启, 是否有冻结的对象, 编号)
+    # Run the supervisor and return (gc enabled, objects frozen, index) of every worker at startup
+    def supervise(self, count, restart, maxRestarts=10):
+        supervisor = Supervisor(count, restart)
+        supervisor.restartDelay = 0
+        supervisor.restart.maxRestarts = maxRestarts
+        supervisor.run()
+        self.assertEqual(supervisor.workers, {})
+        with open(_STARTS) as starts:
+            return sorted(tuple(line.split()) for line in starts)
+
+    # fork之前冻结gc，工作进程和主进程之后都重新开启gc
+    # gc is frozen before forking, and enabled again in the workers and the supervisor afterwards
+    def testGcAroundFork(self):
+        self.assertEqual(self.supervise(2, 'never'), [('1', '1', '0'), ('1', '1', '1')])
+        self.assertTrue(gc.isenabled())
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+    # 'on-failure'不重启正常退出的工作进程
+    # 'on-failure' does not restart a worker that exited normally
+    def testNoRestartOnSuccess(self):
+        self.assertEqual(len(self.supervise(1, 'on-failure')), 1)
+
+    # 失败的工作进程被重启，restartWindow内超过maxRestarts次后主进程放弃并退出
+    # A failed worker is restarted, the supervisor gives up and exits after more than maxRestarts restarts within restartWindow
+    def testGiveUpAfterMaxRestarts(self):
+        _Runtime.code = 1
+        self.assertEqual(self.supervise(1, 'on-failure', maxRestarts=2), [('1', '1', '0')] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()